@@ -0,0 +1,86 @@
+"""
+Benchmark de throughput do chunking: `chunk_text` (janelas de caracteres) vs `iter_chunks`.
+
+Gera um corpus sintético e determinístico (~10 MB por padrão, com parágrafos e
+sentenças) e mede MB/s e chunks/s de cada estratégia. A saída é JSON, para
+comparar entre commits.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_chunking [--size-mb 10] [--repeat 3] [--tokenizer tiktoken:cl100k_base]
+"""
+import argparse
+import json
+import random
+import time
+
+from src.common.chunking import approximate_token_count, get_tokenizer, iter_chunks
+from src.ingest_function.main import chunk_text
+
+_WORDS = (
+    "o a de que e do da em um para é com não uma os no se na por mais as dos como mas foi ao "
+    "ele das tem à seu sua ou ser quando muito há nos já está eu também só pelo pela até isso "
+    "faturamento relatório configuração painel usuário cliente contrato serviço integração "
+    "documentação processamento recorrente administração API vetorial consulta ingestão"
+).split()
+
+
+def build_corpus(size_mb, seed=42):
+    """Gera um texto com ~size_mb megabytes, com sentenças e parágrafos de tamanho variável."""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    paragraphs = []
+    size = 0
+    while size < target:
+        sentences = []
+        for _ in range(rng.randint(2, 8)):
+            words = rng.choices(_WORDS, k=rng.randint(5, 30))
+            words[0] = words[0].capitalize()
+            sentences.append(" ".join(words) + rng.choice(".!?"))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def _measure(name, fn, corpus, repeat):
+    best = None
+    chunks = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = sum(1 for _ in fn(corpus))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    size_mb = len(corpus.encode("utf-8")) / (1024 * 1024)
+    return {
+        "name": name,
+        "seconds": round(best, 4),
+        "chunks": chunks,
+        "mb_per_s": round(size_mb / best, 2),
+        "chunks_per_s": round(chunks / best, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tokenizer", default=None, help="Tokenizador adicional, ex.: tiktoken:cl100k_base")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size_mb)
+    results = [
+        _measure("chunk_text", chunk_text, corpus, args.repeat),
+        _measure("iter_chunks[approx]", lambda text: iter_chunks(text, count_tokens=approximate_token_count),
+                 corpus, args.repeat),
+    ]
+    if args.tokenizer:
+        count_tokens = get_tokenizer(args.tokenizer)
+        results.append(_measure(f"iter_chunks[{args.tokenizer}]",
+                                lambda text: iter_chunks(text, count_tokens=count_tokens),
+                                corpus, args.repeat))
+
+    print(json.dumps({"corpus_mb": args.size_mb, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark do gerenciamento de conexão com o banco (busca vetorial).
+
+Mede, contra um Postgres com pgvector descartável:
+  * conexão fria: conectar + preparar + primeira busca;
+  * conexão quente: buscas seguidas com statement preparado e com SQL direto;
+  * conexão ociosa: busca após o tempo ocioso (inclui o teste de vida `SELECT 1`);
+  * conexão derrubada: busca após `pg_terminate_backend` (reconexão transparente).
+
+Aplica as migrações pendentes e insere chunks sintéticos em uma base nova,
+removida ao final.
+
+Uso (a partir da raiz do repositório):
+    BENCH_DB_DSN=postgresql://... python -m benchmarks.bench_db_connection [--chunks 2000] [--runs 200]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+import psycopg2
+from psycopg2.extras import execute_batch
+
+from benchmarks.local_db import create_knowledge_base, drop_knowledge_base, ensure_schema
+from src.common.db import ConnectionManager
+from src.common.embedding_config import DEFAULT_CONFIG
+from src.common.vectors import EMBEDDING_DIMENSIONS, EmbeddingBatch
+from src.ingest_function.main import INSERT_CHUNK
+from src.query_function.main import SEARCH_CHUNKS
+
+
+def _random_vector(rng):
+    return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+
+def _setup(dsn, chunks, rng):
+    ensure_schema(dsn)
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    kb_id = create_knowledge_base(conn, "bench-db")
+
+    manager = ConnectionManager(dsn)
+    batch = EmbeddingBatch(chunks)
+    for i in range(chunks):
+        batch.set_row(i, _random_vector(rng))
+    records = [(kb_id, f"chunk sintético {i}", batch.vector(i)) for i in range(chunks)]
+    manager.run(lambda cur: execute_batch(cur, manager.statement_sql(cur, INSERT_CHUNK), records), commit=True)
+    manager.connection.close()
+    return conn, kb_id
+
+
+def _search(manager, embedding, kb_id):
+    def run(cur):
+        cur.execute(manager.statement_sql(cur, SEARCH_CHUNKS), (embedding, kb_id, *DEFAULT_CONFIG, 5))
+        return cur.fetchall()
+    return manager.run(run)
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--cold-runs", type=int, default=20)
+    args = parser.parse_args()
+
+    dsn = os.environ.get("BENCH_DB_DSN")
+    if not dsn:
+        raise SystemExit("Defina BENCH_DB_DSN com a string de conexão de um banco descartável.")
+
+    rng = random.Random(42)
+    admin, kb_id = _setup(dsn, args.chunks, rng)
+    embedding = json.dumps(_random_vector(rng))
+    report = {"chunks": args.chunks, "runs": args.runs}
+    try:
+        report["cold"] = _summary([
+            _timed(lambda: _search(ConnectionManager(dsn, autocommit=True), embedding, kb_id))
+            for _ in range(args.cold_runs)
+        ])
+
+        for label, prepared in (("hot_prepared", True), ("hot_direct", False)):
+            manager = ConnectionManager(dsn, autocommit=True, use_prepared_statements=prepared)
+            _search(manager, embedding, kb_id)
+            report[label] = _summary([_timed(lambda: _search(manager, embedding, kb_id)) for _ in range(args.runs)])
+            manager.connection.close()
+
+        # idle_check_seconds=0 força o teste de vida em toda chamada, como após um período ocioso
+        manager = ConnectionManager(dsn, autocommit=True, idle_check_seconds=0)
+        _search(manager, embedding, kb_id)
+        report["idle_liveness_check"] = _summary(
+            [_timed(lambda: _search(manager, embedding, kb_id)) for _ in range(args.runs)])
+
+        dropped = []
+        for _ in range(args.cold_runs):
+            with admin.cursor() as cur:
+                cur.execute("SELECT pg_terminate_backend(%s)", (manager.connection.get_backend_pid(),))
+            dropped.append(_timed(lambda: _search(manager, embedding, kb_id)))
+        report["after_server_drop"] = _summary(dropped)
+        manager.connection.close()
+    finally:
+        drop_knowledge_base(admin, kb_id)
+        admin.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
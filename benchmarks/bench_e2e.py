@@ -0,0 +1,263 @@
+"""
+Benchmark ponta a ponta, totalmente offline: ingestão e consulta com concorrência.
+
+Sobe um servidor falso da OpenAI (latência, 429 e vetores determinísticos
+configuráveis) e usa um Postgres local com pgvector. Cada worker é um processo
+novo, como um container de Lambda: importa as três funções, executa o
+pré-aquecimento e chama os `lambda_handler`s no próprio processo. Ingestão e
+consulta chamam o proxy por um `LocalLambdaClient`, como em produção.
+
+Relata chunks/s da ingestão e p50/p95/p99 da consulta em JSON, além da mediana
+de cada fase medida pelas próprias funções (linhas EMF de `src.common.metrics`).
+Com `--output` o relatório é salvo; com `--compare` ele é comparado com um
+relatório anterior.
+
+Uso (a partir da raiz do repositório):
+    BENCH_DB_DSN=postgresql://... python -m benchmarks.bench_e2e \\
+        [--documents 40] [--doc-kb 32] [--queries 400] [--concurrency 4] \\
+        [--latency-ms 20] [--rate-429 0.0] [--output atual.json] [--compare base.json]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+
+from benchmarks.bench_chunking import _WORDS, build_corpus
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.local_db import create_knowledge_base, drop_knowledge_base, ensure_schema
+from benchmarks.local_lambda import PROXY_FUNCTION_NAME, LocalContext, LocalLambdaClient
+
+_HANDLERS = {}
+
+
+def _worker_init():
+    """Inicializa um 'container': importa as funções e liga o cliente Lambda local."""
+    import src.ingest_function.main as ingest
+    import src.openai_embedding_proxy.main as proxy
+    import src.query_function.main as query
+
+    client = LocalLambdaClient({PROXY_FUNCTION_NAME: proxy.__name__})
+    for module in (ingest, query):
+        module._warmup()
+        module.LAMBDA_CLIENT = client
+    proxy._initialize()
+    _HANDLERS.update(ingest=ingest.lambda_handler, query=query.lambda_handler)
+
+
+def _emitted_phases(output):
+    """Extrai os tempos `<fase>_ms` das linhas EMF emitidas durante a invocação, por função."""
+    phases = []
+    for line in output.splitlines():
+        if not line.startswith("{") or '"_aws"' not in line:
+            continue
+        doc = json.loads(line)
+        function = doc["Function"]
+        for name in (m["Name"] for m in doc["_aws"]["CloudWatchMetrics"][0]["Metrics"]):
+            if name.endswith("_ms"):
+                phases.append((function, name[:-3], doc[name]))
+    return phases
+
+
+def _invoke(name, body):
+    captured, stdout = io.StringIO(), sys.stdout
+    sys.stdout = captured
+    try:
+        start = time.perf_counter()
+        response = _HANDLERS[name]({"body": json.dumps(body)}, LocalContext(name))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    finally:
+        sys.stdout = stdout
+    return response["statusCode"], elapsed_ms, response["body"], _emitted_phases(captured.getvalue())
+
+
+def _ingest_task(kb_id, seed, doc_kb):
+    body = {"knowledgeBaseId": kb_id, "text": build_corpus(doc_kb / 1024, seed)}
+    status, elapsed_ms, response_body, phases = _invoke("ingest", body)
+    chunks = 0
+    if status < 300:
+        match = re.search(r"(\d+) chunks", json.loads(response_body).get("message", ""))
+        chunks = int(match.group(1)) if match else 0
+    return status, elapsed_ms, chunks, phases
+
+
+def _query_task(kb_id, text, top_k):
+    status, elapsed_ms, _, phases = _invoke("query", {"knowledgeBaseId": kb_id, "text": text, "top_k": top_k})
+    return status, elapsed_ms, phases
+
+
+def _phase_medians(results):
+    """Mediana de cada fase por função, a partir dos tempos coletados em cada invocação."""
+    samples = {}
+    for phases in results:
+        for function, phase, elapsed_ms in phases:
+            samples.setdefault(function, {}).setdefault(phase, []).append(elapsed_ms)
+    return {
+        function: {phase: round(statistics.median(values), 3) for phase, values in sorted(by_phase.items())}
+        for function, by_phase in sorted(samples.items())
+    }
+
+
+def _percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, max(0, int(round(pct / 100 * len(sorted_samples))) - 1))
+    return round(sorted_samples[index], 2)
+
+
+def _latency_summary(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": _percentile(samples, 50),
+        "p95_ms": _percentile(samples, 95),
+        "p99_ms": _percentile(samples, 99),
+        "mean_ms": round(statistics.fmean(samples), 2) if samples else None,
+    }
+
+
+def _errors(statuses):
+    errors = {}
+    for status in statuses:
+        if status >= 300:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    return errors
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Métricas comparadas com --compare: (seção, chave, maior é melhor)
+_COMPARED = [
+    ("ingest", "chunks_per_s", True),
+    ("ingest", "p50_ms", False),
+    ("query", "qps", True),
+    ("query", "p50_ms", False),
+    ("query", "p95_ms", False),
+    ("query", "p99_ms", False),
+]
+
+
+def compare(baseline, current):
+    """Variação percentual das métricas principais em relação a um relatório anterior."""
+    deltas = {}
+    for section, key, higher_is_better in _COMPARED:
+        before = baseline.get(section, {}).get(key)
+        after = current.get(section, {}).get(key)
+        if not before or after is None:
+            continue
+        change = (after - before) / before * 100
+        deltas[f"{section}.{key}"] = {
+            "baseline": before,
+            "current": after,
+            "change_pct": round(change, 1),
+            "better": change > 0 if higher_is_better else change < 0,
+        }
+    return deltas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--doc-kb", type=float, default=32, help="Tamanho de cada documento em KB.")
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4, help="Número de 'containers' (processos).")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latência do servidor falso da OpenAI.")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fração de respostas 429 do servidor falso.")
+    parser.add_argument("--output", help="Salva o relatório JSON neste arquivo.")
+    parser.add_argument("--compare", help="Relatório JSON anterior para comparação.")
+    args = parser.parse_args()
+
+    dsn = os.environ.get("BENCH_DB_DSN")
+    if not dsn:
+        raise SystemExit("Defina BENCH_DB_DSN com a string de conexão de um Postgres local com pgvector.")
+
+    ensure_schema(dsn)
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    kb_id = str(create_knowledge_base(admin, "bench-e2e"))
+
+    server = FakeOpenAIServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429).start()
+    # Herdado pelos workers: as funções leem a configuração do ambiente, como na Lambda.
+    os.environ.update({
+        "NEON_DB_CONNECTION_STRING": dsn,
+        "OPENAI_PROXY_LAMBDA_ARN": PROXY_FUNCTION_NAME,
+        "OPENAI_API_KEY": "sk-fake-benchmark",
+        "OPENAI_EMBEDDINGS_URL": server.url,
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+    })
+    os.environ.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+
+    rng = random.Random(7)
+    query_texts = [" ".join(rng.choices(_WORDS, k=rng.randint(3, 12))) for _ in range(args.queries)]
+    report = {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+    }
+
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(args.concurrency, mp_context=context, initializer=_worker_init) as pool:
+            # Garante que todos os workers terminaram o init antes de medir
+            list(pool.map(_query_task, [kb_id] * args.concurrency, ["aquecimento"] * args.concurrency,
+                          [1] * args.concurrency))
+
+            start = time.perf_counter()
+            ingest = list(pool.map(_ingest_task, [kb_id] * args.documents, range(args.documents),
+                                   [args.doc_kb] * args.documents))
+            ingest_seconds = time.perf_counter() - start
+            chunks = sum(c for _, _, c, _ in ingest)
+            report["ingest"] = {
+                "documents": args.documents,
+                "chunks": chunks,
+                "seconds": round(ingest_seconds, 3),
+                "chunks_per_s": round(chunks / ingest_seconds, 1),
+                **_latency_summary([ms for status, ms, _, _ in ingest if status < 300]),
+                "errors": _errors(status for status, _, _, _ in ingest),
+                "phases_p50_ms": _phase_medians(phases for _, _, _, phases in ingest),
+            }
+
+            start = time.perf_counter()
+            queries = list(pool.map(_query_task, [kb_id] * args.queries, query_texts, [args.top_k] * args.queries))
+            query_seconds = time.perf_counter() - start
+            report["query"] = {
+                "count": args.queries,
+                "seconds": round(query_seconds, 3),
+                "qps": round(args.queries / query_seconds, 1),
+                **_latency_summary([ms for status, ms, _ in queries if status < 300]),
+                "errors": _errors(status for status, _, _ in queries),
+                "phases_p50_ms": _phase_medians(phases for _, _, phases in queries),
+            }
+    finally:
+        server.stop()
+        drop_knowledge_base(admin, kb_id)
+        admin.close()
+
+    report["fake_openai"] = server.stats()
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(json.load(f), report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Benchmark de requisições/s: Lambdas locais versus o modo servidor (`src.server.main`).
+
+Os dois modos recebem a mesma carga de consultas, totalmente offline (servidor falso
+da OpenAI e Postgres local com pgvector):
+
+  * lambda: N processos, cada um como um container de Lambda, chamando os
+    `lambda_handler`s e o proxy por um `LocalLambdaClient` (como o bench_e2e);
+  * server: um processo `python -m src.server.main --workers N`, com N clientes
+    HTTP keep-alive em paralelo.
+
+Antes das consultas, a base é povoada pela rota /ingest do servidor. Relata req/s e
+p50/p95/p99 de cada modo em JSON.
+
+Uso (a partir da raiz do repositório):
+    BENCH_DB_DSN=postgresql://... python -m benchmarks.bench_server \\
+        [--documents 10] [--queries 400] [--concurrency 8] [--latency-ms 20]
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import psycopg2
+
+from benchmarks.bench_chunking import _WORDS, build_corpus
+from benchmarks.bench_e2e import _errors, _latency_summary, _query_task, _worker_init
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.local_db import create_knowledge_base, drop_knowledge_base, ensure_schema
+from benchmarks.local_lambda import PROXY_FUNCTION_NAME
+
+STARTUP_TIMEOUT_SECONDS = 30
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(port, workers):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.server.main", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("O servidor terminou durante a inicialização.")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("O servidor não respondeu a tempo.")
+
+
+class _Client:
+    """Cliente HTTP keep-alive; um por thread."""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+    def post(self, path, body):
+        start = time.perf_counter()
+        self.conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+        response = self.conn.getresponse()
+        response.read()
+        return response.status, (time.perf_counter() - start) * 1000
+
+
+def _run_clients(port, concurrency, path, bodies):
+    """Distribui as requisições entre `concurrency` clientes keep-alive e mede o total."""
+    shards = [bodies[i::concurrency] for i in range(concurrency)]
+
+    def run(shard):
+        client = _Client(port)
+        return [client.post(path, body) for body in shard]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = [r for shard in pool.map(run, shards) for r in shard]
+    return results, time.perf_counter() - start
+
+
+def _summary(results, seconds):
+    return {
+        "count": len(results),
+        "seconds": round(seconds, 3),
+        "rps": round(len(results) / seconds, 1),
+        **_latency_summary([ms for status, ms in results if status < 300]),
+        "errors": _errors(status for status, _ in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--doc-kb", type=float, default=16, help="Tamanho de cada documento em KB.")
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Containers (modo lambda) e workers/clientes (modo server).")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latência do servidor falso da OpenAI.")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    dsn = os.environ.get("BENCH_DB_DSN")
+    if not dsn:
+        raise SystemExit("Defina BENCH_DB_DSN com a string de conexão de um Postgres local com pgvector.")
+
+    ensure_schema(dsn)
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    kb_id = str(create_knowledge_base(admin, "bench-server"))
+
+    fake = FakeOpenAIServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms).start()
+    # Herdado pelos workers e pelo servidor: a configuração vem do ambiente, como na Lambda.
+    os.environ.update({
+        "NEON_DB_CONNECTION_STRING": dsn,
+        "OPENAI_PROXY_LAMBDA_ARN": PROXY_FUNCTION_NAME,
+        "OPENAI_API_KEY": "sk-fake-benchmark",
+        "OPENAI_EMBEDDINGS_URL": fake.url,
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+        "CORTEXA_METRICS": "false",
+    })
+    os.environ.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+
+    rng = random.Random(7)
+    query_texts = [" ".join(rng.choices(_WORDS, k=rng.randint(3, 12))) for _ in range(args.queries)]
+    report = {"python": sys.version.split()[0], "config": vars(args)}
+
+    port = _free_port()
+    server = _start_server(port, args.concurrency)
+    try:
+        ingest, seconds = _run_clients(port, args.concurrency, "/ingest", [
+            {"knowledgeBaseId": kb_id, "text": build_corpus(args.doc_kb / 1024, seed)}
+            for seed in range(args.documents)
+        ])
+        report["server_ingest"] = _summary(ingest, seconds)
+
+        # Aquecimento: abre as conexões de cada worker antes de medir
+        _run_clients(port, args.concurrency, "/query", [{"knowledgeBaseId": kb_id, "text": "aquecimento"}]
+                     * args.concurrency * 2)
+        queries, seconds = _run_clients(port, args.concurrency, "/query", [
+            {"knowledgeBaseId": kb_id, "text": text, "top_k": args.top_k} for text in query_texts
+        ])
+        report["server"] = _summary(queries, seconds)
+    finally:
+        server.terminate()
+        server.wait()
+
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(args.concurrency, mp_context=context, initializer=_worker_init) as pool:
+            list(pool.map(_query_task, [kb_id] * args.concurrency, ["aquecimento"] * args.concurrency,
+                          [1] * args.concurrency))
+            start = time.perf_counter()
+            queries = list(pool.map(_query_task, [kb_id] * args.queries, query_texts, [args.top_k] * args.queries))
+            report["lambda"] = _summary([(status, ms) for status, ms, _ in queries], time.perf_counter() - start)
+    finally:
+        fake.stop()
+        drop_knowledge_base(admin, kb_id)
+        admin.close()
+
+    report["speedup"] = round(report["server"]["rps"] / report["lambda"]["rps"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark de cold start das três funções Lambda.
+
+Para cada função, em processos Python novos (como um container recém-criado):
+  * mede o tempo de import do módulo com `-X importtime` (e lista os imports mais caros);
+  * mede o "init" (import + pré-aquecimento, se simulado) e a latência da primeira invocação.
+
+Sem serviços configurados, a primeira invocação retorna erro rapidamente (o status é
+reportado); com NEON_DB_CONNECTION_STRING, OPENAI_PROXY_LAMBDA_ARN e OPENAI_API_KEY
+no ambiente, mede o caminho real. `--simulate-lambda` define AWS_LAMBDA_FUNCTION_NAME
+para que o pré-aquecimento do init seja executado.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_startup [--runs 5] [--simulate-lambda]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTIONS = {
+    "ingest_function": {
+        "module": "src.ingest_function.main",
+        "event": {"body": json.dumps({"knowledgeBaseId": "bench-kb", "text": "Texto de benchmark. " * 20})},
+    },
+    "query_function": {
+        "module": "src.query_function.main",
+        "event": {"body": json.dumps({"knowledgeBaseId": "bench-kb", "text": "consulta de benchmark"})},
+    },
+    "openai_embedding_proxy": {
+        "module": "src.openai_embedding_proxy.main",
+        "event": {"body": json.dumps({"input": "texto de benchmark"})},
+    },
+}
+
+_FIRST_INVOCATION = """
+import importlib, json, sys, time
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+initialized = time.perf_counter()
+
+class Context:
+    aws_request_id = "bench-startup"
+
+response = module.lambda_handler(json.loads(sys.argv[2]), Context())
+finished = time.perf_counter()
+print(json.dumps({
+    "init_ms": (initialized - start) * 1000,
+    "first_invocation_ms": (finished - initialized) * 1000,
+    "status": response.get("statusCode"),
+}))
+"""
+
+
+def _import_time(module, env):
+    """Executa `-X importtime` e retorna (tempo cumulativo do módulo em ms, imports mais caros)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    total_us = None
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # Formato: "import time: <self us> | <cumulative us> | <indentação por nível><módulo>"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.rstrip()[1:]
+        entries.append((int(cumulative_us), name))
+        if name == module:
+            total_us = int(cumulative_us)
+    # Só os imports de primeiro nível, para um resumo legível
+    top_level = sorted(((us, name) for us, name in entries if not name.startswith(" ")), reverse=True)[:8]
+    return total_us / 1000 if total_us else None, [{"module": n, "ms": round(us / 1000, 1)} for us, n in top_level]
+
+
+def _first_invocation(module, event, env):
+    result = subprocess.run(
+        [sys.executable, "-c", _FIRST_INVOCATION, module, json.dumps(event)],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--simulate-lambda", action="store_true",
+                        help="Define AWS_LAMBDA_FUNCTION_NAME para executar o pré-aquecimento no init.")
+    parser.add_argument("--function", choices=sorted(FUNCTIONS), action="append",
+                        help="Limita o benchmark a uma função (pode repetir).")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    if args.simulate_lambda:
+        env.setdefault("AWS_LAMBDA_FUNCTION_NAME", "bench-startup")
+
+    report = {"python": sys.version.split()[0], "simulate_lambda": args.simulate_lambda, "functions": {}}
+    for name in args.function or sorted(FUNCTIONS):
+        spec = FUNCTIONS[name]
+        import_ms = []
+        top_imports = None
+        invocations = []
+        for _ in range(args.runs):
+            total, top_imports = _import_time(spec["module"], env)
+            import_ms.append(total)
+            invocations.append(_first_invocation(spec["module"], spec["event"], env))
+        report["functions"][name] = {
+            "import_ms_median": round(statistics.median(import_ms), 1),
+            "init_ms_median": round(statistics.median(i["init_ms"] for i in invocations), 1),
+            "first_invocation_ms_median": round(statistics.median(i["first_invocation_ms"] for i in invocations), 1),
+            "first_invocation_status": invocations[-1]["status"],
+            "top_imports": top_imports,
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
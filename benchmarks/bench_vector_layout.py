@@ -0,0 +1,176 @@
+"""
+Benchmark da busca com vetores separados do conteúdo (migração V5).
+
+Gera, no schema de rascunho `vector_layout`, um corpus sintético com conteúdo e
+metadados de tamanho realista em `knowledge_chunks` e a cópia estreita dos vetores
+em `knowledge_chunk_vectors` (com o mesmo STORAGE de produção), cria os índices
+ivfflat das duas tabelas após a carga e compara, para as mesmas consultas:
+
+  * `SEARCH_CHUNKS`: ranking sobre `knowledge_chunks` (vetor no TOAST);
+  * `SEARCH_CHUNKS_SPLIT`: ranking sobre `knowledge_chunk_vectors` e conteúdo só do top-k.
+
+Para cada uma, relata os blocos lidos por consulta (`EXPLAIN (ANALYZE, BUFFERS)`:
+compartilhados em cache e lidos do disco), o tempo de execução no servidor e a
+latência p50/p95 medida no cliente, além do tamanho das tabelas. O schema de
+rascunho é removido ao final.
+
+Uso (a partir da raiz do repositório):
+    BENCH_DB_DSN=postgresql://... python -m benchmarks.bench_vector_layout \\
+        [--rows 50000] [--clusters 100] [--content-bytes 1500] [--queries 100] [--k 10] [--probes 10]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+from benchmarks.local_db import ensure_schema
+from src.common.db import ConnectionManager
+from src.common.embedding_config import DEFAULT_CONFIG
+from src.common.vectors import EMBEDDING_DIMENSIONS
+from src.query_function.main import SEARCH_CHUNKS, SEARCH_CHUNKS_SPLIT
+
+SCHEMA = "vector_layout"
+KB_ID = "00000000-0000-4000-8000-000000000000"
+
+
+def _prepare_schema(cur, rows, clusters, content_bytes, seed):
+    """Cria as duas tabelas no schema de rascunho, carrega o corpus e constrói os índices."""
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"CREATE TABLE {SCHEMA}.knowledge_chunks "
+                f"(LIKE public.knowledge_chunks INCLUDING DEFAULTS INCLUDING STORAGE)")
+    cur.execute(f"CREATE TABLE {SCHEMA}.knowledge_chunk_vectors "
+                f"(LIKE public.knowledge_chunk_vectors INCLUDING DEFAULTS INCLUDING STORAGE)")
+    # A busca confirma o modelo da base (`matching_base`): a base sintética usa o padrão
+    cur.execute(f"CREATE TABLE {SCHEMA}.knowledge_bases (LIKE public.knowledge_bases INCLUDING DEFAULTS)")
+    cur.execute(f"INSERT INTO {SCHEMA}.knowledge_bases (id, name, user_id) "
+                "VALUES (%s, 'vector-layout', gen_random_uuid())", (KB_ID,))
+
+    cur.execute("SELECT setseed(%s)", (seed / 2 ** 31,))
+    cur.execute("""
+        CREATE TEMP TABLE layout_centers AS
+        SELECT c AS id, array_agg(random() - 0.5 ORDER BY d) AS v
+        FROM generate_series(0, %s - 1) c, generate_series(1, %s) d
+        GROUP BY c
+    """, (clusters, EMBEDDING_DIMENSIONS))
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.knowledge_chunks (knowledge_base_id, content, embedding, metadata)
+        SELECT %s, left(repeat('Trecho sintético ' || i || ' de um documento. ', 1 + %s / 30), %s),
+               (SELECT array_agg(c.v[d] + (random() - 0.5) * 0.5 ORDER BY d)
+                FROM generate_series(1, %s) d)::vector,
+               jsonb_build_object('source', 'documento-' || (i / 20) || '.pdf', 'page', i %% 40)
+        FROM generate_series(1, %s) i
+        JOIN layout_centers c ON c.id = i %% %s
+    """, (KB_ID, content_bytes, content_bytes, EMBEDDING_DIMENSIONS, rows, clusters))
+    cur.execute("DROP TABLE layout_centers")
+    cur.execute(f"INSERT INTO {SCHEMA}.knowledge_chunk_vectors (id, knowledge_base_id, embedding) "
+                f"SELECT id, knowledge_base_id, embedding FROM {SCHEMA}.knowledge_chunks")
+
+    # Índices de produção, construídos com os dados já carregados
+    lists = max(1, rows // 1000)
+    cur.execute(f"ALTER TABLE {SCHEMA}.knowledge_chunks ADD PRIMARY KEY (id)")
+    cur.execute(f"ALTER TABLE {SCHEMA}.knowledge_chunk_vectors ADD PRIMARY KEY (id)")
+    for table in ("knowledge_chunks", "knowledge_chunk_vectors"):
+        cur.execute(f"CREATE INDEX ON {SCHEMA}.{table} USING ivfflat (embedding vector_cosine_ops) "
+                    f"WITH (lists = {lists})")
+        cur.execute(f"CREATE INDEX ON {SCHEMA}.{table} (knowledge_base_id)")
+        cur.execute(f"VACUUM ANALYZE {SCHEMA}.{table}")
+
+
+def _table_sizes(cur):
+    sizes = {}
+    for table in ("knowledge_chunks", "knowledge_chunk_vectors"):
+        cur.execute("SELECT pg_relation_size(%s), pg_total_relation_size(%s)",
+                    (f"{SCHEMA}.{table}", f"{SCHEMA}.{table}"))
+        heap, total = cur.fetchone()
+        sizes[table] = {"heap_mb": round(heap / 2 ** 20, 1), "total_mb": round(total / 2 ** 20, 1)}
+    return sizes
+
+
+def _sample_queries(cur, count, seed, noise=0.05):
+    """Consultas próximas aos dados: vetores armazenados com ruído gaussiano."""
+    cur.execute(f"SELECT embedding::text FROM {SCHEMA}.knowledge_chunks ORDER BY md5(id::text || %s) LIMIT %s",
+                (str(seed), count))
+    rng = random.Random(seed)
+    return [json.dumps([float(v) + rng.gauss(0.0, noise) for v in text.strip("[]").split(",")])
+            for (text,) in cur.fetchall()]
+
+
+def _explain(cur, statement, query, k):
+    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement.direct_sql}", (query, KB_ID, *DEFAULT_CONFIG, k))
+    result = cur.fetchone()[0][0]
+    plan = result["Plan"]
+    return plan["Shared Hit Blocks"], plan["Shared Read Blocks"], result["Execution Time"]
+
+
+def _measure(manager, statement, queries, k):
+    """Blocos e tempo no servidor (EXPLAIN) e latência no cliente da busca preparada."""
+    hits, reads, server_ms, latencies = [], [], [], []
+    for query in queries:
+        hit, read, execution = manager.run(lambda cur: _explain(cur, statement, query, k))
+        hits.append(hit)
+        reads.append(read)
+        server_ms.append(execution)
+
+    def search(cur, query):
+        cur.execute(manager.statement_sql(cur, statement), (query, KB_ID, *DEFAULT_CONFIG, k))
+        return cur.fetchall()
+
+    for query in queries:
+        start = time.perf_counter()
+        manager.run(lambda cur: search(cur, query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "shared_hit_blocks": round(statistics.mean(hits), 1),
+        "shared_read_blocks": round(statistics.mean(reads), 1),
+        "execution_ms": round(statistics.mean(server_ms), 3),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--content-bytes", type=int, default=1500, help="Tamanho do texto de cada chunk.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--probes", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Mantém o schema de rascunho ao final.")
+    args = parser.parse_args()
+
+    dsn = os.environ.get("BENCH_DB_DSN")
+    if not dsn:
+        raise SystemExit("Defina BENCH_DB_DSN com a string de conexão do banco a avaliar.")
+
+    ensure_schema(dsn)
+    manager = ConnectionManager(dsn, autocommit=True)
+    try:
+        manager.run(lambda cur: _prepare_schema(cur, args.rows, args.clusters, args.content_bytes, args.seed))
+        queries = manager.run(lambda cur: _sample_queries(cur, args.queries, args.seed))
+        # As buscas de produção resolvem as tabelas para as cópias de rascunho
+        manager.run(lambda cur: cur.execute(f"SET search_path TO {SCHEMA}, public"))
+        manager.run(lambda cur: cur.execute(f"SET ivfflat.probes = {args.probes}"))
+
+        report = {"rows": args.rows, "queries": len(queries), "k": args.k, "probes": args.probes,
+                  "content_bytes": args.content_bytes, "tables": manager.run(_table_sizes)}
+        for label, statement in (("combined", SEARCH_CHUNKS), ("split", SEARCH_CHUNKS_SPLIT)):
+            # Primeira passada só aquece o cache, para comparar as duas com o mesmo estado
+            _measure(manager, statement, queries, args.k)
+            report[label] = _measure(manager, statement, queries, args.k)
+    finally:
+        if not args.keep:
+            manager.run(lambda cur: cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        if manager.connection is not None:
+            manager.connection.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Avaliação de recall e latência da busca vetorial para diferentes índices.
+
+Copia os vetores de uma base de conhecimento (`--kb`) — ou gera um corpus sintético
+de vetores 1536-d agrupados em clusters — para o schema de rascunho `ann_eval`,
+com uma tabela `knowledge_chunks` idêntica à de produção. Com `search_path`
+apontando para esse schema, a mesma query `SEARCH_CHUNKS` da `query_function` é
+executada (como statement preparado) para cada configuração da grade:
+
+  * exata (sem índice): é o ground truth, top-k por força bruta;
+  * ivfflat para cada `lists`, variando `ivfflat.probes`;
+  * hnsw para cada (`m`, `ef_construction`), variando `hnsw.ef_search`.
+
+Durante a avaliação de um índice, `enable_seqscan` fica desligado para medir o
+índice em si; `planner_uses_index` informa se o planejador o escolheria sozinho
+(com vetores em TOAST, ele tende a subestimar a varredura sequencial).
+
+Relata recall@k, p50/p99 de latência e tempo de construção do índice em JSON,
+com a fronteira de Pareto (maior recall para cada latência). As tabelas de
+produção não são alteradas; o schema de rascunho é removido ao final.
+
+Uso (a partir da raiz do repositório):
+    BENCH_DB_DSN=postgresql://... python -m benchmarks.eval_ann \\
+        [--kb <uuid> | --rows 10000 --clusters 50] [--queries 200] [--k 10] \\
+        [--ivfflat-lists 50,100,200] [--ivfflat-probes 1,5,10,20] \\
+        [--hnsw-m 16] [--hnsw-ef-construction 64] [--hnsw-ef-search 20,40,100]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.local_db import ensure_schema
+from src.common.db import ConnectionManager
+from src.common.vectors import EMBEDDING_DIMENSIONS
+from src.query_function.main import SEARCH_CHUNKS
+
+SCHEMA = "ann_eval"
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()] if value else []
+
+
+def _prepare_schema(cur, kb_id, rows, clusters, seed):
+    """Cria a cópia da tabela e a preenche; retorna (knowledge_base_id, número de linhas)."""
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    # Sem índices nem FKs: cada configuração da grade cria o seu
+    cur.execute(f"CREATE TABLE {SCHEMA}.knowledge_chunks (LIKE public.knowledge_chunks INCLUDING DEFAULTS)")
+    # A busca confirma o modelo da base (`matching_base`): a base vai junto para o rascunho
+    cur.execute(f"CREATE TABLE {SCHEMA}.knowledge_bases (LIKE public.knowledge_bases INCLUDING DEFAULTS)")
+
+    if kb_id:
+        cur.execute(f"INSERT INTO {SCHEMA}.knowledge_bases SELECT * FROM public.knowledge_bases WHERE id = %s",
+                    (kb_id,))
+        cur.execute(f"INSERT INTO {SCHEMA}.knowledge_chunks SELECT * FROM public.knowledge_chunks "
+                    f"WHERE knowledge_base_id = %s", (kb_id,))
+    else:
+        kb_id = "00000000-0000-4000-8000-000000000000"
+        cur.execute(f"INSERT INTO {SCHEMA}.knowledge_bases (id, name, user_id) "
+                    "VALUES (%s, 'ann-eval', gen_random_uuid())", (kb_id,))
+        cur.execute("SELECT setseed(%s)", (seed / 2 ** 31,))
+        # Gerado no servidor: centros aleatórios e pontos = centro + ruído
+        cur.execute(f"""
+            CREATE TEMP TABLE ann_centers AS
+            SELECT c AS id, array_agg(random() - 0.5 ORDER BY d) AS v
+            FROM generate_series(0, %s - 1) c, generate_series(1, %s) d
+            GROUP BY c
+        """, (clusters, EMBEDDING_DIMENSIONS))
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.knowledge_chunks (knowledge_base_id, content, embedding)
+            SELECT %s, 'sintético ' || i,
+                   (SELECT array_agg(c.v[d] + (random() - 0.5) * 0.5 ORDER BY d)
+                    FROM generate_series(1, %s) d)::vector
+            FROM generate_series(1, %s) i
+            JOIN ann_centers c ON c.id = i %% %s
+        """, (kb_id, EMBEDDING_DIMENSIONS, rows, clusters))
+        cur.execute("DROP TABLE ann_centers")
+    cur.execute(f"ANALYZE {SCHEMA}.knowledge_chunks")
+    cur.execute(f"SELECT count(*) FROM {SCHEMA}.knowledge_chunks")
+    rows = cur.fetchone()[0]
+    cur.execute(f"SELECT id, embedding_model, embedding_dimensions FROM {SCHEMA}.knowledge_bases")
+    # (id, modelo, dimensão): os parâmetros da base na busca de produção
+    return cur.fetchone(), rows
+
+
+def _sample_queries(cur, count, seed, noise=0.05):
+    """Consultas próximas aos dados reais: vetores armazenados com ruído gaussiano."""
+    cur.execute(f"SELECT embedding::text FROM {SCHEMA}.knowledge_chunks ORDER BY md5(id::text || %s) LIMIT %s",
+                (str(seed), count))
+    rng = random.Random(seed)
+    queries = []
+    for (text,) in cur.fetchall():
+        vector = [float(v) + rng.gauss(0.0, noise) for v in text.strip("[]").split(",")]
+        queries.append(json.dumps(vector))
+    return queries
+
+
+def _run_queries(manager, queries, base, k):
+    """Executa a busca de produção para cada consulta; retorna (conteúdos, latências em ms)."""
+    results, latencies = [], []
+
+    def search(cur, query):
+        cur.execute(manager.statement_sql(cur, SEARCH_CHUNKS), (query, *base, k))
+        return [row[0] for row in cur.fetchall()]
+
+    for query in queries:
+        start = time.perf_counter()
+        results.append(manager.run(lambda cur: search(cur, query)))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, latencies
+
+
+def recall_at_k(approximate, exact):
+    """Recall médio: fração do top-k exato presente no resultado aproximado (com repetições)."""
+    total = 0.0
+    for found, truth in zip(approximate, exact):
+        if truth:
+            total += sum((Counter(found) & Counter(truth)).values()) / len(truth)
+    return total / len(exact) if exact else 0.0
+
+
+def _percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))]
+
+
+def _execute(manager, sql):
+    manager.run(lambda cur: cur.execute(sql))
+
+
+def _planner_uses_index(manager, query, base, k):
+    """Verifica, sem forçar nada, se o plano da busca de produção usa o índice avaliado."""
+    def explain(cur):
+        cur.execute("SET LOCAL enable_seqscan = on")
+        cur.execute(f"EXPLAIN (FORMAT JSON) {SEARCH_CHUNKS.direct_sql}", (query, *base, k))
+        return json.dumps(cur.fetchone()[0])
+    manager.run(lambda cur: cur.execute("BEGIN"))
+    try:
+        return "ann_eval_idx" in manager.run(explain)
+    finally:
+        manager.run(lambda cur: cur.execute("COMMIT"))
+
+
+def _evaluate(manager, label, params, queries, base, k, exact, build_seconds=None):
+    results, latencies = _run_queries(manager, queries, base, k)
+    entry = {
+        "index": label,
+        **params,
+        "planner_uses_index": _planner_uses_index(manager, queries[0], base, k),
+        "recall_at_k": round(recall_at_k(results, exact), 4),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+    }
+    if build_seconds is not None:
+        entry["build_s"] = round(build_seconds, 2)
+    return entry
+
+
+def _build_index(manager, sql):
+    _execute(manager, f"DROP INDEX IF EXISTS {SCHEMA}.ann_eval_idx")
+    start = time.perf_counter()
+    _execute(manager, sql)
+    _execute(manager, f"ANALYZE {SCHEMA}.knowledge_chunks")
+    return time.perf_counter() - start
+
+
+def pareto_frontier(entries):
+    """Configurações não dominadas: nenhuma outra tem recall maior ou igual com p50 menor."""
+    frontier = []
+    for entry in sorted(entries, key=lambda e: (e["p50_ms"], -e["recall_at_k"])):
+        if not frontier or entry["recall_at_k"] > frontier[-1]["recall_at_k"]:
+            frontier.append(entry)
+    return frontier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kb", help="Avalia com os vetores desta base de conhecimento.")
+    parser.add_argument("--rows", type=int, default=10000, help="Tamanho do corpus sintético.")
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ivfflat-lists", default="50,100,200")
+    parser.add_argument("--ivfflat-probes", default="1,5,10,20")
+    parser.add_argument("--hnsw-m", default="16")
+    parser.add_argument("--hnsw-ef-construction", default="64")
+    parser.add_argument("--hnsw-ef-search", default="20,40,100")
+    parser.add_argument("--maintenance-work-mem", default="512MB")
+    parser.add_argument("--keep", action="store_true", help="Mantém o schema de rascunho ao final.")
+    args = parser.parse_args()
+
+    dsn = os.environ.get("BENCH_DB_DSN")
+    if not dsn:
+        raise SystemExit("Defina BENCH_DB_DSN com a string de conexão do banco a avaliar.")
+
+    ensure_schema(dsn)
+    manager = ConnectionManager(dsn, autocommit=True)
+    try:
+        base, rows = manager.run(lambda cur: _prepare_schema(cur, args.kb, args.rows, args.clusters, args.seed))
+        if rows == 0:
+            raise SystemExit("Nenhum vetor encontrado para avaliar.")
+        queries = manager.run(lambda cur: _sample_queries(cur, args.queries, args.seed))
+        # A busca de produção resolve `knowledge_chunks` para a cópia de rascunho
+        _execute(manager, f"SET search_path TO {SCHEMA}, public")
+        _execute(manager, f"SET maintenance_work_mem TO '{args.maintenance_work_mem}'")
+
+        report = {"rows": rows, "queries": len(queries), "k": args.k, "source": args.kb or "synthetic", "results": []}
+
+        # Ground truth: sem índice, o plano é uma varredura sequencial com distância exata
+        exact, latencies = _run_queries(manager, queries, base, args.k)
+        report["results"].append({
+            "index": "exact",
+            "recall_at_k": 1.0,
+            "p50_ms": round(statistics.median(latencies), 3),
+            "p99_ms": round(_percentile(latencies, 99), 3),
+        })
+
+        _execute(manager, "SET enable_seqscan = off")
+        for lists in _int_list(args.ivfflat_lists):
+            build = _build_index(manager, f"CREATE INDEX ann_eval_idx ON {SCHEMA}.knowledge_chunks "
+                                          f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})")
+            for probes in _int_list(args.ivfflat_probes):
+                _execute(manager, f"SET ivfflat.probes = {probes}")
+                report["results"].append(_evaluate(manager, "ivfflat", {"lists": lists, "probes": probes},
+                                                   queries, base, args.k, exact, build))
+            _execute(manager, "RESET ivfflat.probes")
+
+        for m in _int_list(args.hnsw_m):
+            for ef_construction in _int_list(args.hnsw_ef_construction):
+                build = _build_index(manager, f"CREATE INDEX ann_eval_idx ON {SCHEMA}.knowledge_chunks "
+                                              f"USING hnsw (embedding vector_cosine_ops) "
+                                              f"WITH (m = {m}, ef_construction = {ef_construction})")
+                for ef_search in _int_list(args.hnsw_ef_search):
+                    _execute(manager, f"SET hnsw.ef_search = {ef_search}")
+                    params = {"m": m, "ef_construction": ef_construction, "ef_search": ef_search}
+                    report["results"].append(_evaluate(manager, "hnsw", params, queries, base, args.k, exact, build))
+                _execute(manager, "RESET hnsw.ef_search")
+
+        report["pareto"] = pareto_frontier(report["results"])
+    finally:
+        if not args.keep:
+            _execute(manager, f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        if manager.connection is not None:
+            manager.connection.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Servidor falso da API de Embeddings da OpenAI, para benchmarks offline.
+
+Responde `POST /v1/embeddings` no mesmo formato da OpenAI (inclusive
+`encoding_format: "base64"` e `dimensions`), com vetores determinísticos: o mesmo
+texto sempre gera o mesmo vetor normalizado, então buscas são reproduzíveis.
+A latência (fixa + variação) e a fração de respostas 429 são configuráveis.
+
+Uso isolado (a partir da raiz do repositório):
+    python -m benchmarks.fake_openai [--port 8089] [--latency-ms 50] [--rate-429 0.01]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_DIMENSIONS = 1536
+
+
+def fake_embedding(text, dimensions=DEFAULT_DIMENSIONS):
+    """Vetor unitário determinístico derivado do hash do texto."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+class FakeOpenAIServer:
+    """Servidor HTTP em thread própria; use como context manager."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.requests = 0
+        self.throttled = 0
+        self.inputs = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/embeddings"
+
+    def stats(self):
+        return {"requests": self.requests, "throttled": self.throttled, "inputs": self.inputs}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _next_request(self):
+        """Sorteia (sob lock, para ser determinístico por ordem de chegada) latência e throttling."""
+        with self._lock:
+            self.requests += 1
+            throttled = self._rng.random() < self.rate_429
+            if throttled:
+                self.throttled += 1
+            delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+        return throttled, delay / 1000
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Cabeçalhos e corpo saem em escritas separadas; sem isso o delayed ACK soma ~40 ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                throttled, delay = server._next_request()
+                time.sleep(delay)
+                if throttled:
+                    self._send(429, {"error": {"message": "Rate limit reached (fake).", "type": "requests"}})
+                    return
+                try:
+                    request = json.loads(body)
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "JSON inválido."}})
+                    return
+
+                inputs = request.get("input")
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                dimensions = int(request.get("dimensions", DEFAULT_DIMENSIONS))
+                use_base64 = request.get("encoding_format") == "base64"
+                data = []
+                for index, text in enumerate(inputs):
+                    vector = fake_embedding(text, dimensions)
+                    if use_base64:
+                        embedding = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode("ascii")
+                    else:
+                        embedding = vector
+                    data.append({"object": "embedding", "index": index, "embedding": embedding})
+                with server._lock:
+                    server.inputs += len(inputs)
+                tokens = sum(len(text.split()) for text in inputs)
+                self._send(200, {
+                    "object": "list",
+                    "data": data,
+                    "model": request.get("model"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.rate_429)
+    print(f"Servidor falso da OpenAI em {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Preparação de um Postgres local (com pgvector) para os benchmarks.
+
+Aplica, em ordem, as migrações de `database/migrations` ainda não registradas em
+`schema_migrations`, os scripts opcionais de `database/optional` e cria bases de
+conhecimento descartáveis.
+"""
+import glob
+import os
+import re
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "database", "migrations")
+OPTIONAL_DIR = os.path.join(os.path.dirname(__file__), "..", "database", "optional")
+
+
+def _migrations():
+    found = []
+    for path in glob.glob(os.path.join(MIGRATIONS_DIR, "V*__*.sql")):
+        version = re.match(r"V(\d+)__", os.path.basename(path)).group(1)
+        found.append((int(version), version, path))
+    return sorted(found)
+
+
+def ensure_schema(dsn):
+    """Aplica as migrações pendentes e retorna as versões aplicadas nesta chamada."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    applied = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations')")
+            done = set()
+            if cur.fetchone()[0] is not None:
+                cur.execute("SELECT version FROM schema_migrations")
+                done = {row[0] for row in cur.fetchall()}
+            for _, version, path in _migrations():
+                if version in done:
+                    continue
+                with open(path) as f:
+                    cur.execute(f.read())
+                applied.append(version)
+    finally:
+        conn.close()
+    return applied
+
+
+def apply_optional(cur, name):
+    """Executa um script de `database/optional` (ex.: 'chunk_vectors_enable')."""
+    with open(os.path.join(OPTIONAL_DIR, f"{name}.sql")) as f:
+        cur.execute(f.read())
+
+
+def create_knowledge_base(conn, name):
+    """Cria uma base de conhecimento com dono aleatório e retorna seu id."""
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES (%s, gen_random_uuid()) RETURNING id", (name,))
+        kb_id = cur.fetchone()[0]
+    if not conn.autocommit:
+        conn.commit()
+    return kb_id
+
+
+def drop_knowledge_base(conn, kb_id):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,))
+    if not conn.autocommit:
+        conn.commit()
@@ -0,0 +1,38 @@
+"""
+Execução local das Lambdas, sem AWS.
+
+`LocalLambdaClient` imita `lambda_client.invoke` (InvocationType 'RequestResponse')
+chamando o `lambda_handler` do módulo registrado para o nome da função, no mesmo
+processo. Assim a ingestão e a consulta chamam o proxy de embeddings exatamente
+como em produção, mas sem rede nem credenciais.
+"""
+import importlib
+import io
+import json
+import uuid
+
+PROXY_FUNCTION_NAME = "local-openai-embedding-proxy"
+
+
+class LocalContext:
+    """Contexto mínimo da Lambda usado pelos handlers."""
+
+    def __init__(self, function_name="local"):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+
+
+class LocalLambdaClient:
+    """Cliente compatível com `invoke` do boto3 que despacha para handlers locais."""
+
+    def __init__(self, functions=None):
+        self.functions = dict(functions or {PROXY_FUNCTION_NAME: "src.openai_embedding_proxy.main"})
+        self.invocations = 0
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}"):
+        if InvocationType != "RequestResponse":
+            raise ValueError(f"InvocationType não suportado localmente: {InvocationType}")
+        module = importlib.import_module(self.functions[FunctionName])
+        self.invocations += 1
+        result = module.lambda_handler(json.loads(Payload), LocalContext(FunctionName))
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode("utf-8"))}
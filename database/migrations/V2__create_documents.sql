@@ -0,0 +1,31 @@
+-- V2: Documentos de origem e re-ingestão incremental por chunk
+-- Autor: Cortexa Team
+
+-- PASSO 1: Tabela de documentos
+-- Cada documento é identificado pelo id estável fornecido pelo cliente (external_id)
+-- dentro de uma base de conhecimento, com uma versão crescente a cada re-ingestão.
+CREATE TABLE documents (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    knowledge_base_id UUID NOT NULL REFERENCES knowledge_bases(id) ON DELETE CASCADE,
+    external_id VARCHAR(255) NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE (knowledge_base_id, external_id)
+);
+
+-- PASSO 2: Vincular os chunks ao documento, com sua posição e o hash do conteúdo
+-- Chunks ingeridos sem documento (fluxo antigo) continuam com essas colunas nulas.
+-- O hash (SHA-256 do texto, em hex) permite reaproveitar chunks inalterados sem re-embedding.
+ALTER TABLE knowledge_chunks
+    ADD COLUMN document_id UUID REFERENCES documents(id) ON DELETE CASCADE,
+    ADD COLUMN ordinal INTEGER,
+    ADD COLUMN content_hash CHAR(64);
+
+-- PASSO 3: Índice para ler os chunks de um documento em ordem durante o diff
+CREATE INDEX knowledge_chunks_document_idx ON knowledge_chunks (document_id, ordinal)
+    WHERE document_id IS NOT NULL;
+
+-- Registra que esta migração (versão '2') foi aplicada com sucesso.
+INSERT INTO schema_migrations (version) VALUES ('2');
@@ -0,0 +1,34 @@
+-- V3: Modelo de embeddings por base de conhecimento e migração de modelo em background
+-- Autor: Cortexa Team
+
+-- PASSO 1: Modelo e dimensão usados pelos vetores de cada base
+-- Ingestão e consulta vetorizam com o modelo da base; bases existentes ficam com o padrão.
+ALTER TABLE knowledge_bases
+    ADD COLUMN embedding_model VARCHAR(100) NOT NULL DEFAULT 'text-embedding-3-small',
+    ADD COLUMN embedding_dimensions INTEGER NOT NULL DEFAULT 1536;
+
+-- PASSO 2: Coluna sombra para os vetores do novo modelo durante uma migração
+-- As consultas continuam usando `embedding` até a troca, que copia a sombra em uma transação.
+-- A dimensão acompanha a da coluna principal: modelos maiores usam o parâmetro `dimensions` da OpenAI.
+ALTER TABLE knowledge_chunks
+    ADD COLUMN embedding_next VECTOR(1536);
+
+-- PASSO 3: Estado das migrações, para retomar de onde parou
+CREATE TABLE embedding_migrations (
+    knowledge_base_id UUID PRIMARY KEY REFERENCES knowledge_bases(id) ON DELETE CASCADE,
+    target_model VARCHAR(100) NOT NULL,
+    target_dimensions INTEGER NOT NULL,
+    -- Cursor da passada principal (ordem de knowledge_chunks.id)
+    last_chunk_id UUID,
+    embedded_chunks BIGINT NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'switched', 'cancelled')),
+    started_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    switched_at TIMESTAMPTZ
+);
+
+-- PASSO 4: Índice para a passada principal da migração percorrer os chunks de uma base por id
+CREATE INDEX knowledge_chunks_base_id_idx ON knowledge_chunks (knowledge_base_id, id);
+
+-- Registra que esta migração (versão '3') foi aplicada com sucesso.
+INSERT INTO schema_migrations (version) VALUES ('3');
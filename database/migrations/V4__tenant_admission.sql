@@ -0,0 +1,88 @@
+-- V4: Controle de admissão por base de conhecimento (tenant)
+-- Autor: Cortexa Team
+
+-- PASSO 1: Requisições em andamento por tenant e operação ('ingest' ou 'query')
+-- Cada requisição admitida registra um lease e o apaga ao terminar. Um container que
+-- morra no meio da requisição não libera o lease; ele deixa de contar em `expires_at`.
+-- UNLOGGED: estado efêmero, sem custo de WAL; após um crash do banco a tabela volta vazia.
+CREATE UNLOGGED TABLE tenant_leases (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    knowledge_base_id UUID NOT NULL,
+    operation VARCHAR(20) NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX tenant_leases_tenant_idx ON tenant_leases (knowledge_base_id, operation, expires_at);
+
+-- PASSO 2: Balde de tokens por tenant e operação, para o limite de taxa
+CREATE UNLOGGED TABLE tenant_rate_buckets (
+    knowledge_base_id UUID NOT NULL,
+    operation VARCHAR(20) NOT NULL,
+    tokens DOUBLE PRECISION NOT NULL,
+    refilled_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (knowledge_base_id, operation)
+);
+
+-- PASSO 3: Admissão em uma única ida ao banco
+-- Retorna o id do lease (ou NULL sem limite de concorrência) quando a requisição é
+-- admitida; caso contrário, o motivo ('concurrency' ou 'rate') e em quantos segundos
+-- vale tentar de novo. Limites <= 0 desligam a respectiva verificação.
+CREATE FUNCTION cortexa_admit(
+    p_knowledge_base_id UUID,
+    p_operation TEXT,
+    p_max_concurrent INTEGER,
+    p_rate_per_second DOUBLE PRECISION,
+    p_burst DOUBLE PRECISION,
+    p_lease_seconds DOUBLE PRECISION,
+    OUT lease_id UUID,
+    OUT retry_after DOUBLE PRECISION,
+    OUT reason TEXT
+) LANGUAGE plpgsql AS $$
+DECLARE
+    v_active INTEGER;
+    v_tokens DOUBLE PRECISION;
+BEGIN
+    -- Serializa as admissões do mesmo tenant e operação até o fim da transação
+    PERFORM pg_advisory_xact_lock(hashtext(p_operation), hashtext(p_knowledge_base_id::text));
+
+    IF p_max_concurrent > 0 THEN
+        DELETE FROM tenant_leases
+        WHERE knowledge_base_id = p_knowledge_base_id AND operation = p_operation
+          AND expires_at < clock_timestamp();
+        SELECT count(*) INTO v_active
+        FROM tenant_leases
+        WHERE knowledge_base_id = p_knowledge_base_id AND operation = p_operation;
+        IF v_active >= p_max_concurrent THEN
+            reason := 'concurrency';
+            retry_after := 1;
+            RETURN;
+        END IF;
+    END IF;
+
+    IF p_rate_per_second > 0 THEN
+        SELECT LEAST(p_burst, tokens + EXTRACT(EPOCH FROM clock_timestamp() - refilled_at) * p_rate_per_second)
+        INTO v_tokens
+        FROM tenant_rate_buckets
+        WHERE knowledge_base_id = p_knowledge_base_id AND operation = p_operation;
+        v_tokens := COALESCE(v_tokens, p_burst);
+        IF v_tokens < 1 THEN
+            reason := 'rate';
+            retry_after := (1 - v_tokens) / p_rate_per_second;
+            RETURN;
+        END IF;
+        INSERT INTO tenant_rate_buckets (knowledge_base_id, operation, tokens, refilled_at)
+        VALUES (p_knowledge_base_id, p_operation, v_tokens - 1, clock_timestamp())
+        ON CONFLICT (knowledge_base_id, operation)
+        DO UPDATE SET tokens = EXCLUDED.tokens, refilled_at = EXCLUDED.refilled_at;
+    END IF;
+
+    IF p_max_concurrent > 0 THEN
+        INSERT INTO tenant_leases (knowledge_base_id, operation, expires_at)
+        VALUES (p_knowledge_base_id, p_operation, clock_timestamp() + make_interval(secs => p_lease_seconds))
+        RETURNING id INTO lease_id;
+    END IF;
+END;
+$$;
+
+-- Registra que esta migração (versão '4') foi aplicada com sucesso.
+INSERT INTO schema_migrations (version) VALUES ('4');
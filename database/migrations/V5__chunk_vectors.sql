@@ -0,0 +1,36 @@
+-- V5: Tabela estreita de vetores para a busca
+-- Autor: Cortexa Team
+
+-- PASSO 1: Vetores separados do conteúdo
+-- Em `knowledge_chunks`, cada candidato da busca lê a tupla com `content` e `metadata`
+-- e o vetor de 6 KB fica no TOAST (vários blocos por vetor). Esta tabela guarda só
+-- (id, base, vetor), com o vetor dentro da própria tupla (STORAGE PLAIN: cabe em uma
+-- página), para que a busca leia o mínimo e só então busque o conteúdo do top-k.
+CREATE TABLE knowledge_chunk_vectors (
+    id UUID PRIMARY KEY REFERENCES knowledge_chunks(id) ON DELETE CASCADE,
+    knowledge_base_id UUID NOT NULL,
+    embedding VECTOR(1536) NOT NULL
+);
+
+ALTER TABLE knowledge_chunk_vectors ALTER COLUMN embedding SET STORAGE PLAIN;
+
+-- PASSO 2: Função de sincronização a partir de `knowledge_chunks`
+-- A tabela começa vazia e nada a alimenta: o layout é opcional e só custa armazenamento
+-- dobrado, manutenção do ivfflat e WAL a quem o habilita, com
+-- `database/optional/chunk_vectors_enable.sql` (gatilho, cópia dos vetores existentes
+-- e índice vetorial). Toda escrita continua em `knowledge_chunks`; o gatilho mantém a
+-- cópia do vetor e as exclusões seguem pela FK.
+CREATE FUNCTION cortexa_sync_chunk_vector() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO knowledge_chunk_vectors (id, knowledge_base_id, embedding)
+    VALUES (NEW.id, NEW.knowledge_base_id, NEW.embedding)
+    ON CONFLICT (id) DO UPDATE
+        SET knowledge_base_id = EXCLUDED.knowledge_base_id, embedding = EXCLUDED.embedding;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX knowledge_chunk_vectors_base_idx ON knowledge_chunk_vectors (knowledge_base_id);
+
+-- Registra que esta migração (versão '5') foi aplicada com sucesso.
+INSERT INTO schema_migrations (version) VALUES ('5');
@@ -0,0 +1,16 @@
+-- V6: Busca textual (full-text) para a busca híbrida
+-- Autor: Cortexa Team
+
+-- PASSO 1: tsvector gerado a partir do conteúdo
+-- Configuração 'simple': sem stemming nem stopwords, para que identificadores exatos
+-- (SKUs, códigos de erro, nomes de campos) casem como foram escritos, em qualquer idioma.
+-- A coluna é calculada pelo banco em toda escrita; a ingestão não muda.
+-- Atenção: adicionar uma coluna STORED reescreve a tabela (bloqueio exclusivo).
+ALTER TABLE knowledge_chunks
+    ADD COLUMN content_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED;
+
+-- PASSO 2: Índice GIN para o filtro textual (`content_tsv @@ consulta`)
+CREATE INDEX knowledge_chunks_content_tsv_idx ON knowledge_chunks USING gin (content_tsv);
+
+-- Registra que esta migração (versão '6') foi aplicada com sucesso.
+INSERT INTO schema_migrations (version) VALUES ('6');
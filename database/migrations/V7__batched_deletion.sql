@@ -0,0 +1,28 @@
+-- V7: Remoção de bases e documentos em lotes e expiração de chunks (TTL)
+-- Autor: Cortexa Team
+
+-- PASSO 1: Marcas de remoção
+-- A API só marca a base ou o documento; o varredor (`src.common.sweeper`) apaga os
+-- chunks em lotes pequenos e, por último, a própria linha. Bases marcadas deixam de
+-- ser encontradas pela ingestão e pela consulta.
+ALTER TABLE knowledge_bases ADD COLUMN deleted_at TIMESTAMPTZ;
+ALTER TABLE documents ADD COLUMN deleted_at TIMESTAMPTZ;
+
+CREATE INDEX knowledge_bases_deleted_idx ON knowledge_bases (deleted_at) WHERE deleted_at IS NOT NULL;
+CREATE INDEX documents_deleted_idx ON documents (deleted_at) WHERE deleted_at IS NOT NULL;
+
+-- PASSO 2: O external_id de um documento marcado fica livre para uma nova ingestão
+-- A unicidade passa a valer só entre documentos não removidos.
+ALTER TABLE documents DROP CONSTRAINT documents_knowledge_base_id_external_id_key;
+CREATE UNIQUE INDEX documents_external_id_idx ON documents (knowledge_base_id, external_id)
+    WHERE deleted_at IS NULL;
+
+-- PASSO 3: Expiração opcional por chunk
+-- Coluna sem default: só altera o catálogo, sem reescrever a tabela. O índice parcial
+-- contém apenas os chunks com TTL e é percorrido pelo varredor em ordem de expiração.
+ALTER TABLE knowledge_chunks ADD COLUMN expires_at TIMESTAMPTZ;
+
+CREATE INDEX knowledge_chunks_expires_idx ON knowledge_chunks (expires_at, id) WHERE expires_at IS NOT NULL;
+
+-- Registra que esta migração (versão '7') foi aplicada com sucesso.
+INSERT INTO schema_migrations (version) VALUES ('7');
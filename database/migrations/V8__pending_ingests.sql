@@ -0,0 +1,15 @@
+-- V8: Ingestões de arquivo pendentes
+-- Autor: Cortexa Team
+
+-- PASSO 1: Prazo das ingestões em andamento
+-- Uma ingestão de arquivo grava seus chunks em lotes, ligados a um documento criado
+-- com `pending_until`. Até a conclusão, que zera a coluna, as buscas não veem esses
+-- chunks. Cada lote adia o prazo; se a função morrer no meio, o prazo vence e o
+-- varredor marca o documento para remoção, apagando os chunks pelo índice
+-- (document_id, ordinal).
+ALTER TABLE documents ADD COLUMN pending_until TIMESTAMPTZ;
+
+CREATE INDEX documents_pending_idx ON documents (pending_until) WHERE pending_until IS NOT NULL;
+
+-- Registra que esta migração (versão '8') foi aplicada com sucesso.
+INSERT INTO schema_migrations (version) VALUES ('8');
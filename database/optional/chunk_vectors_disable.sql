@@ -0,0 +1,11 @@
+-- Desabilita a tabela estreita de vetores (desfaz `chunk_vectors_enable.sql`)
+-- Autor: Cortexa Team
+--
+-- Desligue SPLIT_VECTOR_SEARCH na função de consulta antes de executar.
+
+-- PASSO 1: As escritas deixam de copiar os vetores
+DROP TRIGGER IF EXISTS knowledge_chunks_sync_vector ON knowledge_chunks;
+
+-- PASSO 2: Libera o espaço da cópia e do índice vetorial
+DROP INDEX IF EXISTS knowledge_chunk_vectors_embedding_idx;
+TRUNCATE knowledge_chunk_vectors;
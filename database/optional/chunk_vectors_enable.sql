@@ -0,0 +1,22 @@
+-- Habilita a tabela estreita de vetores (migração V5) para SPLIT_VECTOR_SEARCH
+-- Autor: Cortexa Team
+--
+-- Opcional: a partir daqui, toda escrita em `knowledge_chunks` grava o vetor duas vezes
+-- (armazenamento, manutenção do ivfflat e WAL dobrados). Pode ser executado de novo
+-- sem efeito; `chunk_vectors_disable.sql` desfaz.
+
+-- PASSO 1: Gatilho que mantém a cópia dos vetores
+CREATE OR REPLACE TRIGGER knowledge_chunks_sync_vector
+    AFTER INSERT OR UPDATE OF embedding, knowledge_base_id ON knowledge_chunks
+    FOR EACH ROW EXECUTE FUNCTION cortexa_sync_chunk_vector();
+
+-- PASSO 2: Cópia dos vetores existentes
+-- Depois do gatilho: escritas concorrentes já são copiadas por ele.
+INSERT INTO knowledge_chunk_vectors (id, knowledge_base_id, embedding)
+SELECT id, knowledge_base_id, embedding FROM knowledge_chunks
+ON CONFLICT (id) DO NOTHING;
+
+-- PASSO 3: Índice da busca, o mesmo de `knowledge_chunks`
+-- Criado com a tabela já preenchida, para que as listas do ivfflat reflitam os dados.
+CREATE INDEX IF NOT EXISTS knowledge_chunk_vectors_embedding_idx ON knowledge_chunk_vectors
+USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
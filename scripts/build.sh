@@ -39,6 +39,12 @@ for func in "${FUNCTIONS[@]}"; do
   cp "src/${func}/main.py" "$TEMP_DIR/"
   cp "src/${func}/requirements.txt" "$TEMP_DIR/" 2>/dev/null || true
 
+  # Copy shared modules (imported as src.common.*)
+  mkdir -p "$TEMP_DIR/src"
+  cp "src/__init__.py" "$TEMP_DIR/src/"
+  cp -r "src/common" "$TEMP_DIR/src/"
+  find "$TEMP_DIR/src" -name "__pycache__" -type d -prune -exec rm -rf {} +
+
   # Install dependencies if any
   if [ -f "$TEMP_DIR/requirements.txt" ]; then
     pip install -r "$TEMP_DIR/requirements.txt" -t "$TEMP_DIR/"
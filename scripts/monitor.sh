@@ -4,6 +4,8 @@ set -e
 # Parse command line arguments
 DURATION="5m"
 THRESHOLD="1.0"
+PHASES=""
+METRICS_NAMESPACE="${METRICS_NAMESPACE:-Cortexa}"
 
 while [[ $# -gt 0 ]]; do
   case $1 in
@@ -15,6 +17,11 @@ while [[ $# -gt 0 ]]; do
       THRESHOLD="$2"
       shift 2
       ;;
+    --phases)
+      # Comma-separated list, e.g. parse,embed,connect,execute,serialize
+      PHASES="$2"
+      shift 2
+      ;;
     *)
       echo "Unknown option: $1"
       exit 1
@@ -28,6 +35,27 @@ end_time=$((SECONDS + duration_seconds))
 
 echo "Starting monitoring for $DURATION (threshold: $THRESHOLD%)"
 
+# Prints p50/p99 of each phase latency (EMF metrics <phase>_ms) over the last 5 minutes
+report_phases() {
+  local phase stats
+  for phase in ${PHASES//,/ }; do
+    stats=$(aws cloudwatch get-metric-statistics \
+      --namespace "$METRICS_NAMESPACE" \
+      --metric-name "${phase}_ms" \
+      --dimensions Name=Function,Value="${FUNCTION_NAME}" \
+      --start-time $(date -u -d '5 minutes ago' "+%Y-%m-%dT%H:%M:%SZ") \
+      --end-time $(date -u "+%Y-%m-%dT%H:%M:%SZ") \
+      --period 300 \
+      --extended-statistics p50 p99 \
+      --query "Datapoints[0].ExtendedStatistics.[p50,p99]" \
+      --output text)
+    if [ -z "$stats" ] || [ "$stats" == "None" ]; then
+      stats="n/a"
+    fi
+    printf "  %-10s p50/p99 (ms): %s\n" "$phase" "$stats"
+  done
+}
+
 while [ $SECONDS -lt $end_time ]; do
   # Get error rate from CloudWatch
   error_rate=$(aws cloudwatch get-metric-statistics \
@@ -46,6 +74,10 @@ while [ $SECONDS -lt $end_time ]; do
     error_rate=0
   fi
 
+  if [ -n "$PHASES" ]; then
+    report_phases
+  fi
+
   if (( $(echo "$error_rate > $THRESHOLD" | bc -l) )); then
     echo "Error rate ($error_rate) exceeds threshold ($THRESHOLD%)"
     exit 1
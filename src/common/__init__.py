@@ -0,0 +1 @@
+"""Módulos compartilhados entre as funções Lambda do Cortexa."""
@@ -0,0 +1,126 @@
+"""
+Controle de admissão por base de conhecimento (tenant).
+
+Uma ingestão grande ou uma rajada de consultas de um único tenant não deve esgotar as
+conexões do Neon nem atrasar as demais bases. Antes de qualquer trabalho pesado, cada
+requisição pede admissão ao banco (`cortexa_admit`, migração V4), que aplica dois
+limites por tenant e operação, válidos entre todos os containers:
+
+  * concorrência: no máximo N requisições em andamento, contadas por leases que
+    expiram sozinhos se o container morrer antes de liberá-los;
+  * taxa: balde de tokens com reposição contínua e rajada máxima.
+
+Requisições acima do limite recebem 429 com `Retry-After` na hora, em vez de esperar
+na fila do banco, e são contadas nas métricas (`shed_requests`, `shed_<motivo>`).
+Os limites vêm de variáveis de ambiente por operação e ficam desligados por padrão:
+
+    TENANT_<OPERAÇÃO>_MAX_CONCURRENT, TENANT_<OPERAÇÃO>_RATE_PER_SECOND,
+    TENANT_<OPERAÇÃO>_BURST e TENANT_LEASE_SECONDS
+
+Se o próprio controle falhar (ex.: banco indisponível), a requisição é admitida: o
+erro real aparece no caminho normal da requisição.
+"""
+import json
+import logging
+import math
+from typing import Callable, NamedTuple, Optional
+
+from src.common import metrics
+
+logger = logging.getLogger()
+
+# Acima da duração máxima de uma invocação (timeout da Lambda)
+DEFAULT_LEASE_SECONDS = 900
+
+ADMIT_SQL = "SELECT lease_id, retry_after, reason FROM cortexa_admit(%s, %s, %s, %s, %s, %s)"
+RELEASE_SQL = "DELETE FROM tenant_leases WHERE id = %s"
+
+
+class AdmissionLimits(NamedTuple):
+    max_concurrent: int = 0
+    rate_per_second: float = 0.0
+    burst: float = 1.0
+    lease_seconds: float = DEFAULT_LEASE_SECONDS
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0 or self.rate_per_second > 0
+
+
+class Admission(NamedTuple):
+    admitted: bool
+    lease_id: Optional[str] = None
+    retry_after: float = 0.0
+    reason: Optional[str] = None
+
+
+ADMITTED = Admission(True)
+
+
+class TenantAdmission:
+    """Pede e libera a admissão de requisições de uma operação ('ingest' ou 'query')."""
+
+    def __init__(self, operation, limits: AdmissionLimits):
+        self.operation = operation
+        self.limits = limits
+
+    def admit(self, run: Callable, knowledge_base_id) -> Admission:
+        """
+        Pede admissão ao banco com `run(fn)` (que executa `fn(cursor)` no primário).
+
+        Sem limites configurados, admite sem ir ao banco.
+        """
+        if not self.limits.enabled:
+            return ADMITTED
+        limits = self.limits
+
+        def admit(cur):
+            cur.execute(ADMIT_SQL, (knowledge_base_id, self.operation, limits.max_concurrent,
+                                    limits.rate_per_second, limits.burst, limits.lease_seconds))
+            return cur.fetchone()
+
+        try:
+            with metrics.phase("admission"):
+                lease_id, retry_after, reason = run(admit)
+        except Exception as e:
+            logger.warning(f"Controle de admissão indisponível; admitindo a requisição: {e}")
+            return ADMITTED
+        if reason is not None:
+            logger.warning(f"Requisição de {self.operation} da base {knowledge_base_id} recusada ({reason}).")
+            metrics.count("shed_requests")
+            metrics.count(f"shed_{reason}")
+            return Admission(False, retry_after=retry_after, reason=reason)
+        return Admission(True, lease_id=lease_id)
+
+    def release(self, run: Callable, admission: Admission):
+        """Libera o lease da requisição; se falhar, ele expira sozinho."""
+        if admission.lease_id is None:
+            return
+        try:
+            run(lambda cur: cur.execute(RELEASE_SQL, (admission.lease_id,)))
+        except Exception as e:
+            logger.warning(f"Não foi possível liberar o lease {admission.lease_id}; ele vai expirar: {e}")
+
+
+def shed_response(admission: Admission) -> dict:
+    """Resposta 429 para uma requisição recusada, com o `Retry-After` em segundos inteiros."""
+    if admission.reason == "rate":
+        message = "Limite de requisições por segundo da base de conhecimento excedido."
+    else:
+        message = "Limite de requisições simultâneas da base de conhecimento excedido."
+    return {
+        "statusCode": 429,
+        "headers": {"Retry-After": str(max(1, math.ceil(admission.retry_after)))},
+        "body": json.dumps({"error": message, "reason": admission.reason}),
+    }
+
+
+def admission_from_env(environ, operation) -> TenantAdmission:
+    prefix = f"TENANT_{operation.upper()}"
+    rate = float(environ.get(f"{prefix}_RATE_PER_SECOND", "0"))
+    return TenantAdmission(operation, AdmissionLimits(
+        max_concurrent=int(environ.get(f"{prefix}_MAX_CONCURRENT", "0")),
+        rate_per_second=rate,
+        burst=float(environ.get(f"{prefix}_BURST", max(rate, 1.0))),
+        lease_seconds=float(environ.get("TENANT_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)),
+    ))
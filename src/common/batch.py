@@ -0,0 +1,113 @@
+"""
+Leitura dos lotes de documentos da ingestão em massa.
+
+Um `POST /ingest` cujo corpo é uma lista JSON, ou que chega com Content-Type NDJSON
+(um objeto JSON por linha), traz vários documentos:
+
+    {"knowledgeBaseId": "...", "documentId": "...", "text": "...", "version": 3, "metadata": {...}}
+
+Cada registro é validado separadamente: um registro inválido vira um resultado de
+erro para aquele documento, sem derrubar os demais.
+"""
+import json
+import os
+from typing import List, NamedTuple, Optional, Tuple
+
+from src.common.documents import MAX_EXTERNAL_ID_LENGTH
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+# Registros aceitos em uma requisição
+MAX_BATCH_DOCUMENTS = int(os.environ.get("MAX_BATCH_DOCUMENTS", "1000"))
+
+
+class BatchFormatError(ValueError):
+    """O corpo não é uma lista JSON nem NDJSON válido, ou excede o limite de registros."""
+
+
+class BatchRecord(NamedTuple):
+    # Posição do registro no lote (ordem dos resultados)
+    index: int
+    knowledge_base_id: str
+    document_id: str
+    text: str
+    version: Optional[int]
+    metadata: Optional[dict]
+
+
+def is_ndjson(event) -> bool:
+    """O Content-Type da requisição (cabeçalhos sem distinção de caixa) é NDJSON."""
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == "content-type":
+            return (value or "").split(";")[0].strip().lower() in NDJSON_CONTENT_TYPES
+    return False
+
+
+def is_batch(event) -> bool:
+    """A requisição é um lote: NDJSON pelo Content-Type ou uma lista JSON no corpo."""
+    return is_ndjson(event) or (event.get("body") or "").lstrip().startswith("[")
+
+
+def parse_batch(body, ndjson=False, max_records=None) -> list:
+    """Registros (ainda não validados) de uma lista JSON ou de um corpo NDJSON."""
+    max_records = MAX_BATCH_DOCUMENTS if max_records is None else max_records
+    if ndjson:
+        records = []
+        for number, line in enumerate((body or "").splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise BatchFormatError(f"Linha {number} do NDJSON inválida: {e.msg}.") from e
+    else:
+        try:
+            records = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise BatchFormatError("Corpo da requisição inválido.") from e
+        if not isinstance(records, list):
+            raise BatchFormatError("O lote deve ser uma lista de documentos.")
+    if not records:
+        raise BatchFormatError("O lote não contém documentos.")
+    if len(records) > max_records:
+        raise BatchFormatError(f"O lote aceita no máximo {max_records} documentos.")
+    return records
+
+
+def validate_record(index, record) -> Tuple[Optional[BatchRecord], Optional[str]]:
+    """Registro validado ou a mensagem de erro do documento."""
+    if not isinstance(record, dict):
+        return None, "Cada documento do lote deve ser um objeto."
+    knowledge_base_id = record.get("knowledgeBaseId")
+    document_id = record.get("documentId")
+    text = record.get("text")
+    version = record.get("version")
+    metadata = record.get("metadata")
+    if not knowledge_base_id or not isinstance(knowledge_base_id, str):
+        return None, "O campo 'knowledgeBaseId' é obrigatório."
+    if not isinstance(document_id, str) or not document_id or len(document_id) > MAX_EXTERNAL_ID_LENGTH:
+        return None, (f"O campo 'documentId' é obrigatório e deve ser um texto de até {MAX_EXTERNAL_ID_LENGTH} "
+                      "caracteres.")
+    if not text or not isinstance(text, str):
+        return None, "O campo 'text' é obrigatório."
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool) or version < 1):
+        return None, "O campo 'version' deve ser um inteiro positivo."
+    if metadata is not None and not isinstance(metadata, dict):
+        return None, "O campo 'metadata' deve ser um objeto."
+    return BatchRecord(index, knowledge_base_id, document_id, text, version, metadata), None
+
+
+def validate_batch(records) -> Tuple[List[BatchRecord], List[Tuple[int, object, str]]]:
+    """Separa os registros válidos dos inválidos (índice, registro, erro); repetições ficam com a primeira."""
+    valid, invalid = [], []
+    seen = set()
+    for index, record in enumerate(records):
+        parsed, error = validate_record(index, record)
+        if parsed is not None and (parsed.knowledge_base_id, parsed.document_id) in seen:
+            parsed, error = None, "Documento repetido no lote."
+        if error:
+            invalid.append((index, record, error))
+            continue
+        seen.add((parsed.knowledge_base_id, parsed.document_id))
+        valid.append(parsed)
+    return valid, invalid
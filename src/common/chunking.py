@@ -0,0 +1,245 @@
+"""
+Chunking de texto orientado a tokens.
+
+Divide o texto respeitando parágrafos e sentenças, limita cada chunk por número
+de tokens (e não por caracteres) e registra a contagem de tokens de cada chunk,
+o que permite empacotar os lotes de embeddings até o limite da API.
+"""
+import logging
+import re
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger()
+
+# Tamanho padrão dos chunks, em tokens
+DEFAULT_MAX_TOKENS = 256
+DEFAULT_OVERLAP_TOKENS = 32
+
+# Ao encontrar um novo parágrafo com o chunk atual já razoavelmente cheio,
+# fechamos o chunk ali em vez de misturar parágrafos.
+PARAGRAPH_FLUSH_RATIO = 0.6
+
+# Limites de um lote de embeddings. A OpenAI aceita até 2048 entradas e 300k tokens
+# por requisição, mas a resposta precisa caber no payload de 6 MB do invoke síncrono
+# da Lambda de proxy, o que limita o número de entradas por lote.
+MAX_BATCH_INPUTS = 128
+MAX_BATCH_TOKENS = 250_000
+
+Tokenizer = Callable[[str], int]
+
+_PARAGRAPH_SEP_RE = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+_SENTENCE_SEP_RE = re.compile(r"(?<=[.!?…])\s+")
+_WORD_RE = re.compile(r"\S+")
+_TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+class Chunk(NamedTuple):
+    """Um pedaço de texto pronto para vetorização."""
+    index: int
+    text: str
+    token_count: int
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Estimativa rápida do número de tokens, sem dependências externas.
+
+    Cada palavra ou sinal de pontuação conta ao menos um token, mais um token a cada
+    4 caracteres adicionais. Tende a superestimar levemente os tokenizadores BPE,
+    o que é seguro para respeitar limites.
+    """
+    pieces = _TOKEN_PIECE_RE.findall(text)
+    return len(pieces) + (sum(map(len, pieces)) - len(pieces)) // 4
+
+
+def get_tokenizer(spec: Optional[str] = None) -> Tokenizer:
+    """
+    Retorna uma função de contagem de tokens a partir de uma especificação.
+
+    Aceita "tiktoken:<encoding>" (ex.: "tiktoken:cl100k_base") ou "approx". Se o
+    tiktoken não estiver instalado ou não conseguir carregar o encoding, usa a
+    estimativa aproximada.
+    """
+    if spec and spec.startswith("tiktoken"):
+        encoding_name = spec.partition(":")[2] or "cl100k_base"
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(f"Tokenizador '{spec}' indisponível, usando estimativa aproximada: {e}")
+        else:
+            def count_tokens(text: str) -> int:
+                return len(encoding.encode(text, disallowed_special=()))
+            return count_tokens
+    return approximate_token_count
+
+
+def _iter_spans(text: str, separator: re.Pattern) -> Iterator[str]:
+    """Itera preguiçosamente pelos trechos não vazios entre separadores."""
+    start = 0
+    for match in separator.finditer(text):
+        if match.start() > start:
+            yield text[start:match.start()]
+        start = match.end()
+    if start < len(text):
+        yield text[start:]
+
+
+def _hard_split(word: str, word_tokens: int, max_tokens: int,
+                count_tokens: Tokenizer) -> Iterator[Tuple[str, int]]:
+    """Divide uma 'palavra' gigante (ex.: base64, URLs) em fatias que cabem no limite."""
+    step = max(1, (len(word) * max_tokens) // (word_tokens + 1))
+    for start in range(0, len(word), step):
+        piece = word[start:start + step]
+        yield piece, count_tokens(piece)
+
+
+def _split_oversized(sentence: str, max_tokens: int,
+                     count_tokens: Tokenizer) -> Iterator[Tuple[str, int]]:
+    """Divide uma sentença maior que o limite em janelas de palavras."""
+    words: List[str] = []
+    size = 0
+    for match in _WORD_RE.finditer(sentence):
+        word = match.group()
+        word_tokens = count_tokens(word)
+        if word_tokens > max_tokens:
+            if words:
+                yield " ".join(words), size
+                words, size = [], 0
+            yield from _hard_split(word, word_tokens, max_tokens, count_tokens)
+            continue
+        if words and size + word_tokens > max_tokens:
+            yield " ".join(words), size
+            words, size = [], 0
+        words.append(word)
+        size += word_tokens
+    if words:
+        yield " ".join(words), size
+
+
+def _iter_units(text: str, max_tokens: int,
+                count_tokens: Tokenizer) -> Iterator[Tuple[str, int, bool]]:
+    """
+    Produz unidades (sentenças ou pedaços de sentença) com sua contagem de tokens.
+
+    O terceiro elemento indica se a unidade inicia um novo parágrafo.
+    """
+    for paragraph in _iter_spans(text, _PARAGRAPH_SEP_RE):
+        paragraph_start = True
+        for sentence in _iter_spans(paragraph, _SENTENCE_SEP_RE):
+            sentence = " ".join(sentence.split())
+            if not sentence:
+                continue
+            tokens = count_tokens(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens, paragraph_start
+                paragraph_start = False
+                continue
+            for piece, piece_tokens in _split_oversized(sentence, max_tokens, count_tokens):
+                yield piece, piece_tokens, paragraph_start
+                paragraph_start = False
+
+
+def _join_units(units: List[Tuple[str, int, bool]]) -> str:
+    parts = []
+    for i, (unit, _, paragraph_start) in enumerate(units):
+        if i:
+            parts.append("\n\n" if paragraph_start else " ")
+        parts.append(unit)
+    return "".join(parts)
+
+
+def _overlap_tail(units: List[Tuple[str, int, bool]], overlap_tokens: int) -> List[Tuple[str, int, bool]]:
+    """Seleciona as últimas unidades do chunk cuja soma cabe na sobreposição."""
+    tail: List[Tuple[str, int, bool]] = []
+    size = 0
+    for unit in reversed(units):
+        if size + unit[1] > overlap_tokens:
+            break
+        tail.append(unit)
+        size += unit[1]
+    tail.reverse()
+    return tail
+
+
+def paragraph_end(text: str) -> int:
+    """Posição logo após a última quebra de parágrafo de `text` (0 se não houver)."""
+    end = 0
+    for match in _PARAGRAPH_SEP_RE.finditer(text):
+        end = match.end()
+    return end
+
+
+def iter_chunks(text, max_tokens: int = DEFAULT_MAX_TOKENS,
+                overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                count_tokens: Tokenizer = approximate_token_count) -> Iterator[Chunk]:
+    """
+    Gera chunks de até `max_tokens` tokens sem cortar palavras ou sentenças.
+
+    Sentenças são agrupadas até o limite; um novo parágrafo fecha o chunk atual
+    quando ele já está razoavelmente cheio. A sobreposição entre chunks consecutivos
+    é feita com sentenças inteiras (até `overlap_tokens`), e não é aplicada quando
+    o corte coincide com uma quebra de parágrafo. Só sentenças maiores que o limite
+    são divididas, por palavras. O `token_count` de cada chunk é a soma das unidades.
+    """
+    if not isinstance(text, str):
+        return
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens deve ser menor que max_tokens.")
+    yield from _chunks_from_units(_iter_units(text, max_tokens, count_tokens), max_tokens, overlap_tokens)
+
+
+def iter_section_chunks(sections: Iterable[str], max_tokens: int = DEFAULT_MAX_TOKENS,
+                        overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                        count_tokens: Tokenizer = approximate_token_count) -> Iterator[Chunk]:
+    """
+    Como `iter_chunks`, mas sobre um texto entregue aos poucos, em seções (páginas,
+    parágrafos ou blocos cortados em quebras de parágrafo). Cada seção começa um
+    parágrafo; só a seção corrente e o chunk em formação ficam em memória.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens deve ser menor que max_tokens.")
+    units = (unit for section in sections for unit in _iter_units(section, max_tokens, count_tokens))
+    yield from _chunks_from_units(units, max_tokens, overlap_tokens)
+
+
+def _chunks_from_units(units_iter: Iterable[Tuple[str, int, bool]], max_tokens: int,
+                       overlap_tokens: int) -> Iterator[Chunk]:
+    units: List[Tuple[str, int, bool]] = []
+    size = 0
+    fresh = 0  # unidades do chunk atual que não vieram da sobreposição
+    index = 0
+    paragraph_flush = max_tokens * PARAGRAPH_FLUSH_RATIO
+
+    for unit in units_iter:
+        tokens, paragraph_start = unit[1], unit[2]
+        at_paragraph_break = paragraph_start and size >= paragraph_flush
+        if fresh and (at_paragraph_break or size + tokens > max_tokens):
+            yield Chunk(index, _join_units(units), size)
+            index += 1
+            units = [] if at_paragraph_break else _overlap_tail(units, overlap_tokens)
+            size = sum(u[1] for u in units)
+            if size + tokens > max_tokens:
+                units, size = [], 0
+            fresh = 0
+        units.append(unit)
+        size += tokens
+        fresh += 1
+
+    if fresh:
+        yield Chunk(index, _join_units(units), size)
+
+
+def pack_batches(chunks: Iterable[Chunk], max_tokens: int = MAX_BATCH_TOKENS,
+                 max_inputs: int = MAX_BATCH_INPUTS) -> Iterator[List[Chunk]]:
+    """Agrupa chunks em lotes de embeddings preenchidos até os limites de tokens e de entradas."""
+    batch: List[Chunk] = []
+    batch_tokens = 0
+    for chunk in chunks:
+        if batch and (batch_tokens + chunk.token_count > max_tokens or len(batch) >= max_inputs):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += chunk.token_count
+    if batch:
+        yield batch
@@ -0,0 +1,181 @@
+"""
+Corpos de requisição e resposta comprimidos (gzip e zstd) nos handlers HTTP.
+
+Documentos inteiros na ingestão e respostas de consulta com top_k alto passam pelo
+API Gateway como JSON puro, o que pesa no limite de payload e no tempo de
+transferência. O decorador `negotiated` trata os dois sentidos:
+
+  * requisições com `Content-Encoding: gzip` ou `zstd` chegam em base64
+    (`isBase64Encoded`, como o API Gateway entrega corpos binários) e são
+    descomprimidas antes do handler, com limite de tamanho descomprimido;
+  * respostas acima de MIN_COMPRESS_BYTES são comprimidas no melhor formato aceito
+    em `Accept-Encoding` e devolvidas em base64 com `Content-Encoding`.
+
+O handler continua lendo `event["body"]` como texto JSON. zstd depende do pacote
+opcional `zstandard`; sem ele, só gzip é oferecido e requisições zstd recebem 415.
+No API Gateway (REST), `*/*` precisa estar em `binaryMediaTypes` para que as
+respostas em base64 sejam entregues como binário.
+"""
+import base64
+import functools
+import gzip
+import io
+import json
+import logging
+import os
+import zlib
+
+from src.common import metrics
+
+logger = logging.getLogger()
+
+# Respostas menores que isto não compensam a compressão
+MIN_COMPRESS_BYTES = int(os.environ.get("MIN_COMPRESS_BYTES", "1024"))
+# Proteção contra "bombas" de compressão: tamanho máximo do corpo descomprimido
+MAX_DECODED_BODY_BYTES = int(os.environ.get("MAX_DECODED_BODY_BYTES", 50 * 1024 * 1024))
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class BodyEncodingError(Exception):
+    """Corpo da requisição que não pode ser decodificado."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def supported_encodings():
+    """Codificações aceitas, em ordem de preferência para as respostas."""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def _header(event, name):
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _gunzip(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj(wbits=31)
+    try:
+        body = decompressor.decompress(data, MAX_DECODED_BODY_BYTES + 1)
+    except zlib.error as e:
+        raise BodyEncodingError(400, f"Corpo gzip inválido: {e}")
+    if len(body) > MAX_DECODED_BODY_BYTES or decompressor.unconsumed_tail:
+        raise BodyEncodingError(413, "Corpo da requisição descomprimido grande demais.")
+    if not decompressor.eof:
+        raise BodyEncodingError(400, "Corpo gzip truncado.")
+    return body
+
+
+def _unzstd(data: bytes) -> bytes:
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            body = reader.read(MAX_DECODED_BODY_BYTES + 1)
+    except zstandard.ZstdError as e:
+        raise BodyEncodingError(400, f"Corpo zstd inválido: {e}")
+    if len(body) > MAX_DECODED_BODY_BYTES:
+        raise BodyEncodingError(413, "Corpo da requisição descomprimido grande demais.")
+    return body
+
+
+def decode_body(event) -> str:
+    """Corpo da requisição como texto, decodificado de base64 e descomprimido se preciso."""
+    body = event.get("body", "{}")
+    encoding = (_header(event, "content-encoding") or "identity").strip().lower()
+    if not event.get("isBase64Encoded"):
+        if encoding != "identity":
+            raise BodyEncodingError(400, "Corpo comprimido deve ser enviado em base64 (isBase64Encoded).")
+        return body
+    try:
+        data = base64.b64decode(body or "", validate=True)
+    except ValueError:
+        raise BodyEncodingError(400, "Corpo em base64 inválido.")
+    if encoding == "gzip":
+        data = _gunzip(data)
+    elif encoding == "zstd" and zstandard is not None:
+        data = _unzstd(data)
+    elif encoding != "identity":
+        raise BodyEncodingError(415, f"Content-Encoding não suportado: {encoding}.")
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        raise BodyEncodingError(400, "O corpo da requisição deve ser texto UTF-8.")
+
+
+def choose_encoding(accept_encoding) -> str:
+    """Melhor codificação suportada em um `Accept-Encoding`, ou None."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode_response(response, accept_encoding):
+    """Comprime o corpo da resposta quando o cliente aceita e o corpo é grande o bastante."""
+    if not isinstance(response, dict) or response.get("isBase64Encoded"):
+        return response
+    body = response.get("body")
+    if not isinstance(body, str) or len(body) < MIN_COMPRESS_BYTES:
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    with metrics.phase("compress"):
+        data = compress(body.encode("utf-8"), encoding)
+    metrics.count("response_bytes_encoded", len(data), "Bytes")
+    headers = dict(response.get("headers") or {})
+    headers.update({"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+    return {**response, "headers": headers, "isBase64Encoded": True,
+            "body": base64.b64encode(data).decode("ascii")}
+
+
+def negotiated(handler):
+    """
+    Decora um `lambda_handler` para aceitar corpos comprimidos e comprimir as respostas.
+
+    Deve ficar dentro de `metrics.instrumented`, para que o tempo de (des)compressão
+    entre nas métricas da invocação.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if (event.get("isBase64Encoded") or _header(event, "content-encoding")) and "body" in event:
+            metrics.count("request_bytes_encoded", len(event.get("body") or ""), "Bytes")
+            try:
+                with metrics.phase("decompress"):
+                    body = decode_body(event)
+            except BodyEncodingError as e:
+                logger.error(f"Corpo da requisição não decodificado: {e}")
+                return {"statusCode": e.status_code, "body": json.dumps({"error": str(e)})}
+            event = {**event, "body": body, "isBase64Encoded": False}
+        return encode_response(handler(event, context), _header(event, "accept-encoding"))
+    return wrapper
@@ -0,0 +1,352 @@
+"""
+Gerenciamento da conexão com o Neon, compartilhado por ingestão e consulta.
+
+O `closed` do psycopg2 só reflete falhas já observadas pelo cliente: uma conexão
+derrubada pelo Neon (ex.: scale-to-zero) durante o congelamento da Lambda continua
+parecendo aberta. O `ConnectionManager` faz um teste barato (`SELECT 1`) quando a
+conexão ficou ociosa por um tempo, reconecta de forma transparente e repete a
+operação uma vez se a conexão cair no meio dela. Também mantém statements
+preparados no servidor (PREPARE/EXECUTE), para que invocações 'warm' pulem o
+planejamento das queries principais.
+
+O `ReadReplicaRouter` envia as leituras da consulta para uma réplica opcional,
+voltando ao primário quando ela está atrasada ou inacessível; escritas sempre usam
+o primário.
+
+O `ThreadLocalConnections` dá a cada thread o seu gerenciador, para o modo servidor
+(`src.server.main`), em que vários handlers rodam ao mesmo tempo no mesmo processo.
+"""
+import logging
+import re
+import threading
+import time
+from typing import Callable, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger()
+
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5
+# Acima deste tempo ocioso, a conexão é testada antes de ser usada
+DEFAULT_IDLE_CHECK_SECONDS = 30
+
+
+class DatabaseConnectionError(Exception):
+    """Não foi possível obter uma conexão utilizável com o banco de dados."""
+
+
+class PreparedStatement(NamedTuple):
+    """Query com parâmetros posicionais ($1, $2, ...) usados uma vez cada, em ordem."""
+    name: str
+    param_types: Tuple[str, ...]
+    sql: str
+
+    @property
+    def prepare_sql(self) -> str:
+        return f"PREPARE {self.name} ({', '.join(self.param_types)}) AS {self.sql}"
+
+    @property
+    def execute_sql(self) -> str:
+        return f"EXECUTE {self.name} ({', '.join(['%s'] * len(self.param_types))})"
+
+    @property
+    def direct_sql(self) -> str:
+        """A mesma query com placeholders do psycopg2, para quando PREPARE não está disponível."""
+        return re.sub(r"\$\d+", "%s", self.sql)
+
+
+class ConnectionManager:
+    """Mantém uma conexão cacheada entre invocações, com teste de vida e reconexão."""
+
+    def __init__(self, dsn, connect_timeout=DEFAULT_CONNECT_TIMEOUT_SECONDS,
+                 idle_check_seconds=DEFAULT_IDLE_CHECK_SECONDS, autocommit=False,
+                 use_prepared_statements=True):
+        self.dsn = dsn
+        self.connect_timeout = connect_timeout
+        self.idle_check_seconds = idle_check_seconds
+        self.autocommit = autocommit
+        # PREPARE nomeado não funciona atrás de PgBouncer em modo transação (endpoints "-pooler")
+        self.use_prepared_statements = use_prepared_statements
+        self.connection = None
+        self._last_used = 0.0
+        self._prepared = set()
+
+    def _connect(self):
+        import psycopg2
+        logger.info("Conectando ao banco de dados Neon.")
+        try:
+            self.connection = psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+        except psycopg2.Error as e:
+            self.connection = None
+            raise DatabaseConnectionError(f"Não foi possível conectar ao banco de dados: {e}") from e
+        self.connection.autocommit = self.autocommit
+        self._prepared = set()
+        self._last_used = time.monotonic()
+        return self.connection
+
+    def _discard(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+        self._prepared = set()
+
+    def _is_alive(self) -> bool:
+        import psycopg2
+        try:
+            with self.connection.cursor() as cur:
+                cur.execute("SELECT 1")
+            if not self.autocommit:
+                self.connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def get(self):
+        """Retorna uma conexão utilizável, testando-a se ficou ociosa além do limite."""
+        if self.connection is None or self.connection.closed != 0:
+            return self._connect()
+        if time.monotonic() - self._last_used > self.idle_check_seconds:
+            if not self._is_alive():
+                logger.warning("Conexão ociosa foi encerrada pelo servidor; reconectando.")
+                self._discard()
+                return self._connect()
+            self._last_used = time.monotonic()
+        return self.connection
+
+    def statement_sql(self, cur, statement: PreparedStatement) -> str:
+        """
+        Garante que o statement está preparado nesta conexão e retorna o SQL para executá-lo.
+
+        O SQL retornado usa placeholders `%s`, então serve para `cur.execute` e `execute_batch`.
+        """
+        if not self.use_prepared_statements:
+            return statement.direct_sql
+        if statement.name not in self._prepared:
+            cur.execute(statement.prepare_sql)
+            self._prepared.add(statement.name)
+        return statement.execute_sql
+
+    def run(self, fn: Callable, commit: bool = False):
+        """
+        Executa `fn(cursor)` e retorna seu resultado.
+
+        Se a conexão cair durante `fn`, reconecta e repete uma única vez. Com `commit=True`
+        a transação é confirmada ao final; falhas no próprio COMMIT não são repetidas, pois
+        não é possível saber se ele foi aplicado. Em erro, a transação é desfeita.
+        """
+        import psycopg2
+        for attempt in (1, 2):
+            conn = self.get()
+            try:
+                with conn.cursor() as cur:
+                    result = fn(cur)
+            except psycopg2.Error as e:
+                if conn.closed != 0:
+                    self._discard()
+                    if attempt == 1:
+                        logger.warning(f"Conexão perdida durante a operação; repetindo uma vez: {e}")
+                        continue
+                    raise DatabaseConnectionError(f"Não foi possível conectar ao banco de dados: {e}") from e
+                self._rollback_quietly(conn)
+                if isinstance(e, psycopg2.errors.InvalidSqlStatementName):
+                    # O servidor perdeu os statements preparados (ex.: DISCARD ALL); preparamos de novo.
+                    self._prepared = set()
+                raise
+            except Exception:
+                self._rollback_quietly(conn)
+                raise
+            if commit:
+                conn.commit()
+            self._last_used = time.monotonic()
+            return result
+
+    def _rollback_quietly(self, conn):
+        if self.autocommit or conn.closed != 0:
+            return
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard()
+
+
+def connection_manager_from_env(environ, dsn: Optional[str], autocommit=False) -> ConnectionManager:
+    """Cria um `ConnectionManager` com os parâmetros de conexão configurados por variáveis de ambiente."""
+    return ConnectionManager(
+        dsn,
+        connect_timeout=int(environ.get("DB_CONNECT_TIMEOUT_SECONDS", DEFAULT_CONNECT_TIMEOUT_SECONDS)),
+        idle_check_seconds=float(environ.get("DB_IDLE_CHECK_SECONDS", DEFAULT_IDLE_CHECK_SECONDS)),
+        autocommit=autocommit,
+        use_prepared_statements=environ.get("DB_PREPARED_STATEMENTS", "true").lower() not in ("0", "false", "no"),
+    )
+
+
+# Posição atual do WAL no primário, lida logo antes de verificar a réplica
+PRIMARY_WAL_LSN_SQL = "SELECT pg_current_wal_lsn()::text"
+
+# Atraso de replicação da réplica em segundos, dada a posição do WAL do primário. É 0
+# quando a réplica já aplicou até essa posição (mesmo que o primário esteja ocioso) ou
+# quando o banco não é uma réplica (ex.: dois bancos independentes em testes). Senão,
+# é o tempo desde a última transação aplicada: uma réplica que parou de receber WAL
+# (desconectada, sem streaming) tem esse tempo crescendo enquanto o primário escreve,
+# em vez de parecer em dia por já ter aplicado tudo o que recebeu.
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_replay_lsn() >= %s::pg_lsn THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+    END
+"""
+
+def _is_recovery_conflict(error) -> bool:
+    """
+    A réplica cancelou a leitura por conflito com o replay do WAL (ex.: VACUUM no
+    primário removendo linhas que a consulta ainda via). Leituras somente de consulta
+    em autocommit só recebem falha de serialização ou deadlock por esse motivo; o
+    cancelamento genérico (também usado pelo statement_timeout) é reconhecido pela mensagem.
+    """
+    import psycopg2
+    if isinstance(error, (psycopg2.errors.SerializationFailure, psycopg2.errors.DeadlockDetected)):
+        return True
+    return isinstance(error, psycopg2.errors.QueryCanceled) and "conflict with recovery" in str(error)
+
+
+DEFAULT_REPLICA_MAX_LAG_SECONDS = 5.0
+# Intervalo entre verificações de atraso (e de nova tentativa após a réplica falhar)
+DEFAULT_REPLICA_CHECK_SECONDS = 10.0
+
+
+class ReadReplicaRouter:
+    """
+    Encaminha operações somente leitura para uma réplica, com o primário como fallback.
+
+    A réplica é usada enquanto seu atraso estiver abaixo de `max_lag_seconds`. O atraso é
+    verificado no máximo a cada `check_seconds`, contra a posição do WAL no primário; se a réplica estiver atrasada ou
+    inacessível, as leituras vão para o primário até a próxima verificação. Sem réplica
+    configurada, tudo vai para o primário.
+    """
+
+    def __init__(self, primary: ConnectionManager, replica: Optional[ConnectionManager] = None,
+                 max_lag_seconds=DEFAULT_REPLICA_MAX_LAG_SECONDS, check_seconds=DEFAULT_REPLICA_CHECK_SECONDS):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag_seconds = max_lag_seconds
+        self.check_seconds = check_seconds
+        self._replica_healthy = False
+        self._checked_at = None
+
+    def _check_replica(self) -> bool:
+        try:
+            primary_lsn = self.primary.run(lambda cur: (cur.execute(PRIMARY_WAL_LSN_SQL), cur.fetchone()[0])[1])
+            lag = self.replica.run(lambda cur: (cur.execute(REPLICA_LAG_SQL, (primary_lsn,)), cur.fetchone()[0])[1])
+        except Exception as e:
+            logger.warning(f"Réplica de leitura indisponível; usando o primário: {e}")
+            return False
+        if float(lag) > self.max_lag_seconds:
+            logger.warning(f"Réplica de leitura com atraso de {float(lag):.1f}s; usando o primário.")
+            return False
+        return True
+
+    def _read_manager(self) -> ConnectionManager:
+        if self.replica is None:
+            return self.primary
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_seconds:
+            self._replica_healthy = self._check_replica()
+            self._checked_at = now
+        return self.replica if self._replica_healthy else self.primary
+
+    def _replica_failed(self, error):
+        """Evita a réplica até a próxima verificação."""
+        logger.warning(f"Réplica de leitura falhou; repetindo no primário: {error}")
+        self._replica_healthy = False
+        self._checked_at = time.monotonic()
+
+    def get(self):
+        """
+        Retorna a conexão usada para leituras neste momento: a do primário se a réplica
+        não conectar, como em `run`.
+        """
+        manager = self._read_manager()
+        if manager is self.primary:
+            return self.primary.get()
+        try:
+            return manager.get()
+        except DatabaseConnectionError as e:
+            self._replica_failed(e)
+            return self.primary.get()
+
+    def statement_sql(self, cur, statement: PreparedStatement) -> str:
+        """Como `ConnectionManager.statement_sql`, no gerenciador dono da conexão do cursor."""
+        if self.replica is not None and cur.connection is self.replica.connection:
+            return self.replica.statement_sql(cur, statement)
+        return self.primary.statement_sql(cur, statement)
+
+    def run(self, fn: Callable):
+        """
+        Executa a leitura `fn(cursor)` na réplica ou no primário.
+
+        Se a réplica cair durante a leitura, ou cancelá-la por conflito com a recuperação,
+        ela é marcada como indisponível até a próxima verificação e a leitura é refeita
+        no primário.
+        """
+        import psycopg2
+        manager = self._read_manager()
+        if manager is self.primary:
+            return self.primary.run(fn)
+        try:
+            return manager.run(fn)
+        except (DatabaseConnectionError, psycopg2.Error) as e:
+            if not isinstance(e, DatabaseConnectionError) and not _is_recovery_conflict(e):
+                raise
+            self._replica_failed(e)
+            return self.primary.run(fn)
+
+    def run_on_primary(self, fn: Callable):
+        """Executa `fn(cursor)` sempre no primário (ex.: escritas de controle durante uma consulta)."""
+        return self.primary.run(fn)
+
+
+def read_router_from_env(environ, primary_dsn: Optional[str], replica_dsn: Optional[str]) -> ReadReplicaRouter:
+    """Cria o roteador de leitura; a réplica é opcional e ambos usam autocommit."""
+    replica = connection_manager_from_env(environ, replica_dsn, autocommit=True) if replica_dsn else None
+    return ReadReplicaRouter(
+        connection_manager_from_env(environ, primary_dsn, autocommit=True),
+        replica,
+        max_lag_seconds=float(environ.get("DB_REPLICA_MAX_LAG_SECONDS", DEFAULT_REPLICA_MAX_LAG_SECONDS)),
+        check_seconds=float(environ.get("DB_REPLICA_CHECK_SECONDS", DEFAULT_REPLICA_CHECK_SECONDS)),
+    )
+
+
+class ThreadLocalConnections:
+    """
+    Um gerenciador de conexão (ou roteador de leitura) por thread.
+
+    `ConnectionManager` e `ReadReplicaRouter` guardam uma única conexão e não podem
+    atender duas requisições ao mesmo tempo. No modo servidor os handlers rodam em um
+    pool de threads: cada thread cria o seu gerenciador com `factory` no primeiro uso
+    e o reutiliza nas requisições seguintes, então o processo mantém no máximo uma
+    conexão (por banco) por thread do pool.
+    """
+
+    def __init__(self, factory: Callable):
+        self.factory = factory
+        self._local = threading.local()
+
+    def _manager(self):
+        manager = getattr(self._local, "manager", None)
+        if manager is None:
+            manager = self._local.manager = self.factory()
+        return manager
+
+    def get(self):
+        return self._manager().get()
+
+    def statement_sql(self, cur, statement: PreparedStatement) -> str:
+        return self._manager().statement_sql(cur, statement)
+
+    def run(self, fn: Callable, **kwargs):
+        return self._manager().run(fn, **kwargs)
+
+    def run_on_primary(self, fn: Callable):
+        return self._manager().run_on_primary(fn)
@@ -0,0 +1,102 @@
+"""
+Supressão de chunks quase duplicados na ingestão.
+
+Contratos de um mesmo modelo, FAQs versionados e rodapés padronizados geram chunks
+quase idênticos que o hash exato não pega: eles inflam `knowledge_chunks` e o
+índice e ocupam o top_k das consultas. Com um limiar de similaridade de cosseno, a
+ingestão descarta:
+
+  * chunks com o mesmo texto de outro chunk da mesma requisição, antes de vetorizar;
+  * chunks cujo embedding está a pelo menos o limiar de um vetor já armazenado na
+    base, ou de um chunk anterior da mesma requisição (do mesmo lote ou de um lote
+    anterior ainda não gravado, enviado junto na consulta).
+
+A comparação com a base é uma única consulta por lote (`NEAR_DUPLICATES`): cada
+vetor do lote busca o seu vizinho mais próximo na base com o índice ivfflat. Por ser
+uma busca aproximada, um duplicado pode escapar (e ser gravado), mas nenhum chunk
+único é descartado por engano além do que o limiar permite. Só contam os chunks que
+as buscas veem: expirados ou de documentos marcados (removidos, ou de ingestões de
+arquivo abandonadas) não suprimem nada, pois o varredor está prestes a apagá-los. A
+exceção é o documento pendente da própria ingestão, com os lotes já confirmados.
+"""
+import hashlib
+from typing import Iterable, List, Optional, Sequence, Set
+
+from src.common.db import PreparedStatement
+from src.common.sweeper import MARKED_DOCUMENTS
+
+# Devolve as posições (a partir de 0) dos vetores que são quase duplicados. `$1` traz
+# primeiro os `$2` vetores já aceitos na requisição (só comparados, nunca devolvidos)
+# e depois o lote. `$3` e `$6` são a mesma distância máxima (1 - similaridade); cada
+# parâmetro aparece uma única vez para que `direct_sql` continue posicional. `$5` é o
+# documento pendente da própria ingestão (ou NULL), visível apesar de estar em
+# `MARKED_DOCUMENTS`.
+NEAR_DUPLICATES = PreparedStatement(
+    "cortexa_near_duplicates",
+    ("vector[]", "integer", "float8", "uuid", "uuid", "float8"),
+    f"""
+    WITH batch AS (
+        SELECT embedding, i FROM unnest($1::vector[]) WITH ORDINALITY AS b(embedding, i)
+    )
+    SELECT b.i - 1
+    FROM batch b
+    WHERE b.i > $2 AND (EXISTS (
+        SELECT 1 FROM batch p WHERE p.i < b.i AND (p.embedding <=> b.embedding) <= $3
+    ) OR (
+        SELECT c.embedding <=> b.embedding
+        FROM knowledge_chunks c
+        WHERE c.knowledge_base_id = $4
+          AND (c.expires_at IS NULL OR c.expires_at > NOW())
+          AND (c.document_id IS NULL OR c.document_id = $5 OR c.document_id NOT IN ({MARKED_DOCUMENTS}))
+        ORDER BY c.embedding <=> b.embedding
+        LIMIT 1
+    ) <= $6)
+    """
+)
+
+
+def validate_threshold(value) -> bool:
+    """O limiar é uma similaridade de cosseno em (0, 1]."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value <= 1
+
+
+def threshold_from_env(environ) -> Optional[float]:
+    """
+    Limiar padrão de `INGEST_DEDUP_THRESHOLD` (vazio desliga), lido uma vez na carga do
+    módulo. Um valor malformado ou fora de (0, 1] impede a função de iniciar.
+    """
+    raw = (environ.get("INGEST_DEDUP_THRESHOLD") or "").strip()
+    if not raw:
+        return None
+    try:
+        threshold = float(raw)
+    except ValueError:
+        threshold = None
+    if not validate_threshold(threshold):
+        raise ValueError(f"INGEST_DEDUP_THRESHOLD deve ser uma similaridade entre 0 e 1, não {raw!r}.")
+    return threshold
+
+
+def unique_texts(chunks: Iterable, seen: Set[bytes]) -> List:
+    """Remove chunks cujo texto já apareceu (em `seen`, atualizado) nesta requisição."""
+    unique = []
+    for chunk in chunks:
+        digest = hashlib.sha256(chunk.text.encode("utf-8")).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(chunk)
+    return unique
+
+
+def near_duplicates(cur, sql, knowledge_base_id, vectors: Sequence, min_similarity, document_id=None,
+                    accepted: Sequence = ()) -> Set[int]:
+    """
+    Posições de `vectors` quase duplicadas na base, no próprio lote ou em `accepted`
+    (vetores aceitos antes na requisição e ainda não gravados); `sql` vem de
+    `statement_sql`. `document_id` é o documento pendente da ingestão, se houver.
+    """
+    max_distance = 1 - min_similarity
+    accepted = list(accepted)
+    cur.execute(sql, (accepted + list(vectors), len(accepted), max_distance, knowledge_base_id, document_id,
+                      max_distance))
+    return {row[0] - len(accepted) for row in cur.fetchall()}
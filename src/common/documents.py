@@ -0,0 +1,308 @@
+"""
+Re-ingestão incremental de documentos com diff por chunk.
+
+Cada chunk de um documento guarda sua posição (`ordinal`) e o SHA-256 do texto
+(`content_hash`). Na re-ingestão, os chunks novos são comparados por hash com os
+armazenados: chunks iguais são mantidos (no máximo com o `ordinal` atualizado),
+só os diferentes são vetorizados e inseridos, e os que sumiram são removidos.
+
+O fluxo é otimista, para não segurar transação durante as chamadas à OpenAI:
+
+  1. `read_document_chunks` lê os hashes atuais, sem lock;
+  2. o chamador vetoriza `diff_chunks(...).insert`, fora de transação;
+  3. `write_document` trava a linha do documento, refaz o diff sobre o estado
+     atual e aplica remoções, reordenações e inserções em uma única transação.
+     Se outro processo alterou o documento no meio tempo e faltam vetores, ela
+     desiste com `MissingVectors`: o chamador desfaz a transação, vetoriza os
+     chunks que faltaram (sem lock) e repete a escrita, até `MAX_WRITE_ATTEMPTS`
+     vezes. A OpenAI nunca é chamada com o documento travado.
+
+Como o chunker fecha chunks nas quebras de parágrafo, uma edição dentro de um
+parágrafo costuma afetar só os chunks daquele parágrafo; os cortes seguintes se
+ressincronizam na próxima quebra.
+"""
+import hashlib
+import json
+from collections import defaultdict, deque
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+# Limite da coluna documents.external_id
+MAX_EXTERNAL_ID_LENGTH = 255
+
+INSERT_DOCUMENT_CHUNKS = (
+    "INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, document_id, ordinal, content_hash, "
+    "metadata) VALUES %s"
+)
+# Linhas por comando na inserção em massa
+INSERT_PAGE_SIZE = 1000
+# Escritas de um documento (ou lote) antes de desistir por alterações concorrentes
+MAX_WRITE_ATTEMPTS = 3
+
+
+class DocumentVersionConflict(Exception):
+    """A versão enviada não é mais nova que a armazenada."""
+
+    def __init__(self, external_id, requested, current):
+        super().__init__(
+            f"O documento '{external_id}' já está na versão {current}; a versão {requested} não é mais nova."
+        )
+        self.requested = requested
+        self.current = current
+
+
+class PendingDocumentExpired(Exception):
+    """O prazo da ingestão pendente venceu e o varredor já marcou o documento para remoção."""
+
+    def __init__(self, document_id):
+        super().__init__(f"A ingestão pendente do documento {document_id} excedeu o prazo e foi descartada.")
+        self.document_id = document_id
+
+
+class MissingVectors(Exception):
+    """Outro processo alterou o documento: há chunks a inserir sem vetor. A transação deve ser desfeita."""
+
+    def __init__(self, chunks):
+        super().__init__(f"{len(chunks)} chunks do documento precisam ser vetorizados antes da escrita.")
+        self.chunks = chunks
+
+
+class DocumentChunk(NamedTuple):
+    ordinal: int
+    text: str
+    token_count: int
+    content_hash: str
+
+
+class StoredChunk(NamedTuple):
+    id: str
+    ordinal: int
+    content_hash: str
+
+
+class ChunkDiff(NamedTuple):
+    insert: List[DocumentChunk]
+    delete: List[str]
+    # (id do chunk armazenado, novo ordinal)
+    reorder: List[tuple]
+    unchanged: int
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.insert or self.delete or self.reorder)
+
+
+class DocumentResult(NamedTuple):
+    document_id: str
+    version: int
+    chunks: int
+    inserted: int
+    deleted: int
+    reordered: int
+    unchanged: int
+    # Chunks vetorizados depois de uma escrita desfeita por alteração concorrente (preenchido pelo chamador)
+    embedded_late: int
+
+
+def hash_chunk(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_chunks(chunks) -> List[DocumentChunk]:
+    """Converte os `Chunk`s do chunker em chunks de documento, com ordinal e hash."""
+    return [DocumentChunk(c.index, c.text, c.token_count, hash_chunk(c.text)) for c in chunks]
+
+
+def diff_chunks(stored: Sequence[StoredChunk], new: Sequence[DocumentChunk]) -> ChunkDiff:
+    """
+    Casa chunks novos com os armazenados pelo hash, em ordem.
+
+    Textos repetidos no documento são casados um a um, na ordem em que aparecem.
+    """
+    available = defaultdict(deque)
+    for chunk in sorted(stored, key=lambda c: c.ordinal):
+        available[chunk.content_hash].append(chunk)
+
+    insert, reorder = [], []
+    unchanged = 0
+    for chunk in new:
+        matches = available.get(chunk.content_hash)
+        if matches:
+            kept = matches.popleft()
+            if kept.ordinal != chunk.ordinal:
+                reorder.append((kept.id, chunk.ordinal))
+            else:
+                unchanged += 1
+        else:
+            insert.append(chunk)
+
+    delete = [chunk.id for remaining in available.values() for chunk in remaining]
+    return ChunkDiff(insert, delete, reorder, unchanged)
+
+
+def read_document_chunks(cur, knowledge_base_id, external_id) -> List[StoredChunk]:
+    """Chunks atuais do documento (vazio se ele ainda não existe)."""
+    cur.execute(
+        """
+        SELECT c.id, c.ordinal, c.content_hash
+        FROM documents d
+        JOIN knowledge_chunks c ON c.document_id = d.id
+        WHERE d.knowledge_base_id = %s AND d.external_id = %s AND d.deleted_at IS NULL
+        ORDER BY c.ordinal
+        """,
+        (knowledge_base_id, external_id),
+    )
+    return [StoredChunk(str(row[0]), row[1], row[2]) for row in cur.fetchall()]
+
+
+def read_documents_chunks(cur, knowledge_base_id, external_ids) -> Dict[str, List[StoredChunk]]:
+    """Chunks atuais de vários documentos da base em uma consulta (documentos novos ficam de fora)."""
+    cur.execute(
+        """
+        SELECT d.external_id, c.id, c.ordinal, c.content_hash
+        FROM documents d
+        JOIN knowledge_chunks c ON c.document_id = d.id
+        WHERE d.knowledge_base_id = %s AND d.external_id = ANY(%s) AND d.deleted_at IS NULL
+        ORDER BY d.external_id, c.ordinal
+        """,
+        (knowledge_base_id, list(external_ids)),
+    )
+    stored = defaultdict(list)
+    for external_id, chunk_id, ordinal, content_hash in cur.fetchall():
+        stored[external_id].append(StoredChunk(str(chunk_id), ordinal, content_hash))
+    return dict(stored)
+
+
+def insert_document_chunks(cur, rows):
+    """Insere as linhas acumuladas por `write_document(..., pending_rows=...)`."""
+    from psycopg2.extras import execute_values
+
+    if rows:
+        execute_values(cur, INSERT_DOCUMENT_CHUNKS, rows, page_size=INSERT_PAGE_SIZE)
+
+
+def _lock_document(cur, knowledge_base_id, external_id):
+    """
+    Cria o documento se necessário e trava sua linha até o fim da transação. Um
+    documento marcado para remoção não é reaproveitado: a ingestão cria outro.
+    """
+    cur.execute(
+        """
+        INSERT INTO documents (knowledge_base_id, external_id, version)
+        VALUES (%s, %s, 0)
+        ON CONFLICT (knowledge_base_id, external_id) WHERE deleted_at IS NULL
+        DO UPDATE SET updated_at = documents.updated_at
+        RETURNING id, version
+        """,
+        (knowledge_base_id, external_id),
+    )
+    document_id, version = cur.fetchone()
+    return str(document_id), version
+
+
+def write_document(cur, knowledge_base_id, external_id, version: Optional[int], chunks: Sequence[DocumentChunk],
+                   vectors: Dict[str, object], metadata: Optional[dict] = None,
+                   pending_rows: Optional[list] = None) -> DocumentResult:
+    """
+    Aplica o diff do documento na transação do cursor.
+
+    `vectors` mapeia hash -> vetor (adaptável pelo psycopg2) dos chunks já vetorizados.
+    Se algum chunk a inserir não está em `vectors`, levanta `MissingVectors` antes de
+    qualquer alteração além da criação/trava do documento. Sem `version`, a versão é incrementada
+    quando o conteúdo muda. Com `metadata`, todos os chunks do documento passam a tê-la.
+    Com `pending_rows`, os chunks novos são acrescentados à lista em vez de inseridos,
+    para uma única inserção em massa (`insert_document_chunks`) ao final de um lote.
+    """
+    from psycopg2.extras import execute_values
+
+    document_id, current_version = _lock_document(cur, knowledge_base_id, external_id)
+    if version is not None and current_version and version <= current_version:
+        raise DocumentVersionConflict(external_id, version, current_version)
+
+    cur.execute("SELECT id, ordinal, content_hash FROM knowledge_chunks WHERE document_id = %s", (document_id,))
+    stored = [StoredChunk(str(row[0]), row[1], row[2]) for row in cur.fetchall()]
+    diff = diff_chunks(stored, chunks)
+
+    missing = [chunk for chunk in diff.insert if chunk.content_hash not in vectors]
+    if missing:
+        raise MissingVectors(missing)
+
+    if diff.delete:
+        cur.execute("DELETE FROM knowledge_chunks WHERE id = ANY(%s::uuid[])", (diff.delete,))
+    if diff.reorder:
+        execute_values(
+            cur,
+            "UPDATE knowledge_chunks AS k SET ordinal = v.ordinal FROM (VALUES %s) AS v(id, ordinal) "
+            "WHERE k.id = v.id::uuid",
+            diff.reorder,
+        )
+    if metadata is not None:
+        metadata = json.dumps(metadata)
+        cur.execute(
+            "UPDATE knowledge_chunks SET metadata = %s WHERE document_id = %s AND metadata IS DISTINCT FROM %s::jsonb",
+            (metadata, document_id, metadata),
+        )
+    rows = [(knowledge_base_id, c.text, vectors[c.content_hash], document_id, c.ordinal, c.content_hash, metadata)
+            for c in diff.insert]
+    if pending_rows is not None:
+        pending_rows.extend(rows)
+    elif rows:
+        insert_document_chunks(cur, rows)
+
+    if version is not None:
+        new_version = version
+    elif diff.is_empty and current_version:
+        new_version = current_version
+    else:
+        new_version = current_version + 1
+    cur.execute(
+        "UPDATE documents SET version = %s, chunk_count = %s, updated_at = NOW() WHERE id = %s",
+        (new_version, len(chunks), document_id),
+    )
+    return DocumentResult(
+        document_id, new_version, len(chunks), len(diff.insert), len(diff.delete), len(diff.reorder),
+        diff.unchanged, 0,
+    )
+
+
+def create_pending_document(cur, knowledge_base_id, external_id, pending_seconds) -> str:
+    """
+    Cria o documento de uma ingestão em lotes (arquivo), oculto das buscas até
+    `complete_pending_document`. Sem conclusão em `pending_seconds` (adiados a cada
+    `extend_pending_document`), o varredor o remove com seus chunks.
+    """
+    cur.execute(
+        "INSERT INTO documents (knowledge_base_id, external_id, pending_until) "
+        "VALUES (%s, %s, NOW() + make_interval(secs => %s)) RETURNING id",
+        (knowledge_base_id, external_id, pending_seconds),
+    )
+    return str(cur.fetchone()[0])
+
+
+def extend_pending_document(cur, document_id, pending_seconds):
+    """Adia o prazo do documento pendente; levanta `PendingDocumentExpired` se ele já venceu."""
+    cur.execute(
+        "UPDATE documents SET pending_until = NOW() + make_interval(secs => %s) "
+        "WHERE id = %s AND pending_until IS NOT NULL AND deleted_at IS NULL",
+        (pending_seconds, document_id),
+    )
+    if cur.rowcount == 0:
+        raise PendingDocumentExpired(document_id)
+
+
+def complete_pending_document(cur, document_id, chunk_count):
+    """Torna o documento e seus chunks visíveis às buscas."""
+    cur.execute(
+        "UPDATE documents SET pending_until = NULL, chunk_count = %s, updated_at = NOW() "
+        "WHERE id = %s AND pending_until IS NOT NULL AND deleted_at IS NULL",
+        (chunk_count, document_id),
+    )
+    if cur.rowcount == 0:
+        raise PendingDocumentExpired(document_id)
+
+
+def abandon_pending_document(cur, document_id):
+    """Marca o documento de uma ingestão que falhou; o varredor remove os chunks em lotes."""
+    cur.execute(
+        "UPDATE documents SET deleted_at = NOW(), pending_until = NULL WHERE id = %s AND deleted_at IS NULL",
+        (document_id,),
+    )
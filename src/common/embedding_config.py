@@ -0,0 +1,157 @@
+"""
+Modelo de embeddings de cada base de conhecimento.
+
+Cada base registra o modelo e a dimensão dos seus vetores (`knowledge_bases.
+embedding_model`/`embedding_dimensions`); ingestão e consulta vetorizam com esse
+modelo. As funções guardam a configuração em um cache por processo com TTL, para
+não pagar uma ida ao banco a cada requisição.
+
+Quando uma migração de modelo é concluída (`src.common.reembed`), a troca é feita
+em uma transação que trava a linha da base. A ingestão confirma, na própria
+transação de escrita, que o modelo usado ainda é o da base (`check_embedding_config`),
+então nenhum vetor do modelo antigo é gravado depois da troca. As buscas confirmam o
+modelo no próprio comando (`matching_base`): com o modelo trocado elas não retornam
+nada, e a consulta descarta o cache, vetoriza de novo e repete a busca uma vez.
+
+O cache também responde se a base existe: os handlers o consultam no início da
+requisição e recusam bases inexistentes antes da admissão, da OpenAI e da busca.
+Identificadores que não são UUID nem chegam ao banco. Com
+EMBEDDING_CONFIG_NEGATIVE_TTL_SECONDS, bases inexistentes também ficam em cache por
+esse tempo (desligado por padrão: uma base recém-criada é encontrada na hora).
+"""
+import threading
+import time
+import uuid
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from src.common.vectors import EMBEDDING_DIMENSIONS
+
+DEFAULT_MODEL = "text-embedding-3-small"
+DEFAULT_CONFIG_TTL_SECONDS = 60
+DEFAULT_NEGATIVE_TTL_SECONDS = 0
+
+
+class EmbeddingConfig(NamedTuple):
+    model: str
+    dimensions: int
+
+    def request_fields(self) -> dict:
+        """Campos do corpo da requisição de embeddings para este modelo."""
+        if self == DEFAULT_CONFIG:
+            return {"model": self.model}
+        return {"model": self.model, "dimensions": self.dimensions}
+
+
+DEFAULT_CONFIG = EmbeddingConfig(DEFAULT_MODEL, EMBEDDING_DIMENSIONS)
+
+
+class EmbeddingModelChanged(Exception):
+    """O modelo da base mudou entre a vetorização e a escrita."""
+
+    def __init__(self, knowledge_base_id, used, current):
+        super().__init__(
+            f"A base {knowledge_base_id} passou a usar {current.model}; os vetores foram gerados com {used.model}."
+        )
+        self.used = used
+        self.current = current
+
+
+class KnowledgeBaseNotFound(Exception):
+    """A base não existe mais (ou foi marcada para remoção) no momento da escrita."""
+
+    def __init__(self, knowledge_base_id):
+        super().__init__(f"A base {knowledge_base_id} não existe ou foi marcada para remoção.")
+        self.knowledge_base_id = knowledge_base_id
+
+
+def is_uuid(value) -> bool:
+    """Identificadores de base são UUIDs; qualquer outro valor não existe no banco."""
+    try:
+        uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+
+def read_embedding_config(cur, knowledge_base_id) -> Optional[EmbeddingConfig]:
+    """Configuração atual da base, ou None se ela não existe (ou foi marcada para remoção)."""
+    if not is_uuid(knowledge_base_id):
+        return None
+    cur.execute("SELECT embedding_model, embedding_dimensions FROM knowledge_bases "
+                "WHERE id = %s AND deleted_at IS NULL", (knowledge_base_id,))
+    row = cur.fetchone()
+    return EmbeddingConfig(row[0], row[1]) if row else None
+
+
+def matching_base(id_param, model_param, dimensions_param) -> str:
+    """
+    Subconsulta SQL com o id da base (`id_param`) só se ela ainda usa o modelo e a
+    dimensão dados, senão NULL. Comparada com `knowledge_base_id`, a busca confirma o
+    modelo no mesmo comando (mesmo snapshot) em que lê os vetores.
+    """
+    return (f"(SELECT id FROM knowledge_bases WHERE id = {id_param} AND embedding_model = {model_param} "
+            f"AND embedding_dimensions = {dimensions_param})")
+
+
+def check_embedding_config(cur, knowledge_base_id, used: EmbeddingConfig):
+    """
+    Trava a linha da base até o fim da transação e confirma que ela ainda existe e que
+    o modelo não mudou.
+
+    FOR KEY SHARE não bloqueia outras ingestões, mas conflita com o FOR UPDATE da troca
+    de modelo: ou a escrita termina antes da troca, ou enxerga o modelo novo. Uma base
+    marcada para remoção (mesmo ainda em cache nos containers) recusa a escrita.
+    """
+    cur.execute("SELECT embedding_model, embedding_dimensions FROM knowledge_bases "
+                "WHERE id = %s AND deleted_at IS NULL FOR KEY SHARE", (knowledge_base_id,))
+    row = cur.fetchone()
+    if row is None:
+        raise KnowledgeBaseNotFound(knowledge_base_id)
+    current = EmbeddingConfig(row[0], row[1])
+    if current != used:
+        raise EmbeddingModelChanged(knowledge_base_id, used, current)
+
+
+class EmbeddingConfigCache:
+    """
+    Cache por processo da configuração de cada base, com expiração. Bases inexistentes
+    (None) ficam guardadas por `negative_ttl_seconds`, se maior que zero.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_CONFIG_TTL_SECONDS, clock: Callable[[], float] = time.monotonic,
+                 negative_ttl_seconds=DEFAULT_NEGATIVE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._clock = clock
+        self._entries: Dict[str, Tuple[float, Optional[EmbeddingConfig]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, knowledge_base_id, load: Callable[[], Optional[EmbeddingConfig]]) -> Optional[EmbeddingConfig]:
+        """Retorna a configuração em cache ou chama `load()`."""
+        key = str(knowledge_base_id)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            ttl = self.ttl_seconds if entry[1] is not None else self.negative_ttl_seconds
+            if now - entry[0] < ttl:
+                return entry[1]
+        config = load()
+        if config is not None or self.negative_ttl_seconds > 0:
+            with self._lock:
+                self._entries[key] = (now, config)
+        return config
+
+    def invalidate(self, knowledge_base_id=None):
+        with self._lock:
+            if knowledge_base_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(knowledge_base_id), None)
+
+
+def config_cache_from_env(environ) -> EmbeddingConfigCache:
+    return EmbeddingConfigCache(
+        float(environ.get("EMBEDDING_CONFIG_TTL_SECONDS", DEFAULT_CONFIG_TTL_SECONDS)),
+        negative_ttl_seconds=float(environ.get("EMBEDDING_CONFIG_NEGATIVE_TTL_SECONDS", DEFAULT_NEGATIVE_TTL_SECONDS)),
+    )
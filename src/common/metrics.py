@@ -0,0 +1,175 @@
+"""
+Métricas por fase das invocações, emitidas em CloudWatch Embedded Metric Format (EMF).
+
+Cada invocação decorada com `instrumented` acumula o tempo de cada fase (parse,
+chunk, embed, connect, execute, serialize, ...) e contadores de itens e bytes, e
+escreve ao final uma única linha JSON no stdout. O CloudWatch extrai dessa linha
+as métricas (namespace `Cortexa`) com as dimensões função, cold/warm e tenant,
+sem chamadas de API no caminho da requisição.
+
+As funções `phase`, `timed`, `count` e `set_tenant` atuam sobre a invocação
+corrente e não fazem nada fora de uma invocação instrumentada (ex.: testes que
+chamam funções auxiliares diretamente).
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "Cortexa")
+
+_CURRENT = contextvars.ContextVar("cortexa_metrics", default=None)
+# Um container de Lambda processa uma invocação por vez; a primeira é a 'cold'.
+_COLD_START = True
+
+
+def _enabled(environ=os.environ) -> bool:
+    return environ.get("CORTEXA_METRICS", "true").lower() not in ("0", "false", "no")
+
+
+class InvocationMetrics:
+    """Tempos por fase e contadores de uma invocação."""
+
+    def __init__(self, function_name, request_id=None, cold_start=False):
+        self.function_name = function_name
+        self.request_id = request_id
+        self.cold_start = cold_start
+        self.tenant = None
+        self.status_code = None
+        self.timings = {}
+        self.counts = {}
+        self._start = time.perf_counter()
+
+    def add_time(self, name, elapsed_ms):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    def add_count(self, name, value, unit="Count"):
+        previous, _ = self.counts.get(name, (0, unit))
+        self.counts[name] = (previous + value, unit)
+
+    def to_emf(self, timestamp_ms=None, tenant_dimension=True) -> dict:
+        """Monta o documento EMF; os tempos são emitidos como `<fase>_ms`."""
+        self.timings.setdefault("total", (time.perf_counter() - self._start) * 1000)
+        dimensions = [["Function"], ["Function", "ColdStart"]]
+        record = {
+            "Function": self.function_name,
+            "ColdStart": "cold" if self.cold_start else "warm",
+        }
+        if self.tenant and tenant_dimension:
+            dimensions.append(["Function", "Tenant"])
+            record["Tenant"] = str(self.tenant)
+
+        definitions = []
+        for name, elapsed_ms in self.timings.items():
+            record[f"{name}_ms"] = round(elapsed_ms, 3)
+            definitions.append({"Name": f"{name}_ms", "Unit": "Milliseconds"})
+        for name, (value, unit) in self.counts.items():
+            record[name] = value
+            definitions.append({"Name": name, "Unit": unit})
+
+        # Propriedades sem métrica: ficam pesquisáveis no Logs Insights
+        if self.request_id:
+            record["RequestId"] = str(self.request_id)
+        if self.status_code is not None:
+            record["StatusCode"] = self.status_code
+
+        record["_aws"] = {
+            "Timestamp": timestamp_ms if timestamp_ms is not None else int(time.time() * 1000),
+            "CloudWatchMetrics": [{"Namespace": NAMESPACE, "Dimensions": dimensions, "Metrics": definitions}],
+        }
+        return record
+
+
+def instrumented(function_name):
+    """
+    Decora um `lambda_handler` para medir a invocação e emitir a linha EMF ao final.
+
+    O nome da função vem de AWS_LAMBDA_FUNCTION_NAME quando disponível (ex.:
+    'query_function-prod'), para casar com as dimensões do dashboard.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _COLD_START
+            if not _enabled():
+                return handler(event, context)
+            metrics = InvocationMetrics(
+                os.environ.get("AWS_LAMBDA_FUNCTION_NAME", function_name),
+                getattr(context, "aws_request_id", None),
+                cold_start=_COLD_START,
+            )
+            _COLD_START = False
+            token = _CURRENT.set(metrics)
+            try:
+                response = handler(event, context)
+                if isinstance(response, dict):
+                    metrics.status_code = response.get("statusCode")
+                return response
+            finally:
+                _CURRENT.reset(token)
+                emit(metrics)
+        return wrapper
+    return decorator
+
+
+def emit(metrics: InvocationMetrics, stream=None):
+    """Escreve a linha EMF. O stdout da Lambda vai para o CloudWatch Logs sem prefixo."""
+    tenant_dimension = os.environ.get("METRICS_TENANT_DIMENSION", "true").lower() not in ("0", "false", "no")
+    line = json.dumps(metrics.to_emf(tenant_dimension=tenant_dimension), separators=(",", ":"))
+    stream = stream or sys.stdout
+    stream.write(line + "\n")
+    stream.flush()
+
+
+def current():
+    """Métricas da invocação corrente, ou None fora de uma invocação instrumentada."""
+    return _CURRENT.get()
+
+
+@contextmanager
+def phase(name):
+    """Mede o bloco como a fase `name`; chamadas repetidas são somadas."""
+    metrics = _CURRENT.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name, iterable):
+    """Itera `iterable` somando à fase `name` o tempo gasto para produzir cada item."""
+    metrics = _CURRENT.get()
+    if metrics is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            metrics.add_time(name, (time.perf_counter() - start) * 1000)
+            return
+        metrics.add_time(name, (time.perf_counter() - start) * 1000)
+        yield item
+
+
+def count(name, value=1, unit="Count"):
+    """Soma `value` ao contador `name` (unidades EMF: Count, Bytes, ...)."""
+    metrics = _CURRENT.get()
+    if metrics is not None:
+        metrics.add_count(name, value, unit)
+
+
+def set_tenant(tenant):
+    """Define o tenant (base de conhecimento) da invocação corrente."""
+    metrics = _CURRENT.get()
+    if metrics is not None:
+        metrics.tenant = tenant
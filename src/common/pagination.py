@@ -0,0 +1,132 @@
+"""
+Paginação das buscas vetoriais sobre uma lista de candidatos.
+
+A primeira página busca, uma única vez, os `PAGE_CANDIDATES` chunks mais próximos da
+consulta (só id e distância, com mais `probes` do ivfflat para que a lista chegue a
+esse tamanho) e guarda a lista em um cache LRU por processo, com expiração. Cada
+página é uma fatia dessa lista, a partir da posição do último resultado da página
+anterior, (distância, id); só o conteúdo dos chunks da fatia é lido do banco. As
+páginas anteriores não são recalculadas.
+
+A lista tem um horizonte: quando a paginação chega ao fim de uma lista cheia, a
+resposta traz `horizon_reached` em vez de indicar que os resultados acabaram. Em
+outro container (ou após a expiração), a lista é buscada de novo e a fatia continua
+da mesma posição.
+
+O cursor devolvido ao cliente é opaco (JSON em base64 url-safe) e carrega essa
+posição, o tamanho da página, a base e uma impressão digital da consulta (texto +
+modelo). Um cursor só vale para a mesma consulta na mesma base. As páginas seguintes
+também reaproveitam o embedding da consulta, guardado em outro cache LRU.
+"""
+import base64
+import bisect
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Tuple
+
+CURSOR_VERSION = 1
+# Posição anterior a qualquer resultado: distâncias de cosseno ficam em [0, 2]
+START_DISTANCE = -1.0
+START_ID = "00000000-0000-0000-0000-000000000000"
+DEFAULT_EMBEDDING_CACHE_SIZE = 256
+DEFAULT_CANDIDATE_CACHE_SIZE = 64
+DEFAULT_CANDIDATE_TTL_SECONDS = 300
+
+
+class InvalidCursor(Exception):
+    """Cursor malformado ou de outra consulta."""
+
+
+class PageCursor(NamedTuple):
+    knowledge_base_id: str
+    fingerprint: str
+    distance: float
+    last_id: str
+    page_size: int
+
+
+def query_fingerprint(text, config) -> str:
+    return hashlib.sha256(f"{config.model}:{config.dimensions}:{text}".encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(cursor: PageCursor) -> str:
+    payload = {"v": CURSOR_VERSION, "kb": cursor.knowledge_base_id, "q": cursor.fingerprint,
+               "d": cursor.distance, "id": cursor.last_id, "n": cursor.page_size}
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(token) -> PageCursor:
+    if not isinstance(token, str) or not token:
+        raise InvalidCursor("O campo 'cursor' é inválido.")
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if payload["v"] != CURSOR_VERSION:
+            raise InvalidCursor("O campo 'cursor' é de uma versão não suportada.")
+        return PageCursor(str(payload["kb"]), str(payload["q"]), float(payload["d"]), str(payload["id"]),
+                          int(payload["n"]))
+    except InvalidCursor:
+        raise
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("O campo 'cursor' é inválido.")
+
+
+class QueryEmbeddingCache:
+    """Cache LRU, por processo, dos embeddings de consultas paginadas."""
+
+    def __init__(self, max_entries=DEFAULT_EMBEDDING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+class CandidateCache(QueryEmbeddingCache):
+    """Cache LRU, por processo, das listas de candidatos das consultas paginadas, com expiração."""
+
+    def __init__(self, max_entries=DEFAULT_CANDIDATE_CACHE_SIZE, ttl_seconds=DEFAULT_CANDIDATE_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__(max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+
+    def get(self, key, compute):
+        now = self._clock()
+        stamped = super().get(key, lambda: (now, compute()))
+        if now - stamped[0] < self.ttl_seconds:
+            return stamped[1]
+        with self._lock:
+            self._entries.pop(key, None)
+        return super().get(key, lambda: (now, compute()))[1]
+
+
+class PageSlice(NamedTuple):
+    # (distância, id) dos candidatos da página, em ordem
+    candidates: List[Tuple[float, str]]
+    # Há candidatos depois desta página
+    has_more: bool
+    # A lista estava cheia e acabou aqui: pode haver resultados além do horizonte
+    horizon_reached: bool
+
+
+def page_slice(candidates, page: PageCursor, limit) -> PageSlice:
+    """Fatia da lista de candidatos (ordenada por distância e id) que forma a página do cursor."""
+    start = bisect.bisect_right(candidates, (page.distance, page.last_id))
+    end = start + page.page_size
+    has_more = end < len(candidates)
+    return PageSlice(candidates[start:end], has_more, not has_more and len(candidates) >= limit)
@@ -0,0 +1,183 @@
+"""
+Profiling opcional por invocação (cProfile + tracemalloc).
+
+Desligado por padrão: com CORTEXA_PROFILE ausente ou 'off', `profiled` devolve o
+próprio handler, sem nenhum wrapper. Modos:
+
+  * `always`: perfila todas as invocações;
+  * `sampled`: perfila uma fração PROFILE_SAMPLE_RATE (ex.: 0.01) das invocações;
+  * `request`: perfila só as requisições com o cabeçalho `X-Cortexa-Profile: 1`
+    (útil para investigar um tenant específico).
+
+Cada invocação perfilada grava as estatísticas do cProfile (`.prof`, legíveis com
+`pstats`/snakeviz) e as maiores alocações do tracemalloc (`.alloc.txt`) no destino
+PROFILE_SINK — um diretório local (padrão) ou `s3://bucket/prefixo` — e registra
+no log um resumo das funções mais custosas.
+"""
+import cProfile
+import functools
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import time
+import tracemalloc
+
+logger = logging.getLogger()
+
+DEFAULT_SINK = "/tmp/cortexa-profiles"
+PROFILE_HEADER = "x-cortexa-profile"
+# Linhas do resumo no log e alocações gravadas
+SUMMARY_FUNCTIONS = 10
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 10
+
+
+class LocalDirectorySink:
+    """Grava os artefatos em um diretório local (na Lambda, só /tmp é gravável)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, name, data: bytes) -> str:
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+
+class S3Sink:
+    """Grava os artefatos em um bucket S3, sob um prefixo."""
+
+    def __init__(self, bucket, prefix="", client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = client
+
+    def write(self, name, data: bytes) -> str:
+        if self._client is None:
+            import botocore.session
+            self._client = botocore.session.get_session().create_client("s3")
+        key = f"{self.prefix}/{name}" if self.prefix else name
+        self._client.put_object(Bucket=self.bucket, Key=key, Body=data)
+        return f"s3://{self.bucket}/{key}"
+
+
+def _s3_sink(spec):
+    bucket, _, prefix = spec[len("s3://"):].partition("/")
+    return S3Sink(bucket, prefix)
+
+
+# Esquema do PROFILE_SINK -> fábrica do destino; outros destinos podem ser registrados aqui.
+SINKS = {
+    "s3://": _s3_sink,
+}
+
+
+def get_sink(spec=None):
+    """Cria o destino a partir de PROFILE_SINK; sem esquema conhecido, é um diretório local."""
+    spec = spec or DEFAULT_SINK
+    for scheme, factory in SINKS.items():
+        if spec.startswith(scheme):
+            return factory(spec)
+    return LocalDirectorySink(spec)
+
+
+def _requested(event) -> bool:
+    headers = (event or {}).get("headers") or {}
+    value = next((v for k, v in headers.items() if k.lower() == PROFILE_HEADER), None)
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def _should_profile(mode, sample_rate, event) -> bool:
+    if mode == "always":
+        return True
+    if mode == "sampled":
+        return random.random() < sample_rate
+    if mode == "request":
+        return _requested(event)
+    return False
+
+
+def _stats_bytes(profiler) -> bytes:
+    """Serializa as estatísticas no formato de `pstats.Stats.dump_stats`."""
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+def summarize(profiler, limit=SUMMARY_FUNCTIONS) -> str:
+    """As `limit` funções com maior tempo cumulativo, em texto."""
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    # Só a tabela: o cabeçalho do pstats é ruído no log
+    lines = out.getvalue().splitlines()
+    start = next((i for i, line in enumerate(lines) if line.lstrip().startswith("ncalls")), 0)
+    return "\n".join(line for line in lines[start:] if line.strip())
+
+
+def _allocations_text(snapshot, limit=TOP_ALLOCATIONS) -> str:
+    lines = []
+    for stat in snapshot.statistics("traceback")[:limit]:
+        lines.append(f"{stat.size / 1024:.1f} KiB em {stat.count} blocos")
+        lines.extend(f"    {line}" for line in stat.traceback.format())
+    return "\n".join(lines) + "\n"
+
+
+def _save(sink, function_name, request_id, profiler, snapshot, peak_bytes, elapsed_ms):
+    base = f"{function_name}/{time.strftime('%Y%m%dT%H%M%S')}-{request_id}"
+    summary = summarize(profiler)
+    prof_location = sink.write(f"{base}.prof", _stats_bytes(profiler))
+    sink.write(f"{base}.alloc.txt", _allocations_text(snapshot).encode("utf-8"))
+    logger.info(
+        f"Profiling de {function_name} ({request_id}): {elapsed_ms:.0f} ms, pico de memória "
+        f"rastreada {peak_bytes / (1024 * 1024):.1f} MiB, salvo em {prof_location}\n{summary}"
+    )
+
+
+def profiled(function_name, environ=None):
+    """
+    Decora um `lambda_handler` com profiling opcional, configurado pelo ambiente no import.
+
+    Falhas ao gravar os artefatos são registradas e nunca afetam a resposta.
+    """
+    environ = os.environ if environ is None else environ
+    mode = environ.get("CORTEXA_PROFILE", "off").lower()
+    if mode not in ("always", "sampled", "request"):
+        return lambda handler: handler
+
+    sample_rate = float(environ.get("PROFILE_SAMPLE_RATE", "0.01"))
+    sink = get_sink(environ.get("PROFILE_SINK"))
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not _should_profile(mode, sample_rate, event):
+                return handler(event, context)
+
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                return handler(event, context)
+            finally:
+                profiler.disable()
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                snapshot = tracemalloc.take_snapshot()
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+                try:
+                    _save(sink, function_name, str(getattr(context, "aws_request_id", "local")),
+                          profiler, snapshot, peak_bytes, elapsed_ms)
+                except Exception as e:
+                    logger.warning(f"Não foi possível gravar o profiling de {function_name}: {e}")
+        return wrapper
+    return decorator
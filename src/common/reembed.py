@@ -0,0 +1,352 @@
+"""
+Migração de modelo de embeddings em background, sem tirar o serviço do ar.
+
+Fluxo de uma base de conhecimento:
+
+  1. `start_migration` registra o modelo alvo em `embedding_migrations`;
+  2. `run_migration` re-vetoriza os chunks em lotes, respeitando um orçamento de
+     tokens e requisições por minuto, e grava os vetores novos na coluna sombra
+     `embedding_next`. Cada lote é confirmado junto com o cursor, então a
+     migração pode ser interrompida e retomada a qualquer momento. Depois da
+     passada principal (por id), uma passada de recuperação pega os chunks
+     ingeridos durante a migração;
+  3. `switch_migration` trava a linha da base, vetoriza os últimos chunks que
+     faltarem e, em uma única transação, copia `embedding_next` para `embedding`
+     e atualiza o modelo da base.
+
+Até a troca, as consultas continuam usando `embedding` e o modelo antigo.
+A troca reescreve as linhas da base: com índice ivfflat, reconstrua o índice
+depois (`--reindex`), já que as listas foram treinadas com os vetores antigos.
+
+Uso (a partir da raiz do repositório):
+    NEON_DB_CONNECTION_STRING=... OPENAI_PROXY_LAMBDA_ARN=... python -m src.common.reembed \\
+        start|run|switch|cancel|status <kb> [--model text-embedding-3-large] [--dimensions 1536] \\
+        [--batch-size 100] [--tokens-per-minute 500000] [--requests-per-minute 300] \\
+        [--max-seconds 600] [--switch] [--reindex]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Callable, NamedTuple, Optional
+
+from src.common.chunking import approximate_token_count
+from src.common.embedding_config import EmbeddingConfig
+from src.common.vectors import EMBEDDING_DIMENSIONS
+
+logger = logging.getLogger()
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_TOKENS_PER_MINUTE = 500_000
+DEFAULT_REQUESTS_PER_MINUTE = 300
+
+# Função de embeddings: (textos, config) -> EmbeddingBatch
+Embedder = Callable[[list, EmbeddingConfig], object]
+
+
+class MigrationError(Exception):
+    """A migração não existe ou não está no estado esperado."""
+
+
+class MigrationProgress(NamedTuple):
+    knowledge_base_id: str
+    target: EmbeddingConfig
+    status: str
+    embedded_chunks: int
+    total_chunks: int
+    pending_chunks: int
+
+
+class RateBudget:
+    """
+    Orçamento de tokens e requisições por minuto (token bucket).
+
+    `acquire(tokens)` espera até que a requisição caiba no orçamento; o balde
+    começa cheio, o que permite uma rajada inicial de até um minuto de orçamento.
+    """
+
+    def __init__(self, tokens_per_minute, requests_per_minute,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(tokens_per_minute)
+        self._requests = float(requests_per_minute)
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+
+    def acquire(self, tokens):
+        # Um lote maior que o balde inteiro esperaria para sempre
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            self._refill()
+            if self._tokens >= tokens and self._requests >= 1:
+                self._tokens -= tokens
+                self._requests -= 1
+                return
+            wait = max((tokens - self._tokens) * 60 / self.tokens_per_minute,
+                       (1 - self._requests) * 60 / self.requests_per_minute)
+            self._sleep(max(wait, 0.001))
+
+
+def _migration(cur, knowledge_base_id, lock=False):
+    cur.execute(
+        "SELECT target_model, target_dimensions, last_chunk_id, embedded_chunks, status "
+        "FROM embedding_migrations WHERE knowledge_base_id = %s" + (" FOR UPDATE" if lock else ""),
+        (knowledge_base_id,),
+    )
+    return cur.fetchone()
+
+
+def _running(cur, knowledge_base_id, lock=False):
+    """Alvo e cursor da migração em andamento."""
+    row = _migration(cur, knowledge_base_id, lock)
+    if row is None or row[4] != "running":
+        raise MigrationError(f"Não há migração em andamento para a base {knowledge_base_id}.")
+    return EmbeddingConfig(row[0], row[1]), row[2]
+
+
+def start_migration(conn, knowledge_base_id, target: EmbeddingConfig):
+    """Registra (ou reinicia) a migração da base para o modelo alvo."""
+    if target.dimensions != EMBEDDING_DIMENSIONS:
+        raise MigrationError(
+            f"A coluna de vetores tem {EMBEDDING_DIMENSIONS} dimensões; use o parâmetro 'dimensions' do modelo "
+            f"para gerar vetores desse tamanho."
+        )
+    # `with conn`: confirma ao final ou desfaz em erro, liberando os locks
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT embedding_model, embedding_dimensions FROM knowledge_bases WHERE id = %s FOR UPDATE",
+                    (knowledge_base_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise MigrationError(f"Base de conhecimento não encontrada: {knowledge_base_id}")
+        if EmbeddingConfig(row[0], row[1]) == target:
+            raise MigrationError(f"A base {knowledge_base_id} já usa {target.model}.")
+        existing = _migration(cur, knowledge_base_id, lock=True)
+        if existing is not None and existing[4] == "running":
+            if EmbeddingConfig(existing[0], existing[1]) == target:
+                return
+            raise MigrationError(f"A base {knowledge_base_id} já está migrando para {existing[0]}; cancele antes.")
+        # Vetores sombra de uma migração anterior cancelada não servem mais
+        cur.execute("UPDATE knowledge_chunks SET embedding_next = NULL "
+                    "WHERE knowledge_base_id = %s AND embedding_next IS NOT NULL", (knowledge_base_id,))
+        cur.execute(
+            """
+            INSERT INTO embedding_migrations (knowledge_base_id, target_model, target_dimensions)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (knowledge_base_id) DO UPDATE SET
+                target_model = EXCLUDED.target_model, target_dimensions = EXCLUDED.target_dimensions,
+                last_chunk_id = NULL, embedded_chunks = 0, status = 'running',
+                started_at = NOW(), updated_at = NOW(), switched_at = NULL
+            """,
+            (knowledge_base_id, target.model, target.dimensions),
+        )
+
+
+def _next_batch(cur, knowledge_base_id, last_chunk_id, batch_size):
+    """Próximo lote da passada principal (por id) ou, ao final dela, da passada de recuperação."""
+    if last_chunk_id is not None:
+        cur.execute(
+            "SELECT id, content FROM knowledge_chunks WHERE knowledge_base_id = %s AND id > %s "
+            "ORDER BY id LIMIT %s",
+            (knowledge_base_id, last_chunk_id, batch_size),
+        )
+    else:
+        cur.execute(
+            "SELECT id, content FROM knowledge_chunks WHERE knowledge_base_id = %s ORDER BY id LIMIT %s",
+            (knowledge_base_id, batch_size),
+        )
+    rows = cur.fetchall()
+    if rows:
+        return rows, True
+    cur.execute(
+        "SELECT id, content FROM knowledge_chunks WHERE knowledge_base_id = %s AND embedding_next IS NULL LIMIT %s",
+        (knowledge_base_id, batch_size),
+    )
+    return cur.fetchall(), False
+
+
+def _embed_rows(rows, target, embed: Embedder, budget: Optional[RateBudget]):
+    texts = [row[1] for row in rows]
+    if budget is not None:
+        budget.acquire(sum(approximate_token_count(text) for text in texts))
+    embeddings = embed(texts, target)
+    return [(str(row[0]), embeddings.vector(i)) for i, row in enumerate(rows)]
+
+
+def _store_vectors(cur, vectors):
+    from psycopg2.extras import execute_values
+
+    execute_values(
+        cur,
+        "UPDATE knowledge_chunks AS k SET embedding_next = v.embedding::vector "
+        "FROM (VALUES %s) AS v(id, embedding) WHERE k.id = v.id::uuid",
+        vectors,
+    )
+
+
+def run_migration(conn, knowledge_base_id, embed: Embedder, batch_size=DEFAULT_BATCH_SIZE,
+                  budget: Optional[RateBudget] = None, max_seconds: Optional[float] = None,
+                  max_batches: Optional[int] = None) -> bool:
+    """
+    Re-vetoriza os chunks pendentes; retorna True quando não resta nenhum.
+
+    Para após `max_seconds` ou `max_batches`; uma nova chamada retoma do cursor salvo.
+    """
+    deadline = None if max_seconds is None else time.monotonic() + max_seconds
+    batches = 0
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        if max_batches is not None and batches >= max_batches:
+            return False
+        with conn, conn.cursor() as cur:
+            target, last_chunk_id = _running(cur, knowledge_base_id)
+            rows, main_pass = _next_batch(cur, knowledge_base_id, last_chunk_id, batch_size)
+        if not rows:
+            return True
+
+        # A chamada à API acontece fora de transação
+        vectors = _embed_rows(rows, target, embed, budget)
+        with conn, conn.cursor() as cur:
+            if _running(cur, knowledge_base_id, lock=True)[0] != target:
+                raise MigrationError(f"A migração da base {knowledge_base_id} mudou de alvo.")
+            _store_vectors(cur, vectors)
+            cur.execute(
+                "UPDATE embedding_migrations SET embedded_chunks = embedded_chunks + %s, updated_at = NOW()"
+                + (", last_chunk_id = %s" if main_pass else "") + " WHERE knowledge_base_id = %s",
+                (len(vectors), rows[-1][0], knowledge_base_id) if main_pass else (len(vectors), knowledge_base_id),
+            )
+        batches += 1
+        logger.info(f"Migração da base {knowledge_base_id}: {len(vectors)} chunks re-vetorizados com {target.model}.")
+
+
+def switch_migration(conn, knowledge_base_id, embed: Embedder, batch_size=DEFAULT_BATCH_SIZE,
+                     budget: Optional[RateBudget] = None) -> int:
+    """
+    Troca a base para o modelo novo de forma atômica; retorna os chunks trocados.
+
+    A linha da base fica travada (FOR UPDATE) durante a troca: novas escritas esperam
+    e, ao continuar, enxergam o modelo novo.
+    """
+    # Recupera o que foi ingerido até aqui sem segurar o lock
+    run_migration(conn, knowledge_base_id, embed, batch_size, budget)
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT id FROM knowledge_bases WHERE id = %s FOR UPDATE", (knowledge_base_id,))
+        target = _running(cur, knowledge_base_id, lock=True)[0]
+        # Chunks confirmados entre a recuperação e o lock
+        while True:
+            cur.execute(
+                "SELECT id, content FROM knowledge_chunks "
+                "WHERE knowledge_base_id = %s AND embedding_next IS NULL LIMIT %s",
+                (knowledge_base_id, batch_size),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            _store_vectors(cur, _embed_rows(rows, target, embed, budget))
+        cur.execute(
+            "UPDATE knowledge_chunks SET embedding = embedding_next, embedding_next = NULL "
+            "WHERE knowledge_base_id = %s",
+            (knowledge_base_id,),
+        )
+        switched = cur.rowcount
+        cur.execute("UPDATE knowledge_bases SET embedding_model = %s, embedding_dimensions = %s WHERE id = %s",
+                    (target.model, target.dimensions, knowledge_base_id))
+        cur.execute("UPDATE embedding_migrations SET status = 'switched', switched_at = NOW(), updated_at = NOW() "
+                    "WHERE knowledge_base_id = %s", (knowledge_base_id,))
+    logger.info(f"Base {knowledge_base_id} trocada para {target.model}: {switched} chunks.")
+    return switched
+
+
+def cancel_migration(conn, knowledge_base_id):
+    """Cancela a migração e descarta os vetores sombra; as consultas nunca os usaram."""
+    with conn, conn.cursor() as cur:
+        _running(cur, knowledge_base_id, lock=True)
+        cur.execute("UPDATE knowledge_chunks SET embedding_next = NULL "
+                    "WHERE knowledge_base_id = %s AND embedding_next IS NOT NULL", (knowledge_base_id,))
+        cur.execute("UPDATE embedding_migrations SET status = 'cancelled', updated_at = NOW() "
+                    "WHERE knowledge_base_id = %s", (knowledge_base_id,))
+
+
+def migration_progress(conn, knowledge_base_id) -> MigrationProgress:
+    with conn, conn.cursor() as cur:
+        row = _migration(cur, knowledge_base_id)
+        if row is None:
+            raise MigrationError(f"Não há migração registrada para a base {knowledge_base_id}.")
+        cur.execute("SELECT count(*), count(*) FILTER (WHERE embedding_next IS NULL) "
+                    "FROM knowledge_chunks WHERE knowledge_base_id = %s", (knowledge_base_id,))
+        total, pending = cur.fetchone()
+    pending = pending if row[4] == "running" else 0
+    return MigrationProgress(str(knowledge_base_id), EmbeddingConfig(row[0], row[1]), row[4], row[3], total, pending)
+
+
+def _proxy_embedder():
+    """Vetoriza pela Lambda de proxy, como a ingestão (a chave da OpenAI fica só no proxy)."""
+    import botocore.session
+
+    from src.ingest_function.main import get_embeddings
+
+    proxy_arn = os.environ.get("OPENAI_PROXY_LAMBDA_ARN")
+    if not proxy_arn:
+        raise SystemExit("Defina OPENAI_PROXY_LAMBDA_ARN.")
+    client = botocore.session.get_session().create_client("lambda")
+    return lambda texts, config: get_embeddings(texts, client, proxy_arn, config)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("start", "run", "switch", "cancel", "status"))
+    parser.add_argument("kb")
+    parser.add_argument("--model")
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--tokens-per-minute", type=int, default=DEFAULT_TOKENS_PER_MINUTE)
+    parser.add_argument("--requests-per-minute", type=int, default=DEFAULT_REQUESTS_PER_MINUTE)
+    parser.add_argument("--max-seconds", type=float, help="Para após este tempo; a próxima execução retoma.")
+    parser.add_argument("--switch", action="store_true", help="Com 'run', troca o modelo ao terminar.")
+    parser.add_argument("--reindex", action="store_true", help="Reconstrói o índice vetorial após a troca.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    dsn = os.environ.get("NEON_DB_CONNECTION_STRING")
+    if not dsn:
+        raise SystemExit("Defina NEON_DB_CONNECTION_STRING.")
+
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    budget = RateBudget(args.tokens_per_minute, args.requests_per_minute)
+    try:
+        if args.command == "start":
+            if not args.model:
+                raise SystemExit("Informe --model.")
+            start_migration(conn, args.kb, EmbeddingConfig(args.model, args.dimensions))
+        elif args.command == "run":
+            done = run_migration(conn, args.kb, _proxy_embedder(), args.batch_size, budget, args.max_seconds)
+            if done and args.switch:
+                switch_migration(conn, args.kb, _proxy_embedder(), args.batch_size, budget)
+        elif args.command == "switch":
+            switch_migration(conn, args.kb, _proxy_embedder(), args.batch_size, budget)
+        elif args.command == "cancel":
+            cancel_migration(conn, args.kb)
+        progress = migration_progress(conn, args.kb)
+        if args.reindex and progress.status == "switched":
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("REINDEX INDEX CONCURRENTLY knowledge_chunks_embedding_idx")
+    finally:
+        conn.close()
+    print(json.dumps({**progress._asdict(), "target": progress.target._asdict()}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Leitura de arquivos do armazenamento de objetos (API do S3) para a ingestão.
+
+Arquivos grandes não passam pelo API Gateway nem cabem inteiros na memória da
+Lambda. A ingestão recebe uma referência (`bucket`, `key`) e o texto é extraído aos
+poucos, em seções (parágrafos, páginas), que alimentam o chunking sob demanda:
+
+  * TXT: um único GET em streaming, decodificado em blocos e cortado em quebras de
+    parágrafo;
+  * DOCX: leituras por faixa (`Range`) do zip, descomprimindo `word/document.xml`
+    em streaming e liberando cada parágrafo após extraí-lo;
+  * PDF: leituras por faixa, página a página, com o pacote opcional `pypdf`.
+
+Em todos os casos só alguns blocos (`SOURCE_BLOCK_BYTES`) ficam em memória. O
+endpoint pode apontar para um serviço compatível com S3 (ex.: MinIO) com
+`S3_ENDPOINT_URL`.
+"""
+import codecs
+import io
+import logging
+import os
+import posixpath
+import zipfile
+from collections import OrderedDict
+from typing import Iterable, Iterator, NamedTuple, Optional
+from xml.etree.ElementTree import ParseError, iterparse
+
+from src.common import metrics
+from src.common.chunking import paragraph_end
+
+logger = logging.getLogger()
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# Tamanho de cada leitura por faixa e de cada bloco do GET em streaming
+SOURCE_BLOCK_BYTES = int(os.environ.get("SOURCE_BLOCK_BYTES", 1024 * 1024))
+# Blocos mantidos em cache pelas leituras por faixa (o índice do zip/PDF fica no fim do arquivo)
+CACHED_BLOCKS = 4
+# Texto sem nenhuma quebra de parágrafo é cortado em espaço ao passar deste tamanho
+MAX_PENDING_CHARS = 1024 * 1024
+
+FORMATS = ("txt", "pdf", "docx")
+_EXTENSIONS = {".txt": "txt", ".md": "txt", ".pdf": "pdf", ".docx": "docx"}
+_CONTENT_TYPES = {
+    "text/plain": "txt",
+    "text/markdown": "txt",
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+}
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class UnsupportedFormat(Exception):
+    """Formato de arquivo não reconhecido ou sem suporte instalado."""
+
+
+class SourceFormatError(Exception):
+    """Arquivo corrompido ou que não corresponde ao formato informado."""
+
+
+class ObjectInfo(NamedTuple):
+    bucket: str
+    key: str
+    size: int
+    content_type: Optional[str]
+
+    @property
+    def uri(self) -> str:
+        return f"s3://{self.bucket}/{self.key}"
+
+
+def create_s3_client(environ=os.environ):
+    """Cliente S3 do botocore; `S3_ENDPOINT_URL` aponta para um serviço compatível."""
+    import botocore.session
+    return botocore.session.get_session().create_client("s3", endpoint_url=environ.get("S3_ENDPOINT_URL") or None)
+
+
+def head_object(client, bucket, key) -> ObjectInfo:
+    response = client.head_object(Bucket=bucket, Key=key)
+    content_type = (response.get("ContentType") or "").split(";")[0].strip().lower() or None
+    return ObjectInfo(bucket, key, response["ContentLength"], content_type)
+
+
+def detect_format(info: ObjectInfo, requested=None) -> str:
+    """Formato pedido, ou deduzido da extensão e, em seguida, do Content-Type."""
+    if requested is not None:
+        if requested not in FORMATS:
+            raise UnsupportedFormat(f"Formato não suportado: {requested}. Use um de: {', '.join(FORMATS)}.")
+        return requested
+    extension = posixpath.splitext(info.key)[1].lower()
+    detected = _EXTENSIONS.get(extension) or _CONTENT_TYPES.get(info.content_type)
+    if detected is None:
+        raise UnsupportedFormat(f"Não foi possível identificar o formato de {info.uri}; informe 'format'.")
+    return detected
+
+
+class RangeReader(io.RawIOBase):
+    """Arquivo somente leitura e posicionável sobre um objeto, lido em blocos por `Range`."""
+
+    def __init__(self, client, info: ObjectInfo, block_size=SOURCE_BLOCK_BYTES, cached_blocks=CACHED_BLOCKS):
+        super().__init__()
+        self.client = client
+        self.info = info
+        self.block_size = block_size
+        self.cached_blocks = cached_blocks
+        self._blocks = OrderedDict()
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.info.size
+        if offset < 0:
+            raise ValueError("Posição negativa.")
+        self._position = offset
+        return offset
+
+    def _block(self, number) -> bytes:
+        block = self._blocks.get(number)
+        if block is not None:
+            self._blocks.move_to_end(number)
+            return block
+        start = number * self.block_size
+        end = min(start + self.block_size, self.info.size) - 1
+        response = self.client.get_object(Bucket=self.info.bucket, Key=self.info.key, Range=f"bytes={start}-{end}")
+        block = response["Body"].read()
+        metrics.count("source_requests")
+        metrics.count("source_bytes", len(block), "Bytes")
+        self._blocks[number] = block
+        while len(self._blocks) > self.cached_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view) and self._position < self.info.size:
+            number, offset = divmod(self._position, self.block_size)
+            data = self._block(number)[offset:offset + len(view) - filled]
+            view[filled:filled + len(data)] = data
+            filled += len(data)
+            self._position += len(data)
+        return filled
+
+
+def _stream_blocks(client, info: ObjectInfo, block_size) -> Iterator[bytes]:
+    """O objeto inteiro em um único GET, entregue em blocos."""
+    body = client.get_object(Bucket=info.bucket, Key=info.key)["Body"]
+    metrics.count("source_requests")
+    try:
+        while True:
+            block = body.read(block_size)
+            if not block:
+                return
+            metrics.count("source_bytes", len(block), "Bytes")
+            yield block
+    finally:
+        body.close()
+
+
+def iter_text_sections(blocks: Iterable[bytes], max_pending=MAX_PENDING_CHARS) -> Iterator[str]:
+    """Decodifica blocos UTF-8 e produz o texto cortado na última quebra de parágrafo de cada bloco."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    for block in blocks:
+        pending += decoder.decode(block)
+        cut = paragraph_end(pending)
+        if not cut and len(pending) > max_pending:
+            cut = pending.rfind(" ") + 1 or len(pending)
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending
+
+
+def iter_docx_paragraphs(stream) -> Iterator[str]:
+    """Texto de cada parágrafo do `word/document.xml`, lido em streaming do zip."""
+    try:
+        with zipfile.ZipFile(stream) as archive, archive.open("word/document.xml") as document:
+            body = None
+            for event, element in iterparse(document, events=("start", "end")):
+                if event == "start":
+                    if element.tag == _W + "body":
+                        body = element
+                    continue
+                if element.tag != _W + "p":
+                    continue
+                parts = []
+                for node in element.iter():
+                    if node.tag == _W + "t" and node.text:
+                        parts.append(node.text)
+                    elif node.tag == _W + "tab":
+                        parts.append("\t")
+                    elif node.tag in (_W + "br", _W + "cr"):
+                        parts.append("\n")
+                text = "".join(parts)
+                # Parágrafos já lidos não ficam pendurados na árvore
+                element.clear()
+                if body is not None:
+                    body.clear()
+                if text.strip():
+                    yield text
+    except (zipfile.BadZipFile, KeyError, ParseError) as e:
+        raise SourceFormatError(f"Arquivo DOCX inválido: {e}")
+
+
+def iter_pdf_pages(stream) -> Iterator[str]:
+    """Texto de cada página do PDF, extraído página a página."""
+    if pypdf is None:
+        raise UnsupportedFormat("Suporte a PDF requer o pacote pypdf.")
+    try:
+        reader = pypdf.PdfReader(stream)
+        for page in reader.pages:
+            text = page.extract_text() or ""
+            if text.strip():
+                yield text
+    except pypdf.errors.PdfReadError as e:
+        raise SourceFormatError(f"Arquivo PDF inválido: {e}")
+
+
+def iter_sections(client, info: ObjectInfo, file_format, block_size=SOURCE_BLOCK_BYTES) -> Iterator[str]:
+    """Seções de texto do objeto, na ordem do arquivo, extraídas sob demanda."""
+    if file_format == "txt":
+        return iter_text_sections(_stream_blocks(client, info, block_size))
+    if file_format == "pdf" and pypdf is None:
+        raise UnsupportedFormat("Suporte a PDF requer o pacote pypdf.")
+    stream = io.BufferedReader(RangeReader(client, info, block_size), buffer_size=64 * 1024)
+    if file_format == "docx":
+        return iter_docx_paragraphs(stream)
+    return iter_pdf_pages(stream)
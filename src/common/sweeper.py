@@ -0,0 +1,311 @@
+"""
+Remoção de dados em background, em lotes pequenos.
+
+Apagar uma base grande em um único DELETE (pelo ON DELETE CASCADE) segura locks
+por muito tempo, gera uma rajada de WAL e deixa o índice vetorial inchado. A API
+apenas marca o que deve sair (`knowledge_bases.deleted_at`, `documents.deleted_at`
+ou o TTL em `knowledge_chunks.expires_at`) e este varredor faz a remoção:
+
+  0. documentos de ingestões de arquivo abandonadas (`pending_until` vencido) são
+     marcados, e seguem pelo passo 2;
+  1. chunks expirados, em ordem de (`expires_at`, id) pelo índice parcial;
+  2. chunks de documentos marcados, pelo índice (document_id, ordinal), e depois
+     a linha do documento;
+  3. chunks de bases marcadas, pelo índice (knowledge_base_id, id), os documentos
+     e por último a linha da base.
+
+Até lá, as buscas já ignoram o que foi marcado, expirou ou ainda está pendente
+(`visible_chunks`).
+
+Cada lote é um DELETE de até `batch_size` linhas em sua própria transação, com
+`lock_timeout` curto e `SKIP LOCKED` (linhas em uso por uma escrita ficam para a
+próxima passada), seguido de uma pausa para que as consultas não disputem I/O e
+locks com a remoção. Os lotes avançam por keyset, sem revisitar as entradas mortas
+do índice. Ao final, se muitas linhas saíram, as tabelas passam por VACUUM
+(ANALYZE) e, com `--reindex`, os índices ivfflat são reconstruídos (as listas foram
+treinadas com vetores que não existem mais).
+
+Uso (a partir da raiz do repositório):
+    NEON_DB_CONNECTION_STRING=... python -m src.common.sweeper \\
+        [--batch-size 500] [--pause 0.2] [--max-seconds 600] [--vacuum-threshold 10000] [--reindex]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import Counter
+from typing import Callable, NamedTuple, Optional
+
+logger = logging.getLogger()
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE_SECONDS = 0.2
+# Linhas removidas a partir das quais a passada termina com VACUUM
+DEFAULT_VACUUM_THRESHOLD = 10_000
+# Um lote não espera mais que isto por um lock; em vez disso, tenta na próxima passada
+LOCK_TIMEOUT = "2s"
+
+VECTOR_INDEXES = ("knowledge_chunks_embedding_idx", "knowledge_chunk_vectors_embedding_idx")
+
+# Lotes por keyset: cada DELETE devolve a chave das linhas removidas e o próximo lote
+# começa depois da maior delas.
+DELETE_EXPIRED = """
+    WITH batch AS (
+        SELECT id FROM knowledge_chunks
+        WHERE expires_at IS NOT NULL AND expires_at <= NOW() AND (expires_at, id) > (%s, %s)
+        ORDER BY expires_at, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM knowledge_chunks c USING batch WHERE c.id = batch.id
+    RETURNING c.expires_at, c.id
+"""
+
+DELETE_DOCUMENT_CHUNKS = """
+    WITH batch AS (
+        SELECT id FROM knowledge_chunks
+        WHERE document_id = %s AND ordinal > %s
+        ORDER BY ordinal
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM knowledge_chunks c USING batch WHERE c.id = batch.id
+    RETURNING c.ordinal
+"""
+
+DELETE_BASE_CHUNKS = """
+    WITH batch AS (
+        SELECT id FROM knowledge_chunks
+        WHERE knowledge_base_id = %s AND id > %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    DELETE FROM knowledge_chunks c USING batch WHERE c.id = batch.id
+    RETURNING c.id
+"""
+
+MARK_ABANDONED_INGESTS = """
+    UPDATE documents SET deleted_at = NOW(), pending_until = NULL
+    WHERE pending_until <= NOW() AND deleted_at IS NULL
+"""
+
+DELETE_BASE_DOCUMENTS = """
+    DELETE FROM documents WHERE id IN (
+        SELECT id FROM documents WHERE knowledge_base_id = %s ORDER BY id LIMIT %s
+    )
+"""
+
+MIN_UUID = "00000000-0000-0000-0000-000000000000"
+MIN_TIMESTAMP = "-infinity"
+
+# O que já foi marcado sai das buscas na hora, sem esperar o varredor, e o que está
+# pendente (ingestão de arquivo em andamento) só entra nelas na conclusão. As listas
+# de bases e documentos são pequenas (o varredor e a conclusão as esvaziam) e viram
+# um hash calculado uma vez por consulta; a expiração é conferida na própria linha.
+MARKED_BASES = "SELECT id FROM knowledge_bases WHERE deleted_at IS NOT NULL"
+MARKED_DOCUMENTS = "SELECT id FROM documents WHERE deleted_at IS NOT NULL OR pending_until IS NOT NULL"
+
+
+def visible_chunks(alias="knowledge_chunks") -> str:
+    """Condição SQL das linhas de `knowledge_chunks` (com o alias dado) que as buscas podem retornar."""
+    return (
+        f"({alias}.expires_at IS NULL OR {alias}.expires_at > NOW()) "
+        f"AND ({alias}.document_id IS NULL OR {alias}.document_id NOT IN ({MARKED_DOCUMENTS})) "
+        f"AND {alias}.knowledge_base_id NOT IN ({MARKED_BASES})"
+    )
+
+
+def visible_chunk_vectors(alias="knowledge_chunk_vectors") -> str:
+    """Mesma condição para a tabela estreita de vetores, que não tem expiração nem documento."""
+    return (
+        f"{alias}.knowledge_base_id NOT IN ({MARKED_BASES}) AND {alias}.id NOT IN ("
+        "SELECT id FROM knowledge_chunks WHERE expires_at <= NOW() "
+        f"UNION ALL SELECT id FROM knowledge_chunks WHERE document_id IN ({MARKED_DOCUMENTS}))"
+    )
+
+
+def mark_knowledge_base(cur, knowledge_base_id) -> bool:
+    """Marca a base para remoção; False se ela não existe ou já estava marcada."""
+    cur.execute("UPDATE knowledge_bases SET deleted_at = NOW() WHERE id = %s AND deleted_at IS NULL",
+                (knowledge_base_id,))
+    return cur.rowcount > 0
+
+
+def mark_document(cur, knowledge_base_id, external_id) -> bool:
+    """Marca o documento para remoção; False se ele (ou a base) não existe ou já estava marcado."""
+    cur.execute(
+        """
+        UPDATE documents SET deleted_at = NOW()
+        WHERE knowledge_base_id = %s AND external_id = %s AND deleted_at IS NULL
+          AND knowledge_base_id IN (SELECT id FROM knowledge_bases WHERE deleted_at IS NULL)
+        """,
+        (knowledge_base_id, external_id),
+    )
+    return cur.rowcount > 0
+
+
+class SweepResult(NamedTuple):
+    abandoned_ingests: int
+    expired_chunks: int
+    document_chunks: int
+    documents: int
+    base_chunks: int
+    knowledge_bases: int
+    # False quando a passada parou por `max_seconds` e ainda há o que remover
+    complete: bool
+
+    @property
+    def deleted_rows(self) -> int:
+        return self.expired_chunks + self.document_chunks + self.base_chunks
+
+
+class _Deadline(Exception):
+    """O tempo da passada acabou; a próxima continua de onde esta parou."""
+
+
+class Sweeper:
+    """Executa os lotes de remoção em uma conexão psycopg2, com pausa entre eles."""
+
+    def __init__(self, conn, batch_size=DEFAULT_BATCH_SIZE, pause_seconds=DEFAULT_PAUSE_SECONDS,
+                 max_seconds: Optional[float] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._deadline = None if max_seconds is None else clock() + max_seconds
+        # Linhas removidas até aqui, por tipo (campos de SweepResult)
+        self.removed = Counter()
+
+    def _batch(self, sql, params, counter):
+        """
+        Um lote em sua própria transação; soma em `removed[counter]` as linhas removidas
+        e retorna as devolvidas pelo DELETE (ou quantas saíram). Se o lock não vier a
+        tempo, o lote é desfeito e conta como vazio.
+        """
+        from psycopg2 import errors
+
+        if self._deadline is not None and self._clock() >= self._deadline:
+            raise _Deadline()
+        try:
+            # `with conn`: confirma o lote ao final ou desfaz em erro, liberando os locks
+            with self.conn, self.conn.cursor() as cur:
+                cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                cur.execute(sql, params)
+                rows = cur.fetchall() if cur.description else cur.rowcount
+        except errors.LockNotAvailable as e:
+            logger.warning(f"Lote adiado para a próxima varredura: {e}")
+            return []
+        if rows:
+            self.removed[counter] += rows if isinstance(rows, int) else len(rows)
+            self._sleep(self.pause_seconds)
+        return rows
+
+    def abandoned_ingests(self):
+        """Marca os documentos de ingestões de arquivo cujo prazo venceu."""
+        self._batch(MARK_ABANDONED_INGESTS, None, "abandoned_ingests")
+
+    def expired_chunks(self):
+        position = (MIN_TIMESTAMP, MIN_UUID)
+        while True:
+            rows = self._batch(DELETE_EXPIRED, (*position, self.batch_size), "expired_chunks")
+            if not rows:
+                return
+            position = max(rows)
+
+    def document(self, document_id):
+        """Remove os chunks do documento em lotes e depois o documento."""
+        last_ordinal = -1
+        while True:
+            rows = self._batch(DELETE_DOCUMENT_CHUNKS, (document_id, last_ordinal, self.batch_size),
+                               "document_chunks")
+            if not rows:
+                break
+            last_ordinal = max(row[0] for row in rows)
+        # Chunks pulados por SKIP LOCKED ou sem ordinal ainda seguem pelo CASCADE
+        self._batch("DELETE FROM documents WHERE id = %s AND deleted_at IS NOT NULL", (document_id,), "documents")
+
+    def knowledge_base(self, knowledge_base_id):
+        """Remove os chunks e os documentos da base em lotes e depois a base."""
+        last_id = MIN_UUID
+        while True:
+            rows = self._batch(DELETE_BASE_CHUNKS, (knowledge_base_id, last_id, self.batch_size), "base_chunks")
+            if not rows:
+                break
+            last_id = max(str(row[0]) for row in rows)
+        while self._batch(DELETE_BASE_DOCUMENTS, (knowledge_base_id, self.batch_size), "documents"):
+            pass
+        self._batch("DELETE FROM knowledge_bases WHERE id = %s AND deleted_at IS NOT NULL", (knowledge_base_id,),
+                    "knowledge_bases")
+
+    def _marked(self, table):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(f"SELECT id FROM {table} WHERE deleted_at IS NOT NULL ORDER BY deleted_at")
+            return [str(row[0]) for row in cur.fetchall()]
+
+    def sweep(self) -> SweepResult:
+        """Uma passada completa (ou até `max_seconds`)."""
+        complete = True
+        try:
+            self.abandoned_ingests()
+            self.expired_chunks()
+            for document_id in self._marked("documents"):
+                self.document(document_id)
+            for knowledge_base_id in self._marked("knowledge_bases"):
+                self.knowledge_base(knowledge_base_id)
+        except _Deadline:
+            logger.info("Tempo da varredura esgotado; a próxima passada continua a remoção.")
+            complete = False
+        return SweepResult(**{field: self.removed[field] for field in SweepResult._fields[:-1]}, complete=complete)
+
+
+def maintain(conn, reindex=False):
+    """VACUUM (ANALYZE) das tabelas de chunks e, opcionalmente, reconstrução dos índices ivfflat."""
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in ("knowledge_chunks", "knowledge_chunk_vectors"):
+                cur.execute(f"VACUUM (ANALYZE) {table}")
+            if reindex:
+                for index in VECTOR_INDEXES:
+                    cur.execute("SELECT to_regclass(%s)", (index,))
+                    if cur.fetchone()[0] is not None:
+                        cur.execute(f"REINDEX INDEX CONCURRENTLY {index}")
+    finally:
+        conn.autocommit = autocommit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=DEFAULT_PAUSE_SECONDS, help="Segundos entre lotes.")
+    parser.add_argument("--max-seconds", type=float, help="Para após este tempo; a próxima execução continua.")
+    parser.add_argument("--vacuum-threshold", type=int, default=DEFAULT_VACUUM_THRESHOLD,
+                        help="Faz VACUUM (ANALYZE) se ao menos estas linhas foram removidas.")
+    parser.add_argument("--reindex", action="store_true", help="Reconstrói os índices ivfflat após o VACUUM.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    dsn = os.environ.get("NEON_DB_CONNECTION_STRING")
+    if not dsn:
+        raise SystemExit("Defina NEON_DB_CONNECTION_STRING.")
+
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        result = Sweeper(conn, args.batch_size, args.pause, args.max_seconds).sweep()
+        maintained = result.deleted_rows >= args.vacuum_threshold
+        if maintained:
+            maintain(conn, args.reindex)
+    finally:
+        conn.close()
+    print(json.dumps({**result._asdict(), "maintained": maintained}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Exportação, importação e clonagem de bases de conhecimento sem re-embedding.
+
+Formato do arquivo (versão 2):
+
+  * `MAGIC` seguido de um cabeçalho JSON prefixado pelo tamanho (uint32 big-endian)
+    com a versão do formato, a base de origem e as colunas de cada seção;
+  * uma seção por tabela (`documents`, depois `knowledge_chunks`), cada uma com o
+    fluxo de `COPY ... TO STDOUT (FORMAT binary)` dividido em frames
+    `[uint32 tamanho][dados]` e terminado por um frame vazio.
+
+A versão 2 acrescenta `expires_at` aos chunks, para que chunks com TTL continuem
+expirando no destino. Arquivos da versão 1 ainda são lidos; seus chunks não expiram.
+
+Exportação e importação são em fluxo: o COPY escreve/lê o arquivo em blocos, então
+a memória usada não depende do tamanho da base. Arquivos terminados em `.gz` são
+comprimidos com gzip. Na importação, os dados passam por tabelas temporárias e os
+ids são regenerados, então o mesmo arquivo pode ser importado várias vezes, cada vez
+em uma base nova. Com `--kb`, a base de destino precisa estar vazia: documentos com
+o mesmo `external_id` violariam o índice único, e não há política de mesclagem.
+
+Uso (a partir da raiz do repositório):
+    NEON_DB_CONNECTION_STRING=postgresql://... python -m src.common.transfer export <kb> base.cortexa.gz
+    NEON_DB_CONNECTION_STRING=postgresql://... python -m src.common.transfer import base.cortexa.gz [--kb <kb>]
+    NEON_DB_CONNECTION_STRING=postgresql://... python -m src.common.transfer clone <kb> --name "Staging"
+"""
+import argparse
+import gzip
+import json
+import os
+import struct
+from typing import NamedTuple, Optional
+
+from src.common.embedding_config import DEFAULT_MODEL, EmbeddingConfig, read_embedding_config
+from src.common.sweeper import MARKED_DOCUMENTS, visible_chunks
+from src.common.vectors import EMBEDDING_DIMENSIONS
+
+MAGIC = b"CORTEXA-KB\n"
+FORMAT_VERSION = 2
+# Tamanho dos frames gravados: o COPY entrega uma mensagem por linha, agrupadas aqui
+FRAME_BYTES = 1024 * 1024
+
+_LENGTH = struct.Struct(">I")
+
+# Colunas transferidas; ids e knowledge_base_id são regenerados no destino
+DOCUMENT_COLUMNS = ("id", "external_id", "version", "chunk_count", "created_at", "updated_at")
+CHUNK_COLUMNS = ("content", "embedding", "metadata", "created_at", "document_id", "ordinal", "content_hash",
+                 "expires_at")
+# Colunas dos chunks de cada versão lida; as que faltam ficam NULL na importação
+READABLE_CHUNK_COLUMNS = {1: CHUNK_COLUMNS[:-1], 2: CHUNK_COLUMNS}
+# Só o que as buscas veem é copiado: documentos marcados ou de ingestões ainda pendentes
+# e chunks expirados ou desses documentos ficam de fora
+LIVE_ROWS = {
+    "documents": f"id NOT IN ({MARKED_DOCUMENTS})",
+    "knowledge_chunks": visible_chunks(),
+}
+
+
+class TransferFormatError(Exception):
+    """O arquivo não é uma exportação válida ou é de uma versão não suportada."""
+
+
+class TransferResult(NamedTuple):
+    knowledge_base_id: str
+    documents: int
+    chunks: int
+
+
+class FrameWriter:
+    """Objeto tipo arquivo que agrupa as escritas do COPY em frames com tamanho."""
+
+    def __init__(self, out, frame_bytes=FRAME_BYTES):
+        self._out = out
+        self._frame_bytes = frame_bytes
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self._frame_bytes:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._out.write(_LENGTH.pack(len(self._buffer)))
+            self._out.write(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self):
+        """Grava o que restou e o frame vazio que encerra a seção."""
+        self.flush()
+        self._out.write(_LENGTH.pack(0))
+
+
+class FrameReader:
+    """Objeto tipo arquivo que lê uma seção de frames até o frame vazio."""
+
+    def __init__(self, source):
+        self._source = source
+        self._remaining = 0
+        self._done = False
+
+    def _read_exact(self, size):
+        data = self._source.read(size)
+        if len(data) != size:
+            raise TransferFormatError("Arquivo de exportação truncado.")
+        return data
+
+    def read(self, size=-1):
+        if self._done:
+            return b""
+        if self._remaining == 0:
+            self._remaining = _LENGTH.unpack(self._read_exact(_LENGTH.size))[0]
+            if self._remaining == 0:
+                self._done = True
+                return b""
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        self._remaining -= size
+        return self._read_exact(size)
+
+    def drain(self):
+        """Consome o restante da seção (o COPY pode parar antes do frame vazio)."""
+        while self.read(FRAME_BYTES):
+            pass
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, compresslevel=6)
+    return open(path, mode)
+
+
+def _column_list(columns):
+    return ", ".join(columns)
+
+
+def write_header(out, header):
+    data = json.dumps(header, sort_keys=True).encode("utf-8")
+    out.write(MAGIC)
+    out.write(_LENGTH.pack(len(data)))
+    out.write(data)
+
+
+def read_header(source):
+    if source.read(len(MAGIC)) != MAGIC:
+        raise TransferFormatError("O arquivo não é uma exportação do Cortexa.")
+    (length,) = _LENGTH.unpack(source.read(_LENGTH.size))
+    header = json.loads(source.read(length).decode("utf-8"))
+    if header.get("format_version") not in READABLE_CHUNK_COLUMNS:
+        raise TransferFormatError(f"Versão de formato não suportada: {header.get('format_version')}.")
+    if (tuple(header["documents"]["columns"]) != DOCUMENT_COLUMNS
+            or tuple(header["chunks"]["columns"]) != READABLE_CHUNK_COLUMNS[header["format_version"]]):
+        raise TransferFormatError("As colunas do arquivo não correspondem às deste formato.")
+    return header
+
+
+def _embedding_type(cur):
+    cur.execute("SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = 'knowledge_chunks'::regclass AND attname = 'embedding'")
+    return cur.fetchone()[0]
+
+
+def export_knowledge_base(conn, knowledge_base_id, out) -> TransferResult:
+    """
+    Grava a base em `out` (arquivo binário aberto para escrita).
+
+    Usa uma transação REPEATABLE READ para que documentos e chunks venham do mesmo
+    snapshot.
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        try:
+            cur.execute("SELECT name, user_id, embedding_model, embedding_dimensions FROM knowledge_bases "
+                        "WHERE id = %s AND deleted_at IS NULL", (knowledge_base_id,))
+            row = cur.fetchone()
+            if row is None:
+                raise ValueError(f"Base de conhecimento não encontrada ou marcada para remoção: {knowledge_base_id}")
+            write_header(out, {
+                "format_version": FORMAT_VERSION,
+                "knowledge_base": {"id": str(knowledge_base_id), "name": row[0], "user_id": str(row[1]),
+                                   "embedding_model": row[2], "embedding_dimensions": row[3]},
+                "embedding_type": _embedding_type(cur),
+                "documents": {"columns": list(DOCUMENT_COLUMNS)},
+                "chunks": {"columns": list(CHUNK_COLUMNS)},
+            })
+
+            counts = []
+            for table, columns in (("documents", DOCUMENT_COLUMNS), ("knowledge_chunks", CHUNK_COLUMNS)):
+                writer = FrameWriter(out)
+                sql = cur.mogrify(
+                    f"COPY (SELECT {_column_list(columns)} FROM {table} "
+                    f"WHERE knowledge_base_id = %s AND {LIVE_ROWS[table]}) TO STDOUT (FORMAT binary)",
+                    (knowledge_base_id,),
+                ).decode("utf-8")
+                cur.copy_expert(sql, writer)
+                writer.close()
+                counts.append(cur.rowcount)
+        finally:
+            cur.execute("COMMIT")
+            conn.autocommit = autocommit
+    return TransferResult(str(knowledge_base_id), counts[0], counts[1])
+
+
+def _check_same_model(cur, source_kb, knowledge_base_id):
+    """Vetores de modelos diferentes não são comparáveis: o destino precisa usar o mesmo modelo."""
+    config = read_embedding_config(cur, knowledge_base_id)
+    if config is None:
+        raise ValueError(f"Base de conhecimento não encontrada: {knowledge_base_id}")
+    source = EmbeddingConfig(source_kb.get("embedding_model", DEFAULT_MODEL),
+                             source_kb.get("embedding_dimensions", EMBEDDING_DIMENSIONS))
+    if config != source:
+        raise TransferFormatError(f"O arquivo usa {source.model}; a base de destino usa {config.model}.")
+
+
+def _check_empty_target(cur, knowledge_base_id):
+    """A importação não mescla: documentos e chunks já presentes no destino a impedem."""
+    cur.execute(
+        "SELECT EXISTS (SELECT 1 FROM documents WHERE knowledge_base_id = %s AND deleted_at IS NULL) "
+        f"OR EXISTS (SELECT 1 FROM knowledge_chunks WHERE knowledge_base_id = %s AND {visible_chunks()})",
+        (knowledge_base_id, knowledge_base_id),
+    )
+    if cur.fetchone()[0]:
+        raise ValueError(f"A base de destino {knowledge_base_id} não está vazia; importe em uma base nova "
+                         "(sem --kb) ou em uma base sem documentos nem chunks.")
+
+
+def import_knowledge_base(conn, source, knowledge_base_id: Optional[str] = None) -> TransferResult:
+    """
+    Lê uma exportação de `source` para a base `knowledge_base_id`, que precisa estar
+    vazia, ou para uma base nova com o nome e o dono da origem. Tudo em uma transação.
+    """
+    header = read_header(source)
+    with conn.cursor() as cur:
+        embedding_type = _embedding_type(cur)
+        if header["embedding_type"] != embedding_type:
+            raise TransferFormatError(
+                f"Embeddings do arquivo ({header['embedding_type']}) incompatíveis com o destino ({embedding_type})."
+            )
+        if knowledge_base_id is None:
+            source_kb = header["knowledge_base"]
+            cur.execute(
+                "INSERT INTO knowledge_bases (name, user_id, embedding_model, embedding_dimensions) "
+                "VALUES (%s, %s, %s, %s) RETURNING id",
+                (source_kb["name"], source_kb["user_id"],
+                 source_kb.get("embedding_model", DEFAULT_MODEL),
+                 source_kb.get("embedding_dimensions", EMBEDDING_DIMENSIONS)),
+            )
+            knowledge_base_id = cur.fetchone()[0]
+        else:
+            _check_same_model(cur, header["knowledge_base"], knowledge_base_id)
+            _check_empty_target(cur, knowledge_base_id)
+
+        # Tabelas temporárias com os tipos exatos das colunas exportadas
+        cur.execute(f"CREATE TEMP TABLE import_documents ON COMMIT DROP AS "
+                    f"SELECT {_column_list(DOCUMENT_COLUMNS)} FROM documents WITH NO DATA")
+        cur.execute(f"CREATE TEMP TABLE import_chunks ON COMMIT DROP AS "
+                    f"SELECT {_column_list(CHUNK_COLUMNS)} FROM knowledge_chunks WITH NO DATA")
+        for table, columns in (("import_documents", DOCUMENT_COLUMNS), ("import_chunks", header["chunks"]["columns"])):
+            reader = FrameReader(source)
+            cur.copy_expert(f"COPY {table} ({_column_list(columns)}) FROM STDIN (FORMAT binary)", reader)
+            reader.drain()
+
+        result = _copy_rows(cur, "import_documents", "import_chunks", knowledge_base_id)
+    conn.commit()
+    return result
+
+
+def _copy_rows(cur, documents_source, chunks_source, knowledge_base_id) -> TransferResult:
+    """
+    Insere documentos e chunks na base, religando os chunks aos novos ids de documento.
+
+    `documents_source` e `chunks_source` são tabelas ou subconsultas com as colunas
+    de DOCUMENT_COLUMNS e CHUNK_COLUMNS.
+    """
+    cur.execute(
+        f"""
+        INSERT INTO documents (knowledge_base_id, external_id, version, chunk_count, created_at, updated_at)
+        SELECT %s, external_id, version, chunk_count, created_at, updated_at FROM {documents_source} AS d
+        """,
+        (knowledge_base_id,),
+    )
+    documents = cur.rowcount
+    cur.execute(
+        f"""
+        INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, metadata, created_at,
+                                      document_id, ordinal, content_hash, expires_at)
+        SELECT %s, c.content, c.embedding, c.metadata, c.created_at, nd.id, c.ordinal, c.content_hash, c.expires_at
+        FROM {chunks_source} c
+        LEFT JOIN {documents_source} od ON od.id = c.document_id
+        LEFT JOIN documents nd ON nd.knowledge_base_id = %s AND nd.external_id = od.external_id
+                               AND nd.deleted_at IS NULL
+        """,
+        (knowledge_base_id, knowledge_base_id),
+    )
+    return TransferResult(str(knowledge_base_id), documents, cur.rowcount)
+
+
+def clone_knowledge_base(conn, knowledge_base_id, name=None) -> TransferResult:
+    """
+    Copia a base para uma nova no próprio servidor (INSERT ... SELECT), sem chamar a
+    API de embeddings e sem trafegar os vetores pelo cliente.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO knowledge_bases (name, user_id, embedding_model, embedding_dimensions) "
+            "SELECT COALESCE(%s, name || ' (cópia)'), user_id, embedding_model, embedding_dimensions "
+            "FROM knowledge_bases WHERE id = %s AND deleted_at IS NULL RETURNING id",
+            (name, knowledge_base_id),
+        )
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError(f"Base de conhecimento não encontrada ou marcada para remoção: {knowledge_base_id}")
+        documents = cur.mogrify(
+            f"(SELECT {_column_list(DOCUMENT_COLUMNS)} FROM documents "
+            f"WHERE knowledge_base_id = %s AND {LIVE_ROWS['documents']})",
+            (knowledge_base_id,),
+        ).decode("utf-8")
+        chunks = cur.mogrify(
+            f"(SELECT {_column_list(CHUNK_COLUMNS)} FROM knowledge_chunks "
+            f"WHERE knowledge_base_id = %s AND {LIVE_ROWS['knowledge_chunks']})",
+            (knowledge_base_id,),
+        ).decode("utf-8")
+        result = _copy_rows(cur, documents, chunks, row[0])
+    conn.commit()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export")
+    export.add_argument("kb")
+    export.add_argument("path")
+    load = commands.add_parser("import")
+    load.add_argument("path")
+    load.add_argument("--kb", help="Base de destino existente e vazia; sem ela, uma nova é criada.")
+    clone = commands.add_parser("clone")
+    clone.add_argument("kb")
+    clone.add_argument("--name")
+    args = parser.parse_args()
+
+    dsn = os.environ.get("NEON_DB_CONNECTION_STRING")
+    if not dsn:
+        raise SystemExit("Defina NEON_DB_CONNECTION_STRING.")
+
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        if args.command == "export":
+            conn.autocommit = True
+            with _open(args.path, "wb") as out:
+                result = export_knowledge_base(conn, args.kb, out)
+        elif args.command == "import":
+            with _open(args.path, "rb") as source:
+                result = import_knowledge_base(conn, source, args.kb)
+        else:
+            result = clone_knowledge_base(conn, args.kb, args.name)
+    finally:
+        conn.close()
+    print(json.dumps(result._asdict()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Representação compacta de embeddings em buffers float32.
+
+Um lote de embeddings vive em um único `array('f')` contíguo (n x dimensões),
+preenchido diretamente a partir do base64 retornado pela OpenAI
+(`encoding_format="base64"`). Cada linha é exposta como uma `memoryview`, sem
+listas intermediárias de floats Python (~50 KB por embedding de 1536 dimensões,
+contra 6 KB no buffer).
+"""
+import base64
+import sys
+from array import array
+
+# Dimensão do modelo text-embedding-3-small (coluna VECTOR(1536))
+EMBEDDING_DIMENSIONS = 1536
+
+# float32 com 9 dígitos significativos é reconstruído sem perdas pelo pg_vector
+_format_float = "{:.9g}".format
+
+
+class EmbeddingBatch:
+    """Matriz float32 pré-alocada com um embedding por linha."""
+
+    def __init__(self, rows, dimensions=EMBEDDING_DIMENSIONS):
+        self.rows = rows
+        self.dimensions = dimensions
+        self.data = array('f', bytes(4 * rows * dimensions))
+        self._view = memoryview(self.data)
+        self._bytes = self._view.cast('B')
+
+    def __len__(self):
+        return self.rows
+
+    def set_row_base64(self, index, encoded):
+        """Decodifica um embedding em base64 (float32 little-endian) direto na linha."""
+        raw = base64.b64decode(encoded)
+        row_size = 4 * self.dimensions
+        if len(raw) != row_size:
+            raise ValueError(f"Embedding com {len(raw) // 4} dimensões; esperado {self.dimensions}.")
+        start = index * row_size
+        self._bytes[start:start + row_size] = raw
+        if sys.byteorder == "big":
+            # Raro (a Lambda roda em x86_64/arm64), mas o formato da OpenAI é little-endian.
+            row = array('f', raw)
+            row.byteswap()
+            self._view[index * self.dimensions:(index + 1) * self.dimensions] = row
+
+    def set_row(self, index, values):
+        """Copia um embedding já decodificado (ex.: lista de floats) para a linha."""
+        if len(values) != self.dimensions:
+            raise ValueError(f"Embedding com {len(values)} dimensões; esperado {self.dimensions}.")
+        start = index * self.dimensions
+        self._view[start:start + self.dimensions] = array('f', values)
+
+    def row(self, index):
+        """Retorna a linha como uma `memoryview` float32, sem cópia."""
+        start = index * self.dimensions
+        return self._view[start:start + self.dimensions]
+
+    def vector(self, index):
+        """Retorna a linha pronta para ser usada como parâmetro SQL."""
+        return PgVector(self.row(index))
+
+
+class PgVector:
+    """
+    Parâmetro SQL para uma coluna `vector` do pg_vector.
+
+    Implementa o protocolo de adaptação do psycopg2 (`__conform__`/`getquoted`),
+    gerando o literal '[...]'::vector diretamente do buffer float32 no momento da
+    execução, sem converter o embedding para lista.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __conform__(self, protocol):
+        return self
+
+    def getquoted(self):
+        return ("'[" + ",".join(map(_format_float, self.values)) + "]'::vector").encode("ascii")
@@ -0,0 +1,79 @@
+"""
+Pré-aquecimento durante a fase de init da Lambda.
+
+O init roda com CPU em boost e fora do tempo cobrado da primeira invocação, então
+é o melhor momento para importar dependências pesadas, criar clientes e abrir
+conexões. O pré-aquecimento roda em uma thread com tempo limite: se demorar ou
+falhar, o init segue normalmente e o handler completa o trabalho sob demanda.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger()
+
+# Tempo máximo que o init espera pelo pré-aquecimento (o init da Lambda tem limite de 10 s)
+DEFAULT_WARMUP_TIMEOUT_SECONDS = 3.0
+
+
+class InitWarmup:
+    """Executa uma função de pré-aquecimento em background com tempo limite."""
+
+    def __init__(self, fn, timeout_seconds=DEFAULT_WARMUP_TIMEOUT_SECONDS):
+        self.fn = fn
+        self.timeout_seconds = timeout_seconds
+        self.elapsed_ms = None
+        self._thread = None
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.fn()
+        except Exception as e:
+            logger.warning(f"Pré-aquecimento falhou, seguindo sob demanda: {e}")
+        finally:
+            self.elapsed_ms = (time.perf_counter() - start) * 1000
+
+    def start(self):
+        """Inicia o pré-aquecimento e aguarda no máximo `timeout_seconds`."""
+        self._thread = threading.Thread(target=self._run, name="init-warmup", daemon=True)
+        self._thread.start()
+        self._thread.join(self.timeout_seconds)
+        if self._thread.is_alive():
+            logger.warning(f"Pré-aquecimento excedeu {self.timeout_seconds}s; o init continuará sem esperar.")
+        else:
+            logger.info(f"Pré-aquecimento concluído em {self.elapsed_ms:.0f} ms.")
+        return self
+
+    def wait(self):
+        """
+        Garante que o pré-aquecimento terminou antes de o handler usar o estado global.
+
+        Só bloqueia se o init tiver excedido o tempo limite; as operações pré-aquecidas
+        têm timeouts próprios (ex.: connect_timeout do banco).
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+
+
+class _NoWarmup:
+    elapsed_ms = None
+
+    def wait(self):
+        pass
+
+
+def start_init_warmup(fn):
+    """
+    Dispara o pré-aquecimento se o módulo estiver sendo carregado no init de uma Lambda.
+
+    Fora da Lambda (testes, scripts) ou com CORTEXA_INIT_WARMUP=false, não faz nada.
+    O tempo limite é configurável por INIT_WARMUP_TIMEOUT_SECONDS.
+    """
+    if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        return _NoWarmup()
+    if os.environ.get("CORTEXA_INIT_WARMUP", "true").lower() in ("0", "false", "no"):
+        return _NoWarmup()
+    timeout = float(os.environ.get("INIT_WARMUP_TIMEOUT_SECONDS", DEFAULT_WARMUP_TIMEOUT_SECONDS))
+    return InitWarmup(fn, timeout).start()
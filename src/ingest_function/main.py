@@ -1,9 +1,65 @@
+import functools
 import json
 import logging
 import os
-import boto3
-import psycopg2
-from psycopg2.extras import execute_batch
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from src.common import batch, compression, metrics, profiling
+from src.common.admission import admission_from_env, shed_response
+from src.common.chunking import (
+    DEFAULT_MAX_TOKENS,
+    DEFAULT_OVERLAP_TOKENS,
+    get_tokenizer,
+    iter_chunks,
+    iter_section_chunks,
+    pack_batches,
+)
+from src.common.db import (
+    DatabaseConnectionError,
+    PreparedStatement,
+    ThreadLocalConnections,
+    connection_manager_from_env,
+)
+from src.common.dedup import NEAR_DUPLICATES, near_duplicates, threshold_from_env, unique_texts, validate_threshold
+from src.common.documents import (
+    MAX_EXTERNAL_ID_LENGTH,
+    MAX_WRITE_ATTEMPTS,
+    DocumentVersionConflict,
+    MissingVectors,
+    PendingDocumentExpired,
+    abandon_pending_document,
+    complete_pending_document,
+    create_pending_document,
+    diff_chunks,
+    document_chunks,
+    extend_pending_document,
+    hash_chunk,
+    insert_document_chunks,
+    read_document_chunks,
+    read_documents_chunks,
+    write_document,
+)
+from src.common.embedding_config import (
+    DEFAULT_CONFIG,
+    EmbeddingModelChanged,
+    KnowledgeBaseNotFound,
+    check_embedding_config,
+    config_cache_from_env,
+    is_uuid,
+    read_embedding_config,
+)
+from src.common.sources import (
+    SourceFormatError,
+    UnsupportedFormat,
+    create_s3_client,
+    detect_format,
+    head_object,
+    iter_sections,
+)
+from src.common.sweeper import mark_document, mark_knowledge_base
+from src.common.vectors import EmbeddingBatch
+from src.common.warmup import start_init_warmup
 
 # Configuração do logger
 logger = logging.getLogger()
@@ -13,11 +69,54 @@ logger.setLevel(logging.INFO)
 NEON_DB_CONNECTION_STRING = None
 OPENAI_PROXY_LAMBDA_ARN = None
 LAMBDA_CLIENT = None
-DB_CONNECTION = None
+DB = None
+COUNT_TOKENS = None
+# Cliente S3 da ingestão de arquivos (`source`), criado no primeiro uso
+S3_CLIENT = None
+CHUNK_MAX_TOKENS = DEFAULT_MAX_TOKENS
+CHUNK_OVERLAP_TOKENS = DEFAULT_OVERLAP_TOKENS
+# Modelo de embeddings de cada base, com expiração
+EMBEDDING_CONFIGS = config_cache_from_env(os.environ)
+# Limites de ingestões simultâneas e por segundo de cada base (desligados por padrão)
+ADMISSION = admission_from_env(os.environ, "ingest")
+# Limiar padrão de supressão de quase duplicados (similaridade de cosseno); vazio desliga
+INGEST_DEDUP_THRESHOLD = threshold_from_env(os.environ)
+
+INSERT_CHUNK = PreparedStatement(
+    "cortexa_insert_chunk",
+    ("uuid", "text", "vector"),
+    "INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES ($1, $2, $3)"
+)
+
+# Chunks com TTL (`ttlSeconds`): removidos pelo varredor depois de `expires_at`
+INSERT_CHUNK_EXPIRING = PreparedStatement(
+    "cortexa_insert_chunk_expiring",
+    ("uuid", "text", "vector", "float8"),
+    "INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, expires_at) "
+    "VALUES ($1, $2, $3, NOW() + make_interval(secs => $4))"
+)
 
-def _initialize():
-    """Inicializa as variáveis de ambiente e clientes."""
-    global NEON_DB_CONNECTION_STRING, OPENAI_PROXY_LAMBDA_ARN, LAMBDA_CLIENT
+# Chunks de um arquivo, ligados ao documento pendente da ingestão. A expiração ($8) é
+# absoluta, a mesma em todos os lotes, e opcional: nula, o chunk não expira
+INSERT_SOURCE_CHUNK = PreparedStatement(
+    "cortexa_insert_source_chunk",
+    ("uuid", "text", "vector", "jsonb", "uuid", "integer", "text", "timestamptz"),
+    "INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, metadata, document_id, ordinal, "
+    "content_hash, expires_at) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)"
+)
+
+# Prazo, renovado a cada lote, de uma ingestão de arquivo; vencido, o varredor a descarta
+SOURCE_PENDING_SECONDS = float(os.environ.get("SOURCE_PENDING_SECONDS", "900"))
+
+def _initialize(lambda_client=None, thread_local_db=False):
+    """
+    Inicializa as variáveis de ambiente e clientes.
+
+    O modo servidor (`src.server.main`) injeta um cliente que chama o proxy no próprio
+    processo e pede uma conexão por thread do pool de execução.
+    """
+    global NEON_DB_CONNECTION_STRING, OPENAI_PROXY_LAMBDA_ARN, LAMBDA_CLIENT, DB
+    global COUNT_TOKENS, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
     if LAMBDA_CLIENT is None:
         logger.info("Inicializando clientes e variáveis de ambiente.")
         NEON_DB_CONNECTION_STRING = os.environ.get("NEON_DB_CONNECTION_STRING")
@@ -25,23 +124,37 @@ def _initialize():
         if not NEON_DB_CONNECTION_STRING or not OPENAI_PROXY_LAMBDA_ARN:
             logger.error("Variáveis de ambiente NEON_DB_CONNECTION_STRING ou OPENAI_PROXY_LAMBDA_ARN não definidas.")
             return False
-        LAMBDA_CLIENT = boto3.client('lambda')
+        # Tokenizador plugável: "approx" (padrão, sem dependências) ou "tiktoken:cl100k_base"
+        COUNT_TOKENS = get_tokenizer(os.environ.get("CHUNK_TOKENIZER"))
+        CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", DEFAULT_MAX_TOKENS))
+        CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", DEFAULT_OVERLAP_TOKENS))
+        # Escritas sempre no primário; NEON_DB_READ_CONNECTION_STRING é só para consultas
+        if thread_local_db:
+            DB = ThreadLocalConnections(lambda: connection_manager_from_env(os.environ, NEON_DB_CONNECTION_STRING))
+        else:
+            DB = connection_manager_from_env(os.environ, NEON_DB_CONNECTION_STRING)
+        if lambda_client is None:
+            # botocore diretamente: mesmo cliente do boto3.client('lambda'), com import mais leve
+            import botocore.session
+            lambda_client = botocore.session.get_session().create_client('lambda')
+        LAMBDA_CLIENT = lambda_client
     return True
 
 def _get_db_connection():
-    """Estabelece e cacheia a conexão com o banco de dados."""
-    global DB_CONNECTION
-    if DB_CONNECTION is None or DB_CONNECTION.closed != 0:
-        logger.info("Conectando ao banco de dados Neon.")
-        try:
-            DB_CONNECTION = psycopg2.connect(NEON_DB_CONNECTION_STRING)
-        except psycopg2.Error as e:
-            logger.error(f"Não foi possível conectar ao banco de dados: {e}")
-            return None
-    return DB_CONNECTION
+    """Retorna a conexão cacheada com o banco de dados, testada e reconectada se necessário."""
+    try:
+        return DB.get()
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return None
 
 def chunk_text(text, chunk_size=512, chunk_overlap=50):
-    """Divide um texto em chunks com sobreposição."""
+    """
+    Divide um texto em janelas fixas de caracteres com sobreposição.
+
+    Mantida como referência para benchmarks; a ingestão usa `iter_chunks`,
+    que respeita sentenças e limita os chunks por tokens.
+    """
     if not isinstance(text, str):
         return []
 
@@ -56,12 +169,12 @@ def chunk_text(text, chunk_size=512, chunk_overlap=50):
             break
     return [c for c in chunks if c]
 
-def get_embedding(text_chunk, lambda_client, proxy_arn):
+def get_embedding(text_chunk, lambda_client, proxy_arn, config=DEFAULT_CONFIG):
     """Invoca a Lambda de proxy para obter o embedding."""
     payload = {
         "body": json.dumps({
             "input": text_chunk,
-            "model": "text-embedding-3-small"
+            **config.request_fields()
         })
     }
     response = lambda_client.invoke(
@@ -79,69 +192,765 @@ def get_embedding(text_chunk, lambda_client, proxy_arn):
     # A API da OpenAI retorna uma lista de embeddings, pegamos o primeiro.
     return embedding_body['data'][0]['embedding']
 
+def get_embeddings(text_chunks, lambda_client, proxy_arn, config=DEFAULT_CONFIG):
+    """
+    Invoca a Lambda de proxy uma única vez para vetorizar um lote de chunks.
+
+    Os embeddings são pedidos em base64 e decodificados direto para um
+    `EmbeddingBatch` (float32 contíguo), sem listas de floats intermediárias.
+    """
+    payload = {
+        "body": json.dumps({
+            "input": text_chunks,
+            **config.request_fields(),
+            "encoding_format": "base64"
+        })
+    }
+    response = lambda_client.invoke(
+        FunctionName=proxy_arn,
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload)
+    )
+    response_payload = json.loads(response['Payload'].read().decode('utf-8'))
+
+    if response_payload.get("statusCode") != 200:
+        logger.error(f"Proxy retornou erro: {response_payload.get('body')}")
+        raise Exception(f"Failed to get embeddings: {response_payload.get('body')}")
+
+    data = json.loads(response_payload["body"])['data']
+    if len(data) != len(text_chunks):
+        raise Exception(f"Failed to get embeddings: esperados {len(text_chunks)}, recebidos {len(data)}")
+
+    batch = EmbeddingBatch(len(data))
+    for position, item in enumerate(data):
+        # A OpenAI informa a posição de cada embedding no lote em 'index'.
+        index = item.get('index', position)
+        embedding = item['embedding']
+        if isinstance(embedding, str):
+            batch.set_row_base64(index, embedding)
+        else:
+            batch.set_row(index, embedding)
+    return batch
+
+@metrics.instrumented("ingest_function")
+@compression.negotiated
+@profiling.profiled("ingest_function")
 def lambda_handler(event, context):
     """
     Lambda para ingerir texto, gerar embeddings e armazenar no Neon DB.
     """
+    WARMUP.wait()
     if not _initialize():
         return {"statusCode": 500, "body": json.dumps({"error": "Erro de configuração do servidor."})}
+    if event.get("httpMethod") == "DELETE":
+        return _delete_request(event)
+    if batch.is_batch(event):
+        return _batch_request(event)
+
+    with metrics.phase("parse"):
+        try:
+            raw_body = event.get("body", "{}")
+            metrics.count("request_bytes", len(raw_body or ""), "Bytes")
+            body = json.loads(raw_body)
+            knowledge_base_id = body.get("knowledgeBaseId")
+            text = body.get("text")
+            source = body.get("source")
+            document_id = body.get("documentId")
+            version = body.get("version")
+            dedup_threshold = body.get("dedupThreshold")
+            ttl_seconds = body.get("ttlSeconds")
+            if dedup_threshold is None and INGEST_DEDUP_THRESHOLD is not None and document_id is None:
+                dedup_threshold = INGEST_DEDUP_THRESHOLD
+            if not knowledge_base_id:
+                return {"statusCode": 400, "body": json.dumps({"error": "O campo 'knowledgeBaseId' é obrigatório."})}
+            if source is not None:
+                error = _source_error(source, text, document_id)
+                if error:
+                    return {"statusCode": 400, "body": json.dumps({"error": error})}
+            elif not text:
+                return {"statusCode": 400, "body": json.dumps({"error": "O campo 'text' é obrigatório."})}
+            if document_id is not None and (not isinstance(document_id, str) or not document_id
+                                            or len(document_id) > MAX_EXTERNAL_ID_LENGTH):
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": f"O campo 'documentId' deve ser um texto de até {MAX_EXTERNAL_ID_LENGTH} caracteres."})}
+            if version is not None and (document_id is None or not isinstance(version, int)
+                                        or isinstance(version, bool) or version < 1):
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": "O campo 'version' deve ser um inteiro positivo e exige 'documentId'."})}
+            if dedup_threshold is not None and (document_id is not None or not validate_threshold(dedup_threshold)):
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": "O campo 'dedupThreshold' deve estar entre 0 e 1 e não se aplica a 'documentId'."})}
+            if ttl_seconds is not None and (document_id is not None or not isinstance(ttl_seconds, (int, float))
+                                            or isinstance(ttl_seconds, bool) or not ttl_seconds > 0):
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": "O campo 'ttlSeconds' deve ser um número positivo e não se aplica a 'documentId'."})}
+        except (json.JSONDecodeError, AttributeError):
+            return {"statusCode": 400, "body": json.dumps({"error": "Corpo da requisição inválido."})}
+
+    metrics.set_tenant(knowledge_base_id)
+    logger.info(f"Iniciando ingestão para a base de conhecimento: {knowledge_base_id}")
 
+    # Bases inexistentes são recusadas pelo cache, antes da admissão e de qualquer embedding
+    config, error = _embedding_config(knowledge_base_id)
+    if error:
+        return error
+    admission = ADMISSION.admit(_run_and_commit, knowledge_base_id)
+    if not admission.admitted:
+        return shed_response(admission)
     try:
-        body = json.loads(event.get("body", "{}"))
-        knowledge_base_id = body.get("knowledgeBaseId")
-        text = body.get("text")
+        if source is not None:
+            return _ingest_source(knowledge_base_id, source, config, dedup_threshold, ttl_seconds)
+        if document_id is not None:
+            return _ingest_document(knowledge_base_id, document_id, version, text, config)
+        return _ingest_text(knowledge_base_id, text, config, dedup_threshold, ttl_seconds)
+    finally:
+        ADMISSION.release(_run_and_commit, admission)
+
+def _run_and_commit(fn):
+    return DB.run(fn, commit=True)
+
+def _delete_request(event):
+    """
+    Marca uma base (ou, com `documentId`, um documento dela) para remoção. Os dados
+    são apagados em lotes pelo varredor (`src.common.sweeper`).
+    """
+    import psycopg2
+
+    with metrics.phase("parse"):
+        try:
+            body = json.loads(event.get("body") or "{}")
+            knowledge_base_id = body.get("knowledgeBaseId")
+            document_id = body.get("documentId")
+        except (json.JSONDecodeError, AttributeError):
+            return {"statusCode": 400, "body": json.dumps({"error": "Corpo da requisição inválido."})}
         if not knowledge_base_id:
             return {"statusCode": 400, "body": json.dumps({"error": "O campo 'knowledgeBaseId' é obrigatório."})}
-        if not text:
-            return {"statusCode": 400, "body": json.dumps({"error": "O campo 'text' é obrigatório."})}
-    except (json.JSONDecodeError, AttributeError):
-        return {"statusCode": 400, "body": json.dumps({"error": "Corpo da requisição inválido."})}
+        if document_id is not None and (not isinstance(document_id, str) or not document_id):
+            return {"statusCode": 400, "body": json.dumps({"error": "O campo 'documentId' deve ser um texto."})}
+        if not is_uuid(knowledge_base_id):
+            return {"statusCode": 404, "body": json.dumps({"error": "Base de conhecimento não encontrada."})}
 
-    logger.info(f"Iniciando ingestão para a base de conhecimento: {knowledge_base_id}")
+    metrics.set_tenant(knowledge_base_id)
+    try:
+        with metrics.phase("execute"):
+            if document_id is None:
+                marked = DB.run(lambda cur: mark_knowledge_base(cur, knowledge_base_id), commit=True)
+            else:
+                marked = DB.run(lambda cur: mark_document(cur, knowledge_base_id, document_id), commit=True)
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+    except psycopg2.Error as e:
+        logger.error(f"Erro de banco de dados: {e}")
+        return {"statusCode": 500, "body": json.dumps({"error": f"Database error: {e}"})}
 
-    text_chunks = chunk_text(text)
-    if not text_chunks:
-        return {"statusCode": 400, "body": json.dumps({"error": "Texto para ingestão está vazio ou inválido."})}
+    if not marked:
+        error = "Documento não encontrado." if document_id is not None else "Base de conhecimento não encontrada."
+        return {"statusCode": 404, "body": json.dumps({"error": error})}
+    if document_id is None:
+        EMBEDDING_CONFIGS.invalidate(knowledge_base_id)
+        logger.info(f"Base {knowledge_base_id} marcada para remoção.")
+    else:
+        logger.info(f"Documento {document_id} da base {knowledge_base_id} marcado para remoção.")
+
+    response = {"status": "scheduled", "knowledgeBaseId": knowledge_base_id}
+    if document_id is not None:
+        response["documentId"] = document_id
+    return {"statusCode": 202, "body": json.dumps(response)}
 
-    logger.info(f"Texto dividido em {len(text_chunks)} chunks.")
+def _source_error(source, text, document_id):
+    """Mensagem de erro de uma referência de arquivo inválida, ou None."""
+    if text is not None or document_id is not None:
+        return "O campo 'source' não pode ser combinado com 'text' nem com 'documentId'."
+    if (not isinstance(source, dict) or not isinstance(source.get("bucket"), str) or not source["bucket"]
+            or not isinstance(source.get("key"), str) or not source["key"]):
+        return "O campo 'source' deve ter 'bucket' e 'key'."
+    if source.get("format") is not None and not isinstance(source["format"], str):
+        return "O campo 'source.format' deve ser 'txt', 'pdf' ou 'docx'."
+    return None
+
+def _embedded_batches(knowledge_base_id, chunks, config, dedup_threshold=None, pending_document=None):
+    """
+    Vetoriza os chunks em lotes, sob demanda. Produz, por lote, os pares (chunk, vetor)
+    a inserir e quantos chunks do lote foram suprimidos como quase duplicados.
+    `pending_document` devolve o documento pendente que já guarda os lotes anteriores;
+    sem ele, os lotes só são gravados no fim e os vetores aceitos seguem na consulta.
+    """
+    seen_texts = set()
+    accepted = []
+    # O chunking é preguiçoso: seu tempo é medido a cada lote produzido, separado do embed.
+    for batch in metrics.timed("chunk", pack_batches(chunks)):
+        suppressed = 0
+        if dedup_threshold is not None:
+            unique = unique_texts(batch, seen_texts)
+            suppressed = len(batch) - len(unique)
+            batch = unique
+            if not batch:
+                yield [], suppressed
+                continue
+        with metrics.phase("embed"):
+            embeddings = get_embeddings([chunk.text for chunk in batch], LAMBDA_CLIENT, OPENAI_PROXY_LAMBDA_ARN,
+                                        config)
+        metrics.count("embed_batches")
+        duplicates = set()
+        if dedup_threshold is not None:
+            vectors = [embeddings.vector(i) for i in range(len(batch))]
+            with metrics.phase("dedup"):
+                duplicates = DB.run(lambda cur: near_duplicates(
+                    cur, DB.statement_sql(cur, NEAR_DUPLICATES), knowledge_base_id, vectors, dedup_threshold,
+                    pending_document() if pending_document else None, accepted))
+            suppressed += len(duplicates)
+            if pending_document is None:
+                accepted.extend(vector for i, vector in enumerate(vectors) if i not in duplicates)
+        # Cada par referencia a linha do buffer float32; nada é convertido até o INSERT.
+        yield [(chunk, embeddings.vector(i)) for i, chunk in enumerate(batch) if i not in duplicates], suppressed
+
+def _ingest_text(knowledge_base_id, text, config, dedup_threshold=None, ttl_seconds=None):
+    """
+    Ingestão sem documento: os chunks do texto são vetorizados e inseridos.
+
+    Com `dedup_threshold`, chunks quase duplicados (na requisição ou na base) são
+    descartados e contados em `suppressed` (ver `src.common.dedup`). Com `ttl_seconds`,
+    os chunks expiram e são removidos pelo varredor.
+    """
+    # Os chunks são gerados sob demanda e agrupados em lotes preenchidos até o limite de tokens.
+    text_chunks = iter_chunks(text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, COUNT_TOKENS)
 
     records_to_insert = []
+    total_tokens = 0
+    suppressed = 0
     try:
-        for chunk in text_chunks:
-            embedding = get_embedding(chunk, LAMBDA_CLIENT, OPENAI_PROXY_LAMBDA_ARN)
-            records_to_insert.append((knowledge_base_id, chunk, embedding))
+        for embedded, batch_suppressed in _embedded_batches(knowledge_base_id, text_chunks, config, dedup_threshold):
+            suppressed += batch_suppressed
+            for chunk, vector in embedded:
+                record = (knowledge_base_id, chunk.text, vector)
+                records_to_insert.append(record if ttl_seconds is None else (*record, ttl_seconds))
+                total_tokens += chunk.token_count
 
-        logger.info(f"Embeddings gerados para {len(records_to_insert)} chunks.")
+        logger.info(f"Embeddings gerados para {len(records_to_insert)} chunks (~{total_tokens} tokens).")
 
     except Exception as e:
         logger.error(f"Erro ao obter embeddings: {e}")
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
 
-    conn = _get_db_connection()
-    if not conn:
-        return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+    metrics.count("chunks", len(records_to_insert))
+    metrics.count("tokens", total_tokens)
+    if dedup_threshold is not None:
+        metrics.count("chunks_suppressed", suppressed)
+    if not records_to_insert and not suppressed:
+        return {"statusCode": 400, "body": json.dumps({"error": "Texto para ingestão está vazio ou inválido."})}
+
+    # Imports tardios: já carregados no pré-aquecimento do init; aqui custam só uma consulta ao sys.modules.
+    import psycopg2
+    from psycopg2.extras import execute_batch
+
+    statement = INSERT_CHUNK if ttl_seconds is None else INSERT_CHUNK_EXPIRING
+
+    def _insert(cur):
+        check_embedding_config(cur, knowledge_base_id, config)
+        execute_batch(cur, DB.statement_sql(cur, statement), records_to_insert)
 
     try:
-        with conn.cursor() as cur:
-            sql = "INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)"
-            execute_batch(cur, sql, records_to_insert)
-        conn.commit()
+        with metrics.phase("connect"):
+            DB.get()
+        # Conexão testada/reconectada pelo DB; a transação é confirmada ao final e desfeita em erro.
+        with metrics.phase("execute"):
+            if records_to_insert:
+                DB.run(_insert, commit=True)
         logger.info(f"Sucesso! {len(records_to_insert)} chunks inseridos no banco de dados.")
 
+    except EmbeddingModelChanged as e:
+        return _model_changed_response(knowledge_base_id, e)
+    except KnowledgeBaseNotFound as e:
+        return _removed_base_response(knowledge_base_id, e)
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
     except psycopg2.Error as e:
         logger.error(f"Erro de banco de dados: {e}")
-        if conn:
-            conn.rollback()
         return {"statusCode": 500, "body": json.dumps({"error": f"Database error: {e}"})}
 
-    finally:
-        # A conexão não é fechada aqui para permitir reutilização em 'warm' invocations.
-        pass
-
+    with metrics.phase("serialize"):
+        response = {
+            "status": "accepted",
+            "message": f"{len(records_to_insert)} chunks foram processados e agendados para inserção."
+        }
+        if dedup_threshold is not None:
+            response["suppressed"] = suppressed
+        response_body = json.dumps(response)
     return {
         "statusCode": 202,
-        "body": json.dumps({
+        "body": response_body
+    }
+
+def _s3_client():
+    global S3_CLIENT
+    if S3_CLIENT is None:
+        S3_CLIENT = create_s3_client(os.environ)
+    return S3_CLIENT
+
+def _ingest_source(knowledge_base_id, source, config, dedup_threshold=None, ttl_seconds=None):
+    """
+    Ingestão de um arquivo do armazenamento de objetos (TXT, PDF ou DOCX).
+
+    O texto é extraído e dividido em chunks sob demanda e cada lote é inserido (e
+    confirmado) logo após ser vetorizado, para que a memória não cresça com o arquivo.
+    Os chunks pertencem a um documento pendente (`external_id` = `ingestId`), oculto
+    das buscas até o último lote. Se a ingestão falhar, o documento é marcado para
+    remoção; se a função morrer no meio, o prazo do documento vence e o varredor o
+    descarta. Os chunks levam em `metadata` a origem e o `ingestId`.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+    from psycopg2.extras import execute_batch
+
+    try:
+        with metrics.phase("fetch"):
+            info = head_object(_s3_client(), source["bucket"], source["key"])
+        sections = iter_sections(_s3_client(), info, detect_format(info, source.get("format")))
+    except UnsupportedFormat as e:
+        return {"statusCode": 415, "body": json.dumps({"error": str(e)})}
+    except ClientError as e:
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        logger.error(f"Erro ao acessar s3://{source['bucket']}/{source['key']}: {e}")
+        if status in (403, 404):
+            return {"statusCode": status, "body": json.dumps(
+                {"error": "Arquivo não encontrado ou sem permissão de leitura."})}
+        return {"statusCode": 502, "body": json.dumps({"error": f"Erro ao acessar o arquivo: {e}"})}
+    except BotoCoreError as e:
+        logger.error(f"Erro ao acessar s3://{source['bucket']}/{source['key']}: {e}")
+        return {"statusCode": 502, "body": json.dumps({"error": f"Erro ao acessar o arquivo: {e}"})}
+
+    ingest_id = str(uuid.uuid4())
+    metadata = json.dumps({"source": info.uri, "ingestId": ingest_id})
+    # Calculada no início: cada lote tem sua transação, e NOW() nela daria a cada lote um prazo diferente
+    expires_at = None if ttl_seconds is None else datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+    chunks = iter_section_chunks(sections, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, COUNT_TOKENS)
+    logger.info(f"Ingerindo {info.uri} ({info.size} bytes) como {ingest_id}.")
+
+    def _insert(cur, document, embedded):
+        """Um lote na transação; o documento pendente é criado com o primeiro. Retorna o id do documento."""
+        check_embedding_config(cur, knowledge_base_id, config)
+        if document is None:
+            document = create_pending_document(cur, knowledge_base_id, ingest_id, SOURCE_PENDING_SECONDS)
+        else:
+            extend_pending_document(cur, document, SOURCE_PENDING_SECONDS)
+        records = [(knowledge_base_id, chunk.text, vector, metadata, document, chunk.index, hash_chunk(chunk.text),
+                    expires_at) for chunk, vector in embedded]
+        execute_batch(cur, DB.statement_sql(cur, INSERT_SOURCE_CHUNK), records)
+        return document
+
+    document = None
+    inserted = total_tokens = suppressed = 0
+    try:
+        batches = _embedded_batches(knowledge_base_id, chunks, config, dedup_threshold, lambda: document)
+        for embedded, batch_suppressed in batches:
+            suppressed += batch_suppressed
+            if embedded:
+                with metrics.phase("execute"):
+                    document = DB.run(lambda cur: _insert(cur, document, embedded), commit=True)
+            inserted += len(embedded)
+            total_tokens += sum(chunk.token_count for chunk, _ in embedded)
+        if document is not None:
+            with metrics.phase("execute"):
+                DB.run(lambda cur: complete_pending_document(cur, document, inserted), commit=True)
+    except Exception as e:
+        response = _source_failure_response(knowledge_base_id, info, e)
+        if document is not None:
+            _abandon_source_document(document, ingest_id)
+        return response
+
+    metrics.count("chunks", inserted)
+    metrics.count("tokens", total_tokens)
+    if dedup_threshold is not None:
+        metrics.count("chunks_suppressed", suppressed)
+    if not inserted and not suppressed:
+        return {"statusCode": 400, "body": json.dumps({"error": f"Nenhum texto extraído de {info.uri}."})}
+    logger.info(f"Sucesso! {inserted} chunks de {info.uri} inseridos (~{total_tokens} tokens).")
+
+    response = {
+        "status": "accepted",
+        "message": f"{inserted} chunks foram processados e inseridos.",
+        "source": info.uri,
+        "ingestId": ingest_id,
+        "chunks": inserted,
+    }
+    if dedup_threshold is not None:
+        response["suppressed"] = suppressed
+    return {"statusCode": 202, "body": json.dumps(response)}
+
+def _source_failure_response(knowledge_base_id, info, error):
+    """Resposta de uma falha no meio da leitura, vetorização ou inserção de um arquivo."""
+    import psycopg2
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    if isinstance(error, EmbeddingModelChanged):
+        return _model_changed_response(knowledge_base_id, error)
+    if isinstance(error, KnowledgeBaseNotFound):
+        return _removed_base_response(knowledge_base_id, error)
+    if isinstance(error, SourceFormatError):
+        return {"statusCode": 422, "body": json.dumps({"error": str(error)})}
+    if isinstance(error, PendingDocumentExpired):
+        logger.error(str(error))
+        return {"statusCode": 500, "body": json.dumps({"error": str(error)})}
+    if isinstance(error, (ClientError, BotoCoreError)):
+        logger.error(f"Erro ao ler {info.uri}: {error}")
+        return {"statusCode": 502, "body": json.dumps({"error": f"Erro ao ler o arquivo: {error}"})}
+    if isinstance(error, DatabaseConnectionError):
+        logger.error(str(error))
+        return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+    if isinstance(error, psycopg2.Error):
+        logger.error(f"Erro de banco de dados: {error}")
+        return {"statusCode": 500, "body": json.dumps({"error": f"Database error: {error}"})}
+    logger.error(f"Erro ao obter embeddings: {error}")
+    return {"statusCode": 500, "body": json.dumps({"error": str(error)})}
+
+def _abandon_source_document(document, ingest_id):
+    """Marca o documento de uma ingestão de arquivo que falhou; o varredor remove os chunks já confirmados."""
+    try:
+        DB.run(lambda cur: abandon_pending_document(cur, document), commit=True)
+        logger.info(f"Ingestão {ingest_id} descartada; seus chunks parciais serão removidos pelo varredor.")
+    except Exception as e:
+        logger.error(f"Não foi possível descartar a ingestão {ingest_id}; ela expira com o prazo: {e}")
+
+def _embedding_config(knowledge_base_id):
+    """Modelo de embeddings da base (em cache); retorna (config, resposta de erro)."""
+    import psycopg2
+
+    try:
+        config = EMBEDDING_CONFIGS.get(
+            knowledge_base_id, lambda: DB.run(lambda cur: read_embedding_config(cur, knowledge_base_id))
+        )
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return None, {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+    except psycopg2.Error as e:
+        logger.error(f"Erro de banco de dados: {e}")
+        return None, {"statusCode": 500, "body": json.dumps({"error": f"Database error: {e}"})}
+    if config is None:
+        return None, {"statusCode": 404, "body": json.dumps({"error": "Base de conhecimento não encontrada."})}
+    return config, None
+
+def _model_changed_response(knowledge_base_id, error):
+    """A base trocou de modelo durante a requisição: o cliente deve reenviar."""
+    logger.warning(str(error))
+    EMBEDDING_CONFIGS.invalidate(knowledge_base_id)
+    return {
+        "statusCode": 503,
+        "headers": {"Retry-After": "1"},
+        "body": json.dumps({"error": "A base de conhecimento trocou de modelo de embeddings; tente novamente."}),
+    }
+
+def _concurrent_change_response(error):
+    """Os documentos mudaram a cada tentativa de escrita (MAX_WRITE_ATTEMPTS): o cliente deve reenviar."""
+    logger.warning(f"{error} Desistindo após {MAX_WRITE_ATTEMPTS} tentativas de escrita.")
+    return {
+        "statusCode": 503,
+        "headers": {"Retry-After": "1"},
+        "body": json.dumps({"error": "O documento está sendo alterado por outra ingestão; tente novamente."}),
+    }
+
+def _removed_base_response(knowledge_base_id, error):
+    """A base foi marcada para remoção depois de entrar no cache: nada é gravado."""
+    logger.warning(str(error))
+    EMBEDDING_CONFIGS.invalidate(knowledge_base_id)
+    return {"statusCode": 404, "body": json.dumps({"error": "Base de conhecimento não encontrada."})}
+
+def _embed_document_chunks(chunks, config=DEFAULT_CONFIG):
+    """Vetoriza chunks de documento em lotes, uma vez por texto distinto; retorna hash -> vetor."""
+    unique = list({chunk.content_hash: chunk for chunk in chunks}.values())
+    vectors = {}
+    for batch in pack_batches(unique):
+        with metrics.phase("embed"):
+            embeddings = get_embeddings([chunk.text for chunk in batch], LAMBDA_CLIENT, OPENAI_PROXY_LAMBDA_ARN,
+                                        config)
+        metrics.count("embed_batches")
+        for i, chunk in enumerate(batch):
+            vectors[chunk.content_hash] = embeddings.vector(i)
+    return vectors
+
+def _write_documents(write, embed_missing):
+    """
+    Executa `write(cur)` em uma transação. Se ela desistir por `MissingVectors` (outro
+    processo alterou o documento depois da leitura), a transação já foi desfeita:
+    `embed_missing(chunks)` vetoriza os chunks sem nenhum lock e a escrita é repetida,
+    até MAX_WRITE_ATTEMPTS vezes.
+    """
+    for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+        try:
+            with metrics.phase("execute"):
+                return DB.run(write, commit=True)
+        except MissingVectors as e:
+            if attempt == MAX_WRITE_ATTEMPTS:
+                raise
+            logger.warning(f"Documento alterado durante a ingestão; vetorizando {len(e.chunks)} chunks e repetindo.")
+            metrics.count("document_write_retries")
+            embed_missing(e.chunks)
+
+def _ingest_document(knowledge_base_id, document_id, version, text, config=DEFAULT_CONFIG):
+    """
+    Ingestão (ou re-ingestão) de um documento identificado pelo cliente.
+
+    Só os chunks cujo hash não está armazenado são vetorizados; remoções, reordenações
+    e inserções são aplicadas em uma única transação.
+    """
+    import psycopg2
+
+    with metrics.phase("chunk"):
+        chunks = document_chunks(iter_chunks(text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, COUNT_TOKENS))
+    if not chunks:
+        return {"statusCode": 400, "body": json.dumps({"error": "Texto para ingestão está vazio ou inválido."})}
+
+    try:
+        with metrics.phase("connect"):
+            DB.get()
+        with metrics.phase("execute"):
+            stored = DB.run(lambda cur: read_document_chunks(cur, knowledge_base_id, document_id))
+        # Vetorização fora da transação: o documento só fica travado durante a escrita.
+        vectors = _embed_document_chunks(diff_chunks(stored, chunks).insert, config)
+        late = []
+
+        def _write(cur):
+            check_embedding_config(cur, knowledge_base_id, config)
+            return write_document(cur, knowledge_base_id, document_id, version, chunks, vectors)
+
+        def _embed_missing(missing):
+            vectors.update(_embed_document_chunks(missing, config))
+            late.extend(missing)
+
+        result = _write_documents(_write, _embed_missing)._replace(embedded_late=len(late))
+    except DocumentVersionConflict as e:
+        return {"statusCode": 409, "body": json.dumps({"error": str(e), "currentVersion": e.current})}
+    except EmbeddingModelChanged as e:
+        return _model_changed_response(knowledge_base_id, e)
+    except KnowledgeBaseNotFound as e:
+        return _removed_base_response(knowledge_base_id, e)
+    except MissingVectors as e:
+        return _concurrent_change_response(e)
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+    except psycopg2.Error as e:
+        logger.error(f"Erro de banco de dados: {e}")
+        return {"statusCode": 500, "body": json.dumps({"error": f"Database error: {e}"})}
+    except Exception as e:
+        logger.error(f"Erro ao obter embeddings: {e}")
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+    metrics.count("chunks", result.chunks)
+    metrics.count("chunks_embedded", result.inserted)
+    metrics.count("chunks_deleted", result.deleted)
+    logger.info(
+        f"Documento {document_id} na versão {result.version}: {result.inserted} chunks inseridos, "
+        f"{result.deleted} removidos, {result.reordered} reordenados, {result.unchanged} inalterados."
+    )
+    with metrics.phase("serialize"):
+        response_body = json.dumps({
             "status": "accepted",
-            "message": f"{len(records_to_insert)} chunks foram processados e agendados para inserção."
+            "message": f"{result.inserted} chunks foram processados e agendados para inserção.",
+            "documentId": document_id,
+            "version": result.version,
+            "chunks": result.chunks,
+            "inserted": result.inserted,
+            "deleted": result.deleted,
+            "reordered": result.reordered,
+            "unchanged": result.unchanged,
         })
-    }
+    return {"statusCode": 202, "body": response_body}
+
+def _batch_request(event):
+    """Valida um lote de documentos, confere as bases, admite cada uma (todas ou nenhuma) e o ingere."""
+    with metrics.phase("parse"):
+        raw_body = event.get("body") or ""
+        metrics.count("request_bytes", len(raw_body), "Bytes")
+        try:
+            records = batch.parse_batch(raw_body, batch.is_ndjson(event))
+        except batch.BatchFormatError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+        valid, invalid = batch.validate_batch(records)
+
+    results = [None] * len(records)
+    for index, record, error in invalid:
+        results[index] = _batch_result(index, record if isinstance(record, dict) else {}, 400, error=error)
+    logger.info(f"Iniciando ingestão em lote: {len(records)} documentos.")
+
+    # Bases inexistentes recebem 404 por documento, antes da admissão e de qualquer embedding
+    configs = {}
+    for kb in dict.fromkeys(record.knowledge_base_id for record in valid):
+        config, error = _embedding_config(kb)
+        if error and error["statusCode"] != 404:
+            return error
+        if config is not None:
+            configs[kb] = config
+    for record in valid:
+        if record.knowledge_base_id not in configs:
+            results[record.index] = _batch_result(record.index, record, 404,
+                                                  error="Base de conhecimento não encontrada.")
+
+    admissions = []
+    try:
+        for kb in configs:
+            admission = ADMISSION.admit(_run_and_commit, kb)
+            if not admission.admitted:
+                return shed_response(admission)
+            admissions.append(admission)
+        error = _ingest_batch([record for record in valid if record.knowledge_base_id in configs], configs, results)
+        if error:
+            return error
+    finally:
+        for admission in admissions:
+            ADMISSION.release(_run_and_commit, admission)
+
+    succeeded = sum(1 for result in results if result["statusCode"] == 202)
+    metrics.count("batch_documents", len(results))
+    logger.info(f"Lote processado: {succeeded} documentos ingeridos, {len(results) - succeeded} com erro.")
+    with metrics.phase("serialize"):
+        response_body = json.dumps({
+            "status": "accepted",
+            "documents": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results,
+        })
+    return {"statusCode": 202, "body": response_body}
+
+def _batch_result(index, record, status_code, **fields):
+    """Resultado de um documento do lote; `record` é o BatchRecord ou o objeto recebido."""
+    if isinstance(record, batch.BatchRecord):
+        knowledge_base_id, document_id = record.knowledge_base_id, record.document_id
+    else:
+        knowledge_base_id, document_id = record.get("knowledgeBaseId"), record.get("documentId")
+    return {"index": index, "knowledgeBaseId": knowledge_base_id, "documentId": document_id,
+            "statusCode": status_code, **fields}
+
+def _ingest_batch(records, configs, results):
+    """
+    Ingere os documentos válidos de um lote (`configs`: modelo de cada base), preenchendo
+    `results` por documento.
+
+    Os chunks de todos os documentos de um mesmo modelo são vetorizados juntos, em
+    lotes cheios, e a escrita é uma única transação: cada documento em seu SAVEPOINT
+    (um conflito de versão desfaz só aquele documento) e os chunks novos de todos em
+    uma inserção em massa ao final. Retorna uma resposta de erro se o lote inteiro falhar.
+    """
+    import psycopg2
+
+    by_base = {}
+    for record in records:
+        by_base.setdefault(record.knowledge_base_id, []).append(record)
+
+    chunked = {}
+    with metrics.phase("chunk"):
+        for kb in by_base:
+            for record in by_base[kb]:
+                chunks = document_chunks(iter_chunks(record.text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS,
+                                                     COUNT_TOKENS))
+                if chunks:
+                    chunked[record.index] = chunks
+                else:
+                    results[record.index] = _batch_result(record.index, record, 400,
+                                                          error="Texto para ingestão está vazio ou inválido.")
+    pending = {kb: [r for r in base_records if r.index in chunked] for kb, base_records in by_base.items()}
+    pending = {kb: base_records for kb, base_records in pending.items() if base_records}
+    if not pending:
+        return None
+
+    try:
+        with metrics.phase("connect"):
+            DB.get()
+        with metrics.phase("execute"):
+            stored = DB.run(lambda cur: {
+                kb: read_documents_chunks(cur, kb, [r.document_id for r in base_records])
+                for kb, base_records in pending.items()
+            })
+        # Chunks a inserir de todos os documentos, agrupados por modelo: lotes de embeddings cheios
+        to_embed = {}
+        for kb, base_records in pending.items():
+            for record in base_records:
+                diff = diff_chunks(stored[kb].get(record.document_id, []), chunked[record.index])
+                to_embed.setdefault(configs[kb], []).extend(diff.insert)
+        vectors = {config: _embed_document_chunks(chunks, config) for config, chunks in to_embed.items()}
+        # Chunks sem vetor na última tentativa, por modelo (documentos alterados no meio tempo)
+        late = {}
+
+        def _write(cur):
+            outcomes = {}
+            rows = []
+            late.clear()
+            for kb, base_records in pending.items():
+                config = configs[kb]
+                try:
+                    check_embedding_config(cur, kb, config)
+                except (EmbeddingModelChanged, KnowledgeBaseNotFound) as e:
+                    outcomes.update({r.index: e for r in base_records})
+                    continue
+                for record in base_records:
+                    cur.execute("SAVEPOINT cortexa_batch_document")
+                    try:
+                        outcomes[record.index] = write_document(
+                            cur, kb, record.document_id, record.version, chunked[record.index],
+                            vectors.get(config, {}), metadata=record.metadata, pending_rows=rows,
+                        )
+                    except DocumentVersionConflict as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT cortexa_batch_document")
+                        outcomes[record.index] = e
+                        continue
+                    except MissingVectors as e:
+                        # Segue com os demais para juntar todos os faltantes antes de desfazer o lote
+                        cur.execute("ROLLBACK TO SAVEPOINT cortexa_batch_document")
+                        late.setdefault(config, []).extend(e.chunks)
+                        continue
+                    cur.execute("RELEASE SAVEPOINT cortexa_batch_document")
+            if late:
+                raise MissingVectors([chunk for chunks in late.values() for chunk in chunks])
+            insert_document_chunks(cur, rows)
+            return outcomes
+
+        def _embed_missing(missing):
+            for config, chunks in late.items():
+                vectors.setdefault(config, {}).update(_embed_document_chunks(chunks, config))
+
+        outcomes = _write_documents(_write, _embed_missing)
+    except MissingVectors as e:
+        return _concurrent_change_response(e)
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+    except psycopg2.Error as e:
+        logger.error(f"Erro de banco de dados: {e}")
+        return {"statusCode": 500, "body": json.dumps({"error": f"Database error: {e}"})}
+    except Exception as e:
+        logger.error(f"Erro ao obter embeddings: {e}")
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+    for kb, base_records in pending.items():
+        for record in base_records:
+            outcome = outcomes[record.index]
+            if isinstance(outcome, KnowledgeBaseNotFound):
+                EMBEDDING_CONFIGS.invalidate(kb)
+                results[record.index] = _batch_result(record.index, record, 404,
+                                                      error="Base de conhecimento não encontrada.")
+            elif isinstance(outcome, EmbeddingModelChanged):
+                EMBEDDING_CONFIGS.invalidate(kb)
+                results[record.index] = _batch_result(
+                    record.index, record, 503,
+                    error="A base de conhecimento trocou de modelo de embeddings; tente novamente.")
+            elif isinstance(outcome, DocumentVersionConflict):
+                results[record.index] = _batch_result(record.index, record, 409, error=str(outcome),
+                                                      currentVersion=outcome.current)
+            else:
+                metrics.count("chunks", outcome.chunks)
+                metrics.count("chunks_embedded", outcome.inserted)
+                metrics.count("chunks_deleted", outcome.deleted)
+                results[record.index] = _batch_result(
+                    record.index, record, 202, version=outcome.version, chunks=outcome.chunks,
+                    inserted=outcome.inserted, deleted=outcome.deleted, reordered=outcome.reordered,
+                    unchanged=outcome.unchanged)
+    return None
+
+def _warmup():
+    """Importa o driver, cria o cliente Lambda, abre a conexão e prepara o INSERT durante o init."""
+    import psycopg2.extras  # noqa: F401
+    if _initialize():
+        DB.run(lambda cur: DB.statement_sql(cur, INSERT_CHUNK), commit=True)
+
+WARMUP = start_init_warmup(_warmup)
@@ -1,9 +1,11 @@
 import json
 import logging
 import os
-import urllib.request
 from typing import Dict, Any
 
+from src.common import metrics, profiling
+from src.common.warmup import start_init_warmup
+
 # Configuração do logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -11,16 +13,36 @@ logger.setLevel(logging.INFO)
 # Variáveis de ambiente e constantes
 # Usando um modelo mais recente e econômico como padrão
 DEFAULT_MODEL = "text-embedding-3-small"
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-OPENAI_URL = "https://api.openai.com/v1/embeddings"
+# Sobrescrevível para apontar para um servidor compatível (ex.: o falso dos benchmarks)
+OPENAI_URL = os.environ.get("OPENAI_EMBEDDINGS_URL", "https://api.openai.com/v1/embeddings")
+OPENAI_TIMEOUT_SECONDS = 25
+
+# Variáveis globais para cache
+API_KEY = None
+HTTP = None
 
+def _initialize() -> bool:
+    """Lê a chave da API e cria o pool HTTP com keep-alive, reutilizado entre invocações."""
+    global API_KEY, HTTP
+    if HTTP is None:
+        API_KEY = os.environ.get("OPENAI_API_KEY")
+        if not API_KEY:
+            logger.error("A variável de ambiente OPENAI_API_KEY não foi definida.")
+            return False
+        import urllib3
+        # No modo servidor, várias requisições usam o pool ao mesmo tempo: uma conexão por thread
+        HTTP = urllib3.PoolManager(maxsize=int(os.environ.get("OPENAI_HTTP_POOL_SIZE", "10")), retries=False)
+    return True
+
+@metrics.instrumented("openai_embedding_proxy")
+@profiling.profiled("openai_embedding_proxy")
 def lambda_handler(event: Dict[str, Any], context: object) -> Dict[str, Any]:
     """
     Função Lambda que atua como um proxy seguro e inteligente para a API de Embeddings da OpenAI.
     Valida a entrada, aplica padrões e encaminha a requisição.
     """
-    if not OPENAI_API_KEY:
-        logger.error("A variável de ambiente OPENAI_API_KEY não foi definida.")
+    WARMUP.wait()
+    if not _initialize():
         return {
             "statusCode": 500,
             "body": json.dumps({"error": "Erro de configuração do servidor."})
@@ -32,7 +54,8 @@ def lambda_handler(event: Dict[str, Any], context: object) -> Dict[str, Any]:
     # 1. Validação e parsing do corpo da requisição
     try:
         # O corpo vem como uma string, precisamos convertê-lo para um dicionário Python
-        body = json.loads(event.get("body", "{}"))
+        with metrics.phase("parse"):
+            body = json.loads(event.get("body", "{}"))
         if not isinstance(body, dict):
             raise json.JSONDecodeError("O corpo deve ser um objeto JSON.", "", 0)
     except (json.JSONDecodeError, TypeError) as e:
@@ -76,34 +99,57 @@ def lambda_handler(event: Dict[str, Any], context: object) -> Dict[str, Any]:
     # 4. Requisição para a API da OpenAI
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Authorization": f"Bearer {API_KEY}",
     }
     
+    # Import tardio: o urllib3 já foi carregado em _initialize.
+    from urllib3.exceptions import HTTPError as Urllib3HTTPError, TimeoutError as Urllib3TimeoutError
+
     try:
         # Converte o dicionário do payload de volta para uma string JSON codificada em bytes
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(OPENAI_URL, data=data, headers=headers, method="POST")
-        
-        with urllib.request.urlopen(req, timeout=25) as response:
-            response_body = response.read().decode("utf-8")
-            status_code = response.status
-            logger.info(f"Resposta da OpenAI recebida com status: {status_code}")
-            return {
-                "statusCode": status_code,
-                "body": response_body
-            }
-
-    except urllib.error.HTTPError as e:
-        # Captura erros HTTP da OpenAI (4xx, 5xx)
-        error_body = e.read().decode("utf-8")
-        logger.error(f"Erro HTTP da OpenAI: Status {e.code}, Corpo: {error_body}")
+        with metrics.phase("serialize"):
+            data = json.dumps(payload).encode("utf-8")
+        metrics.count("inputs", 1 if isinstance(input_text, str) else len(input_text))
+        metrics.count("request_bytes", len(data), "Bytes")
+        # O pool mantém a conexão TLS com a OpenAI aberta entre invocações 'warm'.
+        with metrics.phase("openai"):
+            response = HTTP.request("POST", OPENAI_URL, body=data, headers=headers, timeout=OPENAI_TIMEOUT_SECONDS)
+        metrics.count("response_bytes", len(response.data), "Bytes")
+        response_body = response.data.decode("utf-8")
+        if response.status >= 400:
+            # Erros HTTP da OpenAI (4xx, 5xx) são repassados ao chamador
+            logger.error(f"Erro HTTP da OpenAI: Status {response.status}, Corpo: {response_body}")
+        else:
+            logger.info(f"Resposta da OpenAI recebida com status: {response.status}")
         return {
-            "statusCode": e.code,
-            "body": error_body
+            "statusCode": response.status,
+            "body": response_body
+        }
+
+    except Urllib3TimeoutError as e:
+        logger.error(f"Timeout na chamada à OpenAI: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Timeout na comunicação com a OpenAI."})
+        }
+    except Urllib3HTTPError as e:
+        logger.error(f"Erro de comunicação com a OpenAI: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Erro de comunicação com a OpenAI."})
         }
     except Exception as e:
         logger.error(f"Erro inesperado no proxy: {e}")
         return {
             "statusCode": 500,
             "body": json.dumps({"error": "Erro inesperado ao processar a requisição."})
-        }
\ No newline at end of file
+        }
+
+
+def _warmup():
+    """Cria o pool HTTP e abre a conexão TLS com a OpenAI durante o init."""
+    if _initialize():
+        # HEAD não é cobrado nem autenticado; serve apenas para deixar a conexão no pool.
+        HTTP.request("HEAD", OPENAI_URL, timeout=2)
+
+WARMUP = start_init_warmup(_warmup)
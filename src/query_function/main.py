@@ -1,8 +1,29 @@
+import heapq
 import json
 import logging
 import os
-import boto3
-import psycopg2
+import threading
+from typing import Optional
+
+from src.common import compression, metrics, profiling
+from src.common.admission import admission_from_env, shed_response
+from src.common.db import DatabaseConnectionError, PreparedStatement, ThreadLocalConnections, read_router_from_env
+from src.common.embedding_config import DEFAULT_CONFIG, config_cache_from_env, matching_base, read_embedding_config
+from src.common.pagination import (
+    DEFAULT_CANDIDATE_TTL_SECONDS,
+    START_DISTANCE,
+    START_ID,
+    CandidateCache,
+    InvalidCursor,
+    PageCursor,
+    QueryEmbeddingCache,
+    decode_cursor,
+    encode_cursor,
+    page_slice,
+    query_fingerprint,
+)
+from src.common.sweeper import visible_chunk_vectors, visible_chunks
+from src.common.warmup import start_init_warmup
 
 # Configuração do logger
 logger = logging.getLogger()
@@ -10,41 +31,388 @@ logger.setLevel(logging.INFO)
 
 # Variáveis globais para cache
 NEON_DB_CONNECTION_STRING = None
+NEON_DB_READ_CONNECTION_STRING = None
 OPENAI_PROXY_LAMBDA_ARN = None
 LAMBDA_CLIENT = None
-DB_CONNECTION = None
+DB = None
+# Modelo de embeddings de cada base, com expiração. As buscas confirmam o modelo
+# (`matching_base`); após uma troca, a primeira busca vazia descarta a entrada.
+EMBEDDING_CONFIGS = config_cache_from_env(os.environ)
+# Limites de consultas simultâneas e por segundo de cada base (desligados por padrão)
+ADMISSION = admission_from_env(os.environ, "query")
+
+# A query usa o operador de distância de cosseno (<=>) do pg_vector; ordenar pela
+# distância (e não pelo score) permite que o índice ivfflat seja usado.
+# 1 - distancia_cosseno = similaridade_cosseno
+# Todas as buscas ignoram chunks expirados e de documentos ou bases marcados para
+# remoção (`visible_chunks`), mesmo antes da passagem do varredor, e recebem o modelo
+# com que a consulta foi vetorizada: se a base trocou de modelo, não retornam nada.
+SEARCH_CHUNKS = PreparedStatement(
+    "cortexa_search_chunks",
+    ("vector", "uuid", "text", "integer", "integer"),
+    f"""
+    SELECT content, 1 - distance AS score, metadata
+    FROM (
+        SELECT content, metadata, embedding <=> $1 AS distance
+        FROM knowledge_chunks
+        WHERE knowledge_base_id = {matching_base("$2", "$3", "$4")} AND {visible_chunks()}
+        ORDER BY distance
+        LIMIT $5
+    ) AS hits
+    ORDER BY distance
+    """
+)
+
+# Mesma busca sobre a tabela estreita de vetores (migração V5): o ranking lê só
+# (id, base, vetor) e o conteúdo e os metadados vêm de `knowledge_chunks` pela chave
+# primária, apenas para as linhas do top-k.
+SEARCH_CHUNKS_SPLIT = PreparedStatement(
+    "cortexa_search_chunks_split",
+    ("vector", "uuid", "text", "integer", "integer"),
+    f"""
+    SELECT c.content, 1 - hits.distance AS score, c.metadata
+    FROM (
+        SELECT id, embedding <=> $1 AS distance
+        FROM knowledge_chunk_vectors
+        WHERE knowledge_base_id = {matching_base("$2", "$3", "$4")} AND {visible_chunk_vectors()}
+        ORDER BY distance
+        LIMIT $5
+    ) AS hits
+    JOIN knowledge_chunks c ON c.id = hits.id
+    ORDER BY hits.distance
+    """
+)
+# Usa SEARCH_CHUNKS_SPLIT na busca simples (top-k sem contexto nem paginação)
+SPLIT_VECTOR_SEARCH = os.environ.get("SPLIT_VECTOR_SEARCH", "false").lower() in ("1", "true", "yes")
+# Se o layout de vetores separados está habilitado no banco; conferido na primeira busca do processo
+SPLIT_LAYOUT_ENABLED: Optional[bool] = None
+SPLIT_LAYOUT_LOCK = threading.Lock()
+
+# Maior `top_k` (e `page_size`) aceito; resultados mais profundos são paginados com cursor
+MAX_TOP_K = int(os.environ.get("MAX_TOP_K", "100"))
+# Embeddings das consultas paginadas, reaproveitados nas páginas seguintes
+QUERY_EMBEDDINGS = QueryEmbeddingCache()
+
+# Paginação (ver `src.common.pagination`): candidatos buscados uma vez por consulta,
+# com `probes` elevado para que o ivfflat chegue ao tamanho da lista, e páginas
+# fatiadas dela. Só os chunks da página têm conteúdo lido.
+PAGE_CANDIDATES = int(os.environ.get("PAGE_CANDIDATES", str(MAX_TOP_K * 10)))
+PAGE_SEARCH_PROBES = int(os.environ.get("PAGE_SEARCH_PROBES", "10"))
+CANDIDATES = CandidateCache(
+    ttl_seconds=float(os.environ.get("PAGE_CANDIDATES_TTL_SECONDS", DEFAULT_CANDIDATE_TTL_SECONDS)))
+
+SEARCH_CHUNK_CANDIDATES = PreparedStatement(
+    "cortexa_search_chunk_candidates",
+    ("vector", "uuid", "text", "integer", "integer"),
+    f"""
+    SELECT distance, id
+    FROM (
+        SELECT id, embedding <=> $1 AS distance
+        FROM knowledge_chunks
+        WHERE knowledge_base_id = {matching_base("$2", "$3", "$4")} AND {visible_chunks()}
+        ORDER BY distance
+        LIMIT $5
+    ) AS hits
+    ORDER BY distance, id
+    """
+)
+
+# Os ids chegam como text[] (o psycopg2 envia listas como ARRAY[...] de texto)
+READ_PAGE_CHUNKS = PreparedStatement(
+    "cortexa_read_page_chunks",
+    ("text[]",),
+    f"""
+    SELECT id, content, metadata
+    FROM knowledge_chunks
+    WHERE id = ANY($1::uuid[]) AND {visible_chunks()}
+    """
+)
+
+# Maior número de bases em uma busca federada (`knowledgeBaseIds`)
+MAX_FEDERATED_BASES = int(os.environ.get("MAX_FEDERATED_BASES", "20"))
 
-def _initialize():
-    """Inicializa as variáveis de ambiente e clientes."""
-    global NEON_DB_CONNECTION_STRING, OPENAI_PROXY_LAMBDA_ARN, LAMBDA_CLIENT
+# Busca federada em uma única ida ao banco: para cada base da lista, o LATERAL faz a
+# mesma busca de SEARCH_CHUNKS (top-k próprio pelo índice ivfflat). A fusão no top-k
+# global fica no handler. Bases que trocaram de modelo ficam sem linhas.
+SEARCH_CHUNKS_FEDERATED = PreparedStatement(
+    "cortexa_search_chunks_federated",
+    # Os ids chegam como text[] (o psycopg2 envia listas como ARRAY[...] de texto)
+    ("vector", "text[]", "text", "integer", "integer"),
+    f"""
+    SELECT kb.id, hits.content, 1 - hits.distance AS score, hits.metadata
+    FROM (SELECT $1::vector AS embedding) AS q
+    CROSS JOIN unnest($2::uuid[]) AS b(knowledge_base_id)
+    JOIN knowledge_bases kb ON kb.id = b.knowledge_base_id AND kb.embedding_model = $3
+        AND kb.embedding_dimensions = $4
+    CROSS JOIN LATERAL (
+        SELECT content, metadata, embedding <=> q.embedding AS distance
+        FROM knowledge_chunks
+        WHERE knowledge_base_id = kb.id AND {visible_chunks()}
+        ORDER BY distance
+        LIMIT $5
+    ) AS hits
+    """
+)
+
+# Busca híbrida (`"mode": "hybrid"`): peso padrão do ranking textual na fusão (0 = só
+# vetorial, 1 = só textual), candidatos de cada ranking e a constante k da fusão por
+# posição recíproca (RRF), que atenua a diferença entre as primeiras posições.
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get("HYBRID_LEXICAL_WEIGHT", "0.5"))
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "40"))
+RRF_K = 60
+
+# Busca híbrida em uma única ida ao banco: os candidatos da busca vetorial (índice
+# ivfflat) e da busca textual sobre `content_tsv` (índice GIN, migração V6) são
+# numerados por posição em cada ranking e fundidos por RRF:
+#   score = (1 - peso) / (k + posição vetorial) + peso / (k + posição textual)
+# A configuração 'simple' casa identificadores exatos (SKUs, códigos de erro) sem
+# stemming. Só o top-k fundido lê conteúdo e metadados. Os dois rankings usam a base
+# só se o modelo confere, para que a troca de modelo não passe despercebida.
+SEARCH_CHUNKS_HYBRID = PreparedStatement(
+    "cortexa_search_chunks_hybrid",
+    ("uuid", "text", "integer", "vector", "integer", "text", "integer", "float8", "integer", "integer"),
+    f"""
+    WITH base AS (
+        SELECT {matching_base("$1", "$2", "$3")} AS id
+    ), vector_hits AS (
+        SELECT id, row_number() OVER (ORDER BY distance, id) AS rank
+        FROM (
+            SELECT id, embedding <=> $4 AS distance
+            FROM knowledge_chunks
+            WHERE knowledge_base_id = (SELECT id FROM base) AND {visible_chunks()}
+            ORDER BY distance
+            LIMIT $5
+        ) AS v
+    ), lexical_hits AS (
+        SELECT id, row_number() OVER (ORDER BY relevance DESC, id) AS rank
+        FROM (
+            SELECT c.id, ts_rank_cd(c.content_tsv, q.query) AS relevance
+            FROM knowledge_chunks c, websearch_to_tsquery('simple', $6) AS q(query)
+            WHERE c.knowledge_base_id = (SELECT id FROM base) AND c.content_tsv @@ q.query AND {visible_chunks("c")}
+            ORDER BY relevance DESC
+            LIMIT $7
+        ) AS l
+    ), params AS (
+        SELECT $8::float8 AS lexical_weight, $9::integer AS k
+    ), fused AS (
+        SELECT h.id,
+               sum(h.weight / (p.k + h.rank)) AS score,
+               min(h.vector_rank) AS vector_rank,
+               min(h.lexical_rank) AS lexical_rank
+        FROM (
+            SELECT v.id, v.rank, 1 - p.lexical_weight AS weight, v.rank AS vector_rank, NULL::bigint AS lexical_rank
+            FROM vector_hits v, params p
+            UNION ALL
+            SELECT l.id, l.rank, p.lexical_weight, NULL, l.rank
+            FROM lexical_hits l, params p
+        ) AS h, params p
+        GROUP BY h.id
+    )
+    SELECT c.content, f.score, c.metadata, f.vector_rank, f.lexical_rank
+    FROM (SELECT * FROM fused ORDER BY score DESC, id LIMIT $10) AS f
+    JOIN knowledge_chunks c ON c.id = f.id
+    ORDER BY f.score DESC, f.id
+    """
+)
+
+# Maior `context_window` aceito: ±N chunks vizinhos por resultado
+MAX_CONTEXT_WINDOW = int(os.environ.get("MAX_CONTEXT_WINDOW", "5"))
+
+# Busca com contexto em uma única ida ao banco: os top-k resultados viram janelas
+# [ordinal - N, ordinal + N] no documento; janelas sobrepostas ou adjacentes do mesmo
+# documento são fundidas (ilhas) e cada ilha é lida pelo índice (document_id, ordinal).
+# O resultado de cada ilha é o seu melhor acerto. Chunks sem documento voltam sem contexto.
+# Cada parâmetro aparece uma única vez, para que `direct_sql` continue posicional.
+SEARCH_CHUNKS_WITH_CONTEXT = PreparedStatement(
+    "cortexa_search_chunks_context",
+    ("vector", "uuid", "text", "integer", "integer", "integer"),
+    f"""
+    WITH hits AS (
+        SELECT content, metadata, document_id, ordinal, embedding <=> $1 AS distance
+        FROM knowledge_chunks
+        WHERE knowledge_base_id = {matching_base("$2", "$3", "$4")} AND {visible_chunks()}
+        ORDER BY distance
+        LIMIT $5
+    ), windows AS (
+        SELECT h.*, h.ordinal - w.size AS lo, h.ordinal + w.size AS hi
+        FROM hits h, (SELECT $6::integer AS size) w
+        WHERE h.document_id IS NOT NULL
+    ), starts AS (
+        SELECT *, CASE WHEN lo <= max(hi) OVER (
+                      PARTITION BY document_id ORDER BY lo, hi
+                      ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) + 1
+                  THEN 0 ELSE 1 END AS island_start
+        FROM windows
+    ), islands AS (
+        SELECT *, sum(island_start) OVER (PARTITION BY document_id ORDER BY lo, hi) AS island
+        FROM starts
+    ), merged AS (
+        SELECT document_id,
+               min(lo) AS lo,
+               max(hi) AS hi,
+               min(distance) AS distance,
+               (array_agg(content ORDER BY distance))[1] AS content,
+               (array_agg(metadata ORDER BY distance))[1] AS metadata,
+               array_agg(ordinal ORDER BY ordinal) AS hit_ordinals
+        FROM islands
+        GROUP BY document_id, island
+    )
+    SELECT m.content, 1 - m.distance AS score, m.metadata, d.external_id, m.hit_ordinals, ctx.chunks
+    FROM merged m
+    JOIN documents d ON d.id = m.document_id
+    CROSS JOIN LATERAL (
+        SELECT json_agg(json_build_object('ordinal', c.ordinal, 'content', c.content) ORDER BY c.ordinal) AS chunks
+        FROM knowledge_chunks c
+        WHERE c.document_id = m.document_id AND c.ordinal BETWEEN m.lo AND m.hi AND {visible_chunks("c")}
+    ) ctx
+    UNION ALL
+    SELECT content, 1 - distance, metadata, NULL, NULL, NULL
+    FROM hits
+    WHERE document_id IS NULL
+    ORDER BY score DESC
+    """
+)
+
+def _initialize(lambda_client=None, thread_local_db=False):
+    """
+    Inicializa as variáveis de ambiente e clientes.
+
+    O modo servidor (`src.server.main`) injeta um cliente que chama o proxy no próprio
+    processo e pede um roteador de leitura por thread do pool de execução.
+    """
+    global NEON_DB_CONNECTION_STRING, NEON_DB_READ_CONNECTION_STRING, OPENAI_PROXY_LAMBDA_ARN, LAMBDA_CLIENT, DB
     if LAMBDA_CLIENT is None:
         logger.info("Inicializando clientes e variáveis de ambiente.")
         NEON_DB_CONNECTION_STRING = os.environ.get("NEON_DB_CONNECTION_STRING")
+        # Opcional: endpoint de leitura (réplica); sem ele, as buscas vão para o primário
+        NEON_DB_READ_CONNECTION_STRING = os.environ.get("NEON_DB_READ_CONNECTION_STRING")
         OPENAI_PROXY_LAMBDA_ARN = os.environ.get("OPENAI_PROXY_LAMBDA_ARN")
         if not NEON_DB_CONNECTION_STRING or not OPENAI_PROXY_LAMBDA_ARN:
             logger.error("Variáveis de ambiente não definidas.")
             return False
-        LAMBDA_CLIENT = boto3.client('lambda')
+        # Consultas são somente leitura: autocommit evita transações abertas entre invocações.
+        def make_router():
+            return read_router_from_env(os.environ, NEON_DB_CONNECTION_STRING, NEON_DB_READ_CONNECTION_STRING)
+        DB = ThreadLocalConnections(make_router) if thread_local_db else make_router()
+        if lambda_client is None:
+            # botocore diretamente: mesmo cliente do boto3.client('lambda'), com import mais leve
+            import botocore.session
+            lambda_client = botocore.session.get_session().create_client('lambda')
+        LAMBDA_CLIENT = lambda_client
     return True
 
 def _get_db_connection():
-    """Estabelece e cacheia a conexão com o banco de dados."""
-    global DB_CONNECTION
-    if DB_CONNECTION is None or DB_CONNECTION.closed != 0:
-        logger.info("Conectando ao banco de dados Neon.")
-        try:
-            DB_CONNECTION = psycopg2.connect(NEON_DB_CONNECTION_STRING)
-        except psycopg2.Error as e:
-            logger.error(f"Não foi possível conectar ao banco de dados: {e}")
-            return None
-    return DB_CONNECTION
+    """Retorna a conexão de leitura cacheada (réplica ou primário), testada e reconectada se necessário."""
+    try:
+        return DB.get()
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return None
+
+def _search(cur, query_embedding, knowledge_base_id, top_k, config=DEFAULT_CONFIG):
+    """Executa a busca vetorial usando o statement preparado na conexão."""
+    # O embedding precisa ser passado como string para a query
+    statement = SEARCH_CHUNKS_SPLIT if _use_split_layout(cur) else SEARCH_CHUNKS
+    cur.execute(DB.statement_sql(cur, statement),
+                (json.dumps(query_embedding), knowledge_base_id, config.model, config.dimensions, top_k))
+    return cur.fetchall()
+
+def _search_with_context(cur, query_embedding, knowledge_base_id, top_k, context_window, config=DEFAULT_CONFIG):
+    """Busca vetorial com os ±`context_window` chunks vizinhos de cada resultado."""
+    cur.execute(
+        DB.statement_sql(cur, SEARCH_CHUNKS_WITH_CONTEXT),
+        (json.dumps(query_embedding), knowledge_base_id, config.model, config.dimensions, top_k, context_window),
+    )
+    return cur.fetchall()
+
+def _page_candidates(cur, query_embedding, knowledge_base_id, config=DEFAULT_CONFIG):
+    """Os PAGE_CANDIDATES chunks mais próximos, como (distância, id), com mais probes no ivfflat."""
+    cur.execute("SELECT current_setting('ivfflat.probes', true)")
+    probes = cur.fetchone()[0]
+    cur.execute("SET ivfflat.probes = %s", (max(int(probes or 1), PAGE_SEARCH_PROBES),))
+    try:
+        cur.execute(DB.statement_sql(cur, SEARCH_CHUNK_CANDIDATES),
+                    (json.dumps(query_embedding), knowledge_base_id, config.model, config.dimensions, PAGE_CANDIDATES))
+        return [(float(distance), str(chunk_id)) for distance, chunk_id in cur.fetchall()]
+    finally:
+        # Volta ao valor da sessão: as demais buscas da conexão não pagam os probes extras
+        if probes:
+            cur.execute("SET ivfflat.probes = %s", (int(probes),))
+        else:
+            cur.execute("RESET ivfflat.probes")
+
+def _search_page(cur, query_embedding, knowledge_base_id, page: PageCursor, config=DEFAULT_CONFIG):
+    """
+    Uma página da busca, fatiada da lista de candidatos da consulta (em cache). Retorna
+    as linhas (id, conteúdo, score, metadados, distância) e a fatia.
+    """
+    candidates = CANDIDATES.get((str(knowledge_base_id), page.fingerprint),
+                                lambda: _page_candidates(cur, query_embedding, knowledge_base_id, config))
+    sliced = page_slice(candidates, page, PAGE_CANDIDATES)
+    rows = []
+    if sliced.candidates:
+        cur.execute(DB.statement_sql(cur, READ_PAGE_CHUNKS), ([chunk_id for _, chunk_id in sliced.candidates],))
+        chunks = {str(row[0]): row for row in cur.fetchall()}
+        # Chunks removidos depois de a lista ser buscada ficam de fora
+        rows = [(chunk_id, chunks[chunk_id][1], 1 - distance, chunks[chunk_id][2], distance)
+                for distance, chunk_id in sliced.candidates if chunk_id in chunks]
+    return rows, sliced
+
+def _search_federated(cur, query_embedding, knowledge_base_ids, top_k, config=DEFAULT_CONFIG):
+    """Top-k de cada base da lista, em uma única consulta."""
+    cur.execute(
+        DB.statement_sql(cur, SEARCH_CHUNKS_FEDERATED),
+        (json.dumps(query_embedding), list(knowledge_base_ids), config.model, config.dimensions, top_k),
+    )
+    return cur.fetchall()
+
+def _search_hybrid(cur, query_embedding, query_text, knowledge_base_id, top_k, lexical_weight, config=DEFAULT_CONFIG):
+    """Busca vetorial e textual fundidas por RRF, em uma única consulta."""
+    candidates = max(top_k, HYBRID_CANDIDATES)
+    cur.execute(
+        DB.statement_sql(cur, SEARCH_CHUNKS_HYBRID),
+        (knowledge_base_id, config.model, config.dimensions, json.dumps(query_embedding), candidates,
+         query_text, candidates, lexical_weight, RRF_K, top_k),
+    )
+    return cur.fetchall()
+
+def _switched_configs(cur, knowledge_base_ids, config) -> dict:
+    """
+    Bases da lista que não usam mais `config` (o modelo trocou depois de entrar no
+    cache), com o modelo atual. Consultada só quando a busca volta vazia.
+    """
+    switched = {}
+    for kb in knowledge_base_ids:
+        current = read_embedding_config(cur, kb)
+        if current is not None and current != config:
+            switched[kb] = current
+    return switched
+
+def _forget_switched(switched):
+    """Descarta do cache as bases que trocaram de modelo."""
+    for kb, current in switched.items():
+        logger.info(f"A base {kb} passou a usar {current.model}; refazendo a consulta.")
+        EMBEDDING_CONFIGS.invalidate(kb)
+    metrics.count("embedding_model_switched", len(switched))
+
+def _hybrid_result(row):
+    # Posições em cada ranking (None quando o chunk não está entre os candidatos dele)
+    return {"content": row[0], "score": row[1], "metadata": row[2], "vectorRank": row[3], "lexicalRank": row[4]}
 
-def get_embedding(text_query, lambda_client, proxy_arn):
+def _context_result(row):
+    result = {"content": row[0], "score": row[1], "metadata": row[2]}
+    if row[3] is not None:
+        result["documentId"] = row[3]
+        result["hits"] = row[4]
+        result["context"] = row[5]
+    return result
+
+def get_embedding(text_query, lambda_client, proxy_arn, config=DEFAULT_CONFIG):
     """Invoca a Lambda de proxy para obter o embedding da consulta."""
     payload = {
         "body": json.dumps({
             "input": text_query,
-            "model": "text-embedding-3-small"
+            **config.request_fields()
         })
     }
     response = lambda_client.invoke(
@@ -62,66 +430,347 @@ def get_embedding(text_query, lambda_client, proxy_arn):
     return embedding_body['data'][0]['embedding']
 
 
+@metrics.instrumented("query_function")
+@compression.negotiated
+@profiling.profiled("query_function")
 def lambda_handler(event, context):
     """
     Lambda para receber uma query, gerar seu embedding e fazer a busca vetorial.
     """
+    WARMUP.wait()
     if not _initialize():
         return {"statusCode": 500, "body": json.dumps({"error": "Erro de configuração do servidor."})}
 
-    try:
-        body = json.loads(event.get("body", "{}"))
-        knowledge_base_id = body.get("knowledgeBaseId")
-        query_text = body.get("text")
-        top_k = int(body.get("top_k", 3))
-
-        if not knowledge_base_id:
-            return {"statusCode": 400, "body": json.dumps({"error": "O campo 'knowledgeBaseId' é obrigatório."})}
-        if not query_text:
-            return {"statusCode": 400, "body": json.dumps({"error": "O campo 'text' é obrigatório."})}
-    except (json.JSONDecodeError, AttributeError, ValueError):
-        return {"statusCode": 400, "body": json.dumps({"error": "Corpo da requisição inválido."})}
+    with metrics.phase("parse"):
+        try:
+            raw_body = event.get("body", "{}")
+            metrics.count("request_bytes", len(raw_body or ""), "Bytes")
+            body = json.loads(raw_body)
+            knowledge_base_id = body.get("knowledgeBaseId")
+            knowledge_base_ids = body.get("knowledgeBaseIds")
+            query_text = body.get("text")
+            top_k = int(body.get("top_k", 3))
+            context_window = int(body.get("context_window", 0))
+            page_size = body.get("page_size")
+            page_size = int(page_size) if page_size is not None else None
+            cursor = body.get("cursor")
+            mode = body.get("mode", "vector")
+            lexical_weight = float(body.get("lexical_weight", HYBRID_LEXICAL_WEIGHT))
 
+            if knowledge_base_ids is not None:
+                error = _federated_error(knowledge_base_ids, knowledge_base_id, body)
+                if error:
+                    return {"statusCode": 400, "body": json.dumps({"error": error})}
+            elif not knowledge_base_id:
+                return {"statusCode": 400, "body": json.dumps({"error": "O campo 'knowledgeBaseId' é obrigatório."})}
+            if not query_text:
+                return {"statusCode": 400, "body": json.dumps({"error": "O campo 'text' é obrigatório."})}
+            if not 0 <= context_window <= MAX_CONTEXT_WINDOW:
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": f"O campo 'context_window' deve estar entre 0 e {MAX_CONTEXT_WINDOW}."})}
+            if mode not in ("vector", "hybrid"):
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": "O campo 'mode' deve ser 'vector' ou 'hybrid'."})}
+            if not 0 <= lexical_weight <= 1:
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": "O campo 'lexical_weight' deve estar entre 0 e 1."})}
+            if not 1 <= top_k <= MAX_TOP_K:
+                return {"statusCode": 400, "body": json.dumps({"error": (
+                    f"O campo 'top_k' é inválido: deve estar entre 1 e {MAX_TOP_K}. "
+                    "Para resultados mais profundos, pagine com 'page_size' e 'cursor'.")})}
+            page = _page(knowledge_base_id, page_size, cursor) if knowledge_base_ids is None else None
+            if page is not None and context_window:
+                return {"statusCode": 400, "body": json.dumps(
+                    {"error": "A paginação ('page_size'/'cursor') não pode ser combinada com 'context_window'."})}
+            if mode == "hybrid" and (knowledge_base_ids is not None or context_window or page is not None):
+                return {"statusCode": 400, "body": json.dumps({"error": (
+                    "A busca híbrida não aceita 'knowledgeBaseIds', 'context_window', 'page_size' nem 'cursor'.")})}
+        except InvalidCursor as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+        except (json.JSONDecodeError, AttributeError, ValueError):
+            return {"statusCode": 400, "body": json.dumps({"error": "Corpo da requisição inválido."})}
+
+    if knowledge_base_ids is not None:
+        return _admitted_federated_query(list(dict.fromkeys(knowledge_base_ids)), query_text, top_k)
+
+    metrics.set_tenant(knowledge_base_id)
     logger.info(f"Recebida consulta para a base: {knowledge_base_id}")
 
+    # Bases inexistentes são recusadas pelo cache, antes da admissão e da vetorização
+    configs, error = _embedding_configs([knowledge_base_id])
+    if error:
+        return error
+    # O controle de admissão grava no primário, mesmo com as leituras na réplica
+    admission = ADMISSION.admit(DB.run_on_primary, knowledge_base_id)
+    if not admission.admitted:
+        return shed_response(admission)
     try:
-        query_embedding = get_embedding(query_text, LAMBDA_CLIENT, OPENAI_PROXY_LAMBDA_ARN)
-    except Exception as e:
-        logger.error(f"Erro ao obter embedding da consulta: {e}")
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        return _query(knowledge_base_id, configs[knowledge_base_id], query_text, top_k, context_window, page,
+                      lexical_weight if mode == "hybrid" else None)
+    finally:
+        ADMISSION.release(DB.run_on_primary, admission)
 
-    conn = _get_db_connection()
-    if not conn:
-        return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+def _federated_error(knowledge_base_ids, knowledge_base_id, body):
+    """Mensagem de erro de uma busca federada inválida, ou None."""
+    if knowledge_base_id:
+        return "Use 'knowledgeBaseId' ou 'knowledgeBaseIds', não os dois."
+    if (not isinstance(knowledge_base_ids, list) or not knowledge_base_ids
+            or not all(isinstance(kb, str) and kb for kb in knowledge_base_ids)):
+        return "O campo 'knowledgeBaseIds' deve ser uma lista não vazia de identificadores."
+    if len(set(knowledge_base_ids)) > MAX_FEDERATED_BASES:
+        return f"O campo 'knowledgeBaseIds' aceita no máximo {MAX_FEDERATED_BASES} bases."
+    if any(body.get(field) for field in ("context_window", "page_size", "cursor")):
+        return "A busca em várias bases não aceita 'context_window', 'page_size' nem 'cursor'."
+    return None
 
-    results = []
-    try:
-        with conn.cursor() as cur:
-            # A query usa o operador de distância de cosseno (<=>) do pg_vector
-            # 1 - distancia_cosseno = similaridade_cosseno
-            sql = """
-                SELECT content, 1 - (embedding <=> %s) as score, metadata
-                FROM knowledge_chunks
-                WHERE knowledge_base_id = %s
-                ORDER BY score DESC
-                LIMIT %s;
-            """
-            # O embedding precisa ser passado como string para a query
-            cur.execute(sql, (json.dumps(query_embedding), knowledge_base_id, top_k))
-
-            for row in cur.fetchall():
-                results.append({
-                    "content": row[0],
-                    "score": row[1],
-                    "metadata": row[2]
-                })
-        logger.info(f"Busca encontrou {len(results)} resultados.")
+def _embedding_configs(knowledge_base_ids):
+    """
+    Modelo de embeddings de cada base, pelo cache por processo; retorna (configs, resposta
+    de erro). Qualquer base inexistente recusa a requisição inteira com 404.
+    """
+    # Import tardio: já carregado no pré-aquecimento do init.
+    import psycopg2
 
+    try:
+        configs = {
+            kb: EMBEDDING_CONFIGS.get(kb, lambda kb=kb: DB.run(lambda cur: read_embedding_config(cur, kb)))
+            for kb in knowledge_base_ids
+        }
+    except DatabaseConnectionError as e:
+        logger.error(str(e))
+        return None, {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
     except psycopg2.Error as e:
         logger.error(f"Erro na busca no banco de dados: {e}")
-        return {"statusCode": 500, "body": json.dumps({"error": f"Database query error: {e}"})}
+        return None, {"statusCode": 500, "body": json.dumps({"error": f"Database query error: {e}"})}
+    missing = [kb for kb, config in configs.items() if config is None]
+    if missing:
+        error = {"error": "Base de conhecimento não encontrada."}
+        if len(knowledge_base_ids) > 1:
+            error["knowledgeBaseIds"] = missing
+        return None, {"statusCode": 404, "body": json.dumps(error)}
+    return configs, None
+
+def _admitted_federated_query(knowledge_base_ids, query_text, top_k):
+    """Valida as bases, admite a consulta em cada uma (todas ou nenhuma) e executa a busca federada."""
+    logger.info(f"Recebida consulta federada para {len(knowledge_base_ids)} bases.")
+    configs, error = _embedding_configs(knowledge_base_ids)
+    if error:
+        return error
+    if len(set(configs.values())) > 1:
+        return _mixed_models_response()
+    admissions = []
+    try:
+        for kb in knowledge_base_ids:
+            admission = ADMISSION.admit(DB.run_on_primary, kb)
+            if not admission.admitted:
+                return shed_response(admission)
+            admissions.append(admission)
+        return _federated_query(knowledge_base_ids, configs[knowledge_base_ids[0]], query_text, top_k)
+    finally:
+        for admission in admissions:
+            ADMISSION.release(DB.run_on_primary, admission)
+
+def _mixed_models_response():
+    return {"statusCode": 400, "body": json.dumps(
+        {"error": "As bases usam modelos de embeddings diferentes e não podem ser consultadas juntas."})}
+
+def _federated_query(knowledge_base_ids, config, query_text, top_k):
+    """
+    Vetoriza a consulta uma única vez, busca o top-k de cada base em uma só consulta e
+    funde tudo no top-k global. As bases precisam usar o mesmo modelo de embeddings
+    (`config`), senão os scores não são comparáveis. Se alguma base trocou de modelo,
+    a consulta é vetorizada de novo e repetida uma vez.
+    """
+    # Import tardio: já carregado no pré-aquecimento do init.
+    import psycopg2
+
+    for attempt in (1, 2):
+        try:
+            with metrics.phase("embed"):
+                query_embedding = get_embedding(query_text, LAMBDA_CLIENT, OPENAI_PROXY_LAMBDA_ARN, config)
+        except Exception as e:
+            logger.error(f"Erro ao obter embedding da consulta: {e}")
+            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+        try:
+            with metrics.phase("connect"):
+                DB.get()
+            with metrics.phase("execute"):
+                rows = DB.run(lambda cur: _search_federated(cur, query_embedding, knowledge_base_ids, top_k, config))
+                # Bases sem linhas estão vazias ou trocaram de modelo depois de entrar no cache
+                found = {str(row[0]) for row in rows}
+                empty = [kb for kb in knowledge_base_ids if kb not in found]
+                switched = {}
+                if empty and attempt == 1:
+                    switched = DB.run(lambda cur: _switched_configs(cur, empty, config))
+        except DatabaseConnectionError as e:
+            logger.error(str(e))
+            return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+        except psycopg2.Error as e:
+            logger.error(f"Erro na busca no banco de dados: {e}")
+            return {"statusCode": 500, "body": json.dumps({"error": f"Database query error: {e}"})}
+        if not switched:
+            break
+        _forget_switched(switched)
+        models = {switched.get(kb, config) for kb in knowledge_base_ids}
+        if len(models) > 1:
+            return _mixed_models_response()
+        config = models.pop()
+
+    # Cada base já chega com no máximo top_k linhas; o heap escolhe o top-k global
+    top = heapq.nlargest(top_k, rows, key=lambda row: row[2])
+    results = [{"knowledgeBaseId": str(row[0]), "content": row[1], "score": row[2], "metadata": row[3]}
+               for row in top]
+    logger.info(f"Busca federada encontrou {len(results)} resultados.")
+
+    with metrics.phase("serialize"):
+        response_body = json.dumps({"results": results})
+    metrics.count("federated_bases", len(knowledge_base_ids))
+    metrics.count("results", len(results))
+    metrics.count("response_bytes", len(response_body), "Bytes")
+    return {"statusCode": 200, "body": response_body}
+
+def _page(knowledge_base_id, page_size, cursor):
+    """Posição da página pedida, ou None fora do modo paginado. `page_size` sobrepõe o do cursor."""
+    if page_size is not None and not 1 <= page_size <= MAX_TOP_K:
+        raise InvalidCursor(f"O campo 'page_size' deve estar entre 1 e {MAX_TOP_K}.")
+    if cursor is not None:
+        page = decode_cursor(cursor)
+        if page.knowledge_base_id != str(knowledge_base_id):
+            raise InvalidCursor("O 'cursor' pertence a outra base de conhecimento.")
+        return page._replace(page_size=page_size or page.page_size)
+    if page_size is not None:
+        return PageCursor(str(knowledge_base_id), None, START_DISTANCE, START_ID, page_size)
+    return None
+
+def _query(knowledge_base_id, config, query_text, top_k, context_window, page=None, lexical_weight=None):
+    """
+    Vetoriza a consulta com o modelo da base (`config`) e executa a busca (ou uma página
+    dela). Com `lexical_weight`, a busca é híbrida (vetorial + textual). Se a busca volta
+    vazia porque a base trocou de modelo, a consulta é vetorizada de novo e repetida uma vez.
+    """
+    # Import tardio: já carregado no pré-aquecimento do init.
+    import psycopg2
+
+    requested = page
+    for attempt in (1, 2):
+        if requested is not None:
+            fingerprint = query_fingerprint(query_text, config)
+            if requested.fingerprint not in (None, fingerprint):
+                return {"statusCode": 400, "body": json.dumps({"error": "O 'cursor' pertence a outra consulta."})}
+            page = requested._replace(fingerprint=fingerprint)
+
+        try:
+            with metrics.phase("embed"):
+                if page is not None:
+                    query_embedding = QUERY_EMBEDDINGS.get((config, query_text), lambda: get_embedding(
+                        query_text, LAMBDA_CLIENT, OPENAI_PROXY_LAMBDA_ARN, config))
+                else:
+                    query_embedding = get_embedding(query_text, LAMBDA_CLIENT, OPENAI_PROXY_LAMBDA_ARN, config)
+        except Exception as e:
+            logger.error(f"Erro ao obter embedding da consulta: {e}")
+            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+        try:
+            with metrics.phase("connect"):
+                # Teste de vida/reconexão medidos à parte; DB.run reutiliza a conexão obtida aqui.
+                DB.get()
+            with metrics.phase("execute"):
+                if page is not None:
+                    rows, sliced = DB.run(lambda cur: _search_page(cur, query_embedding, knowledge_base_id, page,
+                                                                   config))
+                elif lexical_weight is not None:
+                    rows = DB.run(lambda cur: _search_hybrid(
+                        cur, query_embedding, query_text, knowledge_base_id, top_k, lexical_weight, config))
+                elif context_window:
+                    rows = DB.run(lambda cur: _search_with_context(
+                        cur, query_embedding, knowledge_base_id, top_k, context_window, config))
+                else:
+                    rows = DB.run(lambda cur: _search(cur, query_embedding, knowledge_base_id, top_k, config))
+                switched = {}
+                if not rows and attempt == 1:
+                    switched = DB.run(lambda cur: _switched_configs(cur, [knowledge_base_id], config))
+        except DatabaseConnectionError as e:
+            logger.error(str(e))
+            return {"statusCode": 500, "body": json.dumps({"error": "Não foi possível conectar ao banco de dados."})}
+        except psycopg2.Error as e:
+            logger.error(f"Erro na busca no banco de dados: {e}")
+            return {"statusCode": 500, "body": json.dumps({"error": f"Database query error: {e}"})}
+        if not switched:
+            break
+        _forget_switched(switched)
+        config = switched[knowledge_base_id]
+
+    if page is not None:
+        return _page_response(rows, sliced, page)
+    if lexical_weight is not None:
+        results = [_hybrid_result(row) for row in rows]
+    elif context_window:
+        results = [_context_result(row) for row in rows]
+    else:
+        results = [{"content": row[0], "score": row[1], "metadata": row[2]} for row in rows]
+    logger.info(f"Busca encontrou {len(results)} resultados.")
+
+    with metrics.phase("serialize"):
+        response_body = json.dumps({"results": results})
+    metrics.count("results", len(results))
+    metrics.count("response_bytes", len(response_body), "Bytes")
 
     return {
         "statusCode": 200,
-        "body": json.dumps({"results": results})
+        "body": response_body
     }
+
+def _page_response(rows, sliced, page: PageCursor):
+    """
+    Resultados da página e o cursor da próxima (None na última). `horizon_reached`
+    indica que a lista de candidatos acabou cheia: pode haver resultados além dela.
+    """
+    results = [{"content": row[1], "score": row[2], "metadata": row[3]} for row in rows]
+    next_cursor = None
+    if sliced.has_more:
+        distance, last_id = sliced.candidates[-1]
+        next_cursor = encode_cursor(page._replace(distance=distance, last_id=last_id))
+    logger.info(f"Página com {len(results)} resultados.")
+    if sliced.horizon_reached:
+        metrics.count("page_horizon_reached")
+
+    with metrics.phase("serialize"):
+        response_body = json.dumps({"results": results, "next_cursor": next_cursor,
+                                    "horizon_reached": sliced.horizon_reached})
+    metrics.count("results", len(results))
+    metrics.count("response_bytes", len(response_body), "Bytes")
+    return {"statusCode": 200, "body": response_body}
+
+def _split_layout_enabled(cur) -> bool:
+    """O gatilho de `chunk_vectors_enable.sql` existe, ou seja, knowledge_chunk_vectors está em dia."""
+    cur.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'knowledge_chunks_sync_vector'")
+    return cur.fetchone() is not None
+
+def _use_split_layout(cur) -> bool:
+    """
+    SPLIT_VECTOR_SEARCH confirmado no banco, uma vez por processo.
+
+    A conferência roda na primeira busca (ou no pré-aquecimento, se houver), então vale
+    também no modo servidor, em scripts e quando o pré-aquecimento não roda ou falha.
+    """
+    global SPLIT_LAYOUT_ENABLED
+    if not SPLIT_VECTOR_SEARCH:
+        return False
+    if SPLIT_LAYOUT_ENABLED is None:
+        with SPLIT_LAYOUT_LOCK:
+            if SPLIT_LAYOUT_ENABLED is None:
+                enabled = _split_layout_enabled(cur)
+                if not enabled:
+                    # Sem o gatilho, a tabela estreita está vazia ou desatualizada: buscar nela perderia resultados
+                    logger.error("SPLIT_VECTOR_SEARCH ligado sem o layout de vetores separados habilitado "
+                                 "(database/optional/chunk_vectors_enable.sql); usando knowledge_chunks.")
+                SPLIT_LAYOUT_ENABLED = enabled
+    return SPLIT_LAYOUT_ENABLED
+
+def _warmup():
+    """Cria o cliente Lambda, abre a conexão com o banco e prepara a busca durante o init."""
+    if _initialize():
+        DB.run(lambda cur: DB.statement_sql(cur, SEARCH_CHUNKS_SPLIT if _use_split_layout(cur) else SEARCH_CHUNKS))
+
+WARMUP = start_init_warmup(_warmup)
@@ -0,0 +1,263 @@
+"""
+Modo servidor: ingestão, consulta e proxy de embeddings em um único processo asyncio.
+
+Sob carga contínua, pagar cada invocação de Lambda e o salto Lambda-para-Lambda até o
+proxy custa mais que um serviço de vida longa. Este ponto de entrada atende as mesmas
+rotas com os mesmos `lambda_handler`s e os mesmos esquemas de requisição e resposta:
+
+  * o servidor HTTP/1.1 (com keep-alive) roda no loop asyncio e monta, para cada
+    requisição, o mesmo evento que o API Gateway entregaria à Lambda;
+  * os handlers são síncronos (psycopg2, urllib3) e rodam em um pool de threads;
+    cada thread mantém a sua conexão com o Neon (`ThreadLocalConnections`), então o
+    pool de conexões é compartilhado entre requisições e limitado a `--workers`;
+  * a chamada ao proxy (`lambda_client.invoke`) vira uma chamada de função no próprio
+    processo (`InProcessLambdaClient`), e todas as threads usam o mesmo pool HTTP
+    keep-alive do proxy com a OpenAI.
+
+Uso (a partir da raiz do repositório):
+    NEON_DB_CONNECTION_STRING=... OPENAI_API_KEY=... python -m src.server.main \\
+        [--host 0.0.0.0] [--port 8080] [--workers 16]
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+logger = logging.getLogger()
+
+IN_PROCESS_PROXY = "in-process-openai-embedding-proxy"
+DEFAULT_WORKERS = 16
+# Limite do API Gateway para o corpo da requisição
+MAX_BODY_BYTES = int(os.environ.get("SERVER_MAX_BODY_BYTES", 10 * 1024 * 1024))
+# Conexões keep-alive sem nova requisição neste intervalo são fechadas
+KEEPALIVE_TIMEOUT_SECONDS = float(os.environ.get("SERVER_KEEPALIVE_TIMEOUT_SECONDS", "75"))
+MAX_HEADERS = 100
+
+
+class InvocationContext:
+    """Contexto mínimo da Lambda usado pelos handlers."""
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+
+
+class InProcessLambdaClient:
+    """Cliente compatível com `invoke` do botocore que chama o handler no próprio processo."""
+
+    def __init__(self, handlers: Dict[str, Callable]):
+        self.handlers = dict(handlers)
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}"):
+        if InvocationType != "RequestResponse":
+            raise ValueError(f"InvocationType não suportado no modo servidor: {InvocationType}")
+        result = self.handlers[FunctionName](json.loads(Payload), InvocationContext(FunctionName))
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode("utf-8"))}
+
+
+class HttpError(Exception):
+    """Requisição HTTP que não chega a um handler."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: Optional[Dict[str, str]]
+    headers: Dict[str, str]
+    body: bytes
+    keep_alive: bool
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """Lê uma requisição HTTP/1.1; retorna None se o cliente fechou a conexão entre requisições."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ")
+    except ValueError:
+        raise HttpError(400, "Linha de requisição inválida.")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HttpError(431, "Cabeçalhos demais.")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if "transfer-encoding" in headers:
+        raise HttpError(411, "Envie o corpo com Content-Length.")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "Content-Length inválido.")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "Corpo da requisição grande demais.")
+    body = await reader.readexactly(length) if length else b""
+
+    path, _, query_string = target.partition("?")
+    query = dict(part.partition("=")[::2] for part in query_string.split("&") if part) or None
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return Request(method.upper(), path, query, headers, body, keep_alive)
+
+
+def lambda_event(request: Request) -> Dict[str, Any]:
+    """Evento no formato do API Gateway (proxy REST), o mesmo que a Lambda recebe."""
+    # Como o API Gateway: corpos binários (ex.: comprimidos) chegam em base64
+    is_base64 = request.headers.get("content-encoding", "identity").lower() != "identity"
+    if not is_base64:
+        try:
+            body = request.body.decode("utf-8")
+        except UnicodeDecodeError:
+            is_base64 = True
+    if is_base64:
+        body = base64.b64encode(request.body).decode("ascii")
+    return {
+        "httpMethod": request.method,
+        "path": request.path,
+        "headers": request.headers,
+        "queryStringParameters": request.query,
+        "body": body,
+        "isBase64Encoded": is_base64,
+    }
+
+
+def encode_response(status: int, headers: Dict[str, str], body: bytes, keep_alive: bool) -> bytes:
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    lines = [f"HTTP/1.1 {status} {reason}"]
+    headers = {"Content-Type": "application/json", **headers}
+    headers["Content-Length"] = str(len(body))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def _error_body(message) -> bytes:
+    return json.dumps({"error": message}).encode("utf-8")
+
+
+async def dispatch(request: Request, routes: Dict, executor) -> tuple:
+    """Executa o handler da rota no pool de threads e converte a resposta da Lambda em HTTP."""
+    if request.method == "GET" and request.path == "/health":
+        return 200, {}, b'{"status": "ok"}'
+    route = routes.get((request.method, request.path))
+    if route is None:
+        if any(path == request.path for _, path in routes):
+            return 405, {}, _error_body("Método não permitido.")
+        return 404, {}, _error_body("Rota não encontrada.")
+
+    function_name, handler = route
+    loop = asyncio.get_running_loop()
+    try:
+        response = await loop.run_in_executor(
+            executor, handler, lambda_event(request), InvocationContext(function_name))
+    except Exception as e:
+        logger.exception(f"Erro inesperado no handler {function_name}: {e}")
+        return 500, {}, _error_body("Erro inesperado ao processar a requisição.")
+
+    body = response.get("body") or ""
+    if response.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    return response.get("statusCode", 200), dict(response.get("headers") or {}), body
+
+
+async def handle_connection(reader, writer, routes, executor):
+    """Atende as requisições de uma conexão, em ordem, enquanto o cliente mantiver keep-alive."""
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(read_request(reader), KEEPALIVE_TIMEOUT_SECONDS)
+            except HttpError as e:
+                writer.write(encode_response(e.status, {}, _error_body(str(e)), keep_alive=False))
+                await writer.drain()
+                break
+            if request is None:
+                break
+            status, headers, body = await dispatch(request, routes, executor)
+            writer.write(encode_response(status, headers, body, request.keep_alive))
+            await writer.drain()
+            if not request.keep_alive:
+                break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+        # Cliente ocioso, conexão cortada ou linha acima do limite do StreamReader
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host, port, routes, executor) -> asyncio.AbstractServer:
+    return await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, routes, executor), host, port)
+
+
+def _initialize(workers) -> Optional[Dict]:
+    """Inicializa as três funções no modo servidor e retorna as rotas HTTP."""
+    # Uma conexão keep-alive com a OpenAI por thread do pool
+    os.environ.setdefault("OPENAI_HTTP_POOL_SIZE", str(workers))
+    # O proxy é chamado no próprio processo, por este nome
+    os.environ["OPENAI_PROXY_LAMBDA_ARN"] = IN_PROCESS_PROXY
+
+    import src.ingest_function.main as ingest
+    import src.openai_embedding_proxy.main as proxy
+    import src.query_function.main as query
+
+    client = InProcessLambdaClient({IN_PROCESS_PROXY: proxy.lambda_handler})
+    if not (proxy._initialize()
+            and ingest._initialize(lambda_client=client, thread_local_db=True)
+            and query._initialize(lambda_client=client, thread_local_db=True)):
+        return None
+    return {
+        ("POST", "/ingest"): ("ingest_function", ingest.lambda_handler),
+        ("DELETE", "/ingest"): ("ingest_function", ingest.lambda_handler),
+        ("POST", "/query"): ("query_function", query.lambda_handler),
+    }
+
+
+async def serve(host, port, workers):
+    routes = _initialize(workers)
+    if routes is None:
+        raise SystemExit("Erro de configuração do servidor; veja o log.")
+    with ThreadPoolExecutor(workers, thread_name_prefix="cortexa-handler") as executor:
+        server = await start_server(host, port, routes, executor)
+        addresses = ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets)
+        logger.info(f"Servidor Cortexa ouvindo em {addresses} com {workers} workers.")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVER_WORKERS", DEFAULT_WORKERS)),
+                        help="Threads que executam os handlers (e conexões com o banco).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
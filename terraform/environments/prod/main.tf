@@ -34,6 +34,31 @@ resource "aws_iam_role" "lambda_exec_role" {
   ]
 }
 
+# Read access for `source` ingests (files read from S3 by the ingest function).
+# s3:ListBucket lets HeadObject report a missing key as 404 instead of 403.
+resource "aws_iam_role_policy" "ingest_source_read" {
+  count = length(var.ingest_source_buckets) > 0 ? 1 : 0
+
+  name = "cortexa-ingest-source-read-prod"
+  role = aws_iam_role.lambda_exec_role.id
+
+  policy = jsonencode({
+    Version   = "2012-10-17",
+    Statement = [
+      {
+        Action   = "s3:GetObject",
+        Effect   = "Allow",
+        Resource = [for bucket in var.ingest_source_buckets : "arn:aws:s3:::${bucket}/*"]
+      },
+      {
+        Action   = "s3:ListBucket",
+        Effect   = "Allow",
+        Resource = [for bucket in var.ingest_source_buckets : "arn:aws:s3:::${bucket}"]
+      }
+    ]
+  })
+}
+
 resource "aws_sns_topic" "alerts" {
   name = "cortexa-alerts-topic-prod"
 }
@@ -53,6 +78,15 @@ module "lambda" {
   environment_variables = each.value.environment_variables
 }
 
+locals {
+  # Phases timed by each function (see src/common/metrics.py)
+  function_phases = {
+    "ingest_function"        = ["parse", "chunk", "embed", "connect", "execute", "serialize"]
+    "query_function"         = ["parse", "embed", "connect", "execute", "serialize"]
+    "openai_embedding_proxy" = ["parse", "serialize", "openai"]
+  }
+}
+
 module "monitoring" {
   for_each = module.lambda
 
@@ -60,4 +94,5 @@ module "monitoring" {
 
   function_name   = each.value.function_name
   alert_topic_arn = aws_sns_topic.alerts.arn
+  phases          = lookup(local.function_phases, each.key, ["parse", "embed", "connect", "execute", "serialize"])
 }
@@ -16,6 +16,12 @@ variable "lambda_runtime" {
   default     = "python3.11"
 }
 
+variable "ingest_source_buckets" {
+  description = "S3 buckets the ingest function may read `source` files from. Empty disables the grant."
+  type        = list(string)
+  default     = []
+}
+
 variable "functions" {
   description = "A map of lambda functions to create."
   type = map(object({
@@ -31,3 +31,52 @@ resource "aws_cloudwatch_metric_alarm" "duration" {
     FunctionName = var.function_name
   }
 }
+
+data "aws_region" "current" {}
+
+locals {
+  phase_widgets = [
+    for stat in ["p50", "p99"] : {
+      type   = "metric"
+      width  = 12
+      height = 6
+      properties = {
+        title   = "${var.function_name} - latency per phase (${stat})"
+        region  = data.aws_region.current.name
+        view    = "timeSeries"
+        stacked = stat == "p50"
+        stat    = stat
+        period  = 60
+        metrics = [
+          for phase in var.phases : [var.metrics_namespace, "${phase}_ms", "Function", var.function_name]
+        ]
+      }
+    }
+  ]
+
+  start_widgets = [
+    {
+      type   = "metric"
+      width  = 12
+      height = 6
+      properties = {
+        title  = "${var.function_name} - total latency, cold vs warm (p50)"
+        region = data.aws_region.current.name
+        view   = "timeSeries"
+        stat   = "p50"
+        period = 60
+        metrics = [
+          for start in ["cold", "warm"] : [var.metrics_namespace, "total_ms", "Function", var.function_name, "ColdStart", start]
+        ]
+      }
+    }
+  ]
+}
+
+resource "aws_cloudwatch_dashboard" "phases" {
+  dashboard_name = "${var.function_name}-phases"
+
+  dashboard_body = jsonencode({
+    widgets = concat(local.phase_widgets, local.start_widgets)
+  })
+}
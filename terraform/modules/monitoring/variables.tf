@@ -7,3 +7,15 @@ variable "alert_topic_arn" {
   description = "The ARN of the SNS topic to send alerts to."
   type        = string
 }
+
+variable "metrics_namespace" {
+  description = "The CloudWatch namespace of the per-phase EMF metrics emitted by the function."
+  type        = string
+  default     = "Cortexa"
+}
+
+variable "phases" {
+  description = "The phases timed by the function (emitted as <phase>_ms metrics)."
+  type        = list(string)
+  default     = ["parse", "embed", "connect", "execute", "serialize"]
+}
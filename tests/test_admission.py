@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.common.admission import (
+    ADMITTED,
+    Admission,
+    AdmissionLimits,
+    TenantAdmission,
+    admission_from_env,
+    shed_response,
+)
+
+# --- Fixtures ---
+
+def _run_returning(row):
+    cursor = MagicMock()
+    cursor.fetchone.return_value = row
+    run = MagicMock(side_effect=lambda fn: fn(cursor))
+    return run, cursor
+
+# --- Testes da Admissão ---
+
+def test_admission_disabled_by_default():
+    """Sem limites configurados, nenhuma ida ao banco é feita."""
+    admission = admission_from_env({}, "query")
+    run = MagicMock()
+
+    assert admission.admit(run, "kb") == ADMITTED
+    admission.release(run, ADMITTED)
+    run.assert_not_called()
+
+def test_admission_from_env():
+    """Os limites são lidos por operação; a rajada padrão é a própria taxa."""
+    admission = admission_from_env({"TENANT_INGEST_MAX_CONCURRENT": "2", "TENANT_INGEST_RATE_PER_SECOND": "5",
+                                    "TENANT_LEASE_SECONDS": "60"}, "ingest")
+
+    assert admission.operation == "ingest"
+    assert admission.limits == AdmissionLimits(2, 5.0, 5.0, 60.0)
+
+def test_admission_admitted_and_released():
+    """Uma requisição admitida recebe um lease, que é apagado ao final."""
+    admission = TenantAdmission("query", AdmissionLimits(max_concurrent=2))
+    run, cursor = _run_returning(("lease-1", None, None))
+
+    result = admission.admit(run, "kb")
+    admission.release(run, result)
+
+    assert result == Admission(True, lease_id="lease-1")
+    assert cursor.execute.call_args_list[0].args[1] == ("kb", "query", 2, 0.0, 1.0, 900)
+    assert cursor.execute.call_args_list[1].args[1] == ("lease-1",)
+
+def test_admission_shed_response_and_metrics(mocker):
+    """Requisições recusadas viram 429 com Retry-After e são contadas nas métricas."""
+    count = mocker.patch("src.common.admission.metrics.count")
+    admission = TenantAdmission("query", AdmissionLimits(rate_per_second=2))
+    run, _ = _run_returning((None, 0.3, "rate"))
+
+    result = admission.admit(run, "kb")
+    response = shed_response(result)
+
+    assert result == Admission(False, retry_after=0.3, reason="rate")
+    assert response["statusCode"] == 429
+    assert response["headers"] == {"Retry-After": "1"}
+    assert json.loads(response["body"])["reason"] == "rate"
+    assert [c.args[0] for c in count.call_args_list] == ["shed_requests", "shed_rate"]
+
+def test_admission_fails_open():
+    """Se o controle de admissão falhar, a requisição segue."""
+    admission = TenantAdmission("ingest", AdmissionLimits(max_concurrent=1))
+    run = MagicMock(side_effect=RuntimeError("banco indisponível"))
+
+    assert admission.admit(run, "kb") == ADMITTED
+    admission.release(run, Admission(True, lease_id="lease-1"))
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_concurrency_and_rate_limits():
+    """
+    Limites por tenant aplicados pelo banco, independentes entre bases e operações.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    import uuid
+
+    from src.common.db import ConnectionManager
+
+    db = ConnectionManager(dsn, autocommit=True)
+    kb, other_kb = str(uuid.uuid4()), str(uuid.uuid4())
+
+    concurrency = TenantAdmission("ingest", AdmissionLimits(max_concurrent=2))
+    first, second = concurrency.admit(db.run, kb), concurrency.admit(db.run, kb)
+    assert first.admitted and second.admitted
+    assert concurrency.admit(db.run, kb).reason == "concurrency"
+    assert concurrency.admit(db.run, other_kb).admitted
+    concurrency.release(db.run, first)
+    assert concurrency.admit(db.run, kb).admitted
+
+    expiring = TenantAdmission("query", AdmissionLimits(max_concurrent=1, lease_seconds=0.05))
+    assert expiring.admit(db.run, kb).admitted
+    time.sleep(0.1)
+    assert expiring.admit(db.run, kb).admitted
+
+    rate = TenantAdmission("rate", AdmissionLimits(rate_per_second=2, burst=2))
+    assert [rate.admit(db.run, kb).admitted for _ in range(3)] == [True, True, False]
+    shed = rate.admit(db.run, kb)
+    assert 0 < shed.retry_after <= 0.5
+
+    db.run(lambda cur: cur.execute("DELETE FROM tenant_leases WHERE knowledge_base_id = ANY(%s::uuid[])",
+                                   ([kb, other_kb],)))
+    db.run(lambda cur: cur.execute("DELETE FROM tenant_rate_buckets WHERE knowledge_base_id = %s", (kb,)))
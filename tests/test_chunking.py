@@ -0,0 +1,108 @@
+import pytest
+
+from src.common.chunking import (
+    Chunk,
+    approximate_token_count,
+    get_tokenizer,
+    iter_chunks,
+    pack_batches,
+)
+
+
+def _word_count(text):
+    return len(text.split())
+
+# --- Testes de Contagem de Tokens ---
+
+def test_approximate_token_count():
+    """Palavras curtas e pontuação contam um token cada; palavras longas contam mais."""
+    assert approximate_token_count("") == 0
+    assert approximate_token_count("a b c.") == 4
+    assert approximate_token_count("internacionalização") > 1
+
+def test_get_tokenizer_fallback():
+    """Sem especificação (ou com tokenizador indisponível), usa a estimativa aproximada."""
+    assert get_tokenizer(None) is approximate_token_count
+    assert get_tokenizer("approx") is approximate_token_count
+    assert get_tokenizer("tiktoken:encoding-inexistente") is approximate_token_count
+
+# --- Testes do Chunker ---
+
+def test_iter_chunks_is_lazy():
+    """O chunker é um gerador: nada é processado antes da iteração."""
+    chunks = iter_chunks("Primeira frase. Segunda frase.", count_tokens=_word_count)
+    assert not isinstance(chunks, list)
+    assert next(chunks) == Chunk(0, "Primeira frase. Segunda frase.", 4)
+
+@pytest.mark.parametrize("test_input", [None, "", "   \n\n\t  "])
+def test_iter_chunks_empty_input(test_input):
+    """Entradas vazias ou inválidas não geram chunks."""
+    assert list(iter_chunks(test_input)) == []
+
+def test_iter_chunks_respects_sentences_and_budget():
+    """Nenhum chunk excede o limite e nenhuma sentença é cortada."""
+    sentences = [f"Frase número {i} com algumas palavras extras." for i in range(50)]
+    text = " ".join(sentences)
+
+    chunks = list(iter_chunks(text, max_tokens=30, overlap_tokens=0, count_tokens=_word_count))
+
+    assert len(chunks) > 1
+    assert all(c.token_count <= 30 for c in chunks)
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert chunk.text.endswith(".")
+        assert chunk.token_count == _word_count(chunk.text)
+    # Sem sobreposição, a concatenação reconstrói o texto original
+    assert " ".join(c.text for c in chunks) == text
+
+def test_iter_chunks_overlap_uses_whole_sentences():
+    """A sobreposição repete as últimas sentenças inteiras do chunk anterior."""
+    text = "A b c. D e f. G h i. J k l. M n o."
+    chunks = list(iter_chunks(text, max_tokens=9, overlap_tokens=3, count_tokens=_word_count))
+
+    assert [c.text for c in chunks] == ["A b c. D e f. G h i.", "G h i. J k l. M n o."]
+
+def test_iter_chunks_breaks_at_paragraphs():
+    """Um novo parágrafo fecha um chunk já cheio, sem sobreposição entre parágrafos."""
+    text = "Um dois três quatro cinco seis sete.\n\nOito nove dez."
+    chunks = list(iter_chunks(text, max_tokens=10, overlap_tokens=2, count_tokens=_word_count))
+
+    assert [c.text for c in chunks] == ["Um dois três quatro cinco seis sete.", "Oito nove dez."]
+
+def test_iter_chunks_joins_short_paragraphs():
+    """Parágrafos curtos são agrupados no mesmo chunk, preservando a quebra."""
+    chunks = list(iter_chunks("Título.\n\nCorpo curto.", max_tokens=50, count_tokens=_word_count))
+
+    assert [c.text for c in chunks] == ["Título.\n\nCorpo curto."]
+
+def test_iter_chunks_splits_oversized_sentence_by_words():
+    """Sentenças maiores que o limite são divididas por palavras, nunca no meio de uma."""
+    text = " ".join(f"palavra{i}" for i in range(25))
+    chunks = list(iter_chunks(text, max_tokens=10, overlap_tokens=0, count_tokens=_word_count))
+
+    assert [c.token_count for c in chunks] == [10, 10, 5]
+    assert " ".join(c.text for c in chunks) == text
+
+def test_iter_chunks_invalid_overlap():
+    """A sobreposição precisa ser menor que o tamanho do chunk."""
+    with pytest.raises(ValueError):
+        list(iter_chunks("texto", max_tokens=10, overlap_tokens=10))
+
+# --- Testes do Empacotamento em Lotes ---
+
+def test_pack_batches_respects_token_and_input_limits():
+    """Os lotes são preenchidos até o limite de tokens ou de entradas, o que vier primeiro."""
+    chunks = [Chunk(i, f"chunk {i}", 40) for i in range(10)]
+
+    by_tokens = list(pack_batches(chunks, max_tokens=100, max_inputs=100))
+    assert [len(b) for b in by_tokens] == [2, 2, 2, 2, 2]
+
+    by_inputs = list(pack_batches(chunks, max_tokens=10_000, max_inputs=4))
+    assert [len(b) for b in by_inputs] == [4, 4, 2]
+    assert [c.index for b in by_inputs for c in b] == list(range(10))
+
+def test_pack_batches_oversized_chunk_gets_own_batch():
+    """Um chunk acima do limite de tokens ainda é enviado, sozinho em seu lote."""
+    chunks = [Chunk(0, "a", 10), Chunk(1, "b", 500), Chunk(2, "c", 10)]
+
+    assert [[c.index for c in b] for b in pack_batches(chunks, max_tokens=100)] == [[0], [1], [2]]
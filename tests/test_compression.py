@@ -0,0 +1,103 @@
+import base64
+import gzip
+import json
+
+import pytest
+
+from src.common import compression
+
+# --- Fixtures ---
+
+def _gzip_event(text, **headers):
+    return {
+        "headers": {"Content-Encoding": "gzip", **headers},
+        "isBase64Encoded": True,
+        "body": base64.b64encode(gzip.compress(text.encode("utf-8"))).decode("ascii"),
+    }
+
+@compression.negotiated
+def echo_handler(event, context):
+    """Handler que devolve o corpo recebido, com tamanho suficiente para ser comprimido."""
+    return {"statusCode": 200, "body": json.dumps({"echo": json.loads(event["body"]), "pad": "x" * 2000})}
+
+# --- Testes da Requisição ---
+
+def test_decode_body_plain_and_gzip():
+    """Corpos sem compressão passam intactos; gzip em base64 é descomprimido."""
+    assert compression.decode_body({"body": '{"a": 1}'}) == '{"a": 1}'
+    assert compression.decode_body(_gzip_event('{"texto": "ação"}')) == '{"texto": "ação"}'
+
+@pytest.mark.parametrize("event,status", [
+    ({"headers": {"content-encoding": "br"}, "isBase64Encoded": True, "body": "AAAA"}, 415),
+    ({"headers": {"content-encoding": "gzip"}, "isBase64Encoded": True, "body": "não é base64"}, 400),
+    ({"headers": {"content-encoding": "gzip"}, "isBase64Encoded": True, "body": "AAAA"}, 400),
+    ({"headers": {"content-encoding": "gzip"}, "body": "{}"}, 400),
+])
+def test_decode_body_errors(event, status):
+    """Codificações desconhecidas, base64 ou gzip inválidos são recusados."""
+    with pytest.raises(compression.BodyEncodingError) as error:
+        compression.decode_body(event)
+    assert error.value.status_code == status
+
+def test_decode_body_limits_decompressed_size(mocker):
+    """Um corpo pequeno que descomprime além do limite recebe 413 sem ser expandido por inteiro."""
+    mocker.patch.object(compression, "MAX_DECODED_BODY_BYTES", 1000)
+
+    with pytest.raises(compression.BodyEncodingError) as error:
+        compression.decode_body(_gzip_event(" " * 100_000))
+    assert error.value.status_code == 413
+
+def test_zstd_without_package_is_unsupported(mocker):
+    """Sem o pacote zstandard, zstd não é aceito nem oferecido."""
+    mocker.patch.object(compression, "zstandard", None)
+
+    with pytest.raises(compression.BodyEncodingError) as error:
+        compression.decode_body({"headers": {"Content-Encoding": "zstd"}, "isBase64Encoded": True, "body": "AAAA"})
+    assert error.value.status_code == 415
+    assert compression.choose_encoding("zstd") is None
+
+def test_zstd_round_trip():
+    """Com o pacote zstandard instalado, zstd funciona nos dois sentidos."""
+    zstandard = pytest.importorskip("zstandard")
+    data = zstandard.ZstdCompressor().compress(b'{"a": 1}')
+    event = {"headers": {"Content-Encoding": "zstd"}, "isBase64Encoded": True,
+             "body": base64.b64encode(data).decode("ascii")}
+
+    assert compression.decode_body(event) == '{"a": 1}'
+    assert compression.choose_encoding("gzip, zstd") == "zstd"
+
+# --- Testes da Resposta ---
+
+@pytest.mark.parametrize("accept,expected", [
+    ("gzip", "gzip"),
+    ("gzip;q=0, deflate", None),
+    ("*", "gzip"),
+    ("identity", None),
+    ("", None),
+    ("br, GZIP;q=0.5", "gzip"),
+])
+def test_choose_encoding(mocker, accept, expected):
+    """A codificação vem do Accept-Encoding, respeitando q=0 e o curinga."""
+    mocker.patch.object(compression, "zstandard", None)
+    assert compression.choose_encoding(accept) == expected
+
+def test_encode_response_skips_small_bodies():
+    """Respostas pequenas não são comprimidas."""
+    response = {"statusCode": 200, "body": '{"results": []}'}
+
+    assert compression.encode_response(response, "gzip") is response
+
+def test_negotiated_handler_round_trip():
+    """O handler lê o corpo descomprimido e a resposta volta em gzip/base64 com os cabeçalhos."""
+    response = echo_handler(_gzip_event('{"a": 1}', **{"Accept-Encoding": "gzip"}), None)
+
+    assert response["isBase64Encoded"] is True
+    assert response["headers"] == {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+    body = json.loads(gzip.decompress(base64.b64decode(response["body"])))
+    assert body["echo"] == {"a": 1}
+
+def test_negotiated_handler_rejects_bad_body():
+    """Erros de decodificação são respondidos sem chamar o handler."""
+    response = echo_handler({"headers": {"Content-Encoding": "br"}, "isBase64Encoded": True, "body": "AAAA"}, None)
+
+    assert response["statusCode"] == 415
@@ -0,0 +1,397 @@
+import os
+import threading
+from unittest.mock import MagicMock
+
+import psycopg2
+import pytest
+
+from src.common.db import (
+    PRIMARY_WAL_LSN_SQL,
+    REPLICA_LAG_SQL,
+    ConnectionManager,
+    DatabaseConnectionError,
+    PreparedStatement,
+    ReadReplicaRouter,
+    ThreadLocalConnections,
+)
+
+KB_ID = "2f1c5c1e-7a43-4d4b-9a0e-3c2b1f4e5d6a"
+STATEMENT = PreparedStatement("cortexa_test", ("uuid", "integer"), "SELECT $1::text, $2")
+
+# --- Fixtures ---
+
+def _make_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    cursor = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+    return conn, cursor
+
+@pytest.fixture
+def mock_connect(mocker):
+    """Mocka psycopg2.connect, devolvendo uma conexão nova a cada chamada."""
+    connections = []
+
+    def connect(*args, **kwargs):
+        conn, _ = _make_connection()
+        connections.append(conn)
+        return conn
+
+    patched = mocker.patch('psycopg2.connect', side_effect=connect)
+    patched.connections = connections
+    return patched
+
+# --- Testes do Statement ---
+
+def test_prepared_statement_sql():
+    """O mesmo statement gera PREPARE, EXECUTE e a versão direta com placeholders do psycopg2."""
+    assert STATEMENT.prepare_sql == "PREPARE cortexa_test (uuid, integer) AS SELECT $1::text, $2"
+    assert STATEMENT.execute_sql == "EXECUTE cortexa_test (%s, %s)"
+    assert STATEMENT.direct_sql == "SELECT %s::text, %s"
+
+# --- Testes de Conexão ---
+
+def test_get_reuses_connection(mock_connect):
+    """Conexões usadas recentemente são reutilizadas sem teste de vida."""
+    manager = ConnectionManager("postgresql://fake", idle_check_seconds=60)
+
+    first = manager.get()
+    assert manager.get() is first
+    assert mock_connect.call_count == 1
+    first.cursor.assert_not_called()
+    assert mock_connect.call_args.kwargs["connect_timeout"] == 5
+
+def test_get_checks_idle_connection(mock_connect):
+    """Após o tempo ocioso, a conexão é testada com SELECT 1 e reaproveitada se estiver viva."""
+    manager = ConnectionManager("postgresql://fake", idle_check_seconds=0)
+    first = manager.get()
+
+    assert manager.get() is first
+    first.cursor.return_value.__enter__.return_value.execute.assert_called_once_with("SELECT 1")
+    first.rollback.assert_called_once()
+
+def test_get_reconnects_dropped_idle_connection(mock_connect):
+    """Uma conexão derrubada pelo servidor (closed ainda 0) é substituída de forma transparente."""
+    manager = ConnectionManager("postgresql://fake", idle_check_seconds=0)
+    first = manager.get()
+    first.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError("SSL closed")
+
+    second = manager.get()
+
+    assert second is not first
+    assert mock_connect.call_count == 2
+    first.close.assert_called_once()
+
+def test_get_connection_failure(mocker):
+    """Falhas ao conectar viram DatabaseConnectionError."""
+    mocker.patch('psycopg2.connect', side_effect=psycopg2.OperationalError("timeout"))
+    manager = ConnectionManager("postgresql://fake")
+
+    with pytest.raises(DatabaseConnectionError):
+        manager.get()
+
+# --- Testes de Execução ---
+
+def test_run_commits_and_returns_result(mock_connect):
+    """run executa a função com um cursor e confirma a transação quando pedido."""
+    manager = ConnectionManager("postgresql://fake")
+
+    assert manager.run(lambda cur: "ok", commit=True) == "ok"
+    mock_connect.connections[0].commit.assert_called_once()
+
+def test_run_retries_once_on_lost_connection(mock_connect):
+    """Se a conexão cair durante a operação, reconecta e repete uma única vez."""
+    manager = ConnectionManager("postgresql://fake")
+    calls = []
+
+    def operation(cur):
+        calls.append(cur)
+        conn = mock_connect.connections[-1]
+        if len(calls) == 1:
+            conn.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return "ok"
+
+    assert manager.run(operation) == "ok"
+    assert len(calls) == 2
+    assert mock_connect.call_count == 2
+
+def test_run_gives_up_after_second_failure(mock_connect):
+    """Uma segunda queda de conexão é reportada como DatabaseConnectionError."""
+    manager = ConnectionManager("postgresql://fake")
+
+    def operation(cur):
+        mock_connect.connections[-1].closed = 2
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    with pytest.raises(DatabaseConnectionError):
+        manager.run(operation)
+    assert mock_connect.call_count == 2
+
+def test_run_rolls_back_query_errors(mock_connect):
+    """Erros de SQL não são repetidos; a transação é desfeita e o erro propagado."""
+    manager = ConnectionManager("postgresql://fake")
+
+    def operation(cur):
+        raise psycopg2.ProgrammingError("syntax error")
+
+    with pytest.raises(psycopg2.ProgrammingError):
+        manager.run(operation, commit=True)
+    conn = mock_connect.connections[0]
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+    assert mock_connect.call_count == 1
+
+# --- Testes de Statements Preparados ---
+
+def test_statement_prepared_once_per_connection(mock_connect):
+    """O PREPARE roda uma vez por conexão; depois só o EXECUTE é enviado."""
+    manager = ConnectionManager("postgresql://fake")
+    cur = MagicMock()
+    manager.get()
+
+    assert manager.statement_sql(cur, STATEMENT) == STATEMENT.execute_sql
+    assert manager.statement_sql(cur, STATEMENT) == STATEMENT.execute_sql
+    cur.execute.assert_called_once_with(STATEMENT.prepare_sql)
+
+def test_statement_reprepared_after_reconnect(mock_connect):
+    """Uma nova conexão não tem os statements do servidor anterior e os prepara de novo."""
+    manager = ConnectionManager("postgresql://fake", idle_check_seconds=0)
+    cur = MagicMock()
+    first = manager.get()
+    manager.statement_sql(cur, STATEMENT)
+    first.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError("gone")
+
+    manager.get()
+    manager.statement_sql(cur, STATEMENT)
+
+    assert cur.execute.call_count == 2
+
+def test_statement_without_prepare(mock_connect):
+    """Com statements preparados desligados (ex.: PgBouncer), usa a query direta."""
+    manager = ConnectionManager("postgresql://fake", use_prepared_statements=False)
+    cur = MagicMock()
+
+    assert manager.statement_sql(cur, STATEMENT) == STATEMENT.direct_sql
+    cur.execute.assert_not_called()
+
+# --- Testes do Roteamento de Leitura ---
+
+def _manager_with_lag(lag):
+    """Gerenciador mockado: a verificação de atraso (ou a posição do WAL) retorna `lag`; leituras retornam o nome."""
+    manager = MagicMock(spec=ConnectionManager)
+    manager.connection = MagicMock()
+    manager.cursors = []
+
+    def run(fn, commit=False):
+        cur = MagicMock()
+        cur.fetchone.return_value = (lag,)
+        cur.connection = manager.connection
+        manager.cursors.append(cur)
+        return fn(cur)
+
+    manager.run.side_effect = run
+    return manager
+
+def test_router_without_replica_uses_primary():
+    """Sem réplica configurada, as leituras vão para o primário."""
+    primary = _manager_with_lag(0)
+    router = ReadReplicaRouter(primary)
+
+    assert router.run(lambda cur: "lido") == "lido"
+    primary.run.assert_called_once()
+
+def test_router_uses_healthy_replica():
+    """Com atraso abaixo do limite, a leitura vai para a réplica e o atraso fica cacheado."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(0.5)
+    router = ReadReplicaRouter(primary, replica, max_lag_seconds=5, check_seconds=60)
+
+    router.run(lambda cur: None)
+    router.run(lambda cur: None)
+
+    # Só a posição do WAL, lida uma vez para a verificação de atraso
+    primary.run.assert_called_once()
+    # Uma verificação de atraso + duas leituras
+    assert replica.run.call_count == 3
+
+def test_router_measures_replica_lag_against_primary_wal():
+    """O atraso é medido até a posição atual do WAL do primário, não só até o que a réplica recebeu."""
+    primary, replica = _manager_with_lag("0/16B3748"), _manager_with_lag(0)
+    router = ReadReplicaRouter(primary, replica)
+
+    router.run(lambda cur: None)
+
+    assert primary.cursors[0].execute.call_args.args == (PRIMARY_WAL_LSN_SQL,)
+    assert replica.cursors[0].execute.call_args.args == (REPLICA_LAG_SQL, ("0/16B3748",))
+
+def test_router_falls_back_on_replica_lag():
+    """Réplica atrasada além do limite: leituras vão para o primário."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(30)
+    router = ReadReplicaRouter(primary, replica, max_lag_seconds=5)
+
+    router.run(lambda cur: None)
+
+    # Posição do WAL + leitura
+    assert primary.run.call_count == 2
+    assert replica.run.call_count == 1
+
+def test_router_falls_back_on_unreachable_replica():
+    """Réplica inacessível na verificação: leituras vão para o primário."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(0)
+    replica.run.side_effect = DatabaseConnectionError("réplica fora do ar")
+    router = ReadReplicaRouter(primary, replica)
+
+    assert router.run(lambda cur: "lido") == "lido"
+    assert primary.run.call_count == 2
+
+def test_router_retries_on_primary_when_replica_drops():
+    """Se a réplica cair durante a leitura, a leitura é refeita no primário e a réplica evitada."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(0)
+    router = ReadReplicaRouter(primary, replica, check_seconds=60)
+
+    def read(cur):
+        if cur.connection is replica.connection:
+            raise DatabaseConnectionError("réplica caiu")
+        return "lido"
+
+    assert router.run(read) == "lido"
+    assert router.run(read) == "lido"
+    # Posição do WAL + duas leituras
+    assert primary.run.call_count == 3
+    assert replica.run.call_count == 2
+
+@pytest.mark.parametrize("error", [
+    psycopg2.errors.SerializationFailure("canceling statement due to conflict with recovery"),
+    psycopg2.errors.QueryCanceled("canceling statement due to conflict with recovery"),
+    psycopg2.errors.DeadlockDetected("canceling statement due to conflict with recovery"),
+])
+def test_router_retries_on_primary_on_recovery_conflict(error):
+    """Leituras canceladas pela réplica por conflito com a recuperação são refeitas no primário."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(0)
+    router = ReadReplicaRouter(primary, replica, check_seconds=60)
+
+    def read(cur):
+        if cur.connection is replica.connection:
+            raise error
+        return "lido"
+
+    assert router.run(read) == "lido"
+    assert router.run(read) == "lido"
+    # Posição do WAL + duas leituras; a réplica é evitada até a próxima verificação
+    assert primary.run.call_count == 3
+    assert replica.run.call_count == 2
+
+def test_router_does_not_retry_other_replica_errors():
+    """Outros erros da leitura (ex.: statement_timeout) não são repetidos no primário."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(0)
+    router = ReadReplicaRouter(primary, replica)
+
+    def read(cur):
+        if cur.connection is replica.connection:
+            raise psycopg2.errors.QueryCanceled("canceling statement due to statement timeout")
+        return "lido"
+
+    with pytest.raises(psycopg2.errors.QueryCanceled):
+        router.run(read)
+    assert primary.run.call_count == 1
+
+def test_router_get_falls_back_when_replica_does_not_connect():
+    """Se a réplica não conecta em `get` (fase "connect" da consulta), a conexão vem do primário."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(0)
+    replica.get.side_effect = DatabaseConnectionError("réplica fora do ar")
+    router = ReadReplicaRouter(primary, replica, check_seconds=60)
+
+    assert router.get() is primary.get.return_value
+    assert router.run(lambda cur: cur.connection) is primary.connection
+    replica.get.assert_called_once()
+
+def test_router_statement_sql_uses_cursor_owner():
+    """Statements são preparados no gerenciador dono da conexão do cursor."""
+    primary, replica = _manager_with_lag(0), _manager_with_lag(0)
+    router = ReadReplicaRouter(primary, replica)
+    cur = MagicMock()
+
+    cur.connection = replica.connection
+    router.statement_sql(cur, STATEMENT)
+    cur.connection = primary.connection
+    router.statement_sql(cur, STATEMENT)
+
+    replica.statement_sql.assert_called_once_with(cur, STATEMENT)
+    primary.statement_sql.assert_called_once_with(cur, STATEMENT)
+
+# --- Testes do ThreadLocalConnections ---
+
+def test_thread_local_connections_one_manager_per_thread():
+    """Cada thread cria o seu gerenciador uma única vez e o reutiliza."""
+    created = []
+
+    def factory():
+        manager = MagicMock()
+        manager.run.side_effect = lambda fn, **kwargs: (manager, kwargs)
+        created.append(manager)
+        return manager
+
+    connections = ThreadLocalConnections(factory)
+    assert connections.run(None, commit=True) == (created[0], {"commit": True})
+    connections.get()
+
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(connections.run(None)[0]))
+    thread.start()
+    thread.join()
+
+    assert len(created) == 2
+    assert seen == [created[1]]
+    created[0].get.assert_called_once_with()
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_reconnects_after_server_termination():
+    """
+    Derruba a conexão pelo servidor (como no scale-to-zero do Neon) e verifica a recuperação.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres descartável.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+
+    manager = ConnectionManager(dsn, idle_check_seconds=0, autocommit=True)
+    pid = manager.run(lambda cur: (cur.execute("SELECT pg_backend_pid()"), cur.fetchone()[0])[1])
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute("SELECT pg_terminate_backend(%s)", (pid,))
+    admin.close()
+
+    def prepared_query(cur):
+        cur.execute(manager.statement_sql(cur, STATEMENT), (KB_ID, 1))
+        return cur.fetchone()
+
+    assert manager.run(prepared_query) == (KB_ID, 1)
+    assert manager.run(lambda cur: (cur.execute("SELECT pg_backend_pid()"), cur.fetchone()[0])[1]) != pid
+
+@pytest.mark.integration
+def test_integration_read_replica_routing():
+    """
+    Usa dois bancos (ou um primário e uma réplica em streaming) e confere o roteamento.
+    Requer CORTEXA_TEST_DB_DSN e CORTEXA_TEST_REPLICA_DSN.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    replica_dsn = os.environ.get("CORTEXA_TEST_REPLICA_DSN")
+    if not dsn or not replica_dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN/CORTEXA_TEST_REPLICA_DSN não definidos.")
+
+    def current_database(cur):
+        cur.execute("SELECT current_database()")
+        return cur.fetchone()[0]
+
+    primary = ConnectionManager(dsn, autocommit=True)
+    replica = ConnectionManager(replica_dsn, autocommit=True)
+    expected_replica = replica.run(current_database)
+    router = ReadReplicaRouter(primary, replica, check_seconds=0)
+
+    assert router.run(current_database) == expected_replica
+
+    router.max_lag_seconds = -1
+    assert router.run(current_database) == primary.run(current_database)
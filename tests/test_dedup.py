@@ -0,0 +1,140 @@
+import os
+import random
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.common.chunking import Chunk
+from src.common.dedup import NEAR_DUPLICATES, near_duplicates, threshold_from_env, unique_texts, validate_threshold
+
+# --- Fixtures ---
+
+def _unit(seed, base=None, noise=1.0):
+    rng = random.Random(seed)
+    values = [(base[i] if base else 0.0) + rng.gauss(0, noise) for i in range(1536)]
+    norm = sum(v * v for v in values) ** 0.5
+    return [v / norm for v in values]
+
+# --- Testes Unitários ---
+
+@pytest.mark.parametrize("value,valid", [
+    (0.95, True), (1, True), (0, False), (1.5, False), (True, False), ("0.9", False),
+])
+def test_validate_threshold(value, valid):
+    """O limiar é uma similaridade de cosseno em (0, 1]."""
+    assert validate_threshold(value) is valid
+
+@pytest.mark.parametrize("raw,expected", [(None, None), ("", None), ("  ", None), ("0.97", 0.97), ("1", 1.0)])
+def test_threshold_from_env(raw, expected):
+    """Vazio desliga; um valor válido é convertido uma única vez."""
+    environ = {} if raw is None else {"INGEST_DEDUP_THRESHOLD": raw}
+    assert threshold_from_env(environ) == expected
+
+@pytest.mark.parametrize("raw", ["abc", "0", "1.5", "-0.2", "nan"])
+def test_threshold_from_env_rejects_invalid(raw):
+    """Valor malformado ou fora de (0, 1] falha na carga, não a cada requisição."""
+    with pytest.raises(ValueError, match="INGEST_DEDUP_THRESHOLD"):
+        threshold_from_env({"INGEST_DEDUP_THRESHOLD": raw})
+
+def test_unique_texts_across_batches():
+    """Textos repetidos são descartados também entre lotes da mesma requisição."""
+    seen = set()
+    first = unique_texts([Chunk(0, "rodapé", 1), Chunk(1, "a", 1), Chunk(2, "rodapé", 1)], seen)
+    second = unique_texts([Chunk(3, "rodapé", 1), Chunk(4, "b", 1)], seen)
+
+    assert [c.text for c in first] == ["rodapé", "a"]
+    assert [c.text for c in second] == ["b"]
+
+def test_near_duplicates_converts_similarity_to_distance():
+    """A consulta recebe a distância máxima (1 - similaridade) e devolve as posições."""
+    cur = MagicMock()
+    cur.fetchall.return_value = [(0,), (2,)]
+
+    assert near_duplicates(cur, "sql", "kb", iter(["v0", "v1", "v2"]), 0.75) == {0, 2}
+    assert cur.execute.call_args.args == ("sql", (["v0", "v1", "v2"], 0, 0.25, "kb", None, 0.25))
+
+def test_near_duplicates_offsets_accepted_vectors():
+    """Os vetores já aceitos vão à frente do lote e as posições voltam relativas ao lote."""
+    cur = MagicMock()
+    cur.fetchall.return_value = [(3,)]
+
+    assert near_duplicates(cur, "sql", "kb", ["v0", "v1"], 0.75, accepted=["a0", "a1"]) == {1}
+    assert cur.execute.call_args.args[1][:2] == (["a0", "a1", "v0", "v1"], 2)
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_near_duplicates():
+    """
+    Um lote é comparado com a base e consigo mesmo em uma única consulta.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from src.common.db import ConnectionManager
+    from src.common.vectors import PgVector
+
+    db = ConnectionManager(dsn)
+
+    def setup(cur):
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('dedup', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        for i in range(20):
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)",
+                        (kb, f"chunk {i}", PgVector(_unit(i))))
+        return kb
+
+    kb = db.run(setup, commit=True)
+    try:
+        fresh = _unit(1000)
+        batch = [
+            PgVector(_unit(1, _unit(5), 0.005)),      # quase igual a um chunk da base
+            PgVector(fresh),                          # novo
+            PgVector(_unit(2, fresh, 0.005)),         # quase igual ao anterior do lote
+            PgVector(_unit(2000)),                    # novo
+        ]
+        duplicates = db.run(lambda cur: near_duplicates(cur, db.statement_sql(cur, NEAR_DUPLICATES), kb, batch, 0.95))
+        assert duplicates == {0, 2}
+        assert db.run(lambda cur: near_duplicates(cur, NEAR_DUPLICATES.direct_sql, kb, batch, 0.9999)) == set()
+        # O mesmo vetor em um lote seguinte da requisição, antes de ser gravado
+        later = [PgVector(_unit(3, fresh, 0.005))]
+        assert db.run(lambda cur: near_duplicates(cur, NEAR_DUPLICATES.direct_sql, kb, later, 0.95,
+                                                  accepted=batch[1:2])) == {0}
+    finally:
+        db.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb,)), commit=True)
+
+@pytest.mark.integration
+def test_integration_near_duplicates_ignores_invisible_chunks():
+    """Chunks expirados ou de documentos marcados não suprimem nada; o documento pendente da ingestão sim."""
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from src.common.db import ConnectionManager
+    from src.common.vectors import PgVector
+
+    db = ConnectionManager(dsn)
+
+    def setup(cur):
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('dedup', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        cur.execute("INSERT INTO documents (knowledge_base_id, external_id, deleted_at) VALUES (%s, 'removido', NOW()) "
+                    "RETURNING id", (kb,))
+        removed = cur.fetchone()[0]
+        cur.execute("INSERT INTO documents (knowledge_base_id, external_id, pending_until) "
+                    "VALUES (%s, 'pendente', NOW() + interval '1 hour') RETURNING id", (kb,))
+        pending = cur.fetchone()[0]
+        rows = [(0, None, "NOW() - interval '1 second'"), (1, removed, "NULL"), (2, pending, "NULL")]
+        for seed, document, expires_at in rows:
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, document_id, expires_at) "
+                        f"VALUES (%s, %s, %s, %s, {expires_at})", (kb, f"chunk {seed}", PgVector(_unit(seed)), document))
+        return kb, str(pending)
+
+    kb, pending = db.run(setup, commit=True)
+    try:
+        batch = [PgVector(_unit(10 + seed, _unit(seed), 0.005)) for seed in range(3)]
+        sql = NEAR_DUPLICATES.direct_sql
+        assert db.run(lambda cur: near_duplicates(cur, sql, kb, batch, 0.95)) == set()
+        assert db.run(lambda cur: near_duplicates(cur, sql, kb, batch, 0.95, pending)) == {2}
+    finally:
+        db.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb,)), commit=True)
@@ -0,0 +1,215 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.common.chunking import iter_chunks
+from src.common.documents import (
+    DocumentChunk,
+    DocumentVersionConflict,
+    MissingVectors,
+    StoredChunk,
+    diff_chunks,
+    document_chunks,
+    hash_chunk,
+    insert_document_chunks,
+    read_document_chunks,
+    read_documents_chunks,
+    write_document,
+)
+from src.common.vectors import EMBEDDING_DIMENSIONS, PgVector
+
+KB_ID = "2f1c5c1e-7a43-4d4b-9a0e-3c2b1f4e5d6a"
+
+def _chunk(ordinal, text):
+    return DocumentChunk(ordinal, text, len(text.split()), hash_chunk(text))
+
+def _stored(texts):
+    return [StoredChunk(f"id-{i}", i, hash_chunk(text)) for i, text in enumerate(texts)]
+
+# --- Testes do Diff ---
+
+def test_diff_unchanged():
+    """Documento idêntico: nada a inserir, remover ou reordenar."""
+    texts = ["a", "b", "c"]
+    diff = diff_chunks(_stored(texts), [_chunk(i, t) for i, t in enumerate(texts)])
+
+    assert diff.is_empty
+    assert diff.unchanged == 3
+
+def test_diff_edit_in_the_middle():
+    """Um chunk alterado vira uma inserção e uma remoção; os demais são mantidos."""
+    diff = diff_chunks(_stored(["a", "b", "c"]), [_chunk(0, "a"), _chunk(1, "B"), _chunk(2, "c")])
+
+    assert [c.text for c in diff.insert] == ["B"]
+    assert diff.delete == ["id-1"]
+    assert diff.reorder == []
+    assert diff.unchanged == 2
+
+def test_diff_insertion_shifts_ordinals():
+    """Um chunk novo no início só desloca os seguintes: nenhum deles é re-vetorizado."""
+    diff = diff_chunks(_stored(["a", "b"]), [_chunk(0, "novo"), _chunk(1, "a"), _chunk(2, "b")])
+
+    assert [c.text for c in diff.insert] == ["novo"]
+    assert diff.delete == []
+    assert diff.reorder == [("id-0", 1), ("id-1", 2)]
+
+def test_diff_duplicate_texts():
+    """Textos repetidos são casados um a um; a cópia excedente é removida."""
+    diff = diff_chunks(_stored(["x", "x", "y"]), [_chunk(0, "x"), _chunk(1, "y")])
+
+    assert diff.insert == []
+    assert diff.delete == ["id-1"]
+    assert diff.reorder == [("id-2", 1)]
+
+def test_document_chunks_hash():
+    """Chunks do chunker recebem ordinal e SHA-256 do texto."""
+    chunks = document_chunks(iter_chunks("Primeira frase. Segunda frase.", max_tokens=4, overlap_tokens=0))
+
+    assert [c.ordinal for c in chunks] == list(range(len(chunks)))
+    assert all(c.content_hash == hash_chunk(c.text) and len(c.content_hash) == 64 for c in chunks)
+
+# --- Testes da Escrita ---
+
+def test_write_document_version_conflict():
+    """Uma versão explícita que não é mais nova que a armazenada é rejeitada antes de qualquer escrita."""
+    cur = MagicMock()
+    cur.fetchone.return_value = ("doc-1", 3)
+
+    with pytest.raises(DocumentVersionConflict) as excinfo:
+        write_document(cur, KB_ID, "manual.pdf", 3, [_chunk(0, "a")], {})
+
+    assert excinfo.value.current == 3
+    assert cur.execute.call_count == 1
+
+def test_write_document_missing_vectors_stops_before_writing():
+    """Chunks sem vetor (documento alterado depois da leitura) interrompem a escrita: nada é vetorizado sob lock."""
+    cur = MagicMock()
+    cur.fetchone.return_value = ("doc-1", 1)
+    cur.fetchall.return_value = [("id-0", 0, hash_chunk("a"))]
+    chunks = [_chunk(0, "a"), _chunk(1, "b"), _chunk(2, "c")]
+
+    with pytest.raises(MissingVectors) as excinfo:
+        write_document(cur, KB_ID, "manual.pdf", None, chunks, {hash_chunk("b"): [0.1]})
+
+    assert [c.text for c in excinfo.value.chunks] == ["c"]
+    assert cur.execute.call_count == 2
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_reingest_embeds_only_changed_chunks():
+    """
+    Editar uma frase de um documento longo re-vetoriza só os chunks afetados.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    import psycopg2
+
+    # Parágrafos de 3 frases: as quebras de parágrafo ressincronizam os cortes do chunker
+    sentences = [f"Esta é a frase número {i} do manual de testes." for i in range(200)]
+
+    def text():
+        return "\n\n".join(" ".join(sentences[i:i + 3]) for i in range(0, len(sentences), 3))
+    vector = PgVector([0.01] * EMBEDDING_DIMENSIONS)
+    embedded = []
+
+    def embed(chunks):
+        embedded.extend(chunks)
+        return {c.content_hash: vector for c in chunks}
+
+    def ingest(cur, text):
+        chunks = document_chunks(iter_chunks(text, max_tokens=64, overlap_tokens=0))
+        stored = read_document_chunks(cur, kb_id, "manual.txt")
+        pending = diff_chunks(stored, chunks).insert
+        return write_document(cur, kb_id, "manual.txt", None, chunks, embed(pending))
+
+    kb_id = None
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('docs', gen_random_uuid()) RETURNING id")
+            kb_id = cur.fetchone()[0]
+            first = ingest(cur, text())
+            conn.commit()
+
+            sentences[100] = "Esta frase foi reescrita por completo."
+            embedded.clear()
+            second = ingest(cur, text())
+            conn.commit()
+
+            assert first.version == 1 and second.version == 2
+            assert second.inserted == len(embedded) <= 2
+            assert second.unchanged + second.reordered >= first.chunks - 2
+            cur.execute("SELECT count(*) FROM knowledge_chunks WHERE document_id = %s", (second.document_id,))
+            assert cur.fetchone()[0] == second.chunks
+
+            embedded.clear()
+            third = ingest(cur, text())
+            conn.commit()
+            assert third.version == 2 and embedded == []
+    finally:
+        conn.rollback()
+        if kb_id is not None:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,))
+            conn.commit()
+        conn.close()
+
+@pytest.mark.integration
+def test_integration_batch_write_with_single_insert():
+    """
+    Vários documentos escritos na mesma transação com uma única inserção em massa;
+    a metadata do documento vale para os chunks novos e para os já armazenados.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    import psycopg2
+
+    vector = PgVector([0.01] * EMBEDDING_DIMENSIONS)
+    texts = {"a": "Primeiro documento.", "b": "Segundo documento.\n\nCom dois parágrafos."}
+
+    def write_batch(cur, metadata):
+        stored = read_documents_chunks(cur, kb_id, list(texts))
+        rows = []
+        results = []
+        for external_id, text in texts.items():
+            chunks = document_chunks(iter_chunks(text, max_tokens=8, overlap_tokens=0))
+            pending = diff_chunks(stored.get(external_id, []), chunks).insert
+            results.append(write_document(cur, kb_id, external_id, None, chunks,
+                                          {c.content_hash: vector for c in pending},
+                                          metadata=metadata, pending_rows=rows))
+        insert_document_chunks(cur, rows)
+        return results, len(rows)
+
+    kb_id = None
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('lote', gen_random_uuid()) RETURNING id")
+            kb_id = cur.fetchone()[0]
+            first, inserted = write_batch(cur, None)
+            conn.commit()
+            assert inserted == sum(r.chunks for r in first) == 3
+
+            texts["b"] += "\n\nUm terceiro parágrafo."
+            second, inserted = write_batch(cur, {"origem": "lote"})
+            conn.commit()
+
+            assert inserted == 1
+            assert [r.version for r in second] == [1, 2]
+            assert set(read_documents_chunks(cur, kb_id, ["a", "b", "c"])) == {"a", "b"}
+            cur.execute("SELECT count(*) FROM knowledge_chunks WHERE knowledge_base_id = %s "
+                        "AND metadata = '{\"origem\": \"lote\"}'::jsonb", (kb_id,))
+            assert cur.fetchone()[0] == 4
+    finally:
+        conn.rollback()
+        if kb_id is not None:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,))
+            conn.commit()
+        conn.close()
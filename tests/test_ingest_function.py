@@ -1,3 +1,4 @@
+import io
 import json
 import os
 import pytest
@@ -9,6 +10,7 @@ from src.ingest_function.main import (
     lambda_handler,
     chunk_text,
     get_embedding,
+    get_embeddings,
     _initialize,
     _get_db_connection
 )
@@ -157,6 +159,51 @@ def test_get_embedding_proxy_error(mock_dependencies):
         )
     assert "Failed to get embedding" in str(exc_info.value)
 
+def test_get_embeddings_batch_order():
+    """Testa que o lote é enviado em uma única chamada e reordenado pelo 'index'."""
+    mock = MagicMock()
+    proxy_response = {
+        "statusCode": 200,
+        "body": json.dumps({
+            "data": [
+                {"index": 1, "embedding": [0.2] * 1536},
+                {"index": 0, "embedding": [0.1] * 1536},
+            ]
+        })
+    }
+    mock.invoke.return_value = {
+        'Payload': MagicMock(read=lambda: json.dumps(proxy_response).encode('utf-8'))
+    }
+
+    result = get_embeddings(["primeiro", "segundo"], mock, "arn:proxy")
+
+    mock.invoke.assert_called_once()
+    sent = json.loads(json.loads(mock.invoke.call_args.kwargs["Payload"])["body"])
+    assert sent["input"] == ["primeiro", "segundo"]
+    assert sent["encoding_format"] == "base64"
+    assert len(result) == 2
+    assert [round(result.row(i)[0], 6) for i in range(2)] == [0.1, 0.2]
+
+def test_get_embeddings_base64():
+    """Testa a decodificação de embeddings em base64 direto para o buffer float32."""
+    import base64
+    from array import array
+
+    encoded = base64.b64encode(array('f', [0.5] * 1536).tobytes()).decode('ascii')
+    mock = MagicMock()
+    proxy_response = {
+        "statusCode": 200,
+        "body": json.dumps({"data": [{"index": 0, "embedding": encoded}]})
+    }
+    mock.invoke.return_value = {
+        'Payload': MagicMock(read=lambda: json.dumps(proxy_response).encode('utf-8'))
+    }
+
+    result = get_embeddings(["chunk"], mock, "arn:proxy")
+
+    assert result.row(0).format == 'f'
+    assert list(result.row(0)) == [0.5] * 1536
+
 # --- Testes do Handler Principal ---
 
 def test_lambda_handler_success(mock_dependencies):
@@ -331,6 +378,578 @@ def test_integration_embedding_quality():
     except Exception as e:
         pytest.skip(f"Teste de qualidade de embeddings falhou: {e}")
 
+# --- Testes da Re-ingestão por Documento ---
+
+@pytest.fixture
+def document_handler(mocker):
+    """Handler com clientes já inicializados e o gerenciador de conexões mockado."""
+    from src.common.chunking import approximate_token_count
+    from src.common.embedding_config import DEFAULT_CONFIG, EmbeddingConfigCache
+
+    mocker.patch('src.ingest_function.main.LAMBDA_CLIENT', MagicMock())
+    mocker.patch('src.ingest_function.main.COUNT_TOKENS', approximate_token_count)
+    mocker.patch('src.ingest_function.main.EMBEDDING_CONFIGS', EmbeddingConfigCache())
+    mocker.patch('src.ingest_function.main.read_embedding_config', return_value=DEFAULT_CONFIG)
+    mocker.patch('src.ingest_function.main.check_embedding_config')
+    db = mocker.patch('src.ingest_function.main.DB')
+    db.run.side_effect = lambda fn, commit=False: fn(MagicMock())
+    return db
+
+@pytest.mark.parametrize("extra", [
+    {"documentId": ""},
+    {"documentId": "x" * 256},
+    {"documentId": 42},
+    {"documentId": "manual.pdf", "version": 0},
+    {"version": 2},
+])
+def test_lambda_handler_document_validation(document_handler, extra):
+    """documentId e version inválidos são rejeitados antes de qualquer acesso ao banco."""
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto.", **extra})}
+
+    assert lambda_handler(event, None)["statusCode"] == 400
+    document_handler.run.assert_not_called()
+
+def test_lambda_handler_document_embeds_only_diff(document_handler, mocker):
+    """Só os chunks que não estão armazenados vão para a OpenAI; a resposta traz a versão."""
+    from src.common.documents import DocumentResult, StoredChunk, hash_chunk
+    from src.common.vectors import EmbeddingBatch
+
+    mocker.patch('src.ingest_function.main.read_document_chunks',
+                 return_value=[StoredChunk("id-0", 0, hash_chunk("Primeira frase."))])
+    write = mocker.patch('src.ingest_function.main.write_document',
+                         return_value=DocumentResult("doc-1", 2, 2, 1, 0, 0, 1, 0))
+    embeddings = mocker.patch('src.ingest_function.main.get_embeddings', return_value=EmbeddingBatch(1))
+    mocker.patch('src.ingest_function.main.CHUNK_MAX_TOKENS', 5)
+    mocker.patch('src.ingest_function.main.CHUNK_OVERLAP_TOKENS', 0)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "documentId": "manual.pdf",
+                                 "text": "Primeira frase.\n\nSegunda frase."})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 202
+    assert embeddings.call_args.args[0] == ["Segunda frase."]
+    body = json.loads(response["body"])
+    assert (body["documentId"], body["version"], body["inserted"], body["unchanged"]) == ("manual.pdf", 2, 1, 1)
+    assert document_handler.run.call_args.kwargs["commit"] is True
+    assert set(write.call_args.args[5]) == {hash_chunk("Segunda frase.")}
+
+def test_lambda_handler_document_version_conflict(document_handler, mocker):
+    """Uma versão que não é mais nova que a armazenada retorna 409."""
+    from src.common.documents import DocumentVersionConflict
+
+    mocker.patch('src.ingest_function.main.read_document_chunks', return_value=[])
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: MagicMock())
+    mocker.patch('src.ingest_function.main.write_document',
+                 side_effect=DocumentVersionConflict("manual.pdf", 3, 5))
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "documentId": "manual.pdf", "version": 3,
+                                 "text": "Um texto."})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 409
+    assert json.loads(response["body"])["currentVersion"] == 5
+
+def test_lambda_handler_document_changed_during_write_embeds_outside_transaction(document_handler, mocker):
+    """Chunks que faltam por uma alteração concorrente são vetorizados fora da transação e a escrita é refeita."""
+    from src.common.documents import DocumentResult, MissingVectors, hash_chunk
+    from src.common.vectors import EmbeddingBatch
+
+    late = hash_chunk("Texto novo.")
+    in_transaction = []
+
+    def write(cur, kb, external_id, version, chunks, vectors, metadata=None, pending_rows=None):
+        if late not in vectors:
+            raise MissingVectors([chunks[0]._replace(text="Texto novo.", content_hash=late)])
+        return DocumentResult("doc-1", 2, 1, 1, 0, 0, 0, 0)
+
+    def run(fn, commit=False):
+        in_transaction.append(True)
+        try:
+            return fn(MagicMock())
+        finally:
+            in_transaction.pop()
+
+    def embed(texts, *args):
+        assert not in_transaction
+        return EmbeddingBatch(len(texts))
+
+    document_handler.run.side_effect = run
+    mocker.patch('src.ingest_function.main.read_document_chunks', return_value=[])
+    embeddings = mocker.patch('src.ingest_function.main.get_embeddings', side_effect=embed)
+    write = mocker.patch('src.ingest_function.main.write_document', side_effect=write)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "documentId": "manual.pdf", "text": "Um texto."})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 202
+    assert [c.args[0] for c in embeddings.call_args_list] == [["Um texto."], ["Texto novo."]]
+    assert write.call_count == 2
+
+def test_lambda_handler_document_keeps_changing_returns_503(document_handler, mocker):
+    """Se o documento muda a cada tentativa, a escrita desiste após MAX_WRITE_ATTEMPTS."""
+    from src.common.documents import MAX_WRITE_ATTEMPTS, MissingVectors, hash_chunk
+    from src.common.vectors import EmbeddingBatch
+
+    def write(cur, kb, external_id, version, chunks, vectors, metadata=None, pending_rows=None):
+        # Cada tentativa encontra um chunk novo, ainda sem vetor
+        raise MissingVectors([chunks[0]._replace(content_hash=hash_chunk(f"versão {len(vectors)}"))])
+
+    mocker.patch('src.ingest_function.main.read_document_chunks', return_value=[])
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    write = mocker.patch('src.ingest_function.main.write_document', side_effect=write)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "documentId": "manual.pdf", "text": "Um texto."})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 503
+    assert write.call_count == MAX_WRITE_ATTEMPTS
+
+def test_lambda_handler_model_changed_during_ingest(document_handler, mocker):
+    """Se a base trocou de modelo durante a ingestão, nada é gravado e o cliente deve reenviar."""
+    from src.common.embedding_config import DEFAULT_CONFIG, EmbeddingConfig, EmbeddingModelChanged
+    from src.common.vectors import EmbeddingBatch
+
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    mocker.patch('src.ingest_function.main.check_embedding_config', side_effect=EmbeddingModelChanged(
+        "kb-123", DEFAULT_CONFIG, EmbeddingConfig("text-embedding-3-large", 1536)))
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto."})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 503
+    assert response["headers"]["Retry-After"] == "1"
+
+def test_lambda_handler_base_removed_during_ingest(document_handler, mocker):
+    """Uma base marcada para remoção, ainda em cache, recusa a escrita com 404 e sai do cache."""
+    from src.common.embedding_config import KnowledgeBaseNotFound
+    from src.common.vectors import EmbeddingBatch
+    import src.ingest_function.main as ingest_main
+
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    mocker.patch('src.ingest_function.main.check_embedding_config', side_effect=KnowledgeBaseNotFound("kb-123"))
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto."})}
+
+    assert lambda_handler(event, None)["statusCode"] == 404
+    assert ingest_main.read_embedding_config.call_count == 1
+    assert lambda_handler(event, None)["statusCode"] == 404
+    assert ingest_main.read_embedding_config.call_count == 2
+
+def test_lambda_handler_unknown_knowledge_base(document_handler, mocker):
+    """Bases inexistentes retornam 404 antes de qualquer chamada de embeddings."""
+    mocker.patch('src.ingest_function.main.read_embedding_config', return_value=None)
+    embeddings = mocker.patch('src.ingest_function.main.get_embeddings')
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto."})}
+
+    assert lambda_handler(event, None)["statusCode"] == 404
+    embeddings.assert_not_called()
+
+def test_lambda_handler_unknown_knowledge_base_skips_admission(document_handler, mocker):
+    """Bases inexistentes são recusadas antes da admissão, inclusive em lote."""
+    mocker.patch('src.ingest_function.main.read_embedding_config', return_value=None)
+    admission = mocker.patch('src.ingest_function.main.ADMISSION')
+    single = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto."})}
+    batch = {"body": json.dumps([{"knowledgeBaseId": "kb-123", "documentId": "a", "text": "Um texto."}])}
+
+    assert lambda_handler(single, None)["statusCode"] == 404
+    assert json.loads(lambda_handler(batch, None)["body"])["results"][0]["statusCode"] == 404
+    admission.admit.assert_not_called()
+
+def test_lambda_handler_suppresses_near_duplicates(document_handler, mocker):
+    """Com dedupThreshold, textos repetidos não são vetorizados e quase duplicados não são gravados."""
+    from src.common.vectors import EmbeddingBatch
+
+    embeddings = mocker.patch('src.ingest_function.main.get_embeddings',
+                              side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    near = mocker.patch('src.ingest_function.main.near_duplicates', return_value={1})
+    insert = mocker.patch('psycopg2.extras.execute_batch')
+    mocker.patch('src.ingest_function.main.CHUNK_MAX_TOKENS', 5)
+    mocker.patch('src.ingest_function.main.CHUNK_OVERLAP_TOKENS', 0)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "dedupThreshold": 0.95,
+                                 "text": "Rodapé padrão.\n\nTexto novo.\n\nRodapé padrão.\n\nOutro texto."})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 202
+    assert json.loads(response["body"])["suppressed"] == 2
+    assert embeddings.call_args.args[0] == ["Rodapé padrão.", "Texto novo.", "Outro texto."]
+    assert near.call_args.args[4] == 0.95
+    assert [r[1] for r in insert.call_args.args[2]] == ["Rodapé padrão.", "Outro texto."]
+
+def test_lambda_handler_dedup_across_batches(document_handler, mocker):
+    """Os vetores aceitos em lotes anteriores seguem na consulta, pois o texto só é gravado no fim."""
+    from src.common.vectors import EmbeddingBatch
+
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    accepted, results = [], iter([set(), {0}, set()])
+    mocker.patch('src.ingest_function.main.near_duplicates',
+                 side_effect=lambda *args: accepted.append(len(args[6])) or next(results))
+    mocker.patch('psycopg2.extras.execute_batch')
+    mocker.patch('src.ingest_function.main.CHUNK_MAX_TOKENS', 5)
+    mocker.patch('src.ingest_function.main.CHUNK_OVERLAP_TOKENS', 0)
+    mocker.patch('src.ingest_function.main.pack_batches', side_effect=lambda chunks: ([c] for c in chunks))
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "dedupThreshold": 0.95,
+                                 "text": "Primeiro trecho.\n\nSegundo trecho.\n\nTerceiro trecho."})}
+
+    response = lambda_handler(event, None)
+
+    assert json.loads(response["body"])["suppressed"] == 1
+    assert accepted == [0, 1, 1]
+
+@pytest.mark.parametrize("extra", [
+    {"dedupThreshold": 1.5},
+    {"dedupThreshold": "alto"},
+    {"dedupThreshold": 0.9, "documentId": "manual.pdf"},
+])
+def test_lambda_handler_dedup_validation(document_handler, extra):
+    """O limiar deve estar em (0, 1] e não se combina com a re-ingestão por documento."""
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto.", **extra})}
+
+    assert lambda_handler(event, None)["statusCode"] == 400
+
+def test_lambda_handler_shed_by_admission_control(document_handler, mocker):
+    """Acima do limite de ingestões simultâneas do tenant, a resposta é 429 sem acessar a OpenAI."""
+    from src.common.admission import Admission
+
+    admission = mocker.patch('src.ingest_function.main.ADMISSION')
+    admission.admit.return_value = Admission(False, retry_after=1, reason="concurrency")
+    get_embeddings = mocker.patch('src.ingest_function.main.get_embeddings')
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto."})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 429
+    assert response["headers"] == {"Retry-After": "1"}
+    assert json.loads(response["body"])["reason"] == "concurrency"
+    get_embeddings.assert_not_called()
+
+# --- Testes da Ingestão de Arquivos ---
+
+@pytest.fixture
+def source_handler(document_handler, mocker):
+    """Handler com um armazenamento de objetos em memória e a inserção mockada."""
+    from src.common.vectors import EmbeddingBatch
+
+    objects = {}
+    s3 = MagicMock()
+    s3.head_object.side_effect = lambda Bucket, Key: {"ContentLength": len(objects[Key]), "ContentType": None}
+    s3.get_object.side_effect = lambda Bucket, Key, **kw: {"Body": io.BytesIO(objects[Key])}
+    mocker.patch('src.ingest_function.main.S3_CLIENT', s3)
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    mocker.patch('src.ingest_function.main.CHUNK_MAX_TOKENS', 5)
+    mocker.patch('src.ingest_function.main.CHUNK_OVERLAP_TOKENS', 0)
+    mocker.patch('src.ingest_function.main.pack_batches', side_effect=lambda chunks: ([c] for c in chunks))
+    return objects, mocker.patch('psycopg2.extras.execute_batch')
+
+def test_lambda_handler_ingests_source_in_batches(source_handler, document_handler):
+    """Um arquivo do S3 é inserido lote a lote em um documento pendente, visível só ao final."""
+    objects, insert = source_handler
+    objects["docs/manual.txt"] = "Primeiro trecho.\n\nSegundo trecho.".encode("utf-8")
+    cursor = MagicMock()
+    cursor.fetchone.return_value = ("doc-1",)
+    document_handler.run.side_effect = lambda fn, commit=False: fn(cursor)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "source": {"bucket": "b", "key": "docs/manual.txt"}})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 202
+    body = json.loads(response["body"])
+    assert body["chunks"] == 2 and body["source"] == "s3://b/docs/manual.txt"
+    rows = [call.args[2][0] for call in insert.call_args_list]
+    assert [(row[1], row[4], row[5]) for row in rows] == [("Primeiro trecho.", "doc-1", 0),
+                                                          ("Segundo trecho.", "doc-1", 1)]
+    assert json.loads(rows[-1][3]) == {"source": "s3://b/docs/manual.txt", "ingestId": body["ingestId"]}
+    statements = [call.args for call in cursor.execute.call_args_list]
+    assert statements[0][0].startswith("INSERT INTO documents") and statements[0][1][1] == body["ingestId"]
+    assert "pending_until = NULL" in statements[-1][0] and statements[-1][1] == (2, "doc-1")
+    assert sum(call.kwargs == {"commit": True} for call in document_handler.run.call_args_list) == 3
+
+def test_lambda_handler_source_ttl_is_fixed_at_start(source_handler, document_handler):
+    """Com ttlSeconds, todos os lotes de um arquivo recebem a mesma expiração absoluta."""
+    from datetime import datetime, timedelta, timezone
+
+    objects, insert = source_handler
+    objects["docs/aviso.txt"] = "Primeiro trecho.\n\nSegundo trecho.".encode("utf-8")
+    cursor = MagicMock()
+    cursor.fetchone.return_value = ("doc-1",)
+    document_handler.run.side_effect = lambda fn, commit=False: fn(cursor)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "source": {"bucket": "b", "key": "docs/aviso.txt"},
+                                 "ttlSeconds": 3600})}
+
+    before = datetime.now(timezone.utc)
+    assert lambda_handler(event, None)["statusCode"] == 202
+
+    expirations = {call.args[2][0][7] for call in insert.call_args_list}
+    assert len(insert.call_args_list) == 2 and len(expirations) == 1
+    assert expirations.pop() - before - timedelta(hours=1) < timedelta(seconds=5)
+
+def test_lambda_handler_source_failure_abandons_pending_document(source_handler, document_handler, mocker):
+    """Se a vetorização falhar no meio do arquivo, o documento pendente é marcado para o varredor."""
+    from src.common.vectors import EmbeddingBatch
+
+    objects, insert = source_handler
+    objects["a.txt"] = "Um trecho.\n\nOutro trecho.".encode("utf-8")
+    mocker.patch('src.ingest_function.main.get_embeddings',
+                 side_effect=[EmbeddingBatch(1), Exception("Failed to get embeddings: limite")])
+    cursor = MagicMock()
+    cursor.fetchone.return_value = ("doc-1",)
+    document_handler.run.side_effect = lambda fn, commit=False: fn(cursor)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "source": {"bucket": "b", "key": "a.txt"}})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 500
+    assert insert.call_count == 1
+    sql, params = cursor.execute.call_args.args
+    assert sql.startswith("UPDATE documents SET deleted_at = NOW()") and params == ("doc-1",)
+
+def test_lambda_handler_source_expired_while_ingesting(source_handler, document_handler):
+    """Se o varredor descartou a ingestão (prazo vencido), o lote seguinte falha sem tornar nada visível."""
+    objects, insert = source_handler
+    objects["a.txt"] = "Um trecho.\n\nOutro trecho.".encode("utf-8")
+    cursor = MagicMock()
+    cursor.fetchone.return_value = ("doc-1",)
+    cursor.rowcount = 0
+    document_handler.run.side_effect = lambda fn, commit=False: fn(cursor)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "source": {"bucket": "b", "key": "a.txt"}})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 500
+    assert "excedeu o prazo" in json.loads(response["body"])["error"]
+    assert insert.call_count == 1
+
+def test_lambda_handler_source_dedup_sees_own_pending_document(source_handler, document_handler, mocker):
+    """A partir do segundo lote, a supressão compara também com o documento pendente da própria ingestão."""
+    objects, insert = source_handler
+    objects["a.txt"] = "Um trecho.\n\nOutro trecho.".encode("utf-8")
+    near = mocker.patch('src.ingest_function.main.near_duplicates', return_value=set())
+    cursor = MagicMock()
+    cursor.fetchone.return_value = ("doc-1",)
+    document_handler.run.side_effect = lambda fn, commit=False: fn(cursor)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "dedupThreshold": 0.95,
+                                 "source": {"bucket": "b", "key": "a.txt"}})}
+
+    assert lambda_handler(event, None)["statusCode"] == 202
+    assert [call.args[5] for call in near.call_args_list] == [None, "doc-1"]
+
+@pytest.mark.parametrize("source,extra,status", [
+    ({"bucket": "b"}, {}, 400),
+    ({"bucket": "b", "key": "a.txt"}, {"text": "Um texto."}, 400),
+    ({"bucket": "b", "key": "a.txt"}, {"documentId": "manual"}, 400),
+    ({"bucket": "b", "key": "a.xlsx"}, {}, 415),
+    ({"bucket": "b", "key": "a.txt", "format": "odt"}, {}, 415),
+])
+def test_lambda_handler_source_validation(source_handler, source, extra, status):
+    """Referências incompletas, combinadas com texto ou de formato desconhecido são recusadas."""
+    objects, insert = source_handler
+    objects["a.txt"] = objects["a.xlsx"] = b"x"
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "source": source, **extra})}
+
+    assert lambda_handler(event, None)["statusCode"] == status
+    insert.assert_not_called()
+
+def test_lambda_handler_source_not_found(source_handler, mocker):
+    """Objetos inexistentes retornam 404."""
+    from botocore.exceptions import ClientError
+
+    s3 = mocker.patch('src.ingest_function.main.S3_CLIENT')
+    s3.head_object.side_effect = ClientError({"Error": {"Code": "404"}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+                                             "HeadObject")
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "source": {"bucket": "b", "key": "a.txt"}})}
+
+    assert lambda_handler(event, None)["statusCode"] == 404
+
+# --- Testes de Remoção e Expiração ---
+
+KB_UUID = "2f1c5c1e-7a43-4d4b-9a0e-3c2b1f4e5d6a"
+
+@pytest.mark.parametrize("extra,marker,expected", [
+    ({}, "mark_knowledge_base", (KB_UUID,)),
+    ({"documentId": "manual.pdf"}, "mark_document", (KB_UUID, "manual.pdf")),
+])
+def test_lambda_handler_delete_schedules_removal(document_handler, mocker, extra, marker, expected):
+    """DELETE só marca a base ou o documento, em uma transação; a remoção fica com o varredor."""
+    mark = mocker.patch(f'src.ingest_function.main.{marker}', return_value=True)
+    embeddings = mocker.patch('src.ingest_function.main.get_embeddings')
+    event = {"httpMethod": "DELETE", "body": json.dumps({"knowledgeBaseId": KB_UUID, **extra})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 202
+    assert json.loads(response["body"]) == {"status": "scheduled", "knowledgeBaseId": KB_UUID, **extra}
+    assert mark.call_args.args[1:] == expected
+    assert document_handler.run.call_args.kwargs == {"commit": True}
+    embeddings.assert_not_called()
+
+def test_lambda_handler_delete_unknown(document_handler, mocker):
+    """Bases ou documentos inexistentes (ou já marcados) retornam 404."""
+    mocker.patch('src.ingest_function.main.mark_document', return_value=False)
+    event = {"httpMethod": "DELETE", "body": json.dumps({"knowledgeBaseId": KB_UUID, "documentId": "manual.pdf"})}
+
+    assert lambda_handler(event, None)["statusCode"] == 404
+
+def test_lambda_handler_delete_invalid_id(document_handler):
+    """Um knowledgeBaseId que não é UUID não existe: 404 sem ir ao banco."""
+    event = {"httpMethod": "DELETE", "body": json.dumps({"knowledgeBaseId": "abc"})}
+
+    assert lambda_handler(event, None)["statusCode"] == 404
+    document_handler.run.assert_not_called()
+
+def test_lambda_handler_ttl_inserts_expiring_chunks(document_handler, mocker):
+    """Com ttlSeconds, os chunks são inseridos com expiração."""
+    from src.common.vectors import EmbeddingBatch
+
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    insert = mocker.patch('psycopg2.extras.execute_batch')
+    document_handler.statement_sql.side_effect = lambda cur, stmt: stmt.name
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Aviso temporário.", "ttlSeconds": 3600})}
+
+    assert lambda_handler(event, None)["statusCode"] == 202
+    assert insert.call_args.args[1] == "cortexa_insert_chunk_expiring"
+    assert insert.call_args.args[2][0][3] == 3600
+
+@pytest.mark.parametrize("extra", [
+    {"ttlSeconds": 0},
+    {"ttlSeconds": "1h"},
+    {"ttlSeconds": True},
+    {"ttlSeconds": 60, "documentId": "manual.pdf"},
+])
+def test_lambda_handler_ttl_validation(document_handler, extra):
+    """O TTL deve ser um número positivo e não se aplica a documentos."""
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "Um texto.", **extra})}
+
+    assert lambda_handler(event, None)["statusCode"] == 400
+
+# --- Testes da Ingestão em Lote ---
+
+@pytest.fixture
+def batch_handler(document_handler, mocker):
+    """Lote com escrita de documentos mockada: cada documento acumula um chunk para a inserção em massa."""
+    from src.common.documents import DocumentResult
+    from src.common.vectors import EmbeddingBatch
+
+    def write(cur, kb, external_id, version, chunks, vectors, metadata=None, pending_rows=None):
+        pending_rows.extend((kb, c.text, vectors[c.content_hash], external_id, c.ordinal, c.content_hash, metadata)
+                            for c in chunks)
+        return DocumentResult(external_id, version or 1, len(chunks), len(chunks), 0, 0, 0, 0)
+
+    mocker.patch('src.ingest_function.main.read_documents_chunks', return_value={})
+    mocker.patch('src.ingest_function.main.get_embeddings', side_effect=lambda texts, *a: EmbeddingBatch(len(texts)))
+    mocker.patch('src.ingest_function.main.write_document', side_effect=write)
+    return mocker.patch('src.ingest_function.main.insert_document_chunks')
+
+def test_lambda_handler_batch_ndjson(batch_handler, document_handler):
+    """Documentos de várias bases em NDJSON: embeddings em um só lote, uma inserção e um resultado por documento."""
+    import src.ingest_function.main as ingest_main
+
+    lines = [
+        {"knowledgeBaseId": "kb-1", "documentId": "a", "text": "Texto A.", "metadata": {"lang": "pt"}},
+        {"knowledgeBaseId": "kb-2", "documentId": "b", "text": "Texto B.", "version": 4},
+        {"knowledgeBaseId": "kb-1", "documentId": "c"},
+        {"knowledgeBaseId": "kb-1", "documentId": "a", "text": "Repetido."},
+    ]
+    event = {"headers": {"Content-Type": "application/x-ndjson"},
+             "body": "\n".join(json.dumps(line) for line in lines) + "\n"}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 202
+    body = json.loads(response["body"])
+    assert (body["documents"], body["succeeded"], body["failed"]) == (4, 2, 2)
+    assert [r["statusCode"] for r in body["results"]] == [202, 202, 400, 400]
+    assert body["results"][1]["version"] == 4
+    assert ingest_main.get_embeddings.call_args_list[0].args[0] == ["Texto A.", "Texto B."]
+    rows = batch_handler.call_args.args[1]
+    assert [(row[0], row[1], row[6]) for row in rows] == [("kb-1", "Texto A.", {"lang": "pt"}),
+                                                          ("kb-2", "Texto B.", None)]
+    batch_handler.assert_called_once()
+
+def test_lambda_handler_batch_version_conflict_is_per_document(batch_handler, document_handler, mocker):
+    """Um conflito de versão desfaz só o documento (ROLLBACK TO SAVEPOINT); os demais são gravados."""
+    from src.common.documents import DocumentVersionConflict
+
+    import src.ingest_function.main as ingest_main
+
+    cursor = MagicMock()
+    document_handler.run.side_effect = lambda fn, commit=False: fn(cursor)
+    write = ingest_main.write_document.side_effect
+
+    def write_or_conflict(cur, kb, external_id, *args, **kwargs):
+        if external_id == "antigo":
+            raise DocumentVersionConflict(external_id, 1, 3)
+        return write(cur, kb, external_id, *args, **kwargs)
+
+    ingest_main.write_document.side_effect = write_or_conflict
+    event = {"body": json.dumps([
+        {"knowledgeBaseId": "kb-1", "documentId": "antigo", "text": "Um texto.", "version": 1},
+        {"knowledgeBaseId": "kb-1", "documentId": "novo", "text": "Outro texto."},
+    ])}
+
+    body = json.loads(lambda_handler(event, None)["body"])
+
+    assert [(r["documentId"], r["statusCode"]) for r in body["results"]] == [("antigo", 409), ("novo", 202)]
+    assert body["results"][0]["currentVersion"] == 3
+    statements = [c.args[0] for c in cursor.execute.call_args_list]
+    assert "ROLLBACK TO SAVEPOINT cortexa_batch_document" in statements
+    assert len(batch_handler.call_args.args[1]) == 1
+
+def test_lambda_handler_batch_retries_after_concurrent_change(batch_handler, document_handler, mocker):
+    """Um documento alterado no meio tempo desfaz o lote; os faltantes são vetorizados e o lote é reescrito."""
+    from src.common.documents import MissingVectors, hash_chunk
+
+    import src.ingest_function.main as ingest_main
+
+    cursor = MagicMock()
+    document_handler.run.side_effect = lambda fn, commit=False: fn(cursor)
+    write = ingest_main.write_document.side_effect
+    late = hash_chunk("Parágrafo de outra ingestão.")
+
+    def write_or_missing(cur, kb, external_id, version, chunks, vectors, **kwargs):
+        if external_id == "alterado" and late not in vectors:
+            raise MissingVectors([chunks[0]._replace(text="Parágrafo de outra ingestão.", content_hash=late)])
+        return write(cur, kb, external_id, version, chunks, vectors, **kwargs)
+
+    ingest_main.write_document.side_effect = write_or_missing
+    event = {"body": json.dumps([
+        {"knowledgeBaseId": "kb-1", "documentId": "alterado", "text": "Um texto."},
+        {"knowledgeBaseId": "kb-1", "documentId": "novo", "text": "Outro texto."},
+    ])}
+
+    body = json.loads(lambda_handler(event, None)["body"])
+
+    assert [r["statusCode"] for r in body["results"]] == [202, 202]
+    assert ingest_main.get_embeddings.call_args_list[1].args[0] == ["Parágrafo de outra ingestão."]
+    assert [c.kwargs.get("commit") for c in document_handler.run.call_args_list[-2:]] == [True, True]
+    batch_handler.assert_called_once()
+
+def test_lambda_handler_batch_unknown_knowledge_base(batch_handler, mocker):
+    """Documentos de uma base inexistente recebem 404 sem impedir os das outras bases."""
+    from src.common.embedding_config import DEFAULT_CONFIG
+
+    mocker.patch('src.ingest_function.main.read_embedding_config',
+                 side_effect=lambda cur, kb: None if kb == "kb-x" else DEFAULT_CONFIG)
+    event = {"body": json.dumps([
+        {"knowledgeBaseId": "kb-x", "documentId": "a", "text": "Um texto."},
+        {"knowledgeBaseId": "kb-1", "documentId": "a", "text": "Um texto."},
+    ])}
+
+    body = json.loads(lambda_handler(event, None)["body"])
+
+    assert [r["statusCode"] for r in body["results"]] == [404, 202]
+
+@pytest.mark.parametrize("event", [
+    {"body": "[]"},
+    {"body": "[{\"knowledgeBaseId\": "},
+    {"headers": {"content-type": "application/x-ndjson; charset=utf-8"}, "body": "{}\n{nao json}"},
+    {"body": json.dumps([{"knowledgeBaseId": "kb", "documentId": str(i), "text": "t"} for i in range(3)])},
+])
+def test_lambda_handler_batch_format_errors(batch_handler, document_handler, mocker, event):
+    """Lotes vazios, JSON/NDJSON inválido ou acima do limite são rejeitados por inteiro."""
+    mocker.patch('src.common.batch.MAX_BATCH_DOCUMENTS', 2)
+
+    assert lambda_handler(event, None)["statusCode"] == 400
+    document_handler.run.assert_not_called()
+
 # --- Testes de Performance ---
 
 @pytest.mark.performance
@@ -0,0 +1,133 @@
+import io
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.common import metrics
+
+@pytest.fixture(autouse=True)
+def reset_cold_start(monkeypatch):
+    """Cada teste começa como o primeiro de um container novo."""
+    monkeypatch.setattr(metrics, "_COLD_START", True)
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    monkeypatch.delenv("CORTEXA_METRICS", raising=False)
+    monkeypatch.delenv("METRICS_TENANT_DIMENSION", raising=False)
+
+def _emitted(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+# --- Testes do Formato EMF ---
+
+def test_to_emf_document():
+    """O documento EMF declara cada fase e contador como métrica, com as dimensões esperadas."""
+    invocation = metrics.InvocationMetrics("query_function", "req-1", cold_start=True)
+    invocation.add_time("embed", 12.5)
+    invocation.add_time("embed", 2.5)
+    invocation.add_count("results", 3)
+    invocation.tenant = "kb-1"
+    invocation.status_code = 200
+
+    doc = invocation.to_emf(timestamp_ms=1000)
+
+    directive = doc["_aws"]["CloudWatchMetrics"][0]
+    assert doc["_aws"]["Timestamp"] == 1000
+    assert directive["Namespace"] == metrics.NAMESPACE
+    assert directive["Dimensions"] == [["Function"], ["Function", "ColdStart"], ["Function", "Tenant"]]
+    names = {m["Name"]: m["Unit"] for m in directive["Metrics"]}
+    assert names == {"embed_ms": "Milliseconds", "total_ms": "Milliseconds", "results": "Count"}
+    assert doc["embed_ms"] == 15.0
+    assert doc["results"] == 3
+    assert (doc["Function"], doc["ColdStart"], doc["Tenant"]) == ("query_function", "cold", "kb-1")
+    assert (doc["RequestId"], doc["StatusCode"]) == ("req-1", 200)
+
+def test_to_emf_without_tenant_dimension():
+    """Com a dimensão de tenant desligada (cardinalidade), o tenant não entra nas dimensões."""
+    invocation = metrics.InvocationMetrics("ingest_function")
+    invocation.tenant = "kb-1"
+
+    doc = invocation.to_emf(tenant_dimension=False)
+
+    assert ["Function", "Tenant"] not in doc["_aws"]["CloudWatchMetrics"][0]["Dimensions"]
+    assert "Tenant" not in doc
+
+# --- Testes da Instrumentação ---
+
+def test_instrumented_emits_one_line_per_invocation(capsys):
+    """Cada invocação emite uma linha EMF; só a primeira do container é 'cold'."""
+    @metrics.instrumented("query_function")
+    def handler(event, context):
+        metrics.set_tenant("kb-9")
+        with metrics.phase("parse"):
+            pass
+        metrics.count("response_bytes", 10, "Bytes")
+        return {"statusCode": 200, "body": "{}"}
+
+    context = MagicMock(aws_request_id="req-1")
+    handler({}, context)
+    handler({}, context)
+
+    first, second = _emitted(capsys)
+    assert (first["ColdStart"], second["ColdStart"]) == ("cold", "warm")
+    assert first["Tenant"] == "kb-9"
+    assert first["StatusCode"] == 200
+    assert "parse_ms" in first and "total_ms" in first
+    assert first["response_bytes"] == 10
+
+def test_instrumented_uses_lambda_function_name(monkeypatch, capsys):
+    """Na Lambda, a dimensão Function usa o nome implantado (ex.: com sufixo do ambiente)."""
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "query_function-prod")
+
+    metrics.instrumented("query_function")(lambda event, context: {"statusCode": 200})({}, MagicMock())
+
+    assert _emitted(capsys)[0]["Function"] == "query_function-prod"
+
+def test_instrumented_emits_on_exception(capsys):
+    """Mesmo se o handler falhar, a linha de métricas é emitida."""
+    @metrics.instrumented("ingest_function")
+    def handler(event, context):
+        with metrics.phase("embed"):
+            raise RuntimeError("falha")
+
+    with pytest.raises(RuntimeError):
+        handler({}, MagicMock())
+
+    doc = _emitted(capsys)[0]
+    assert "embed_ms" in doc
+    assert "StatusCode" not in doc
+
+def test_instrumented_disabled(monkeypatch, capsys):
+    """CORTEXA_METRICS=false desliga a emissão."""
+    monkeypatch.setenv("CORTEXA_METRICS", "false")
+
+    response = metrics.instrumented("query_function")(lambda event, context: {"statusCode": 200})({}, MagicMock())
+
+    assert response == {"statusCode": 200}
+    assert _emitted(capsys) == []
+
+def test_helpers_outside_invocation():
+    """Fora de uma invocação instrumentada, as funções auxiliares não fazem nada."""
+    with metrics.phase("parse"):
+        metrics.count("chunks", 2)
+        metrics.set_tenant("kb")
+    assert list(metrics.timed("chunk", [1, 2])) == [1, 2]
+    assert metrics.current() is None
+
+def test_timed_measures_only_item_production():
+    """`timed` soma apenas o tempo de produzir os itens, não o do corpo do laço."""
+    invocation = metrics.InvocationMetrics("ingest_function")
+    token = metrics._CURRENT.set(invocation)
+    try:
+        assert list(metrics.timed("chunk", iter([1, 2, 3]))) == [1, 2, 3]
+    finally:
+        metrics._CURRENT.reset(token)
+    assert "chunk" in invocation.timings
+
+def test_emit_writes_single_json_line():
+    """A linha é JSON compacto, sem prefixo, como o CloudWatch espera."""
+    stream = io.StringIO()
+    metrics.emit(metrics.InvocationMetrics("openai_embedding_proxy"), stream)
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["Function"] == "openai_embedding_proxy"
@@ -0,0 +1,152 @@
+import os
+import random
+
+import pytest
+
+from src.common.embedding_config import DEFAULT_CONFIG
+from src.common.pagination import (
+    START_DISTANCE,
+    START_ID,
+    CandidateCache,
+    InvalidCursor,
+    PageCursor,
+    QueryEmbeddingCache,
+    decode_cursor,
+    encode_cursor,
+    page_slice,
+    query_fingerprint,
+)
+
+# --- Testes Unitários ---
+
+def test_cursor_round_trip():
+    """O cursor é opaco, seguro para URL e preserva a posição da página."""
+    cursor = PageCursor("kb-123", query_fingerprint("consulta", DEFAULT_CONFIG), 0.25, "id-9", 20)
+
+    token = encode_cursor(cursor)
+
+    assert "=" not in token and "+" not in token and "/" not in token
+    assert decode_cursor(token) == cursor
+
+@pytest.mark.parametrize("token", ["", None, 42, "!!!", "e30", encode_cursor(PageCursor("kb", "q", 0, "id", 1))[:-4]])
+def test_decode_cursor_rejects_garbage(token):
+    """Tokens vazios, malformados, truncados ou sem os campos esperados são recusados."""
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token)
+
+def test_query_fingerprint_depends_on_text_and_model():
+    """A impressão digital muda com o texto e com o modelo da base."""
+    other_model = DEFAULT_CONFIG._replace(model="outro-modelo")
+
+    assert query_fingerprint("a", DEFAULT_CONFIG) == query_fingerprint("a", DEFAULT_CONFIG)
+    assert query_fingerprint("a", DEFAULT_CONFIG) != query_fingerprint("b", DEFAULT_CONFIG)
+    assert query_fingerprint("a", DEFAULT_CONFIG) != query_fingerprint("a", other_model)
+
+def test_query_embedding_cache_evicts_least_recently_used():
+    """O cache calcula cada chave uma vez e descarta a menos usada ao encher."""
+    cache = QueryEmbeddingCache(max_entries=2)
+    calls = []
+
+    def compute(key):
+        return lambda: calls.append(key) or [key]
+
+    cache.get("a", compute("a"))
+    cache.get("b", compute("b"))
+    cache.get("a", compute("a"))
+    cache.get("c", compute("c"))
+    cache.get("a", compute("a"))
+    cache.get("b", compute("b"))
+
+    assert calls == ["a", "b", "c", "b"]
+
+def test_candidate_cache_refetches_after_ttl():
+    """Listas de candidatos valem por `ttl_seconds`; depois disso a busca é refeita."""
+    now = [0.0]
+    cache = CandidateCache(ttl_seconds=10, clock=lambda: now[0])
+    calls = []
+
+    def compute():
+        calls.append(now[0])
+        return [(0.1, "id-1")]
+
+    cache.get("q", compute)
+    now[0] = 9
+    cache.get("q", compute)
+    now[0] = 11
+    cache.get("q", compute)
+
+    assert calls == [0.0, 11]
+
+def test_page_slice_continues_after_cursor_and_flags_horizon():
+    """A fatia começa depois de (distância, id) do cursor; o fim de uma lista cheia é sinalizado."""
+    candidates = [(0.1, "a"), (0.2, "b"), (0.2, "c"), (0.3, "d")]
+    page = PageCursor("kb", "q", START_DISTANCE, START_ID, 2)
+
+    first = page_slice(candidates, page, limit=10)
+    second = page_slice(candidates, page._replace(distance=0.2, last_id="b"), limit=10)
+    last = page_slice(candidates, page._replace(distance=0.2, last_id="c"), limit=4)
+
+    assert first == (candidates[:2], True, False)
+    assert second == (candidates[2:], False, False)
+    assert last == (candidates[3:], False, True)
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_pages_cover_results_in_order():
+    """
+    As páginas juntas reproduzem a busca completa, sem repetir nem pular resultados,
+    inclusive com distâncias empatadas.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from unittest.mock import patch
+
+    from src.common.db import ConnectionManager
+    from src.common.vectors import PgVector
+    import src.query_function.main as query_main
+
+    rng = random.Random(7)
+    vectors = [[rng.gauss(0, 1) for _ in range(1536)] for _ in range(12)]
+    vectors += vectors[:3]  # empates de distância
+    manager = ConnectionManager(dsn, autocommit=True)
+
+    def setup(cur):
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('pages', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        for i, vector in enumerate(vectors):
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)",
+                        (kb, f"chunk {i}", PgVector(vector)))
+        return kb
+
+    kb_id = str(manager.run(setup))
+    try:
+        query = vectors[0]
+        with patch.object(query_main, "DB", manager), patch.object(query_main, "CANDIDATES", CandidateCache()):
+            page = PageCursor(kb_id, "q", START_DISTANCE, START_ID, 4)
+            seen = []
+            while True:
+                rows, sliced = manager.run(lambda cur: (cur.execute("SET ivfflat.probes = 100"),
+                                                        query_main._search_page(cur, query, kb_id, page))[1])
+                seen += [(row[4], str(row[0])) for row in rows]
+                if not sliced.has_more:
+                    break
+                distance, last_id = sliced.candidates[-1]
+                page = page._replace(distance=distance, last_id=last_id)
+
+        assert len(seen) == len(vectors)
+        assert seen == sorted(seen)
+        assert not sliced.horizon_reached
+
+        # Com menos candidatos que resultados, a última página avisa que a lista acabou
+        with patch.object(query_main, "DB", manager), patch.object(query_main, "CANDIDATES", CandidateCache()), \
+                patch.object(query_main, "PAGE_CANDIDATES", 6):
+            rows, sliced = manager.run(lambda cur: query_main._search_page(
+                cur, query, kb_id, page._replace(distance=START_DISTANCE, last_id=START_ID, page_size=10)))
+        assert [(row[4], str(row[0])) for row in rows] == seen[:6]
+        assert sliced.horizon_reached and not sliced.has_more
+    finally:
+        manager.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,)))
+        manager.connection.close()
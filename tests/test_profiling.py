@@ -0,0 +1,111 @@
+import marshal
+import os
+from unittest.mock import MagicMock
+
+from src.common import profiling
+
+def _handler(event, context):
+    """Handler de exemplo que aloca memória e chama uma função identificável."""
+    return {"statusCode": 200, "body": str(len(_allocate()))}
+
+def _allocate():
+    return [str(i) * 10 for i in range(20000)]
+
+def _context(request_id="req-1"):
+    return MagicMock(aws_request_id=request_id)
+
+def _written(directory):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory) for name in names
+    )
+
+# --- Testes do Interruptor ---
+
+def test_profiled_off_returns_handler_unchanged():
+    """Desligado, o decorador devolve o próprio handler: custo zero por invocação."""
+    assert profiling.profiled("query_function", environ={})(_handler) is _handler
+    assert profiling.profiled("query_function", environ={"CORTEXA_PROFILE": "off"})(_handler) is _handler
+
+def test_profiled_always_writes_artifacts(tmp_path, caplog):
+    """No modo 'always', grava .prof e .alloc.txt e registra o resumo no log."""
+    environ = {"CORTEXA_PROFILE": "always", "PROFILE_SINK": str(tmp_path)}
+    handler = profiling.profiled("ingest_function", environ=environ)(_handler)
+
+    with caplog.at_level("INFO"):
+        assert handler({}, _context())["statusCode"] == 200
+
+    files = _written(tmp_path)
+    assert len(files) == 2
+    assert all(f.startswith("ingest_function/") and "req-1" in f for f in files)
+    prof = next(f for f in files if f.endswith(".prof"))
+    with open(tmp_path / prof, "rb") as f:
+        stats = marshal.load(f)
+    assert any(name == "_allocate" for (_, _, name) in stats)
+    alloc = next(f for f in files if f.endswith(".alloc.txt"))
+    assert "KiB" in (tmp_path / alloc).read_text()
+    assert "_allocate" in caplog.text
+
+def test_profiled_sampled(tmp_path, mocker):
+    """No modo 'sampled', só a fração configurada das invocações é perfilada."""
+    environ = {"CORTEXA_PROFILE": "sampled", "PROFILE_SAMPLE_RATE": "0.5", "PROFILE_SINK": str(tmp_path)}
+    handler = profiling.profiled("query_function", environ=environ)(_handler)
+    mocker.patch("src.common.profiling.random.random", side_effect=[0.9, 0.1])
+
+    handler({}, _context("req-skip"))
+    handler({}, _context("req-hit"))
+
+    files = _written(tmp_path)
+    assert len(files) == 2
+    assert all("req-hit" in f for f in files)
+
+def test_profiled_request_header(tmp_path):
+    """No modo 'request', só requisições com X-Cortexa-Profile são perfiladas."""
+    environ = {"CORTEXA_PROFILE": "request", "PROFILE_SINK": str(tmp_path)}
+    handler = profiling.profiled("ingest_function", environ=environ)(_handler)
+
+    handler({"headers": {"Content-Type": "application/json"}}, _context("req-no"))
+    handler({"headers": {"X-Cortexa-Profile": "1"}}, _context("req-yes"))
+
+    assert all("req-yes" in f for f in _written(tmp_path))
+    assert len(_written(tmp_path)) == 2
+
+def test_profiled_sink_failure_does_not_fail_request(mocker):
+    """Falhas no destino são registradas; a resposta do handler é preservada."""
+    sink = MagicMock()
+    sink.write.side_effect = OSError("disco cheio")
+    mocker.patch("src.common.profiling.get_sink", return_value=sink)
+    handler = profiling.profiled("query_function", environ={"CORTEXA_PROFILE": "always"})(_handler)
+
+    assert handler({}, _context())["statusCode"] == 200
+
+def test_profiled_stops_tracemalloc():
+    """O tracemalloc é desligado ao final se foi ligado pelo profiling."""
+    import tracemalloc
+
+    handler = profiling.profiled("query_function", environ={"CORTEXA_PROFILE": "always",
+                                                            "PROFILE_SINK": "/tmp/cortexa-profiles-test"})(_handler)
+    handler({}, _context())
+
+    assert not tracemalloc.is_tracing()
+
+# --- Testes dos Destinos ---
+
+def test_get_sink_local_and_s3():
+    """PROFILE_SINK escolhe o destino pelo esquema."""
+    local = profiling.get_sink("/tmp/perfis")
+    s3 = profiling.get_sink("s3://meu-bucket/perfis/prod")
+
+    assert isinstance(local, profiling.LocalDirectorySink)
+    assert isinstance(s3, profiling.S3Sink)
+    assert (s3.bucket, s3.prefix) == ("meu-bucket", "perfis/prod")
+
+def test_s3_sink_put_object():
+    """O destino S3 grava cada artefato como um objeto sob o prefixo."""
+    client = MagicMock()
+    sink = profiling.S3Sink("meu-bucket", "perfis/", client=client)
+
+    location = sink.write("query_function/x.prof", b"dados")
+
+    client.put_object.assert_called_once_with(Bucket="meu-bucket", Key="perfis/query_function/x.prof", Body=b"dados")
+    assert location == "s3://meu-bucket/perfis/query_function/x.prof"
@@ -201,6 +201,696 @@ def test_query_database_errors(mock_dependencies, valid_event, db_error, expecte
     error_msg = json.loads(response["body"])["error"]
     assert expected_message in error_msg
 
+# --- Testes de Contexto (chunks vizinhos) ---
+
+@pytest.fixture
+def context_handler(mocker):
+    """Handler com clientes já inicializados, embedding e banco mockados."""
+    from src.common.embedding_config import DEFAULT_CONFIG, EmbeddingConfigCache
+
+    mocker.patch('src.query_function.main.LAMBDA_CLIENT', MagicMock())
+    mocker.patch('src.query_function.main.get_embedding', return_value=[0.1] * 1536)
+    mocker.patch('src.query_function.main.EMBEDDING_CONFIGS', EmbeddingConfigCache())
+    mocker.patch('src.query_function.main.read_embedding_config', return_value=DEFAULT_CONFIG)
+    cursor = MagicMock()
+    db = mocker.patch('src.query_function.main.DB')
+    db.run.side_effect = lambda fn, commit=False: fn(cursor)
+    db.statement_sql.side_effect = lambda cur, stmt: stmt.name
+    return cursor
+
+def test_query_context_window(context_handler):
+    """Com context_window, a busca com vizinhos é usada e cada ilha traz seus chunks em ordem."""
+    from src.common.embedding_config import DEFAULT_CONFIG
+
+    context_handler.fetchall.return_value = [
+        ("acerto", 0.9, None, "manual.pdf", [5, 6], [{"ordinal": o, "content": f"c{o}"} for o in range(4, 8)]),
+        ("solto", 0.8, None, None, None, None),
+    ]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "top_k": 3, "context_window": 1})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    sql, params = context_handler.execute.call_args.args
+    assert sql == "cortexa_search_chunks_context"
+    assert params[1:] == ("kb-123", *DEFAULT_CONFIG, 3, 1)
+    first, second = json.loads(response["body"])["results"]
+    assert first["documentId"] == "manual.pdf" and first["hits"] == [5, 6]
+    assert [c["ordinal"] for c in first["context"]] == [4, 5, 6, 7]
+    assert "context" not in second
+
+def test_query_without_context_window_uses_plain_search(context_handler):
+    """Sem context_window, a busca original é mantida."""
+    context_handler.fetchall.return_value = [("acerto", 0.9, None)]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query"})}
+
+    lambda_handler(event, None)
+
+    assert context_handler.execute.call_args.args[0] == "cortexa_search_chunks"
+
+@pytest.mark.parametrize("context_window", [-1, 99, "abc"])
+def test_query_context_window_validation(context_handler, context_window):
+    """context_window fora do intervalo permitido é rejeitado."""
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "context_window": context_window})}
+
+    assert lambda_handler(event, None)["statusCode"] == 400
+    context_handler.execute.assert_not_called()
+
+def test_query_uses_knowledge_base_model(context_handler, mocker):
+    """A consulta é vetorizada com o modelo registrado na base."""
+    from src.common.embedding_config import EmbeddingConfig
+
+    large = EmbeddingConfig("text-embedding-3-large", 1536)
+    mocker.patch('src.query_function.main.read_embedding_config', return_value=large)
+    context_handler.fetchall.return_value = []
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query"})}
+
+    lambda_handler(event, None)
+
+    from src.query_function.main import get_embedding as patched
+    assert patched.call_args.args[3] == large
+
+def test_query_retries_after_model_switch(context_handler, mocker):
+    """Se a base trocou de modelo com o antigo em cache, a busca volta vazia e é refeita com o novo."""
+    from src.common.embedding_config import DEFAULT_CONFIG, EmbeddingConfig
+    from src.query_function.main import EMBEDDING_CONFIGS, get_embedding as embed
+
+    large = EmbeddingConfig("text-embedding-3-large", 1536)
+    EMBEDDING_CONFIGS.get("kb-123", lambda: DEFAULT_CONFIG)
+    mocker.patch('src.query_function.main.read_embedding_config', return_value=large)
+    context_handler.fetchall.side_effect = [[], [("acerto", 0.9, None)]]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query"})}
+
+    response = lambda_handler(event, None)
+
+    assert json.loads(response["body"])["results"] == [{"content": "acerto", "score": 0.9, "metadata": None}]
+    assert [call.args[3] for call in embed.call_args_list] == [DEFAULT_CONFIG, large]
+    assert [call.args[1][2:4] for call in context_handler.execute.call_args_list] == [tuple(DEFAULT_CONFIG),
+                                                                                      tuple(large)]
+    # A entrada antiga saiu do cache: a próxima consulta recarrega o modelo
+    assert EMBEDDING_CONFIGS.get("kb-123", lambda: large) == large
+
+def test_query_empty_result_without_switch_is_not_retried(context_handler):
+    """Uma base vazia, com o modelo do cache, responde sem repetir a busca."""
+    from src.query_function.main import get_embedding as embed
+
+    context_handler.fetchall.return_value = []
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query"})}
+
+    assert json.loads(lambda_handler(event, None)["body"])["results"] == []
+    embed.assert_called_once()
+    context_handler.execute.assert_called_once()
+
+def test_query_split_vector_search(context_handler, mocker):
+    """Com SPLIT_VECTOR_SEARCH, a busca simples usa a tabela estreita de vetores."""
+    from src.common.embedding_config import DEFAULT_CONFIG
+
+    mocker.patch('src.query_function.main.SPLIT_VECTOR_SEARCH', True)
+    mocker.patch('src.query_function.main.SPLIT_LAYOUT_ENABLED', True)
+    context_handler.fetchall.return_value = [("acerto", 0.9, None)]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "top_k": 4})}
+
+    response = lambda_handler(event, None)
+
+    sql, params = context_handler.execute.call_args.args
+    assert sql == "cortexa_search_chunks_split"
+    assert params[1:] == ("kb-123", *DEFAULT_CONFIG, 4)
+    assert json.loads(response["body"])["results"] == [{"content": "acerto", "score": 0.9, "metadata": None}]
+
+def test_query_split_vector_search_checks_layout_once(context_handler, mocker):
+    """Sem o gatilho do layout separado, a primeira busca volta para knowledge_chunks e não confere de novo."""
+    mocker.patch('src.query_function.main.SPLIT_VECTOR_SEARCH', True)
+    mocker.patch('src.query_function.main.SPLIT_LAYOUT_ENABLED', None)
+    context_handler.fetchone.return_value = None
+    context_handler.fetchall.return_value = [("acerto", 0.9, None)]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "top_k": 4})}
+
+    lambda_handler(event, None)
+    lambda_handler(event, None)
+
+    statements = [c.args[0] for c in context_handler.execute.call_args_list]
+    assert sum("pg_trigger" in sql for sql in statements) == 1
+    assert [sql for sql in statements if "pg_trigger" not in sql] == ["cortexa_search_chunks"] * 2
+
+def test_query_unknown_knowledge_base(context_handler, mocker):
+    """Bases inexistentes retornam 404."""
+    mocker.patch('src.query_function.main.read_embedding_config', return_value=None)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query"})}
+
+    assert lambda_handler(event, None)["statusCode"] == 404
+
+def test_query_unknown_knowledge_base_skips_admission(context_handler, mocker):
+    """A base é conferida no cache antes da admissão: inexistente, nem admissão nem embedding."""
+    from src.query_function.main import get_embedding as embed
+
+    mocker.patch('src.query_function.main.read_embedding_config', return_value=None)
+    admission = mocker.patch('src.query_function.main.ADMISSION')
+    event = {"body": json.dumps({"knowledgeBaseIds": ["kb-1", "kb-2"], "text": "query"})}
+
+    assert lambda_handler(event, None)["statusCode"] == 404
+    admission.admit.assert_not_called()
+    embed.assert_not_called()
+
+def test_query_shed_by_admission_control(context_handler, mocker):
+    """Acima do limite do tenant, a consulta recebe 429 sem vetorizar nem buscar."""
+    from src.common.admission import Admission
+    from src.query_function.main import get_embedding as embed
+
+    admission = mocker.patch('src.query_function.main.ADMISSION')
+    admission.admit.return_value = Admission(False, retry_after=0.2, reason="rate")
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query"})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 429
+    assert response["headers"] == {"Retry-After": "1"}
+    embed.assert_not_called()
+    admission.release.assert_not_called()
+
+def test_query_releases_admission_lease(context_handler, mocker):
+    """O lease é liberado no primário ao fim da consulta, mesmo em erro."""
+    from src.common.admission import Admission
+    from src.query_function.main import DB
+
+    admission = mocker.patch('src.query_function.main.ADMISSION')
+    admission.admit.return_value = Admission(True, lease_id="lease-1")
+    context_handler.execute.side_effect = RuntimeError("falha inesperada")
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query"})}
+
+    with pytest.raises(RuntimeError):
+        lambda_handler(event, None)
+
+    admission.release.assert_called_once_with(DB.run_on_primary, admission.admit.return_value)
+
+def test_query_compressed_request_and_response(context_handler):
+    """Requisição em gzip/base64 é aceita e respostas grandes voltam comprimidas."""
+    import base64
+    import gzip
+
+    context_handler.fetchall.return_value = [("x" * 2000, 0.9, None)]
+    body = gzip.compress(json.dumps({"knowledgeBaseId": "kb-123", "text": "query"}).encode("utf-8"))
+    event = {"headers": {"Content-Encoding": "gzip", "Accept-Encoding": "gzip"}, "isBase64Encoded": True,
+             "body": base64.b64encode(body).decode("ascii")}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    results = json.loads(gzip.decompress(base64.b64decode(response["body"])))["results"]
+    assert results[0]["content"] == "x" * 2000
+
+def test_query_top_k_above_cap_suggests_pagination(context_handler, mocker):
+    """top_k acima de MAX_TOP_K é recusado antes de vetorizar, indicando a paginação."""
+    mocker.patch('src.query_function.main.MAX_TOP_K', 50)
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "top_k": 51})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 400
+    assert "cursor" in json.loads(response["body"])["error"]
+    context_handler.execute.assert_not_called()
+
+def test_query_pages_with_cursor(context_handler, mocker):
+    """Os candidatos são buscados uma vez; as páginas saem da lista em cache e reusam o embedding."""
+    from src.common.embedding_config import DEFAULT_CONFIG
+    from src.common.pagination import CandidateCache, QueryEmbeddingCache, decode_cursor
+
+    mocker.patch('src.query_function.main.QUERY_EMBEDDINGS', QueryEmbeddingCache())
+    mocker.patch('src.query_function.main.CANDIDATES', CandidateCache())
+    context_handler.fetchone.return_value = ("1",)
+    context_handler.fetchall.side_effect = [
+        [(0.1, "id-1"), (0.2, "id-2"), (0.3, "id-3")],
+        [("id-2", "b", None), ("id-1", "a", None)],
+    ]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "page_size": 2})}
+
+    body = json.loads(lambda_handler(event, None)["body"])
+
+    executed = [call.args for call in context_handler.execute.call_args_list]
+    assert executed[1] == ("SET ivfflat.probes = %s", (10,))
+    assert executed[2][0] == "cortexa_search_chunk_candidates"
+    assert executed[2][1][1:] == ("kb-123", *DEFAULT_CONFIG, 1000)
+    assert executed[3] == ("SET ivfflat.probes = %s", (1,))
+    assert executed[4] == ("cortexa_read_page_chunks", (["id-1", "id-2"],))
+    assert [r["content"] for r in body["results"]] == ["a", "b"]
+    assert body["horizon_reached"] is False
+    assert decode_cursor(body["next_cursor"])[2:] == (0.2, "id-2", 2)
+
+    context_handler.execute.reset_mock()
+    context_handler.fetchall.side_effect = [[("id-3", "c", None)]]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "cursor": body["next_cursor"]})}
+
+    body = json.loads(lambda_handler(event, None)["body"])
+
+    assert [call.args for call in context_handler.execute.call_args_list] == [
+        ("cortexa_read_page_chunks", (["id-3"],))]
+    assert body == {"results": [{"content": "c", "score": 0.7, "metadata": None}], "next_cursor": None,
+                    "horizon_reached": False}
+    from src.query_function.main import get_embedding
+    get_embedding.assert_called_once()
+
+def test_query_page_signals_candidate_horizon(context_handler, mocker):
+    """A última página de uma lista de candidatos cheia avisa que pode haver resultados além dela."""
+    from src.common.pagination import CandidateCache
+
+    mocker.patch('src.query_function.main.CANDIDATES', CandidateCache())
+    mocker.patch('src.query_function.main.PAGE_CANDIDATES', 2)
+    context_handler.fetchone.return_value = (None,)
+    context_handler.fetchall.side_effect = [[(0.1, "id-1"), (0.2, "id-2")], [("id-1", "a", None), ("id-2", "b", None)]]
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "page_size": 5})}
+
+    body = json.loads(lambda_handler(event, None)["body"])
+
+    assert [r["content"] for r in body["results"]] == ["a", "b"]
+    assert body["next_cursor"] is None
+    assert body["horizon_reached"] is True
+    context_handler.execute.assert_any_call("RESET ivfflat.probes")
+
+@pytest.mark.parametrize("change,error", [
+    ({"text": "outra consulta"}, "outra consulta"),
+    ({"knowledgeBaseId": "kb-456"}, "outra base"),
+    ({"cursor": "não-é-cursor"}, "inválido"),
+    ({"context_window": 1}, "context_window"),
+])
+def test_query_rejects_mismatched_cursor(context_handler, change, error):
+    """Cursores de outra consulta, de outra base, malformados ou com context_window são recusados."""
+    from src.common.embedding_config import DEFAULT_CONFIG
+    from src.common.pagination import PageCursor, encode_cursor, query_fingerprint
+
+    cursor = encode_cursor(PageCursor("kb-123", query_fingerprint("query", DEFAULT_CONFIG), 0.2, "id-2", 2))
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "cursor": cursor, **change})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 400
+    assert error in json.loads(response["body"])["error"]
+    context_handler.execute.assert_not_called()
+
+# --- Testes de Busca Federada ---
+
+def test_query_federated_merges_top_k(context_handler):
+    """Várias bases: um único embedding e uma única consulta, fundidas no top-k global com a base de origem."""
+    from src.common.embedding_config import DEFAULT_CONFIG
+    from src.query_function.main import get_embedding as embed
+
+    context_handler.fetchall.return_value = [
+        ("kb-1", "a1", 0.9, None), ("kb-1", "a2", 0.5, None),
+        ("kb-2", "b1", 0.8, None), ("kb-2", "b2", 0.7, None),
+    ]
+    event = {"body": json.dumps({"knowledgeBaseIds": ["kb-1", "kb-2", "kb-1"], "text": "query", "top_k": 3})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    sql, params = context_handler.execute.call_args.args
+    assert sql == "cortexa_search_chunks_federated"
+    assert params[1:] == (["kb-1", "kb-2"], *DEFAULT_CONFIG, 3)
+    embed.assert_called_once()
+    results = json.loads(response["body"])["results"]
+    assert [(r["knowledgeBaseId"], r["content"]) for r in results] == [("kb-1", "a1"), ("kb-2", "b1"), ("kb-2", "b2")]
+
+def test_query_federated_retries_after_model_switch(context_handler, mocker):
+    """Bases sem linhas que trocaram de modelo refazem a busca federada; modelos que divergem dão 400."""
+    from src.common.embedding_config import DEFAULT_CONFIG, EmbeddingConfig
+    from src.query_function.main import EMBEDDING_CONFIGS, get_embedding as embed
+
+    large = EmbeddingConfig("text-embedding-3-large", 1536)
+    for kb in ("kb-1", "kb-2"):
+        EMBEDDING_CONFIGS.get(kb, lambda: DEFAULT_CONFIG)
+    configs = {"kb-1": large, "kb-2": large}
+    mocker.patch('src.query_function.main.read_embedding_config', side_effect=lambda cur, kb: configs[kb])
+    context_handler.fetchall.side_effect = [[], [("kb-1", "a", 0.9, None), ("kb-2", "b", 0.8, None)]]
+    event = {"body": json.dumps({"knowledgeBaseIds": ["kb-1", "kb-2"], "text": "query"})}
+
+    results = json.loads(lambda_handler(event, None)["body"])["results"]
+
+    assert [r["content"] for r in results] == ["a", "b"]
+    assert [call.args[3] for call in embed.call_args_list] == [DEFAULT_CONFIG, large]
+
+    configs["kb-2"] = DEFAULT_CONFIG
+    context_handler.fetchall.side_effect = [[("kb-1", "a", 0.9, None)]]
+    EMBEDDING_CONFIGS.invalidate()
+    mocker.patch('src.query_function.main.read_embedding_config',
+                 side_effect=[DEFAULT_CONFIG, DEFAULT_CONFIG, large])
+
+    assert lambda_handler(event, None)["statusCode"] == 400
+
+@pytest.mark.parametrize("change,error", [
+    ({"knowledgeBaseId": "kb-1"}, "não os dois"),
+    ({"knowledgeBaseIds": []}, "lista não vazia"),
+    ({"knowledgeBaseIds": "kb-1"}, "lista não vazia"),
+    ({"knowledgeBaseIds": ["kb-1", ""]}, "lista não vazia"),
+    ({"knowledgeBaseIds": [f"kb-{i}" for i in range(21)]}, "no máximo 20"),
+    ({"context_window": 1}, "context_window"),
+    ({"page_size": 5}, "page_size"),
+])
+def test_query_federated_validation(context_handler, change, error):
+    """Listas inválidas ou combinadas com contexto/paginação são recusadas."""
+    event = {"body": json.dumps({"knowledgeBaseIds": ["kb-1", "kb-2"], "text": "query", **change})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 400
+    assert error in json.loads(response["body"])["error"]
+    context_handler.execute.assert_not_called()
+
+def test_query_federated_requires_same_model(context_handler, mocker):
+    """Bases com modelos de embeddings diferentes não são misturadas; bases inexistentes dão 404."""
+    from src.common.embedding_config import DEFAULT_CONFIG, EmbeddingConfig
+
+    configs = {"kb-1": DEFAULT_CONFIG, "kb-2": EmbeddingConfig("text-embedding-3-large", 1536), "kb-3": None}
+    mocker.patch('src.query_function.main.read_embedding_config', side_effect=lambda cur, kb: configs[kb])
+
+    mixed = lambda_handler({"body": json.dumps({"knowledgeBaseIds": ["kb-1", "kb-2"], "text": "q"})}, None)
+    missing = lambda_handler({"body": json.dumps({"knowledgeBaseIds": ["kb-1", "kb-3"], "text": "q"})}, None)
+
+    assert mixed["statusCode"] == 400
+    assert missing["statusCode"] == 404
+    assert json.loads(missing["body"])["knowledgeBaseIds"] == ["kb-3"]
+    context_handler.execute.assert_not_called()
+
+def test_query_federated_shed_releases_admitted_bases(context_handler, mocker):
+    """Se uma das bases estiver acima do limite, os leases já obtidos são liberados."""
+    from src.common.admission import Admission
+
+    admission = mocker.patch('src.query_function.main.ADMISSION')
+    admission.admit.side_effect = [Admission(True, lease_id="lease-1"), Admission(False, retry_after=1, reason="rate")]
+    event = {"body": json.dumps({"knowledgeBaseIds": ["kb-1", "kb-2"], "text": "query"})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 429
+    admission.release.assert_called_once()
+    assert admission.release.call_args.args[1].lease_id == "lease-1"
+    context_handler.execute.assert_not_called()
+
+# --- Testes de Busca Híbrida ---
+
+def test_query_hybrid_fuses_in_one_query(context_handler, mocker):
+    """No modo híbrido, uma única consulta traz o ranking fundido e as posições de cada busca."""
+    from src.common.embedding_config import DEFAULT_CONFIG
+
+    mocker.patch('src.query_function.main.HYBRID_CANDIDATES', 40)
+    context_handler.fetchall.return_value = [("SKU-48213", 0.016, None, None, 1), ("acerto", 0.008, None, 1, None)]
+    event = {"body": json.dumps(
+        {"knowledgeBaseId": "kb-123", "text": "SKU-48213", "top_k": 2, "mode": "hybrid", "lexical_weight": 0.7})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    sql, params = context_handler.execute.call_args.args
+    assert sql == "cortexa_search_chunks_hybrid"
+    assert params[:3] == ("kb-123", *DEFAULT_CONFIG)
+    assert params[4:] == (40, "SKU-48213", 40, 0.7, 60, 2)
+    first, second = json.loads(response["body"])["results"]
+    assert first == {"content": "SKU-48213", "score": 0.016, "metadata": None, "vectorRank": None, "lexicalRank": 1}
+    assert second["vectorRank"] == 1
+
+def test_query_hybrid_default_weight(context_handler):
+    """Sem lexical_weight, vale o peso configurado."""
+    context_handler.fetchall.return_value = []
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "mode": "hybrid"})}
+
+    lambda_handler(event, None)
+
+    assert context_handler.execute.call_args.args[1][7] == 0.5
+
+@pytest.mark.parametrize("change,error", [
+    ({"mode": "lexical"}, "'mode'"),
+    ({"lexical_weight": 1.5}, "lexical_weight"),
+    ({"lexical_weight": -0.1}, "lexical_weight"),
+    ({"context_window": 1}, "context_window"),
+    ({"page_size": 5}, "page_size"),
+])
+def test_query_hybrid_validation(context_handler, change, error):
+    """Modos e pesos inválidos, ou a busca híbrida combinada com contexto/paginação, são recusados."""
+    event = {"body": json.dumps({"knowledgeBaseId": "kb-123", "text": "query", "mode": "hybrid", **change})}
+
+    response = lambda_handler(event, None)
+
+    assert response["statusCode"] == 400
+    assert error in json.loads(response["body"])["error"]
+    context_handler.execute.assert_not_called()
+
+@pytest.mark.integration
+def test_integration_hybrid_search_finds_exact_identifier():
+    """
+    Um identificador exato, distante da consulta no espaço vetorial, fica fora do top-k
+    vetorial mas é encontrado pela busca híbrida (índice GIN sobre content_tsv).
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from src.common.db import ConnectionManager
+    from src.common.vectors import PgVector
+    import src.query_function.main as query_main
+
+    def one_hot(i):
+        values = [0.0] * 1536
+        values[i] = 1.0
+        return values
+
+    manager = ConnectionManager(dsn, autocommit=True)
+
+    def setup(cur):
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('hybrid', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        # Seções cada vez mais distantes da consulta, todas mais próximas que o SKU (ortogonal a ela): sem empates
+        for i in range(20):
+            embedding = one_hot(0)
+            embedding[i + 1] = 0.1 * (i + 1)
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)",
+                        (kb, f"Manual de peças, seção {i}.", PgVector(embedding)))
+        cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)",
+                    (kb, "Filtro de ar SKU-48213-X, compatível com a linha 2020.", PgVector(one_hot(100))))
+        return kb
+
+    kb_id = manager.run(setup)
+    try:
+        query = one_hot(0)
+
+        def search(cur, hybrid):
+            cur.execute("SET ivfflat.probes = 100")
+            if hybrid:
+                return query_main._search_hybrid(cur, query, "SKU-48213-X", kb_id, 3, 0.5)
+            return query_main._search(cur, query, kb_id, 3)
+
+        with patch.object(query_main, "DB", manager):
+            vector = manager.run(lambda cur: search(cur, False))
+            hybrid = manager.run(lambda cur: search(cur, True))
+
+        assert all("SKU" not in row[0] for row in vector)
+        assert hybrid[0][0].startswith("Filtro de ar SKU-48213-X")
+        assert hybrid[0][4] == 1
+        assert hybrid[1][0] == "Manual de peças, seção 0." and hybrid[1][3] == 1
+    finally:
+        manager.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,)))
+        manager.connection.close()
+
+@pytest.mark.integration
+def test_integration_federated_search_per_base_top_k():
+    """
+    A consulta federada devolve o top-k de cada base, identificado pela base.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from src.common.db import ConnectionManager
+    from src.common.vectors import PgVector
+    import src.query_function.main as query_main
+
+    def one_hot(i):
+        values = [0.0] * 1536
+        values[i] = 1.0
+        return values
+
+    manager = ConnectionManager(dsn, autocommit=True)
+
+    def setup(cur):
+        bases = []
+        for name in ("fed-a", "fed-b"):
+            cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES (%s, gen_random_uuid()) RETURNING id",
+                        (name,))
+            kb = cur.fetchone()[0]
+            for i in range(4):
+                cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)",
+                            (kb, f"{name} {i}", PgVector(one_hot(i))))
+            bases.append(str(kb))
+        return bases
+
+    bases = manager.run(setup)
+    try:
+        query = one_hot(1)
+        with patch.object(query_main, "DB", manager):
+            rows = manager.run(lambda cur: (cur.execute("SET ivfflat.probes = 100"),
+                                            query_main._search_federated(cur, query, bases, 2))[1])
+
+        assert sorted((str(r[0]), r[1]) for r in rows) == sorted(
+            [(bases[0], "fed-a 1"), (bases[0], "fed-a 0"), (bases[1], "fed-b 1"), (bases[1], "fed-b 0")])
+        assert {r[1]: r[2] for r in rows}["fed-b 1"] == pytest.approx(1.0)
+    finally:
+        manager.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = ANY(%s::uuid[])", (bases,)))
+        manager.connection.close()
+
+@pytest.mark.integration
+def test_integration_split_vector_search_matches_combined():
+    """
+    Com o layout habilitado, o gatilho mantém knowledge_chunk_vectors em dia (inserção,
+    troca de vetor e exclusão) e a busca sobre ela devolve o mesmo que a busca original.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from benchmarks.local_db import apply_optional
+    from src.common.db import ConnectionManager
+    from src.common.vectors import PgVector
+    import src.query_function.main as query_main
+
+    def one_hot(i):
+        values = [0.0] * 1536
+        values[i] = 1.0
+        return values
+
+    manager = ConnectionManager(dsn, autocommit=True)
+
+    def setup(cur):
+        apply_optional(cur, "chunk_vectors_enable")
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('split', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        for i in range(5):
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, metadata) "
+                        "VALUES (%s, %s, %s, %s)", (kb, f"chunk {i}", PgVector(one_hot(i)), json.dumps({"i": i})))
+        cur.execute("UPDATE knowledge_chunks SET embedding = %s WHERE knowledge_base_id = %s AND content = 'chunk 4'",
+                    (PgVector(one_hot(9)), kb))
+        cur.execute("DELETE FROM knowledge_chunks WHERE knowledge_base_id = %s AND content = 'chunk 3'", (kb,))
+        return kb
+
+    kb_id = manager.run(setup)
+    try:
+        query = one_hot(9)
+        query[1] = 0.5
+
+        def search(split):
+            def run(cur):
+                cur.execute("SET enable_seqscan = off")
+                cur.execute("SET ivfflat.probes = 100")
+                return query_main._search(cur, query, kb_id, 2)
+            with patch.object(query_main, "DB", manager), patch.object(query_main, "SPLIT_VECTOR_SEARCH", split), \
+                    patch.object(query_main, "SPLIT_LAYOUT_ENABLED", None):
+                return manager.run(run)
+
+        assert manager.run(lambda cur: (cur.execute(
+            "SELECT count(*) FROM knowledge_chunk_vectors WHERE knowledge_base_id = %s", (kb_id,)),
+            cur.fetchone()[0])[1]) == 4
+        split = search(True)
+        assert [row[0] for row in split] == ["chunk 4", "chunk 1"]
+        assert split[0][2] == {"i": 4}
+        assert split == search(False)
+    finally:
+        manager.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,)))
+        manager.connection.close()
+
+@pytest.mark.integration
+def test_integration_context_window_merges_overlapping_windows():
+    """
+    Acertos vizinhos no mesmo documento viram uma única janela, lida em uma ida ao banco.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from src.common.db import ConnectionManager
+    from src.common.documents import DocumentChunk, hash_chunk, write_document
+    from src.common.vectors import PgVector
+    import src.query_function.main as query_main
+
+    def one_hot(i):
+        values = [0.0] * 1536
+        values[i] = 1.0
+        return values
+
+    texts = [f"Trecho {i} do documento." for i in range(10)]
+    chunks = [DocumentChunk(i, t, 4, hash_chunk(t)) for i, t in enumerate(texts)]
+    vectors = {c.content_hash: PgVector(one_hot(c.ordinal)) for c in chunks}
+    manager = ConnectionManager(dsn, autocommit=True)
+    kb_id = manager.run(lambda cur: (cur.execute(
+        "INSERT INTO knowledge_bases (name, user_id) VALUES ('ctx', gen_random_uuid()) RETURNING id"),
+        cur.fetchone()[0])[1])
+    try:
+        manager.run(lambda cur: write_document(cur, kb_id, "doc.txt", None, chunks, vectors))
+        query = one_hot(4)
+        query[5] = 0.9
+        def run(cur):
+            # Busca exata: o teste é sobre as janelas, não sobre o recall do ivfflat
+            cur.execute("SET ivfflat.probes = 100")
+            return query_main._search_with_context(cur, query, kb_id, 2, 1)
+        with patch.object(query_main, "DB", manager):
+            rows = manager.run(run)
+
+        assert len(rows) == 1
+        assert rows[0][0] == texts[4] and rows[0][4] == [4, 5]
+        assert [c["ordinal"] for c in rows[0][5]] == [3, 4, 5, 6]
+
+        # Vizinho expirado sai da janela antes mesmo de o varredor passar
+        manager.run(lambda cur: cur.execute(
+            "UPDATE knowledge_chunks SET expires_at = NOW() - interval '1 second' "
+            "WHERE knowledge_base_id = %s AND ordinal = 6", (kb_id,)))
+        with patch.object(query_main, "DB", manager):
+            rows = manager.run(run)
+        assert [c["ordinal"] for c in rows[0][5]] == [3, 4, 5]
+    finally:
+        manager.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,)))
+        manager.connection.close()
+
+@pytest.mark.integration
+def test_integration_search_confirms_embedding_model():
+    """
+    A busca com o modelo antigo não retorna nada depois da troca; com o modelo novo, retorna.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from src.common.db import ConnectionManager
+    from src.common.embedding_config import DEFAULT_CONFIG, EmbeddingConfig
+    from src.common.vectors import PgVector
+    import src.query_function.main as query_main
+
+    query = [1.0] + [0.0] * 1535
+    large = EmbeddingConfig("text-embedding-3-large", 1536)
+    manager = ConnectionManager(dsn, autocommit=True)
+
+    def setup(cur):
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('modelo', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, 'a', %s)",
+                    (kb, PgVector(query)))
+        return kb
+
+    kb_id = manager.run(setup)
+    try:
+        def searches(config):
+            def run(cur):
+                return [len(query_main._search(cur, query, kb_id, 3, config)),
+                        len(query_main._search_with_context(cur, query, kb_id, 3, 1, config)),
+                        len(query_main._search_federated(cur, query, [str(kb_id)], 3, config)),
+                        len(query_main._search_hybrid(cur, query, "a", kb_id, 3, 0.5, config))]
+            with patch.object(query_main, "DB", manager):
+                return manager.run(run)
+
+        assert searches(DEFAULT_CONFIG) == [1, 1, 1, 1]
+        manager.run(lambda cur: cur.execute(
+            "UPDATE knowledge_bases SET embedding_model = %s WHERE id = %s", (large.model, kb_id)))
+        assert searches(DEFAULT_CONFIG) == [0, 0, 0, 0]
+        assert searches(large) == [1, 1, 1, 1]
+        assert manager.run(lambda cur: query_main._switched_configs(cur, [kb_id], DEFAULT_CONFIG)) == {kb_id: large}
+    finally:
+        manager.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,)))
+        manager.connection.close()
+
 # --- Testes de Performance ---
 
 def test_query_caching(mock_dependencies):
@@ -233,6 +923,64 @@ def test_query_large_response(mock_dependencies, valid_event):
 
 # --- Testes de Integração ---
 
+@pytest.mark.integration
+def test_integration_deleted_and_expired_chunks_leave_search():
+    """
+    Depois do DELETE de um documento (só a marcação) e da expiração de um chunk com TTL,
+    nenhum caminho de busca os retorna, antes mesmo de o varredor passar.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    from src.common.db import ConnectionManager
+    from src.common.pagination import START_DISTANCE, START_ID, PageCursor
+    from src.common.sweeper import mark_document
+    from src.common.vectors import PgVector
+    import src.query_function.main as query_main
+
+    manager = ConnectionManager(dsn, autocommit=True)
+    vector = PgVector([0.1] * 1536)
+
+    def setup(cur):
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('visible', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        for external_id in ("mantido", "removido"):
+            cur.execute("INSERT INTO documents (knowledge_base_id, external_id) VALUES (%s, %s) RETURNING id",
+                        (kb, external_id))
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, document_id, ordinal) "
+                        "VALUES (%s, %s, %s, %s, 0)", (kb, f"manual {external_id}", vector, cur.fetchone()[0]))
+        cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, expires_at) "
+                    "VALUES (%s, 'manual expirado', %s, NOW() - interval '1 second')", (kb, vector))
+        cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, expires_at) "
+                    "VALUES (%s, 'manual com ttl', %s, NOW() + interval '1 hour')", (kb, vector))
+        return kb
+
+    kb_id = manager.run(setup)
+    try:
+        assert manager.run(lambda cur: mark_document(cur, kb_id, "removido"))
+        query = [0.1] * 1536
+        page = PageCursor(str(kb_id), None, START_DISTANCE, START_ID, 10)
+
+        def search(cur):
+            cur.execute("SET ivfflat.probes = 100")
+            return {
+                "simple": [row[0] for row in query_main._search(cur, query, kb_id, 10)],
+                "context": [row[0] for row in query_main._search_with_context(cur, query, kb_id, 10, 1)],
+                "page": [row[1] for row in query_main._search_page(cur, query, kb_id, page)[0]],
+                "federated": [row[1] for row in query_main._search_federated(cur, query, [str(kb_id)], 10)],
+                "hybrid": [row[0] for row in query_main._search_hybrid(cur, query, "manual", kb_id, 10, 0.5)],
+            }
+
+        with patch.object(query_main, "DB", manager):
+            found = manager.run(search)
+
+        for path, contents in found.items():
+            assert sorted(contents) == ["manual com ttl", "manual mantido"], path
+    finally:
+        manager.run(lambda cur: cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb_id,)))
+        manager.connection.close()
+
 @pytest.mark.integration
 def test_integration_real_services(mock_env):
     """
@@ -0,0 +1,198 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.common.embedding_config import (
+    DEFAULT_CONFIG,
+    EmbeddingConfig,
+    EmbeddingConfigCache,
+    EmbeddingModelChanged,
+    KnowledgeBaseNotFound,
+    check_embedding_config,
+    read_embedding_config,
+)
+from src.common.reembed import (
+    MigrationError,
+    RateBudget,
+    cancel_migration,
+    migration_progress,
+    run_migration,
+    start_migration,
+    switch_migration,
+)
+from src.common.vectors import EMBEDDING_DIMENSIONS, EmbeddingBatch
+
+LARGE = EmbeddingConfig("text-embedding-3-large", EMBEDDING_DIMENSIONS)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+# --- Testes da Configuração por Base ---
+
+def test_request_fields():
+    """O modelo padrão não envia 'dimensions'; os demais enviam a dimensão da coluna."""
+    assert DEFAULT_CONFIG.request_fields() == {"model": "text-embedding-3-small"}
+    assert LARGE.request_fields() == {"model": "text-embedding-3-large", "dimensions": EMBEDDING_DIMENSIONS}
+
+def test_config_cache_ttl_and_invalidate():
+    """A configuração é lida uma vez por TTL; invalidate força a releitura."""
+    clock = FakeClock()
+    cache = EmbeddingConfigCache(ttl_seconds=60, clock=clock)
+    load = MagicMock(side_effect=[DEFAULT_CONFIG, LARGE, LARGE])
+
+    assert cache.get("kb", load) == DEFAULT_CONFIG
+    clock.now = 59
+    assert cache.get("kb", load) == DEFAULT_CONFIG
+    clock.now = 61
+    assert cache.get("kb", load) == LARGE
+    cache.invalidate("kb")
+    cache.get("kb", load)
+    assert load.call_count == 3
+
+def test_config_cache_does_not_store_missing_base():
+    """Bases inexistentes não ficam em cache: podem ser criadas logo depois."""
+    cache = EmbeddingConfigCache()
+    load = MagicMock(side_effect=[None, DEFAULT_CONFIG])
+
+    assert cache.get("kb", load) is None
+    assert cache.get("kb", load) == DEFAULT_CONFIG
+
+def test_config_cache_negative_ttl():
+    """Com negative_ttl_seconds, uma base inexistente é recusada da memória até o prazo curto vencer."""
+    clock = FakeClock()
+    cache = EmbeddingConfigCache(ttl_seconds=60, clock=clock, negative_ttl_seconds=5)
+    load = MagicMock(side_effect=[None, DEFAULT_CONFIG])
+
+    assert cache.get("kb", load) is None
+    clock.now = 4
+    assert cache.get("kb", load) is None
+    clock.now = 6
+    assert cache.get("kb", load) == DEFAULT_CONFIG
+    assert load.call_count == 2
+
+def test_read_embedding_config_rejects_non_uuid():
+    """Identificadores que não são UUID não existem e não chegam ao banco."""
+    cur = MagicMock()
+
+    assert read_embedding_config(cur, "kb-123") is None
+    cur.execute.assert_not_called()
+
+def test_check_embedding_config_detects_switch():
+    """Se a base trocou de modelo entre a vetorização e a escrita, a escrita é abortada."""
+    cur = MagicMock()
+    cur.fetchone.return_value = (LARGE.model, LARGE.dimensions)
+
+    check_embedding_config(cur, "kb", LARGE)
+    with pytest.raises(EmbeddingModelChanged):
+        check_embedding_config(cur, "kb", DEFAULT_CONFIG)
+    assert "FOR KEY SHARE" in cur.execute.call_args.args[0]
+
+def test_check_embedding_config_rejects_removed_base():
+    """Uma base marcada para remoção (ainda em cache) recusa a escrita na transação."""
+    cur = MagicMock()
+    cur.fetchone.return_value = None
+
+    with pytest.raises(KnowledgeBaseNotFound):
+        check_embedding_config(cur, "kb", DEFAULT_CONFIG)
+    assert "deleted_at IS NULL" in cur.execute.call_args.args[0]
+
+# --- Testes do Orçamento ---
+
+def test_rate_budget_waits_for_tokens():
+    """Depois da rajada inicial, o orçamento espera o tempo proporcional aos tokens pedidos."""
+    clock = FakeClock()
+    budget = RateBudget(tokens_per_minute=600, requests_per_minute=1000, clock=clock, sleep=clock.sleep)
+
+    budget.acquire(600)
+    assert clock.now == 0
+    budget.acquire(300)
+    assert clock.now == pytest.approx(30)
+
+def test_rate_budget_limits_requests():
+    """O limite de requisições por minuto vale mesmo para lotes pequenos."""
+    clock = FakeClock()
+    budget = RateBudget(tokens_per_minute=10**6, requests_per_minute=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        budget.acquire(1)
+    assert clock.now == pytest.approx(30)
+
+def test_start_migration_requires_column_dimensions():
+    """Vetores de outra dimensão não cabem na coluna sombra."""
+    with pytest.raises(MigrationError):
+        start_migration(MagicMock(), "kb", EmbeddingConfig("text-embedding-3-large", 3072))
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_migration_resume_and_switch():
+    """
+    Migra uma base em lotes, com interrupção e ingestão no meio, e troca o modelo atomicamente.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    import psycopg2
+    from src.common.vectors import PgVector
+
+    calls = []
+
+    def embed(texts, config):
+        calls.append((len(texts), config))
+        batch = EmbeddingBatch(len(texts))
+        for i in range(len(texts)):
+            batch.set_row(i, [0.5] * EMBEDDING_DIMENSIONS)
+        return batch
+
+    def add_chunks(cur, kb, count, start=0):
+        for i in range(start, start + count):
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)",
+                        (kb, f"chunk {i}", PgVector([0.1] * EMBEDDING_DIMENSIONS)))
+
+    def first_value(cur, kb):
+        cur.execute("SELECT DISTINCT (embedding::real[])[1], embedding_next IS NULL FROM knowledge_chunks "
+                    "WHERE knowledge_base_id = %s", (kb,))
+        return sorted(cur.fetchall())
+
+    conn = psycopg2.connect(dsn)
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('migra', gen_random_uuid()) RETURNING id")
+        kb = cur.fetchone()[0]
+        add_chunks(cur, kb, 25)
+    try:
+        start_migration(conn, kb, LARGE)
+        assert run_migration(conn, kb, embed, batch_size=10, max_batches=2) is False
+        assert migration_progress(conn, kb).embedded_chunks == 20
+
+        # Até a troca, consultas e ingestão continuam com o modelo e os vetores antigos
+        with conn, conn.cursor() as cur:
+            assert first_value(cur, kb) == [(pytest.approx(0.1), False), (pytest.approx(0.1), True)]
+            add_chunks(cur, kb, 3, start=100)
+
+        assert run_migration(conn, kb, embed, batch_size=10) is True
+        assert migration_progress(conn, kb).pending_chunks == 0
+        with conn, conn.cursor() as cur:
+            add_chunks(cur, kb, 2, start=200)
+
+        assert switch_migration(conn, kb, embed, batch_size=10) == 30
+        assert all(config == LARGE for _, config in calls)
+        with conn, conn.cursor() as cur:
+            assert first_value(cur, kb) == [(pytest.approx(0.5), True)]
+            cur.execute("SELECT embedding_model FROM knowledge_bases WHERE id = %s", (kb,))
+            assert cur.fetchone()[0] == LARGE.model
+        assert migration_progress(conn, kb).status == "switched"
+        with pytest.raises(MigrationError):
+            cancel_migration(conn, kb)
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb,))
+        conn.close()
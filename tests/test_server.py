@@ -0,0 +1,112 @@
+import asyncio
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.server import main as server
+
+# --- Fixtures ---
+
+def _read(data: bytes):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await server.read_request(reader)
+    return asyncio.run(read())
+
+def echo_handler(event, context):
+    """Handler no formato da Lambda que devolve o evento recebido."""
+    return {
+        "statusCode": 202,
+        "headers": {"Retry-After": "1"},
+        "body": json.dumps({"body": json.loads(event["body"]), "function": context.function_name}),
+    }
+
+ROUTES = {("POST", "/echo"): ("echo_function", echo_handler)}
+
+# --- Testes do Protocolo HTTP ---
+
+def test_read_request_parses_body_and_keep_alive():
+    """Lê método, rota, query string, cabeçalhos e corpo; HTTP/1.1 mantém a conexão por padrão."""
+    request = _read(b"POST /query?debug=1 HTTP/1.1\r\nHost: x\r\nContent-Length: 2\r\n\r\n{}")
+
+    assert request == server.Request("POST", "/query", {"debug": "1"},
+                                     {"host": "x", "content-length": "2"}, b"{}", True)
+    assert _read(b"GET /health HTTP/1.0\r\n\r\n").keep_alive is False
+    assert _read(b"") is None
+
+def test_read_request_rejects_chunked_and_large_bodies(mocker):
+    """Corpo sem Content-Length ou acima do limite é recusado antes de ser lido."""
+    with pytest.raises(server.HttpError) as error:
+        _read(b"POST /ingest HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n")
+    assert error.value.status == 411
+
+    mocker.patch.object(server, "MAX_BODY_BYTES", 10)
+    with pytest.raises(server.HttpError) as error:
+        _read(b"POST /ingest HTTP/1.1\r\nContent-Length: 11\r\n\r\n")
+    assert error.value.status == 413
+
+def test_dispatch_runs_handler_in_executor():
+    """O handler recebe o evento do API Gateway; status, cabeçalhos e corpo viram a resposta HTTP."""
+    request = server.Request("POST", "/echo", None, {}, b'{"a": 1}', True)
+
+    async def run():
+        with ThreadPoolExecutor(1) as executor:
+            return [await server.dispatch(r, ROUTES, executor) for r in (
+                request, request._replace(method="GET"), request._replace(path="/nada"))]
+
+    (status, headers, body), not_allowed, not_found = asyncio.run(run())
+    assert (status, headers) == (202, {"Retry-After": "1"})
+    assert json.loads(body) == {"body": {"a": 1}, "function": "echo_function"}
+    assert not_allowed[0] == 405
+    assert not_found[0] == 404
+
+def test_dispatch_decodes_base64_response():
+    """Respostas com isBase64Encoded são enviadas como bytes."""
+    routes = {("POST", "/bin"): ("bin", lambda event, context: {
+        "statusCode": 200, "isBase64Encoded": True, "body": base64.b64encode(b"\x00\x01").decode()})}
+
+    async def run():
+        with ThreadPoolExecutor(1) as executor:
+            return await server.dispatch(server.Request("POST", "/bin", None, {}, b"", True), routes, executor)
+
+    assert asyncio.run(run())[2] == b"\x00\x01"
+
+def test_keep_alive_connection_serves_several_requests():
+    """Várias requisições na mesma conexão, até o cliente pedir Connection: close."""
+    async def run():
+        with ThreadPoolExecutor(2) as executor:
+            listener = await server.start_server("127.0.0.1", 0, ROUTES, executor)
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            body = b'{"n": 1}'
+            writer.write(b"POST /echo HTTP/1.1\r\nContent-Length: 8\r\n\r\n" + body)
+            writer.write(b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+            listener.close()
+            await listener.wait_closed()
+            return data
+
+    data = asyncio.run(run())
+    assert data.startswith(b"HTTP/1.1 202 Accepted\r\n")
+    assert b"Retry-After: 1\r\n" in data
+    assert b'{"status": "ok"}' in data
+    assert data.count(b"HTTP/1.1 ") == 2
+
+def test_in_process_lambda_client():
+    """O invoke devolve o mesmo envelope do botocore, com o resultado do handler no Payload."""
+    client = server.InProcessLambdaClient({"proxy": echo_handler})
+
+    response = client.invoke(FunctionName="proxy", InvocationType="RequestResponse",
+                             Payload=json.dumps({"body": json.dumps({"input": "x"})}))
+
+    payload = json.loads(response["Payload"].read())
+    assert payload["statusCode"] == 202
+    assert json.loads(payload["body"]) == {"body": {"input": "x"}, "function": "proxy"}
+    with pytest.raises(ValueError):
+        client.invoke(FunctionName="proxy", InvocationType="Event", Payload="{}")
@@ -0,0 +1,183 @@
+import io
+import os
+import tracemalloc
+import uuid
+import zipfile
+from xml.sax.saxutils import escape
+
+import pytest
+
+from src.common import sources
+from src.common.chunking import iter_chunks, iter_section_chunks
+from src.common.sources import (
+    ObjectInfo,
+    RangeReader,
+    SourceFormatError,
+    UnsupportedFormat,
+    detect_format,
+    iter_docx_paragraphs,
+    iter_sections,
+    iter_text_sections,
+)
+
+# --- Fixtures ---
+
+class FakeS3:
+    """Armazenamento de objetos em memória com a API do S3 usada pela ingestão (inclui `Range`)."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[Key]), "ContentType": "binary/octet-stream"}
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[Key]
+        if Range is not None:
+            start, end = (int(v) for v in Range[len("bytes="):].split("-"))
+            self.ranges.append((start, end))
+            data = data[start:end + 1]
+        return {"Body": io.BytesIO(data)}
+
+
+def _docx(paragraphs):
+    body = "".join(f'<w:p><w:r><w:t>{escape(p)}</w:t></w:r></w:p>' for p in paragraphs)
+    xml = ('<?xml version="1.0" encoding="UTF-8"?>'
+           '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+           f'<w:body>{body}<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Célula</w:t><w:tab/><w:t>A</w:t></w:r></w:p>'
+           '</w:tc></w:tr></w:tbl></w:body></w:document>')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", "<Types/>")
+        archive.writestr("word/document.xml", xml)
+    return buffer.getvalue()
+
+# --- Testes de Leitura ---
+
+@pytest.mark.parametrize("key,content_type,requested,expected", [
+    ("a/relatorio.PDF", None, None, "pdf"),
+    ("notas.md", None, None, "txt"),
+    ("sem-extensao", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", None, "docx"),
+    ("arquivo.bin", None, "txt", "txt"),
+])
+def test_detect_format(key, content_type, requested, expected):
+    """O formato vem do pedido, da extensão ou do Content-Type, nessa ordem."""
+    assert detect_format(ObjectInfo("b", key, 1, content_type), requested) == expected
+
+@pytest.mark.parametrize("key,requested", [("arquivo.bin", None), ("a.txt", "xlsx")])
+def test_detect_format_unsupported(key, requested):
+    """Formatos desconhecidos são recusados."""
+    with pytest.raises(UnsupportedFormat):
+        detect_format(ObjectInfo("b", key, 1, None), requested)
+
+def test_range_reader_reads_blocks_on_demand():
+    """Leituras e seeks buscam só os blocos tocados, reaproveitando o cache."""
+    data = bytes(range(256)) * 40
+    s3 = FakeS3({"k": data})
+    reader = RangeReader(s3, ObjectInfo("b", "k", len(data), None), block_size=1000, cached_blocks=2)
+
+    reader.seek(-10, io.SEEK_END)
+    assert reader.read() == data[-10:]
+    reader.seek(995)
+    assert reader.read(10) == data[995:1005]
+    reader.seek(998)
+    assert reader.read(4) == data[998:1002]
+
+    assert s3.ranges == [(10000, 10239), (0, 999), (1000, 1999)]
+
+def test_text_sections_split_at_paragraph_breaks():
+    """Blocos são decodificados mesmo com caracteres multibyte divididos e cortados em parágrafos."""
+    text = "Ação um.\n\nSegundo parágrafo, com acentuação.\n\nTerceiro."
+    data = text.encode("utf-8")
+    blocks = [data[i:i + 5] for i in range(0, len(data), 5)]
+
+    sections = list(iter_text_sections(blocks))
+
+    assert "".join(sections) == text
+    assert all(s.endswith("\n\n") for s in sections[:-1])
+
+def test_text_sections_without_paragraphs_are_bounded():
+    """Texto sem quebras de parágrafo é cortado em espaços ao passar do limite."""
+    blocks = [b"palavra " * 100] * 10
+
+    sections = list(iter_text_sections(blocks, max_pending=1000))
+
+    assert "".join(sections) == "palavra " * 1000
+    assert max(len(s) for s in sections) <= 1000 + 800
+
+def test_section_chunks_match_whole_text():
+    """Em seções cortadas em parágrafos, os chunks são os mesmos do texto inteiro."""
+    text = "\n\n".join(f"Parágrafo {i}. " + "Uma frase de teste. " * (i % 7 + 1) for i in range(60))
+    sections = list(iter_text_sections([text.encode("utf-8")[i:i + 300] for i in range(0, len(text) * 2, 300)]))
+
+    assert list(iter_section_chunks(sections, 40, 8)) == list(iter_chunks(text, 40, 8))
+
+def test_docx_paragraphs_with_ranged_reads():
+    """Parágrafos (inclusive de tabelas) são extraídos do DOCX lido por faixas."""
+    data = _docx(["Primeiro parágrafo.", "Segundo & último."])
+    s3 = FakeS3({"doc.docx": data})
+    info = ObjectInfo("b", "doc.docx", len(data), None)
+
+    assert list(iter_sections(s3, info, "docx", block_size=256)) == [
+        "Primeiro parágrafo.", "Segundo & último.", "Célula\tA"]
+    assert s3.ranges
+
+def test_docx_invalid_file():
+    """Arquivos que não são DOCX falham com erro de formato."""
+    with pytest.raises(SourceFormatError):
+        list(iter_docx_paragraphs(io.BytesIO(b"isto nao e um zip")))
+
+def test_pdf_without_package_is_unsupported(mocker):
+    """Sem o pacote pypdf, PDFs são recusados antes de qualquer leitura."""
+    mocker.patch.object(sources, "pypdf", None)
+    s3 = FakeS3({"a.pdf": b"%PDF-1.4"})
+
+    with pytest.raises(UnsupportedFormat):
+        iter_sections(s3, ObjectInfo("b", "a.pdf", 8, None), "pdf")
+    assert s3.ranges == []
+
+def test_text_memory_does_not_grow_with_file():
+    """A memória alocada durante o streaming de um TXT grande fica limitada aos blocos."""
+    paragraph = ("Uma frase de um documento muito grande. " * 12 + "\n\n").encode("utf-8")
+    data = paragraph * (2 * 1024 * 1024 // len(paragraph))
+    s3 = FakeS3({"grande.txt": data})
+    info = ObjectInfo("b", "grande.txt", len(data), None)
+
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in iter_section_chunks(iter_sections(s3, info, "txt", block_size=64 * 1024)))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert count > 1000
+    assert peak < len(data) // 2
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_s3_compatible_storage():
+    """
+    Leitura de TXT e DOCX de um serviço compatível com S3 (ex.: MinIO).
+    Requer CORTEXA_TEST_S3_ENDPOINT e credenciais AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY.
+    """
+    endpoint = os.environ.get("CORTEXA_TEST_S3_ENDPOINT")
+    if not endpoint:
+        pytest.skip("CORTEXA_TEST_S3_ENDPOINT não definido.")
+    client = sources.create_s3_client({"S3_ENDPOINT_URL": endpoint})
+    bucket = f"cortexa-test-{uuid.uuid4().hex[:8]}"
+    client.create_bucket(Bucket=bucket)
+    try:
+        client.put_object(Bucket=bucket, Key="a.txt", Body="Um.\n\nDois.".encode("utf-8"))
+        client.put_object(Bucket=bucket, Key="b.docx", Body=_docx(["Três."]))
+
+        txt = sources.head_object(client, bucket, "a.txt")
+        docx = sources.head_object(client, bucket, "b.docx")
+
+        assert "".join(iter_sections(client, txt, detect_format(txt))) == "Um.\n\nDois."
+        assert list(iter_sections(client, docx, detect_format(docx), block_size=128)) == ["Três.", "Célula\tA"]
+    finally:
+        for key in ("a.txt", "b.docx"):
+            client.delete_object(Bucket=bucket, Key=key)
+        client.delete_bucket(Bucket=bucket)
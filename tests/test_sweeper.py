@@ -0,0 +1,247 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.common.sweeper import (
+    DELETE_BASE_CHUNKS,
+    DELETE_BASE_DOCUMENTS,
+    DELETE_EXPIRED,
+    MARK_ABANDONED_INGESTS,
+    MIN_UUID,
+    Sweeper,
+    mark_document,
+    mark_knowledge_base,
+)
+
+# --- Fixtures ---
+
+class FakeConnection:
+    """Conexão que responde a cada DELETE com o próximo resultado da fila do seu SQL."""
+
+    def __init__(self, results):
+        self.results = {sql: list(batches) for sql, batches in results.items()}
+        self.executed = []
+        self.commits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.commits += exc_type is None
+        return False
+
+    def cursor(self):
+        conn = self
+        cur = MagicMock()
+        cur.__enter__.return_value = cur
+
+        def execute(sql, params=None):
+            conn.executed.append((sql, params))
+            batches = conn.results.get(sql)
+            result = batches.pop(0) if batches else []
+            cur.description = None if isinstance(result, int) else ("row",)
+            cur.rowcount = result if isinstance(result, int) else len(result)
+            cur.fetchall.return_value = [] if isinstance(result, int) else result
+
+        cur.execute.side_effect = execute
+        return cur
+
+    def params(self, sql):
+        return [params for executed, params in self.executed if executed == sql]
+
+# --- Testes do Varredor ---
+
+def test_expired_chunks_advance_by_keyset():
+    """Cada lote começa depois da maior chave (expires_at, id) do lote anterior, com pausa entre eles."""
+    conn = FakeConnection({DELETE_EXPIRED: [[("t1", "b"), ("t1", "a")], [("t2", "c")]]})
+    sleep = MagicMock()
+
+    sweeper = Sweeper(conn, batch_size=2, pause_seconds=0.5, sleep=sleep)
+    sweeper.expired_chunks()
+
+    assert sweeper.removed["expired_chunks"] == 3
+    assert conn.params(DELETE_EXPIRED) == [("-infinity", MIN_UUID, 2), ("t1", "b", 2), ("t2", "c", 2)]
+    assert sleep.call_count == 2
+    assert all("lock_timeout" in sql for sql, _ in conn.executed[::2])
+
+def test_knowledge_base_removed_in_batches_then_row():
+    """Chunks e documentos da base saem em lotes; a linha da base é a última."""
+    conn = FakeConnection({
+        DELETE_BASE_CHUNKS: [[("00a",), ("00c",)], [("00f",)]],
+        DELETE_BASE_DOCUMENTS: [2],
+    })
+
+    sweeper = Sweeper(conn, batch_size=2, sleep=lambda s: None)
+    sweeper.knowledge_base("kb")
+
+    assert sweeper.removed == {"base_chunks": 3, "documents": 2}
+    assert [p[1] for p in conn.params(DELETE_BASE_CHUNKS)] == [MIN_UUID, "00c", "00f"]
+    assert conn.executed[-1][0].startswith("DELETE FROM knowledge_bases")
+
+def test_sweep_stops_at_deadline():
+    """Ao passar de max_seconds, a passada termina incompleta; as marcas ficam para a próxima."""
+    clock = MagicMock(side_effect=[0, 0, 0, 5, 11])
+    conn = FakeConnection({DELETE_EXPIRED: [[("t1", "a")], [("t1", "b")], [("t1", "c")]]})
+
+    result = Sweeper(conn, max_seconds=10, clock=clock, sleep=lambda s: None).sweep()
+
+    assert result.expired_chunks == 2
+    assert not result.complete
+
+def test_sweep_marks_abandoned_ingests_first():
+    """Documentos de ingestões com prazo vencido são marcados antes da remoção dos documentos marcados."""
+    conn = FakeConnection({MARK_ABANDONED_INGESTS: [2]})
+
+    result = Sweeper(conn, sleep=lambda s: None).sweep()
+
+    assert conn.executed[1] == (MARK_ABANDONED_INGESTS, None)
+    assert result.abandoned_ingests == 2 and result.complete
+
+def test_lock_timeout_postpones_batch():
+    """Um lote que não obtém o lock a tempo é desfeito e a varredura segue."""
+    from psycopg2 import errors
+
+    conn = FakeConnection({})
+    cur = MagicMock()
+    cur.__enter__.return_value = cur
+    timeout = errors.LockNotAvailable("canceling statement due to lock timeout")
+    cur.execute.side_effect = [None, timeout, None, timeout]
+    conn.cursor = lambda: cur
+    sweeper = Sweeper(conn, sleep=lambda s: None)
+
+    sweeper.document("doc")
+
+    assert cur.execute.call_count == 4
+    assert conn.commits == 0 and not sweeper.removed
+
+def test_mark_knowledge_base():
+    """A marcação é idempotente: uma base já marcada (ou inexistente) retorna False."""
+    cur = MagicMock()
+    cur.rowcount = 1
+    assert mark_knowledge_base(cur, "kb")
+    cur.rowcount = 0
+    assert not mark_document(cur, "kb", "manual.pdf")
+    assert "deleted_at IS NULL" in cur.execute.call_args.args[0]
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_sweeper_removes_marked_and_expired():
+    """
+    O varredor remove, em lotes, chunks expirados, documentos e bases marcados, sem tocar
+    no restante; o external_id de um documento marcado pode ser reingerido na hora.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    import psycopg2
+
+    from benchmarks.local_db import apply_optional
+    from src.common.documents import read_document_chunks, write_document
+    from src.common.embedding_config import read_embedding_config
+    from src.common.vectors import PgVector
+
+    conn = psycopg2.connect(dsn)
+    vector = PgVector([0.1] * 1536)
+
+    def count(cur, sql, params):
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+
+    with conn, conn.cursor() as cur:
+        apply_optional(cur, "chunk_vectors_enable")
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('kept', gen_random_uuid()), "
+                    "('dropped', gen_random_uuid()) RETURNING id")
+        kept, dropped = (str(row[0]) for row in cur.fetchall())
+        for kb in (kept, dropped):
+            cur.execute("INSERT INTO documents (knowledge_base_id, external_id) VALUES (%s, 'manual') RETURNING id",
+                        (kb,))
+            document = cur.fetchone()[0]
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, document_id, ordinal) "
+                        "SELECT %s, 'doc ' || i, %s, %s, i FROM generate_series(0, 6) i", (kb, vector, document))
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, expires_at) "
+                        "SELECT %s, 'ttl ' || i, %s, NOW() - interval '1 minute' + i * interval '1 hour' "
+                        "FROM generate_series(0, 4) i", (kb, vector))
+        assert mark_knowledge_base(cur, dropped)
+        assert mark_document(cur, kept, "manual")
+        assert not mark_document(cur, dropped, "manual")
+        assert read_embedding_config(cur, dropped) is None
+        assert read_document_chunks(cur, kept, "manual") == []
+        write_document(cur, kept, "manual", None, [], {})
+    try:
+        result = Sweeper(conn, batch_size=3, pause_seconds=0).sweep()
+
+        assert result.complete
+        assert result.expired_chunks >= 2 and result.document_chunks == 7
+        assert result.base_chunks == 11 and result.knowledge_bases == 1
+        with conn, conn.cursor() as cur:
+            assert count(cur, "SELECT count(*) FROM knowledge_bases WHERE id = %s", (dropped,)) == 0
+            assert count(cur, "SELECT count(*) FROM knowledge_chunks WHERE knowledge_base_id = %s", (kept,)) == 4
+            assert count(cur, "SELECT count(*) FROM knowledge_chunk_vectors WHERE knowledge_base_id = %s",
+                         (kept,)) == 4
+            assert count(cur, "SELECT count(*) FROM documents WHERE knowledge_base_id = %s", (kept,)) == 1
+            cur.execute("SELECT content FROM knowledge_chunks WHERE knowledge_base_id = %s ORDER BY content", (kept,))
+            assert [row[0] for row in cur.fetchall()] == ["ttl 1", "ttl 2", "ttl 3", "ttl 4"]
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM knowledge_bases WHERE id = ANY(%s::uuid[])", ([kept, dropped],))
+        conn.close()
+
+@pytest.mark.integration
+def test_integration_pending_ingest_hidden_until_complete_and_reclaimed():
+    """
+    Chunks de uma ingestão de arquivo pendente ficam fora das buscas até a conclusão; uma
+    ingestão abandonada (prazo vencido) é descartada pelo varredor com seus chunks.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    import psycopg2
+
+    from src.common.documents import (
+        PendingDocumentExpired,
+        complete_pending_document,
+        create_pending_document,
+        extend_pending_document,
+    )
+    from src.common.sweeper import visible_chunks
+    from src.common.vectors import PgVector
+
+    conn = psycopg2.connect(dsn)
+    vector = PgVector([0.1] * 1536)
+
+    def visible(cur, kb):
+        cur.execute(f"SELECT content FROM knowledge_chunks WHERE knowledge_base_id = %s AND {visible_chunks()} "
+                    "ORDER BY content", (kb,))
+        return [row[0] for row in cur.fetchall()]
+
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('pending', gen_random_uuid()) RETURNING id")
+        kb = str(cur.fetchone()[0])
+        completed = create_pending_document(cur, kb, "ingest-ok", 3600)
+        abandoned = create_pending_document(cur, kb, "ingest-abandonada", -1)
+        for document, content in ((completed, "concluído"), (abandoned, "abandonado")):
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, document_id, ordinal) "
+                        "VALUES (%s, %s, %s, %s, 0)", (kb, content, vector, document))
+    try:
+        with conn, conn.cursor() as cur:
+            assert visible(cur, kb) == []
+            complete_pending_document(cur, completed, 1)
+            assert visible(cur, kb) == ["concluído"]
+
+        result = Sweeper(conn, pause_seconds=0).sweep()
+
+        assert result.abandoned_ingests >= 1 and result.document_chunks >= 1 and result.documents >= 1
+        with conn, conn.cursor() as cur:
+            with pytest.raises(PendingDocumentExpired):
+                extend_pending_document(cur, abandoned, 3600)
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT content FROM knowledge_chunks WHERE knowledge_base_id = %s", (kb,))
+            assert [row[0] for row in cur.fetchall()] == ["concluído"]
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM knowledge_bases WHERE id = %s", (kb,))
+        conn.close()
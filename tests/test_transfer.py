@@ -0,0 +1,156 @@
+import io
+import os
+
+import pytest
+
+from src.common import transfer
+
+# --- Testes do Formato ---
+
+def test_frames_round_trip():
+    """Seções em frames são lidas de volta em blocos de qualquer tamanho, na ordem."""
+    out = io.BytesIO()
+    first = transfer.FrameWriter(out, frame_bytes=10)
+    for piece in (b"abc", b"defghijkl", b"mnop"):
+        first.write(piece)
+    first.close()
+    second = transfer.FrameWriter(out)
+    second.write(b"segunda")
+    second.close()
+
+    source = io.BytesIO(out.getvalue())
+    reader = transfer.FrameReader(source)
+    data = b""
+    while chunk := reader.read(3):
+        data += chunk
+    assert data == b"abcdefghijklmnop"
+    assert transfer.FrameReader(source).read() == b"segunda"
+
+def test_frame_reader_truncated():
+    """Um arquivo cortado no meio de um frame é rejeitado."""
+    reader = transfer.FrameReader(io.BytesIO(b"\x00\x00\x00\x10abc"))
+
+    with pytest.raises(transfer.TransferFormatError):
+        reader.read(16)
+
+def test_header_round_trip_and_version_check():
+    """O cabeçalho é validado pela assinatura, pela versão e pelas colunas."""
+    header = {
+        "format_version": transfer.FORMAT_VERSION,
+        "knowledge_base": {"id": "kb", "name": "Base", "user_id": "u"},
+        "embedding_type": "vector(1536)",
+        "documents": {"columns": list(transfer.DOCUMENT_COLUMNS)},
+        "chunks": {"columns": list(transfer.CHUNK_COLUMNS)},
+    }
+    out = io.BytesIO()
+    transfer.write_header(out, header)
+    assert transfer.read_header(io.BytesIO(out.getvalue())) == header
+
+    v1 = {**header, "format_version": 1, "chunks": {"columns": list(transfer.CHUNK_COLUMNS[:-1])}}
+    out = io.BytesIO()
+    transfer.write_header(out, v1)
+    assert transfer.read_header(io.BytesIO(out.getvalue())) == v1
+
+    out = io.BytesIO()
+    transfer.write_header(out, {**header, "chunks": v1["chunks"]})
+    with pytest.raises(transfer.TransferFormatError):
+        transfer.read_header(io.BytesIO(out.getvalue()))
+
+    out = io.BytesIO()
+    transfer.write_header(out, {**header, "format_version": 99})
+    with pytest.raises(transfer.TransferFormatError):
+        transfer.read_header(io.BytesIO(out.getvalue()))
+    with pytest.raises(transfer.TransferFormatError):
+        transfer.read_header(io.BytesIO(b"PGCOPY\n\xff\r\n\x00"))
+
+# --- Testes de Integração ---
+
+@pytest.mark.integration
+def test_integration_export_import_clone(tmp_path):
+    """
+    Exporta, importa e clona uma base sem re-embedding, preservando vetores e documentos.
+    Requer CORTEXA_TEST_DB_DSN apontando para um Postgres com as migrações aplicadas.
+    """
+    dsn = os.environ.get("CORTEXA_TEST_DB_DSN")
+    if not dsn:
+        pytest.skip("CORTEXA_TEST_DB_DSN não definido.")
+    import psycopg2
+    from src.common.documents import DocumentChunk, create_pending_document, hash_chunk, write_document
+    from src.common.vectors import PgVector
+
+    texts = [f"Trecho {i}." for i in range(5)]
+    chunks = [DocumentChunk(i, t, 2, hash_chunk(t)) for i, t in enumerate(texts)]
+    vectors = {c.content_hash: PgVector([c.ordinal / 10] * 1536) for c in chunks}
+
+    def snapshot(cur, kb):
+        cur.execute("SELECT c.content, c.embedding::text, d.external_id, c.ordinal, c.expires_at "
+                    "FROM knowledge_chunks c LEFT JOIN documents d ON d.id = c.document_id "
+                    "WHERE c.knowledge_base_id = %s ORDER BY c.content", (kb,))
+        return cur.fetchall()
+
+    conn = psycopg2.connect(dsn)
+    created = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('origem', gen_random_uuid()) "
+                        "RETURNING id")
+            source_kb = cur.fetchone()[0]
+            created.append(source_kb)
+            write_document(cur, source_kb, "doc.txt", None, chunks, vectors)
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding) VALUES (%s, %s, %s)",
+                        (source_kb, "avulso", PgVector([0.5] * 1536)))
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, expires_at) "
+                        "VALUES (%s, %s, %s, NOW() + interval '1 day')",
+                        (source_kb, "temporário", PgVector([0.6] * 1536)))
+            # Ingestão de arquivo ainda em andamento: nem o documento nem seus chunks saem
+            pending = create_pending_document(cur, source_kb, "parcial.pdf", 60)
+            cur.execute("INSERT INTO knowledge_chunks (knowledge_base_id, content, embedding, document_id, ordinal) "
+                        "VALUES (%s, %s, %s, %s, 0)", (source_kb, "parcial", PgVector([0.7] * 1536), pending))
+        conn.commit()
+
+        path = str(tmp_path / "base.cortexa.gz")
+        with transfer._open(path, "wb") as out:
+            exported = transfer.export_knowledge_base(conn, source_kb, out)
+        assert (exported.documents, exported.chunks) == (1, 7)
+
+        with transfer._open(path, "rb") as source:
+            imported = transfer.import_knowledge_base(conn, source)
+        created.append(imported.knowledge_base_id)
+        cloned = transfer.clone_knowledge_base(conn, source_kb, name="clone")
+        created.append(cloned.knowledge_base_id)
+
+        # Com --kb, o destino precisa estar vazio: uma segunda importação não mescla
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO knowledge_bases (name, user_id) VALUES ('destino', gen_random_uuid()) "
+                        "RETURNING id")
+            target_kb = cur.fetchone()[0]
+            created.append(target_kb)
+        conn.commit()
+        with transfer._open(path, "rb") as source:
+            assert transfer.import_knowledge_base(conn, source, str(target_kb))[1:] == (1, 7)
+        with transfer._open(path, "rb") as source, pytest.raises(ValueError, match="não está vazia"):
+            transfer.import_knowledge_base(conn, source, str(target_kb))
+        conn.rollback()
+
+        with conn.cursor() as cur:
+            expected = [row for row in snapshot(cur, source_kb) if row[0] != "parcial"]
+            assert snapshot(cur, imported.knowledge_base_id) == expected
+            assert snapshot(cur, cloned.knowledge_base_id) == expected
+            assert snapshot(cur, target_kb) == expected
+            assert any(row[4] is not None for row in expected)
+            cur.execute("SELECT name FROM knowledge_bases WHERE id = %s", (cloned.knowledge_base_id,))
+            assert cur.fetchone()[0] == "clone"
+            cur.execute("UPDATE knowledge_bases SET deleted_at = NOW() WHERE id = %s", (source_kb,))
+        conn.commit()
+
+        # Uma base marcada para remoção não é exportada nem clonada
+        with pytest.raises(ValueError, match="marcada"):
+            transfer.export_knowledge_base(conn, source_kb, io.BytesIO())
+        with pytest.raises(ValueError, match="marcada"):
+            transfer.clone_knowledge_base(conn, source_kb)
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM knowledge_bases WHERE id = ANY(%s::uuid[])", ([str(k) for k in created],))
+        conn.commit()
+        conn.close()
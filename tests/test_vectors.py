@@ -0,0 +1,93 @@
+import base64
+import json
+import tracemalloc
+from array import array
+
+import pytest
+from psycopg2.extensions import adapt
+
+from src.common.vectors import EMBEDDING_DIMENSIONS, EmbeddingBatch, PgVector
+
+
+def _encode(values):
+    return base64.b64encode(array('f', values).tobytes()).decode('ascii')
+
+# --- Testes do Buffer ---
+
+def test_embedding_batch_base64_roundtrip():
+    """Linhas decodificadas de base64 ficam no buffer contíguo, na posição indicada."""
+    batch = EmbeddingBatch(3, dimensions=4)
+    batch.set_row_base64(2, _encode([1.0, 2.0, 3.0, 4.0]))
+    batch.set_row(0, [0.5, 0.25, 0.125, 0.0])
+
+    assert len(batch) == 3
+    assert list(batch.row(0)) == [0.5, 0.25, 0.125, 0.0]
+    assert list(batch.row(1)) == [0.0] * 4
+    assert list(batch.row(2)) == [1.0, 2.0, 3.0, 4.0]
+    assert batch.data.itemsize == 4
+    assert len(batch.data) == 12
+
+@pytest.mark.parametrize("setter,value", [
+    ("set_row_base64", _encode([1.0, 2.0])),
+    ("set_row", [1.0, 2.0]),
+])
+def test_embedding_batch_dimension_mismatch(setter, value):
+    """Embeddings com dimensão diferente da esperada são rejeitados."""
+    batch = EmbeddingBatch(1, dimensions=4)
+    with pytest.raises(ValueError):
+        getattr(batch, setter)(0, value)
+
+# --- Testes do Adaptador SQL ---
+
+def test_pgvector_adapts_to_vector_literal():
+    """O psycopg2 converte a linha do buffer para um literal do pg_vector."""
+    batch = EmbeddingBatch(1, dimensions=3)
+    batch.set_row(0, [0.5, -1.0, 0.1])
+
+    quoted = adapt(batch.vector(0)).getquoted().decode()
+
+    assert quoted.startswith("'[") and quoted.endswith("]'::vector")
+    values = json.loads(quoted[1:-len("'::vector")])
+    assert values[:2] == [0.5, -1.0]
+    assert array('f', [values[2]])[0] == array('f', [0.1])[0]
+
+# --- Testes de Memória ---
+
+def _measure_memory(build):
+    """Retorna (memória retida pelos registros, pico durante a construção)."""
+    tracemalloc.start()
+    try:
+        records = build()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(records) == 64
+    return retained, peak
+
+def test_embedding_batch_peak_memory():
+    """O buffer float32 usa uma fração da memória das listas de floats Python, no pico e retida."""
+    rows = 64
+    data = [{"index": i, "embedding": [0.001 * (i + j) for j in range(EMBEDDING_DIMENSIONS)]}
+            for i in range(rows)]
+    payload_lists = json.dumps({"data": data})
+    payload_base64 = json.dumps({"data": [
+        {"index": item["index"], "embedding": _encode(item["embedding"])} for item in data
+    ]})
+    del data
+
+    def with_lists():
+        # Comportamento anterior: cada embedding vira uma lista de 1536 floats
+        return [("kb", "chunk", item["embedding"]) for item in json.loads(payload_lists)["data"]]
+
+    def with_buffer():
+        batch = EmbeddingBatch(rows)
+        for item in json.loads(payload_base64)["data"]:
+            batch.set_row_base64(item["index"], item["embedding"])
+        return [("kb", "chunk", batch.vector(i)) for i in range(rows)]
+
+    retained_before, peak_before = _measure_memory(with_lists)
+    retained_after, peak_after = _measure_memory(with_buffer)
+
+    # O pico do buffer inclui o JSON em base64 decodificado, liberado ao fim do lote.
+    assert peak_after * 3 < peak_before
+    assert retained_after * 6 < retained_before
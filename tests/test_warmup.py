@@ -0,0 +1,64 @@
+import threading
+import time
+
+from src.common.warmup import InitWarmup, start_init_warmup
+
+# --- Testes do Pré-aquecimento ---
+
+def test_start_init_warmup_outside_lambda(monkeypatch):
+    """Fora da Lambda, o pré-aquecimento não é executado."""
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    calls = []
+
+    warmup = start_init_warmup(lambda: calls.append(1))
+    warmup.wait()
+
+    assert calls == []
+
+def test_start_init_warmup_disabled(monkeypatch):
+    """CORTEXA_INIT_WARMUP=false desliga o pré-aquecimento mesmo na Lambda."""
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "ingest-prod")
+    monkeypatch.setenv("CORTEXA_INIT_WARMUP", "false")
+    calls = []
+
+    start_init_warmup(lambda: calls.append(1)).wait()
+
+    assert calls == []
+
+def test_start_init_warmup_in_lambda(monkeypatch):
+    """No init da Lambda, o pré-aquecimento roda antes de o módulo terminar de carregar."""
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "ingest-prod")
+    calls = []
+
+    warmup = start_init_warmup(lambda: calls.append(1))
+
+    assert calls == [1]
+    assert warmup.elapsed_ms is not None
+
+def test_warmup_errors_never_fail_init():
+    """Exceções no pré-aquecimento são registradas, nunca propagadas."""
+    def failing():
+        raise RuntimeError("banco indisponível")
+
+    warmup = InitWarmup(failing, timeout_seconds=1).start()
+    warmup.wait()
+
+    assert warmup.elapsed_ms is not None
+
+def test_warmup_timeout_does_not_block_init():
+    """Um pré-aquecimento lento não segura o init; o handler espera por ele em wait()."""
+    release = threading.Event()
+    done = []
+
+    def slow():
+        release.wait(5)
+        done.append(1)
+
+    start = time.perf_counter()
+    warmup = InitWarmup(slow, timeout_seconds=0.05).start()
+    assert time.perf_counter() - start < 1
+    assert done == []
+
+    release.set()
+    warmup.wait()
+    assert done == [1]